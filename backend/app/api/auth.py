@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Form
-from sqlalchemy.orm import Session
-from app.database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_async_db
 from app.models.user import User
 from app.schemas.auth import Token
-from app.auth.jwt import verify_password, create_access_token, create_refresh_token, decode_token
+from app.auth import passwords
+from app.auth.jwt import create_access_token, create_refresh_token, decode_token
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
 
@@ -11,11 +13,23 @@ router = APIRouter(prefix="/api/auth", tags=["auth"])
 async def login(
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    user = db.query(User).filter(User.username == username).first()
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalar_one_or_none()
     
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password"
+        )
+    
+    # bcrypt — в пуле потоков, цикл событий не блокируется
+    try:
+        valid, new_hash = await passwords.verify_and_update(password, user.hashed_password)
+    except passwords.HashQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
@@ -27,6 +41,12 @@ async def login(
     access_token = create_access_token(data={"sub": user.username, "role": user.role})
     refresh_token = create_refresh_token(data={"sub": user.username})
     
+    # Хэш со старыми параметрами (AUTH_BCRYPT_ROUNDS) — сохраняем пересчитанный,
+    # только когда вход удался
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        await db.commit()
+    
     return {
         "access_token": access_token,
         "refresh_token": refresh_token,
@@ -34,7 +54,7 @@ async def login(
     }
 
 @router.post("/refresh", response_model=Token)
-async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
+async def refresh_token(refresh_token: str, db: AsyncSession = Depends(get_async_db)):
     payload = decode_token(refresh_token)
     
     if payload is None or payload.get("type") != "refresh":
@@ -44,7 +64,8 @@ async def refresh_token(refresh_token: str, db: Session = Depends(get_db)):
         )
     
     username = payload.get("sub")
-    user = db.query(User).filter(User.username == username).first()
+    result = await db.execute(select(User).where(User.username == username))
+    user = result.scalar_one_or_none()
     
     if not user or not user.is_active:
         raise HTTPException(status_code=401, detail="User not found or inactive")
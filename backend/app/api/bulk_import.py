@@ -0,0 +1,89 @@
+# backend/app/api/bulk_import.py
+# Массовая загрузка CSV/Parquet в таблицы через COPY (app/services/bulk_import.py).
+# Файл сохраняется во временный файл, проверяется по каталогу и грузится
+# фоновым заданием: прогресс и итог — /api/jobs/{id} и /api/jobs/{id}/result.
+
+from typing import Optional
+import logging
+import tempfile
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import JSONResponse
+
+from app.auth.rbac import allow_admin
+from app.config import settings
+from app.models.user import User
+from app.services import bulk_import
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/import", tags=["Import"])
+
+_CHUNK = 1 << 20
+
+
+def _spool(upload: UploadFile):
+    """Копия загрузки во временный файл (не в памяти) с ограничением размера"""
+    limit = settings.IMPORT_MAX_FILE_MB * 1024 * 1024
+    tmp = tempfile.TemporaryFile()
+    size = 0
+    try:
+        while True:
+            chunk = upload.file.read(_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                raise HTTPException(status_code=413, detail=f"File exceeds {settings.IMPORT_MAX_FILE_MB} MB")
+            tmp.write(chunk)
+    except BaseException:
+        tmp.close()
+        raise
+    tmp.seek(0)
+    return tmp, size
+
+
+def _format(filename: Optional[str], fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt.lower()
+    return "parquet" if (filename or "").lower().endswith((".parquet", ".pq")) else "csv"
+
+
+@router.post("", status_code=202)
+def start_import(
+    file: UploadFile = File(...),
+    table: str = Form(..., description="Целевая таблица: schema.table"),
+    mode: str = Form(bulk_import.APPEND, description="append | upsert"),
+    key: Optional[str] = Form(None, description="Колонки ключа upsert через запятую (по умолчанию — первичный ключ)"),
+    fmt: Optional[str] = Form(None, alias="format", description="csv | parquet (по умолчанию — по расширению)"),
+    delimiter: str = Form(","),
+    null: str = Form("", description="Представление NULL в CSV"),
+    current_user: User = Depends(allow_admin)
+):
+    """Поставить загрузку в очередь; ответ — id задания для /api/jobs"""
+    tmp, size = _spool(file)
+    key_columns = [c.strip() for c in key.split(",") if c.strip()] if key else None
+    try:
+        plan = bulk_import.plan_import(tmp, size, table, _format(file.filename, fmt), mode,
+                                       key_columns, delimiter, null)
+        job = bulk_import.submit(current_user.id, tmp, plan)
+    except bulk_import.BulkImportError as e:
+        tmp.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except OverflowError as e:
+        tmp.close()
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception:
+        tmp.close()
+        raise
+    logger.info(f"Import {job.id} queued by {current_user.username}: {file.filename} -> {plan.table.relation} ({size} bytes)")
+    return JSONResponse(status_code=202, content={"id": job.id, "status": job.status, **job.meta})
+
+
+@router.get("/tables/{table}")
+def describe_table(table: str, refresh: bool = Query(False), current_user: User = Depends(allow_admin)):
+    """Колонки, обязательные колонки и ключи таблицы из кэша каталога"""
+    schema = bulk_import.catalog.table(table, refresh=refresh)
+    if schema is None:
+        raise HTTPException(status_code=404, detail=f"Table '{table}' not found")
+    return schema.describe()
@@ -0,0 +1,102 @@
+# backend/app/api/cache.py
+# Администрирование кэшей: статистика, триггеры NOTIFY, ручная инвалидация.
+
+from typing import List, Optional
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+
+from app.auth import passwords, principals
+from app.auth.rbac import allow_admin
+from app.database import get_db
+from app.models.user import User
+from app.services import (
+    dataset_cache, invalidation, prepared, query_cache, result_versions, single_flight, time_chunks,
+)
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/cache", tags=["Cache"])
+
+
+class TablesRequest(BaseModel):
+    # schema.table; если не указано — все таблицы, от которых сейчас зависят кэши
+    tables: Optional[List[str]] = None
+
+
+@router.get("/stats")
+def cache_stats(current_user: User = Depends(allow_admin)):
+    return {
+        "query_cache": query_cache.get_cache().info(),
+        "dataset_cache": dataset_cache.get_cache().info(),
+        "result_versions": result_versions.get_store().info(),
+        "time_chunks": time_chunks.get_cache().info(),
+        "invalidation": invalidation.info(),
+        "single_flight": single_flight.info(),
+        "prepared_statements": prepared.get_cache().info(),
+        "auth": principals.info(),
+        "password_hashing": passwords.info(),
+    }
+
+
+@router.get("/triggers")
+def list_triggers(db: Session = Depends(get_db), current_user: User = Depends(allow_admin)):
+    """Таблицы с установленным триггером уведомлений"""
+    return {"tables": invalidation.list_triggers(db)}
+
+
+@router.post("/triggers")
+def install_triggers(
+    body: TablesRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_admin)
+):
+    """
+    Установить statement-level триггеры, которые шлют NOTIFY при
+    INSERT/UPDATE/DELETE/TRUNCATE. Без них изменения замечаются опросом
+    pg_stat_user_tables (с задержкой CACHE_STATS_POLL_SECONDS и статистики).
+    """
+    tables = body.tables if body.tables is not None else invalidation.index.tracked_relations()
+    try:
+        installed = invalidation.install_triggers(db, tables)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Database error: {e}")
+    logger.info(f"User {current_user.username} installed cache triggers on {installed}")
+    return {"installed": installed}
+
+
+@router.delete("/triggers")
+def drop_triggers(
+    body: TablesRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_admin)
+):
+    tables = body.tables if body.tables is not None else invalidation.list_triggers(db)
+    try:
+        dropped = invalidation.drop_triggers(db, tables)
+        db.commit()
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Database error: {e}")
+    return {"dropped": dropped}
+
+
+@router.post("/invalidate")
+def invalidate(body: TablesRequest, current_user: User = Depends(allow_admin)):
+    """Сбросить записи, зависящие от таблиц (или все кэши целиком)"""
+    if body.tables is None:
+        invalidation.index.clear()
+        prepared.invalidate()
+        principals.clear()
+        return {"status": "cleared"}
+    return {"evicted": invalidation.index.relations_changed(body.tables)}
@@ -1,11 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from app.database import get_db
+from app.services.code_sandbox import get_pool
+from app.services.transforms import TransformError, apply_transforms
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
-import sys
-from io import StringIO
-import json
+from typing import Optional, Dict, Any, List
 
 router = APIRouter(prefix="/api/code", tags=["code"])
 
@@ -19,46 +19,41 @@ class CodeExecuteResponse(BaseModel):
     error: Optional[str] = None
     result: Optional[Any] = None
 
+class TransformRequest(BaseModel):
+    data: Dict[str, Any]                       # {columns, data} — результат запроса
+    transforms: List[Dict[str, Any]]           # шаги, как в props.transforms виджета
+    inputs: Optional[Dict[str, Any]] = None    # результаты других виджетов для join
+
 @router.post("/execute", response_model=CodeExecuteResponse)
 async def execute_code(
     request: CodeExecuteRequest,
     db: Session = Depends(get_db)
 ):
     if request.language == 'python':
-        return execute_python(request.code, request.data)
+        # Блокирующее ожидание рабочего процесса — вне event loop
+        return await run_in_threadpool(execute_python, request.code, request.data)
     else:
         raise HTTPException(status_code=400, detail="Язык не поддерживается")
 
 def execute_python(code: str, data: dict) -> CodeExecuteResponse:
-    """Выполняет Python код в изолированной среде"""
+    """
+    Выполняет Python код в отдельном процессе из пула (app.services.code_sandbox):
+    свой stdout, лимиты CPU / памяти / времени на задание
+    """
+    res = get_pool().run(code, data)
+    return CodeExecuteResponse(
+        output=res.get("output") or "",
+        result=res.get("result"),
+        error=res.get("error")
+    )
+
+@router.post("/transform")
+async def transform_data(request: TransformRequest):
+    """
+    Декларативная постобработка результата без exec:
+    filter / derive / aggregate / pivot / rolling / top_n / sort / join / select / rename
+    """
     try:
-        # Создаём изолированное окружение
-        local_vars = {'data': data}
-        
-        # Перехватываем stdout
-        old_stdout = sys.stdout
-        sys.stdout = captured_output = StringIO()
-        
-        # Выполняем код
-        exec(code, {"__builtins__": __builtins__}, local_vars)
-        
-        # Восстанавливаем stdout
-        sys.stdout = old_stdout
-        
-        # Получаем результат
-        output = captured_output.getvalue()
-        result = local_vars.get('result', None)
-        
-        return CodeExecuteResponse(
-            output=output,
-            result=result,
-            error=None
-        )
-        
-    except Exception as e:
-        sys.stdout = old_stdout
-        return CodeExecuteResponse(
-            output="",
-            error=str(e),
-            result=None
-        )
+        return await run_in_threadpool(apply_transforms, request.data, request.transforms, request.inputs)
+    except TransformError as e:
+        raise HTTPException(status_code=400, detail=f"Transform error: {e}")
@@ -1,13 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from app.database import get_db
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.database import get_async_db, get_db
 from app.models.dashboard import Dashboard
+from app.models.materialized_view import MaterializedView
 from app.models.user import User
 from app.auth.jwt import get_current_user
+from app.auth.rbac import allow_developer
+from app.services import dataset_cache, invalidation, matviews, prepared, query_cache, query_log
+from app.services.widgets import (
+    dashboard_sources, data_widgets, plan_queries, widget_key, widget_query, widget_source,
+)
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, List, Optional
 from datetime import datetime
 import json
+import logging
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/dashboards", tags=["Dashboards"])
 
@@ -37,6 +53,31 @@ class DashboardUpdate(BaseModel):
     config: dict
     is_published: Optional[bool]
 
+class DashboardExportRequest(BaseModel):
+    params: Optional[dict] = None   # общие значения bind-параметров (фильтры дашборда)
+
+class CrossFilterRequest(BaseModel):
+    filters: Optional[Any] = None   # {колонка: значение | [значения]} или список условий {column, op, value, source}
+    params: Optional[dict] = None   # общие значения bind-параметров
+    widgets: Optional[List[str]] = None   # id виджетов; по умолчанию все table/chart
+    refresh: bool = False   # перечитать данные из БД
+
+class DashboardRenderRequest(BaseModel):
+    params: Optional[dict] = None   # общие значения bind-параметров
+    widgets: Optional[List[str]] = None   # id виджетов; по умолчанию все table/chart
+
+class MaterializeRequest(BaseModel):
+    widget_id: Optional[str] = None   # виджет с props.sql
+    source: Optional[str] = None   # или источник config.sources
+    params: Optional[dict] = None   # значения параметров, зашиваемые в представление
+    unique_key: Optional[List[str]] = None   # колонки уникального индекса; по умолчанию номер строки
+    refresh_interval_seconds: Optional[int] = None
+    refresh_on_change: bool = True
+
+class MaterializedViewUpdate(BaseModel):
+    refresh_interval_seconds: Optional[int] = None
+    refresh_on_change: Optional[bool] = None
+
 class DashboardResponse(BaseModel):
     id: int
     title: str
@@ -52,15 +93,23 @@ class DashboardResponse(BaseModel):
 
 # ============ Endpoints ============
 
+async def _owned_dashboard(db: AsyncSession, dashboard_id: int, current_user: User) -> Optional[Dashboard]:
+    result = await db.execute(
+        select(Dashboard).where(Dashboard.id == dashboard_id, Dashboard.owner_id == current_user.id)
+    )
+    return result.scalar_one_or_none()
+
+
 @router.get("/", response_model=List[DashboardResponse])
 async def list_dashboards(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """Получить все дашборды пользователя"""
-    dashboards = db.query(Dashboard).filter(
-        Dashboard.owner_id == current_user.id
-    ).order_by(Dashboard.updated_at.desc()).all()
+    result = await db.execute(
+        select(Dashboard).where(Dashboard.owner_id == current_user.id).order_by(Dashboard.updated_at.desc())
+    )
+    dashboards = result.scalars().all()
     # Кастомная сериализация через pydantic
     return [
         DashboardResponse(
@@ -76,17 +125,159 @@ async def list_dashboards(
         for d in dashboards
     ]
 
+# ============ Материализованные представления ============
+
+def _user_view(db: Session, view_id: int, current_user: User) -> MaterializedView:
+    mv = db.query(MaterializedView).filter(MaterializedView.id == view_id).first()
+    if mv is not None and current_user.role.value != "ADMIN":
+        owned = db.query(Dashboard.id).filter(
+            Dashboard.id == mv.dashboard_id,
+            Dashboard.owner_id == current_user.id
+        ).first()
+        mv = mv if owned else None
+    if mv is None:
+        raise HTTPException(status_code=404, detail="Materialized view not found")
+    return mv
+
+
+@router.get("/materialized")
+def list_materialized_views(
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_developer)
+):
+    """Материализованные представления: расписание, длительность и давность обновления"""
+    query = db.query(MaterializedView)
+    if current_user.role.value != "ADMIN":
+        own = db.query(Dashboard.id).filter(Dashboard.owner_id == current_user.id)
+        query = query.filter(MaterializedView.dashboard_id.in_(own))
+    return {
+        "views": [matviews.describe(mv) for mv in query.order_by(MaterializedView.id).all()],
+        "stats": matviews.info(),
+    }
+
+
+@router.post("/{dashboard_id}/materialize")
+def materialize_widget(
+    dashboard_id: int,
+    body: MaterializeRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_developer)
+):
+    """
+    Перевести запрос виджета (или источника) на материализованное
+    представление. Дальше тот же запрос с теми же параметрами читает
+    представление — в /api/sql/execute, рендере, кросс-фильтре и
+    автообновлении.
+    """
+    from app.api.sql_executor import check_developer_sql
+
+    query = db.query(Dashboard).filter(Dashboard.id == dashboard_id)
+    if current_user.role.value != "ADMIN":
+        query = query.filter(Dashboard.owner_id == current_user.id)
+    dashboard = query.first()
+    if not dashboard:
+        raise HTTPException(status_code=404, detail="Дашборд не найден")
+    if bool(body.widget_id) == bool(body.source):
+        raise HTTPException(status_code=400, detail="Specify either widget_id or source")
+    config = json.loads(dashboard.config) if isinstance(dashboard.config, str) else (dashboard.config or {})
+
+    sources = dashboard_sources(config)
+    if body.source:
+        if body.source not in sources:
+            raise HTTPException(status_code=404, detail=f"Source '{body.source}' not found")
+        widget = {"props": {"source": body.source}}
+    else:
+        widget = next((w for w in data_widgets(config) if w.get("id") == body.widget_id), None)
+        if widget is None:
+            raise HTTPException(status_code=404, detail=f"Widget '{body.widget_id}' not found")
+        if widget_source(widget):
+            raise HTTPException(status_code=400, detail="Widget reads a shared source, materialize the source instead")
+    sql, params = widget_query(widget, sources, body.params, materialized=False)
+    check_developer_sql(sql)
+
+    try:
+        mv = matviews.create_view(
+            db, dashboard_id, sql, params,
+            widget_id=body.widget_id,
+            source_name=body.source,
+            unique_key=body.unique_key,
+            refresh_interval_seconds=body.refresh_interval_seconds,
+            refresh_on_change=body.refresh_on_change,
+            created_by=current_user.id,
+        )
+        db.commit()
+    except matviews.MatviewError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Database error: {e}")
+    db.refresh(mv)
+    matviews.activate(mv)
+    logger.info(f"User {current_user.username} materialized dashboard {dashboard_id} query as {mv.name}")
+    return matviews.describe(mv)
+
+
+@router.post("/materialized/{view_id}/refresh")
+def refresh_materialized_view(
+    view_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_developer)
+):
+    """Обновить представление сейчас (REFRESH MATERIALIZED VIEW CONCURRENTLY)"""
+    mv = _user_view(db, view_id, current_user)
+    result = matviews.refresh_view(mv.id)
+    if result.get("error"):
+        raise HTTPException(status_code=400, detail=f"Refresh failed: {result['error']}")
+    return result
+
+
+@router.patch("/materialized/{view_id}")
+def update_materialized_view(
+    view_id: int,
+    body: MaterializedViewUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_developer)
+):
+    """Изменить расписание обновления"""
+    mv = _user_view(db, view_id, current_user)
+    if "refresh_interval_seconds" in body.model_fields_set:
+        mv.refresh_interval_seconds = body.refresh_interval_seconds
+    if body.refresh_on_change is not None:
+        mv.refresh_on_change = body.refresh_on_change
+    db.commit()
+    db.refresh(mv)
+    return matviews.describe(mv)
+
+
+@router.delete("/materialized/{view_id}")
+def delete_materialized_view(
+    view_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_developer)
+):
+    """Удалить представление: запросы виджета снова идут в исходные таблицы"""
+    mv = _user_view(db, view_id, current_user)
+    name = mv.name
+    try:
+        matviews.drop_view(db, mv)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Database error: {e}")
+    matviews.deactivate(name)
+    logger.info(f"User {current_user.username} dropped materialized view {name}")
+    return {"status": "deleted", "id": view_id, "name": name}
+
+
 @router.get("/{dashboard_id}", response_model=DashboardResponse)
 async def get_dashboard(
     dashboard_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """Получить дашборд по ID"""
-    dashboard = db.query(Dashboard).filter(
-        Dashboard.id == dashboard_id,
-        Dashboard.owner_id == current_user.id
-    ).first()
+    dashboard = await _owned_dashboard(db, dashboard_id, current_user)
     if not dashboard:
         raise HTTPException(status_code=404, detail="Дашборд не найден")
     return DashboardResponse(
@@ -100,13 +291,28 @@ async def get_dashboard(
         owner_id = dashboard.owner_id,
     )
 
+def _check_sources(config: Any, current_user: User) -> None:
+    """
+    SQL общих источников (config.sources) — при сохранении: выполняется
+    он потом без участия автора (рендер, кросс-фильтр, автообновление)
+    """
+    from app.api.sql_executor import guard_user_sql
+
+    for name, source in dashboard_sources(config if isinstance(config, dict) else {}).items():
+        try:
+            guard_user_sql(source["sql"], current_user.role.value, read_only=True)
+        except HTTPException as e:
+            raise HTTPException(status_code=e.status_code, detail=f"Source '{name}': {e.detail}")
+
+
 @router.post("/", response_model=DashboardResponse)
 async def create_dashboard(
     dashboard_data: DashboardCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """Создать новый дашборд"""
+    _check_sources(dashboard_data.config, current_user)
     try:
         dashboard = Dashboard(
             title=dashboard_data.title,
@@ -116,8 +322,8 @@ async def create_dashboard(
             is_published=False,
         )
         db.add(dashboard)
-        db.commit()
-        db.refresh(dashboard)
+        await db.commit()
+        await db.refresh(dashboard)
         return DashboardResponse(
             id = dashboard.id,
             title = dashboard.title,
@@ -129,7 +335,7 @@ async def create_dashboard(
             owner_id = dashboard.owner_id,
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
@@ -137,16 +343,15 @@ async def create_dashboard(
 async def update_dashboard(
     dashboard_id: int,
     dashboard_data: DashboardUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """Обновить дашборд"""
-    dashboard = db.query(Dashboard).filter(
-        Dashboard.id == dashboard_id,
-        Dashboard.owner_id == current_user.id
-    ).first()
+    dashboard = await _owned_dashboard(db, dashboard_id, current_user)
     if not dashboard:
         raise HTTPException(status_code=404, detail="Дашборд не найден")
+    if dashboard_data.config:
+        _check_sources(dashboard_data.config, current_user)
     try:
         if dashboard_data.title:
             dashboard.title = dashboard_data.title
@@ -157,8 +362,9 @@ async def update_dashboard(
         if dashboard_data.is_published is not None:
             dashboard.is_published = dashboard_data.is_published
         dashboard.updated_at = datetime.utcnow()
-        db.commit()
-        db.refresh(dashboard)
+        await db.commit()
+        await db.refresh(dashboard)
+        dataset_cache.get_cache().invalidate(dashboard_id)
         return DashboardResponse(
             id = dashboard.id,
             title = dashboard.title,
@@ -170,64 +376,308 @@ async def update_dashboard(
             owner_id = dashboard.owner_id,
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.delete("/{dashboard_id}")
 async def delete_dashboard(
     dashboard_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """Удалить дашборд"""
-    dashboard = db.query(Dashboard).filter(
-        Dashboard.id == dashboard_id,
-        Dashboard.owner_id == current_user.id
-    ).first()
+    dashboard = await _owned_dashboard(db, dashboard_id, current_user)
     if not dashboard:
         raise HTTPException(status_code=404, detail="Дашборд не найден")
     try:
-        db.delete(dashboard)
-        db.commit()
+        result = await db.execute(select(MaterializedView).where(MaterializedView.dashboard_id == dashboard_id))
+        views = result.scalars().all()
+        view_names = [mv.name for mv in views]
+        # DDL представлений — синхронный код matviews на соединении этой же сессии
+        await db.run_sync(lambda session: [matviews.drop_view(session, mv) for mv in views])
+        await db.delete(dashboard)
+        await db.commit()
+        dataset_cache.get_cache().invalidate(dashboard_id)
+        for name in view_names:
+            await run_in_threadpool(matviews.deactivate, name)
         return {"status": "deleted", "id": dashboard_id}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @router.post("/{dashboard_id}/publish")
 async def publish_dashboard(
     dashboard_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """Опубликовать дашборд"""
-    dashboard = db.query(Dashboard).filter(
-        Dashboard.id == dashboard_id,
-        Dashboard.owner_id == current_user.id
-    ).first()
+    dashboard = await _owned_dashboard(db, dashboard_id, current_user)
     if not dashboard:
         raise HTTPException(status_code=404, detail="Дашборд не найден")
     dashboard.is_published = True
     dashboard.updated_at = datetime.utcnow()
-    db.commit()
+    await db.commit()
     return {"status": "published", "id": dashboard_id}
 
 @router.post("/{dashboard_id}/unpublish")
 async def unpublish_dashboard(
     dashboard_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ):
     """Снять с публикации"""
+    dashboard = await _owned_dashboard(db, dashboard_id, current_user)
+    if not dashboard:
+        raise HTTPException(status_code=404, detail="Дашборд не найден")
+    dashboard.is_published = False
+    dashboard.updated_at = datetime.utcnow()
+    await db.commit()
+    return {"status": "unpublished", "id": dashboard_id}
+
+
+@router.post("/{dashboard_id}/export")
+def export_dashboard(
+    dashboard_id: int,
+    fmt: str = Query("xlsx", alias="format"),
+    body: Optional[DashboardExportRequest] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Выгрузить все table/chart виджеты дашборда одним файлом:
+    xlsx — лист на виджет, csv/parquet/arrow — zip с файлом на виджет.
+    Запросы виджетов выполняются параллельно.
+    """
+    try:
+        from app.api import sql_export
+        from app.services.dashboard_export import DashboardExport, ExportLimitError
+    except ImportError as e:
+        raise HTTPException(status_code=400, detail=f"Export is not available on this server: {e}")
+
+    fmt = sql_export.check_export_format(fmt)
     dashboard = db.query(Dashboard).filter(
         Dashboard.id == dashboard_id,
         Dashboard.owner_id == current_user.id
     ).first()
     if not dashboard:
         raise HTTPException(status_code=404, detail="Дашборд не найден")
-    dashboard.is_published = False
-    dashboard.updated_at = datetime.utcnow()
-    db.commit()
-    return {"status": "unpublished", "id": dashboard_id}
+    config = json.loads(dashboard.config) if isinstance(dashboard.config, str) else (dashboard.config or {})
+    widgets = data_widgets(config)
+    if not widgets:
+        raise HTTPException(status_code=400, detail="Dashboard has no table or chart widgets with SQL")
+
+    export = DashboardExport(
+        widgets, fmt, current_user.role.value, (body.params if body else None), dashboard_sources(config)
+    )
+    started = time.perf_counter()
+    spool = tempfile.TemporaryFile()
+    try:
+        export.write(spool)
+        size = spool.tell()
+    except ExportLimitError as e:
+        spool.close()
+        raise HTTPException(status_code=413 if "memory" in str(e) else 408, detail=str(e))
+    except Exception:
+        spool.close()
+        raise
+
+    logger.info(
+        f"User {current_user.username} exported dashboard {dashboard_id}: "
+        f"{len(widgets)} widgets, {sum(export.row_counts.values())} rows, "
+        f"{len(export.errors)} failed, {size} bytes {fmt} in {time.perf_counter() - started:.2f}s"
+    )
+    if fmt == "xlsx":
+        media_type, ext = sql_export.XLSX_MEDIA_TYPE, "xlsx"
+    else:
+        media_type, ext = "application/zip", "zip"
+    return StreamingResponse(
+        sql_export.iter_file(spool),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="dashboard_{dashboard_id}.{ext}"',
+            "Content-Length": str(size),
+        }
+    )
+
+
+@router.post("/{dashboard_id}/crossfilter")
+def crossfilter_dashboard(
+    dashboard_id: int,
+    body: CrossFilterRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Данные виджетов с учётом фильтров дашборда (config.filters) и
+    кросс-фильтров по клику. Результаты запросов виджетов кэшируются
+    поколоночно с битовыми индексами, фильтры и props.transforms
+    применяются в памяти — PostgreSQL опрашивается только при промахе кэша.
+    """
+    from app.api.sql_executor import DEVELOPER_STATEMENT_TIMEOUT, guard_user_sql
+    from app.services.transforms import TransformError, run_pipeline
+
+    dashboard = db.query(Dashboard).filter(
+        Dashboard.id == dashboard_id,
+        Dashboard.owner_id == current_user.id
+    ).first()
+    if not dashboard:
+        raise HTTPException(status_code=404, detail="Дашборд не найден")
+    config = json.loads(dashboard.config) if isinstance(dashboard.config, str) else (dashboard.config or {})
+
+    try:
+        conditions = dataset_cache.normalize_filters(config.get("filters")) + \
+            dataset_cache.normalize_filters(body.filters)
+    except TransformError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    widgets = data_widgets(config)
+    if body.widgets is not None:
+        widgets = [w for w in widgets if w.get("id") in body.widgets]
+    sources = dashboard_sources(config)
+
+    cache = dataset_cache.get_cache()
+    timeout = None if current_user.role.value == "ADMIN" else DEVELOPER_STATEMENT_TIMEOUT
+    started = time.perf_counter()
+    results, errors = {}, {}
+    loaded = {}   # виджеты одного источника делят набор данных
+    for i, w in enumerate(widgets):
+        wid = widget_key(w, i)
+        props = w.get("props") or {}
+        sql, params = widget_query(w, sources, body.params)
+        source = widget_source(w)
+        key = dataset_cache.dataset_key(dashboard_id, f"source:{source}" if source else wid, sql, params)
+        try:
+            if key not in loaded:
+                # Проверяем до кэша: набор, загруженный другой ролью, не должен обходить проверки
+                guard_user_sql(sql, current_user.role.value, read_only=True)
+                if body.refresh:
+                    cache.invalidate_key(key)
+                loaded[key] = dataset_cache.load_dataset(
+                    db, cache, key, sql, params, settings.DATASET_CACHE_MAX_ROWS, timeout
+                )
+            dataset, cached = loaded[key]
+            frame = dataset.select([c for c in conditions if c.get("source") != wid])
+            if props.get("transforms"):
+                frame = run_pipeline(frame, props["transforms"])
+            result = frame.to_result()
+            result["total_rows"] = dataset.rows
+            result["cached"] = cached
+            results[wid] = result
+        except (dataset_cache.DatasetTooLarge, TransformError) as e:
+            errors[wid] = str(e)
+        except HTTPException as e:
+            errors[wid] = str(e.detail)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Crossfilter: widget {wid} failed: {e}")
+            errors[wid] = str(e)
+
+    return {
+        "widgets": results,
+        "errors": errors,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _query_result(db: Session, sql: str, params: dict):
+    """Результат запроса из кэша /api/sql/execute или из БД: (payload, из_кэша)"""
+    from app.api.sql_executor import MAX_ROWS, fetch_result
+
+    cache = query_cache.get_cache() if settings.QUERY_CACHE_ENABLED else None
+    key = query_cache.query_key(sql, params)
+    if cache is not None:
+        hit = cache.get(key)
+        if hit is not None:
+            payload = hit.payload()
+            payload["truncated"] = False
+            return payload, True
+    since = invalidation.index.begin()
+    payload, truncated = fetch_result(prepared.execute(db, sql, params), MAX_ROWS)
+    if cache is not None and not truncated:
+        cache.store(key, query_cache.render_json(payload), db, sql, params, since)
+    payload["truncated"] = truncated
+    return payload, False
+
+
+@router.post("/{dashboard_id}/render")
+def render_dashboard(
+    dashboard_id: int,
+    body: Optional[DashboardRenderRequest] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Данные table/chart виджетов дашборда за один вызов. Каждый источник
+    config.sources (и каждый различный собственный SQL виджетов)
+    выполняется один раз; props.transforms виджета применяются к
+    результату его источника в памяти.
+    """
+    from app.api.sql_executor import guard_user_sql, set_statement_timeout
+    from app.services.transforms import TransformError, apply_transforms
+
+    body = body or DashboardRenderRequest()
+    dashboard = db.query(Dashboard).filter(
+        Dashboard.id == dashboard_id,
+        Dashboard.owner_id == current_user.id
+    ).first()
+    if not dashboard:
+        raise HTTPException(status_code=404, detail="Дашборд не найден")
+    config = json.loads(dashboard.config) if isinstance(dashboard.config, str) else (dashboard.config or {})
+
+    widgets = data_widgets(config)
+    if body.widgets is not None:
+        widgets = [w for w in widgets if w.get("id") in body.widgets]
+    queries, by_widget = plan_queries(widgets, dashboard_sources(config), body.params)
+
+    started = time.perf_counter()
+    outcomes = {}
+    cached = 0
+    for qkey, (sql, params) in queries.items():
+        # Источник мог быть сохранён до проверок или другой ролью — проверяем каждый раз
+        try:
+            guard_user_sql(sql, current_user.role.value, read_only=True)
+        except HTTPException as e:
+            outcomes[qkey] = e
+            continue
+        widget_ids = ",".join(wid for wid, key in by_widget.items() if key == qkey)
+        try:
+            with query_log.record(sql, params, "render", current_user.username, dashboard_id, widget_ids) as entry:
+                set_statement_timeout(db)
+                outcomes[qkey] = _query_result(db, sql, params)
+                payload, hit = outcomes[qkey]
+                entry.cache, entry.rows = "HIT" if hit else "MISS", payload["row_count"]
+            cached += hit
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Render: dashboard {dashboard_id} query failed: {e}")
+            outcomes[qkey] = e
+    db.rollback()
+
+    results, errors = {}, {}
+    for i, w in enumerate(widgets):
+        wid = widget_key(w, i)
+        outcome = outcomes[by_widget[wid]]
+        if isinstance(outcome, Exception):
+            errors[wid] = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            continue
+        payload, _ = outcome
+        transforms = (w.get("props") or {}).get("transforms")
+        try:
+            results[wid] = apply_transforms(payload, transforms) if transforms else payload
+        except TransformError as e:
+            errors[wid] = f"Transform error: {e}"
+
+    logger.info(
+        f"User {current_user.username} rendered dashboard {dashboard_id}: "
+        f"{len(widgets)} widgets, {len(queries)} queries ({cached} cached)"
+    )
+    return {
+        "widgets": results,
+        "errors": errors,
+        "queries": len(queries),
+        "cached": cached,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -0,0 +1,55 @@
+# backend/app/api/index_advisor.py
+# Советник индексов: предложения по журналу запросов и их применение
+# (app/services/index_advisor.py).
+
+from typing import List
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+
+from app.auth.rbac import allow_admin
+from app.models.user import User
+from app.services import index_advisor
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/index-advisor", tags=["Index Advisor"])
+
+
+class ApplyRequest(BaseModel):
+    ids: List[str]
+
+
+@router.get("")
+def list_proposals(current_user: User = Depends(allow_admin)):
+    """Предложения последнего анализа, по убыванию оценки выигрыша"""
+    advisor = index_advisor.get_advisor()
+    return {"proposals": advisor.proposals(), "stats": advisor.info()}
+
+
+@router.post("/analyze")
+def analyze(
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(allow_admin)
+):
+    """
+    EXPLAIN (FORMAT JSON) последних образцов limit самых дорогих отпечатков
+    журнала запросов: Seq Scan и Sort по большим таблицам -> индексы.
+    """
+    advisor = index_advisor.get_advisor()
+    proposals = advisor.analyze(limit)
+    logger.info(f"User {current_user.username} ran index advisor: {len(proposals)} proposals")
+    return {"proposals": proposals, "stats": advisor.info()}
+
+
+@router.post("/apply")
+def apply_proposals(body: ApplyRequest, current_user: User = Depends(allow_admin)):
+    """Создать одобренные индексы (CREATE INDEX CONCURRENTLY в фоне; статус — в GET)"""
+    advisor = index_advisor.get_advisor()
+    missing = [i for i in body.ids if advisor.get(i) is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Proposals not found: {missing}")
+    applied = [advisor.apply(i).describe() for i in body.ids]
+    logger.info(f"User {current_user.username} applied index proposals {body.ids}")
+    return {"proposals": applied}
@@ -0,0 +1,73 @@
+# backend/app/api/jobs.py
+# Фоновые задания: статус, результат, отмена (app/services/jobs.py) и
+# статистика предварительной оценки запросов (app/services/cost_guard.py).
+
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
+
+from app.auth.rbac import allow_admin, allow_developer
+from app.models.user import User
+from app.services import cost_guard, jobs
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/jobs", tags=["Jobs"])
+
+
+def _user_job(job_id: str, current_user: User) -> jobs.Job:
+    job = jobs.get_queue().get(job_id)
+    # Чужие задания видит только admin
+    if job is None or (job.owner_id != current_user.id and current_user.role.value != "ADMIN"):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("")
+def list_jobs(
+    all_users: bool = Query(False, alias="all"),
+    current_user: User = Depends(allow_developer)
+):
+    owner = None if all_users and current_user.role.value == "ADMIN" else current_user.id
+    return {"jobs": [j.describe() for j in jobs.get_queue().list(owner)]}
+
+
+@router.get("/guard")
+def guard_stats(limit: int = Query(20, ge=1, le=200), current_user: User = Depends(allow_admin)):
+    """Маршрутизация по оценке и точность оценок (q-error: фактические строки против плана)"""
+    guard = cost_guard.get_guard()
+    return {
+        "routing": guard.info(),
+        "accuracy": guard.accuracy(limit),
+        "limits": {role: cost_guard.limits_for(role) for role in ("ADMIN", "DEVELOPER")},
+        "queue": jobs.get_queue().info(),
+    }
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str, current_user: User = Depends(allow_developer)):
+    return _user_job(job_id, current_user).describe()
+
+
+@router.get("/{job_id}/result")
+def get_job_result(job_id: str, current_user: User = Depends(allow_developer)):
+    """Результат в формате /api/sql/execute; пока задание не готово — 202 со статусом"""
+    job = _user_job(job_id, current_user)
+    if job.status == jobs.DONE:
+        return Response(job.result, media_type="application/json")
+    if job.status in (jobs.QUEUED, jobs.RUNNING):
+        return JSONResponse(status_code=202, content={"id": job.id, "status": job.status})
+    raise HTTPException(status_code=409, detail={"status": job.status, "error": job.error})
+
+
+@router.delete("/{job_id}")
+def cancel_job(job_id: str, current_user: User = Depends(allow_developer)):
+    """Отменить выполняющееся задание или удалить завершённое вместе с результатом"""
+    queue = jobs.get_queue()
+    job = _user_job(job_id, current_user)
+    if queue.cancel(job):
+        logger.info(f"User {current_user.username} cancelled job {job.id}")
+        return {"id": job.id, "status": jobs.CANCELLED}
+    queue.remove(job)
+    return {"id": job.id, "status": "deleted"}
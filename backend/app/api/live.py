@@ -0,0 +1,158 @@
+# backend/app/api/live.py
+# Подписка на обновления данных дашборда: WebSocket и SSE поверх
+# app.services.refresh_hub. Браузер (WebSocket, EventSource) не умеет
+# передавать заголовок Authorization, поэтому токен принимается и в ?token=.
+
+from typing import Optional
+import asyncio
+import json
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.auth.jwt import decode_token, get_current_user
+from app.config import settings
+from app.database import SessionLocal
+from app.models.dashboard import Dashboard
+from app.models.user import User
+from app.services.refresh_hub import hub
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/live", tags=["Live"])
+
+
+def authorize(token: Optional[str], dashboard_id: int) -> str:
+    """
+    Проверить токен и доступ к дашборду (владелец или опубликованный).
+    Возвращает имя пользователя, иначе HTTPException.
+    """
+    payload = decode_token(token) if token else None
+    username = payload.get("sub") if payload else None
+    if not username:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        if user is None or not user.is_active:
+            raise HTTPException(status_code=401, detail="Could not validate credentials")
+        dashboard = db.query(Dashboard).filter(Dashboard.id == dashboard_id).first()
+        if dashboard is None or (dashboard.owner_id != user.id and not dashboard.is_published):
+            raise HTTPException(status_code=404, detail="Дашборд не найден")
+        return user.username
+    finally:
+        db.close()
+
+
+def _bearer(request: Request, token: Optional[str]) -> Optional[str]:
+    header = request.headers.get("authorization") or ""
+    if header.lower().startswith("bearer "):
+        return header[7:]
+    return token
+
+
+def _parse_params(raw: Optional[str]) -> dict:
+    if not raw:
+        return {}
+    try:
+        params = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+    if not isinstance(params, dict):
+        raise HTTPException(status_code=400, detail="params must be a JSON object")
+    return params
+
+
+@router.websocket("/dashboards/{dashboard_id}")
+async def dashboard_ws(
+    websocket: WebSocket,
+    dashboard_id: int,
+    token: Optional[str] = Query(None),
+    interval: Optional[float] = Query(None),
+    params: Optional[str] = Query(None),
+):
+    """
+    WebSocket-подписка на обновления виджетов. Сообщения — JSON:
+    snapshot/update (widget_id, hash, result), error, removed, ping, closed.
+    """
+    try:
+        username = await run_in_threadpool(authorize, token, dashboard_id)
+        bind = _parse_params(params)
+    except HTTPException as e:
+        await websocket.close(code=4401 if e.status_code == 401 else 4404 if e.status_code == 404 else 4400)
+        return
+
+    await websocket.accept()
+    sub = hub.subscribe(dashboard_id, bind, interval or settings.REFRESH_HUB_DEFAULT_INTERVAL_SECONDS)
+    logger.info(f"Live: {username} subscribed to dashboard {dashboard_id} (ws)")
+
+    async def drain_incoming():
+        # Клиент ничего не шлёт; читаем, чтобы заметить закрытие соединения
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    reader = asyncio.create_task(drain_incoming())
+    try:
+        while not reader.done():
+            batch = await sub.next_batch(settings.REFRESH_HUB_HEARTBEAT_SECONDS)
+            for message in batch or [{"type": "ping"}]:
+                await asyncio.wait_for(websocket.send_json(message), settings.REFRESH_HUB_SEND_TIMEOUT_SECONDS)
+            if sub.closed:
+                await websocket.close()
+                break
+    except asyncio.TimeoutError:
+        logger.warning(f"Live: {username} is too slow, dropping dashboard {dashboard_id} subscription")
+        await websocket.close(code=1013)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        reader.cancel()
+        hub.unsubscribe(sub)
+
+
+@router.get("/dashboards/{dashboard_id}/events")
+async def dashboard_events(
+    request: Request,
+    dashboard_id: int,
+    token: Optional[str] = Query(None),
+    interval: Optional[float] = Query(None),
+    params: Optional[str] = Query(None),
+):
+    """SSE-вариант той же подписки (EventSource), события с теми же JSON-сообщениями"""
+    username = await run_in_threadpool(authorize, _bearer(request, token), dashboard_id)
+    bind = _parse_params(params)
+    sub = hub.subscribe(dashboard_id, bind, interval or settings.REFRESH_HUB_DEFAULT_INTERVAL_SECONDS)
+    logger.info(f"Live: {username} subscribed to dashboard {dashboard_id} (sse)")
+
+    async def events():
+        try:
+            while not await request.is_disconnected():
+                batch = await sub.next_batch(settings.REFRESH_HUB_HEARTBEAT_SECONDS)
+                if not batch:
+                    yield ": ping\n\n"
+                    continue
+                for message in batch:
+                    yield f"event: {message['type']}\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+                if sub.closed:
+                    break
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/stats")
+async def live_stats(current_user: User = Depends(get_current_user)):
+    """Состояние хаба: каналы, подписчики, выполненные и разделённые запросы"""
+    if current_user.role.value != "ADMIN":
+        raise HTTPException(status_code=403, detail="Admin only")
+    return hub.info()
@@ -0,0 +1,267 @@
+# backend/app/api/pivot.py
+# Сводные таблицы: агрегация на стороне PostgreSQL через GROUPING SETS.
+#
+# SQL виджета оборачивается подзапросом, по измерениям строк и колонок
+# строится один запрос с GROUPING SETS (детали, промежуточные и общие
+# итоги), и клиенту уходит готовая матрица ячеек вместо сырых строк.
+
+from itertools import product
+from typing import Any, Dict, List, Tuple
+import logging
+import time
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import get_db
+from app.models.user import User
+from app.schemas.sql import PivotRequest, PivotMeasure
+from app.auth.dependencies import get_current_active_user
+from app.api.sql_executor import (
+    check_developer_sql,
+    ensure_default_params,
+    raise_sql_error,
+    set_statement_timeout,
+)
+from app.services import sql_analysis
+from app.services.converters import ResultConverter
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/sql", tags=["SQL Pivot"])
+
+# Разрешённые агрегаты: имя -> шаблон выражения
+AGGREGATES = {
+    "sum": "SUM({})",
+    "avg": "AVG({})",
+    "min": "MIN({})",
+    "max": "MAX({})",
+    "count": "COUNT({})",
+    "count_distinct": "COUNT(DISTINCT {})",
+}
+
+MAX_DIMENSIONS = 8
+
+
+def quote_ident(name: str) -> str:
+    """Имя колонки результата SQL виджета -> идентификатор в кавычках"""
+    if not isinstance(name, str) or not name or "\x00" in name:
+        raise HTTPException(status_code=400, detail=f"Invalid column name: {name!r}")
+    return '"' + name.replace('"', '""') + '"'
+
+
+def measure_name(m: PivotMeasure) -> str:
+    return m.name or f"{m.agg}_{m.field}"
+
+
+def grouping_levels(n: int, subtotals: bool, totals: bool) -> List[int]:
+    """Сколько первых измерений участвует в группировке для каждого уровня"""
+    if n == 0:
+        return [0]
+    if subtotals:
+        levels = list(range(n, 0, -1))
+    else:
+        levels = [n]
+    if totals:
+        levels.append(0)
+    return levels
+
+
+def compile_pivot(body: PivotRequest) -> Tuple[str, List[str]]:
+    """
+    PivotRequest -> (SQL, имена измерений). Один проход по данным:
+    GROUPING SETS из декартова произведения уровней строк и колонок.
+    Колонка __grouping — битовая маска GROUPING(...) по всем измерениям,
+    чтобы отличать итог от настоящего NULL в данных.
+    """
+    dims = list(body.rows) + list(body.columns)
+    if len(dims) > MAX_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"Too many pivot dimensions (max {MAX_DIMENSIONS})")
+    if len(set(dims)) != len(dims):
+        raise HTTPException(status_code=400, detail="Pivot dimensions must be unique")
+    if not body.measures:
+        raise HTTPException(status_code=400, detail="At least one measure is required")
+
+    row_q = [quote_ident(d) for d in body.rows]
+    col_q = [quote_ident(d) for d in body.columns]
+
+    select = row_q + col_q
+    if dims:
+        select.append(f"GROUPING({', '.join(row_q + col_q)}) AS __grouping")
+    else:
+        select.append("0 AS __grouping")
+
+    names = set()
+    for i, m in enumerate(body.measures):
+        template = AGGREGATES.get(m.agg.lower())
+        if template is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown aggregation '{m.agg}'. Allowed: {', '.join(AGGREGATES)}"
+            )
+        name = measure_name(m)
+        if name in names:
+            raise HTTPException(status_code=400, detail=f"Duplicate measure name: {name}")
+        names.add(name)
+        if m.field == "*" and m.agg.lower() == "count":
+            expr = "COUNT(*)"
+        else:
+            expr = template.format(quote_ident(m.field))
+        select.append(f"{expr} AS __m{i}")
+
+    sql = body.query.strip().rstrip(";")
+    # SQL встаёт в FROM (...) AS __src: лишняя ")" вывела бы его за обёртку
+    analysis = sql_analysis.analyze(sql)
+    if analysis.error:
+        raise HTTPException(status_code=400, detail=f"SQL parse error: {analysis.error}")
+    if not analysis.is_read:
+        raise HTTPException(status_code=400, detail="Pivot source must be a single SELECT/WITH query")
+    compiled = f"SELECT {', '.join(select)}\nFROM (\n{sql}\n) AS __src"
+
+    if dims:
+        sets = []
+        for r, c in product(
+            grouping_levels(len(row_q), body.subtotals, body.totals),
+            grouping_levels(len(col_q), body.subtotals, body.totals),
+        ):
+            sets.append("(" + ", ".join(row_q[:r] + col_q[:c]) + ")")
+        compiled += f"\nGROUP BY GROUPING SETS ({', '.join(sets)})"
+
+    return compiled, dims
+
+
+def _level(mask: int, offset: int, count: int, total: int) -> int:
+    """Число детализированных измерений группы (подряд с первого)"""
+    level = 0
+    for i in range(count):
+        # GROUPING(a, b, c): бит a — старший
+        if mask >> (total - 1 - offset - i) & 1:
+            break
+        level += 1
+    return level
+
+
+def _sort_key(header: Tuple[int, tuple]):
+    _, key = header
+    # Детали по порядку значений (NULL в конце), итог уровня — после своих деталей
+    return [(0, v is None, "" if v is None else v) for v in key] + [(1, False, "")]
+
+
+def _sorted_headers(headers: Dict[Tuple[int, tuple], int]) -> List[Tuple[int, tuple]]:
+    try:
+        return sorted(headers, key=_sort_key)
+    except TypeError:
+        # Смешанные типы значений в одном измерении — сортируем как строки
+        return sorted(headers, key=lambda h: [(p[0], p[1], str(p[2])) for p in _sort_key(h)])
+
+
+def build_matrix(
+    body: PivotRequest,
+    groups: List[Dict[str, Any]],
+    max_cells: int,
+) -> Dict[str, Any]:
+    """Строки GROUPING SETS -> заголовки строк/колонок и матрицы ячеек по мерам"""
+    n_rows, n_cols = len(body.rows), len(body.columns)
+    total = n_rows + n_cols
+
+    row_headers: Dict[Tuple[int, tuple], int] = {}
+    col_headers: Dict[Tuple[int, tuple], int] = {}
+    located = []
+    for g in groups:
+        mask = g["__grouping"] or 0
+        r_level = _level(mask, 0, n_rows, total)
+        c_level = _level(mask, n_rows, n_cols, total)
+        r_key = (r_level, tuple(g[d] for d in body.rows[:r_level]))
+        c_key = (c_level, tuple(g[d] for d in body.columns[:c_level]))
+        row_headers.setdefault(r_key, 0)
+        col_headers.setdefault(c_key, 0)
+        located.append((r_key, c_key, g))
+
+    rows = _sorted_headers(row_headers)
+    cols = _sorted_headers(col_headers)
+    if len(rows) * len(cols) * len(body.measures) > max_cells:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Pivot is too large: {len(rows)} x {len(cols)} cells (max {max_cells})"
+        )
+    row_index = {h: i for i, h in enumerate(rows)}
+    col_index = {h: i for i, h in enumerate(cols)}
+
+    cells = {measure_name(m): [[None] * len(cols) for _ in rows] for m in body.measures}
+    for r_key, c_key, g in located:
+        ri, ci = row_index[r_key], col_index[c_key]
+        for i, m in enumerate(body.measures):
+            cells[measure_name(m)][ri][ci] = g[f"__m{i}"]
+
+    return {
+        "row_dims": list(body.rows),
+        "column_dims": list(body.columns),
+        "rows": [{"key": list(key), "level": level, "total": level < n_rows} for level, key in rows],
+        "columns": [{"key": list(key), "level": level, "total": level < n_cols} for level, key in cols],
+        "measures": [{"name": measure_name(m), "field": m.field, "agg": m.agg.lower()} for m in body.measures],
+        "cells": cells,
+    }
+
+
+@router.post("/pivot")
+def pivot_sql(
+    body: PivotRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Сводная таблица по SQL виджета: измерения строк и колонок, меры
+    с агрегатами. Считается одним запросом с GROUPING SETS, включая
+    промежуточные (subtotals) и общие (totals) итоги.
+    """
+    if current_user.role.value not in ["ADMIN", "DEVELOPER"]:
+        raise HTTPException(
+            status_code=403,
+            detail="Only admin and developer can execute SQL queries"
+        )
+
+    raw_sql = body.query or ""
+    if not raw_sql.strip():
+        raise HTTPException(status_code=400, detail="SQL query cannot be empty")
+    if sql_analysis.analyze(raw_sql).statement_count > 1:
+        raise HTTPException(status_code=400, detail="Multiple statements are not allowed")
+
+    # Сводная таблица — только чтение, в том числе для ADMIN
+    check_developer_sql(raw_sql)
+
+    compiled, _ = compile_pivot(body)
+    params = ensure_default_params(body.params)
+    max_cells = settings.PIVOT_MAX_CELLS
+    max_groups = max(1, max_cells // len(body.measures))
+
+    started = time.monotonic()
+    try:
+        if current_user.role.value == "DEVELOPER":
+            set_statement_timeout(db)
+        result = db.execute(text(compiled), params)
+        converter = ResultConverter.for_result(result, "json", settings.JSON_DECIMALS_AS_STRING)
+        batch = result.fetchmany(max_groups + 1)
+        if len(batch) > max_groups:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Pivot is too large: more than {max_groups} groups (max {max_cells} cells)"
+            )
+        groups = converter.records(batch)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise_sql_error(e)
+    finally:
+        db.rollback()
+
+    payload = build_matrix(body, groups, max_cells)
+    payload["group_count"] = len(groups)
+    payload["sql"] = compiled
+    logger.info(
+        f"User {current_user.username} pivot: {len(groups)} groups, "
+        f"{len(payload['rows'])}x{len(payload['columns'])} in {time.monotonic() - started:.2f}s"
+    )
+    return JSONResponse(payload)
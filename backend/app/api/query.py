@@ -1,17 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, Body
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text
+from app.config import settings
 from app.database import get_db
+from app.services import query_log, sql_analysis
+from app.services.converters import ResultConverter
 
 router = APIRouter(prefix="/api/query", tags=["Query"])
 
 MAX_ROWS = 500
 
 def is_sql_safe(query: str) -> bool:
-    """Разрешает ТОЛЬКО безопасные SELECT-запросы (без опасных операций)"""
-    q = query.strip().lower()
-    forbidden = ["drop ", "delete ", "update ", "insert ", "alter ", "create ", "truncate "]
-    return q.startswith("select") and not any(f in q for f in forbidden)
+    """Разрешает ТОЛЬКО один читающий оператор (без изменяющих CTE, SELECT INTO, FOR UPDATE)"""
+    return sql_analysis.analyze(query).is_read
 
 @router.post("/")
 async def execute_sql(
@@ -24,21 +26,22 @@ async def execute_sql(
     if not is_sql_safe(query):
         raise HTTPException(status_code=400, detail="Only safe SELECT queries allowed.")
 
-    # Добавим автоматический LIMIT, если не указан
-    query_low = query.lower()
-    if "select" in query_low and "limit" not in query_low:
-        query += f" LIMIT {MAX_ROWS}"
+    # Добавим автоматический LIMIT, если его нет на верхнем уровне
+    if not sql_analysis.analyze(query).has_limit:
+        query = query.strip().rstrip(";") + f"\nLIMIT {MAX_ROWS}"
 
     try:
-        result = db.execute(text(query), params)
-        columns = list(result.keys())
-        # КОРРЕКТНОЕ получение словаря:
-        data = [dict(zip(columns, row)) for row in result]
-        return {
-            "columns": columns,
-            "data": data,
-            "row_count": len(data),
-            "query": query
-        }
+        with query_log.record(query, params, "query") as entry:
+            result = db.execute(text(query), params)
+            converter = ResultConverter.for_result(result, "json", settings.JSON_DECIMALS_AS_STRING)
+            data = converter.records(result.fetchall())
+            response = JSONResponse({
+                "columns": converter.names,
+                "data": data,
+                "row_count": len(data),
+                "query": query
+            })
+            entry.rows, entry.bytes = len(data), len(response.body)
+        return response
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"SQL error: {str(e)}")
@@ -0,0 +1,61 @@
+# backend/app/api/query_log.py
+# Журнал запросов: самые дорогие отпечатки, последние выполнения, планы
+# медленных запросов (app/services/query_log.py).
+
+from typing import Literal, Optional
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.auth.rbac import allow_admin
+from app.models.user import User
+from app.services import query_log
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/query-log", tags=["Query Log"])
+
+
+@router.get("/top")
+def top_fingerprints(
+    by: Literal["total_ms", "p95_ms", "mean_ms", "max_ms", "calls", "errors"] = "total_ms",
+    limit: int = Query(20, ge=1, le=500),
+    source: Optional[str] = None,
+    current_user: User = Depends(allow_admin)
+):
+    """
+    Отпечатки запросов (текст без литералов), отсортированные по
+    суммарному времени, p95 и т.д. source — sql_execute, query, render,
+    export_<format>.
+    """
+    log = query_log.get_log()
+    return {"fingerprints": log.top(by, limit, source), "stats": log.info()}
+
+
+@router.get("/recent")
+def recent_queries(
+    limit: int = Query(100, ge=1, le=1000),
+    fingerprint: Optional[str] = None,
+    min_ms: float = 0,
+    errors_only: bool = False,
+    current_user: User = Depends(allow_admin)
+):
+    """Последние выполнения (новые первыми)"""
+    return {"records": query_log.get_log().recent(limit, fingerprint, min_ms, errors_only)}
+
+
+@router.get("/fingerprints/{fingerprint}")
+def fingerprint_details(fingerprint: str, current_user: User = Depends(allow_admin)):
+    """Сводка отпечатка и план EXPLAIN (ANALYZE, BUFFERS) последнего медленного выполнения"""
+    details = query_log.get_log().get(fingerprint)
+    if details is None:
+        raise HTTPException(status_code=404, detail="Fingerprint not found")
+    details["recent"] = query_log.get_log().recent(20, fingerprint)
+    return details
+
+
+@router.delete("")
+def clear_query_log(current_user: User = Depends(allow_admin)):
+    query_log.get_log().clear()
+    logger.info(f"User {current_user.username} cleared the query log")
+    return {"status": "cleared"}
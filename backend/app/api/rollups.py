@@ -0,0 +1,129 @@
+# backend/app/api/rollups.py
+# Администрирование сводных таблиц (rollups): объявление агрегатов,
+# пересборка и удаление. Подмена запросов — в app/services/rollups.py.
+
+from typing import List, Literal, Optional
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+
+from app.auth.rbac import allow_admin
+from app.database import get_db
+from app.models.rollup import Rollup
+from app.models.user import User
+from app.services import rollups
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/rollups", tags=["Rollups"])
+
+
+class RollupDimension(BaseModel):
+    column: str
+    # date_trunc для дат: day, week, month, quarter, year
+    grain: Optional[str] = None
+
+
+class RollupMeasure(BaseModel):
+    column: str
+    agg: Literal["sum", "count"] = "sum"
+
+
+class RollupCreate(BaseModel):
+    name: str = Field(..., max_length=50)
+    base_table: str                     # schema.table или table
+    dimensions: List[RollupDimension]
+    measures: List[RollupMeasure] = []
+    # trigger — триггеры на базовой таблице; delta — фоновая синхронизация по updated_column
+    mode: Literal["trigger", "delta"] = "trigger"
+    updated_column: Optional[str] = None
+    # delta: подменять запросы на сводку, хотя до полной пересборки она может отставать
+    allow_stale: bool = False
+
+
+def _get_rollup(db: Session, rollup_id: int) -> Rollup:
+    rollup = db.query(Rollup).filter(Rollup.id == rollup_id).first()
+    if rollup is None:
+        raise HTTPException(status_code=404, detail="Rollup not found")
+    return rollup
+
+
+@router.get("")
+def list_rollups(db: Session = Depends(get_db), current_user: User = Depends(allow_admin)):
+    return {
+        "rollups": [rollups.describe(r) for r in db.query(Rollup).order_by(Rollup.id).all()],
+        "stats": rollups.info(),
+    }
+
+
+@router.post("")
+def create_rollup(
+    body: RollupCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_admin)
+):
+    """
+    Создать и заполнить сводную таблицу. Дальше агрегатные запросы к
+    base_table по этим измерениям (или более крупному зерну дат)
+    отвечаются из сводки.
+    """
+    if db.query(Rollup).filter(Rollup.name == body.name).first():
+        raise HTTPException(status_code=400, detail=f"Rollup '{body.name}' already exists")
+    try:
+        rollup = rollups.create_rollup(
+            db, body.name, body.base_table,
+            [d.model_dump() for d in body.dimensions],
+            [m.model_dump() for m in body.measures],
+            mode=body.mode,
+            updated_column=body.updated_column,
+            created_by=current_user.id,
+            allow_stale=body.allow_stale,
+        )
+        db.commit()
+    except rollups.RollupError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Database error: {e}")
+    db.refresh(rollup)
+    rollups.reload()
+    logger.info(f"User {current_user.username} created rollup {rollup.name} over {rollup.base_table}")
+    return rollups.describe(rollup)
+
+
+@router.post("/{rollup_id}/sync")
+def sync_rollup(
+    rollup_id: int,
+    full: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_admin)
+):
+    """Синхронизировать delta-сводку сейчас; full=true — пересобрать целиком"""
+    rollup = _get_rollup(db, rollup_id)
+    result = rollups.sync(rollup.id, full=full)
+    if result.get("error"):
+        raise HTTPException(status_code=400, detail=f"Sync failed: {result['error']}")
+    return result
+
+
+@router.delete("/{rollup_id}")
+def delete_rollup(
+    rollup_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(allow_admin)
+):
+    """Удалить сводку, её триггеры и функцию"""
+    rollup = _get_rollup(db, rollup_id)
+    name = rollup.name
+    try:
+        rollups.drop_rollup(db, rollup)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Database error: {e}")
+    rollups.reload()
+    logger.info(f"User {current_user.username} dropped rollup {name}")
+    return {"status": "deleted", "id": rollup_id, "name": name}
@@ -1,15 +1,24 @@
 # backend/app/api/sql_executor.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-import re
+import json
 import logging
+from typing import NoReturn, Optional, Tuple
 
-from app.database import get_db
+from app.config import settings
+from app.database import ReplicaSessionLocal, SessionLocal, get_db
 from app.models.user import User
 from app.schemas.sql import SQLExecuteRequest, SQLResult
 from app.auth.dependencies import get_current_active_user
+from app.services.converters import ResultConverter
+from app.services.transforms import TransformError, apply_transforms
+from app.services import (
+    cost_guard, invalidation, jobs, matviews, query_cache, query_log, result_versions, rollups,
+    single_flight, sql_analysis, time_chunks,
+)
 
 
 # Настройка логирования
@@ -19,6 +28,13 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/sql", tags=["SQL Executor"])
 
 
+# Ограничим объём результата, чтобы не уронить фронт
+MAX_ROWS = 10000
+
+# Таймаут запросов роли DEVELOPER (и сохранённого SQL дашбордов не-ADMIN)
+DEVELOPER_TIMEOUT_SECONDS = 30
+DEVELOPER_STATEMENT_TIMEOUT = f"{DEVELOPER_TIMEOUT_SECONDS}s"
+
 # Расширенный blacklist опасных функций для роли разработчика
 DANGEROUS_FUNCS = {
     "pg_sleep", "pg_terminate_backend", "pg_cancel_backend",
@@ -27,32 +43,13 @@ DANGEROUS_FUNCS = {
     "current_setting", "dblink", "dblink_connect", "dblink_exec",
     "pg_reload_conf", "pg_rotate_logfile", "copy", "pg_read_binary_file"
 }
+# Семейства функций: pg_sleep_for, dblink_send_query, lo_get, pg_ls_waldir, ...
+DANGEROUS_PREFIXES = ("pg_sleep", "dblink", "lo_", "pg_read", "pg_ls_", "pg_stat_file", "pg_file_")
 
 
-def normalize_sql_start(q: str) -> str:
-    """
-    Удаление лидирующих комментариев/пробелов, поддержка начала с WITH
-    """
-    if not q:
-        return ""
-    
-    s = q.lstrip()
-    
-    # Убрать ведущие многострочные комментарии
-    s = re.sub(r"^\s*/\*.*?\*/\s*", "", s, flags=re.DOTALL)
-    
-    # Убрать ведущие построчные комментарии и пустые строки
-    lines = s.splitlines()
-    i = 0
-    while i < len(lines):
-        line = lines[i]
-        if not line.strip() or line.lstrip().startswith("--"):
-            i += 1
-            continue
-        break
-    
-    s = "\n".join(lines[i:]).lstrip()
-    return s
+def blocked_functions(names) -> list:
+    """Запрещённые для DEVELOPER функции из набора имён (по имени и по семейству)"""
+    return sorted(n for n in names if n in DANGEROUS_FUNCS or n.startswith(DANGEROUS_PREFIXES))
 
 
 def ensure_default_params(raw_params: dict | None) -> dict:
@@ -69,6 +66,253 @@ def ensure_default_params(raw_params: dict | None) -> dict:
     return params
 
 
+def fetch_result(result, max_rows: int) -> Tuple[dict, bool]:
+    """Строки результата -> JSON-готовый {columns, data, row_count} и признак обрезки"""
+    # Конвертер строится до выборки: после неё курсор закрывается
+    converter = ResultConverter.for_result(result, "json", settings.JSON_DECIMALS_AS_STRING)
+    rows = result.fetchmany(max_rows + 1)
+    
+    # Преобразуем строки в JSON-готовые словари (поколоночно)
+    data = converter.records(rows[:max_rows])
+    payload = {
+        "columns": converter.names,
+        "data": data,
+        "row_count": len(data)
+    }
+    return payload, len(rows) > max_rows
+
+
+def run_time_window(db: Session, raw_sql: str, params: dict, raw_spec: dict) -> Optional[Tuple[dict, dict]]:
+    """Запрос по кускам окна p_date_from..p_date_to (см. app.services.time_chunks)"""
+    def run(piece_params: dict) -> dict:
+        payload, truncated = fetch_result(db.execute(text(raw_sql), piece_params), MAX_ROWS)
+        payload["truncated"] = truncated
+        return payload
+    
+    try:
+        spec = time_chunks.TimeWindowSpec(raw_spec)
+        return time_chunks.run_windowed(
+            time_chunks.get_cache(), db, raw_sql, params, spec, run,
+            MAX_ROWS, settings.TIME_CHUNK_MAX_QUERIES,
+        )
+    except time_chunks.TimeWindowError as e:
+        raise HTTPException(status_code=400, detail=f"Time window error: {e}")
+
+
+def run_shared_read(
+    raw_sql: str,
+    params: dict,
+    timeout: Optional[str],
+    cache_key: Optional[str],
+    since: int,
+    replica: bool = False,
+) -> Optional[Tuple[bytes, dict, bool]]:
+    """
+    Выполнить читающий запрос на собственной сессии (вызов общий для всех
+    присоединившихся через single_flight), при replica — на реплике.
+    Возвращает (тело, payload, обрезан ли) или None, если запрос не вернул строк.
+    """
+    db = ReplicaSessionLocal() if replica else SessionLocal()
+    try:
+        if timeout:
+            set_statement_timeout(db, timeout)
+        result = db.execute(text(raw_sql), params)
+        if not result.returns_rows:
+            return None
+        payload, is_truncated = fetch_result(result, MAX_ROWS)
+        body = query_cache.render_json(payload)
+        if cache_key is not None and not is_truncated:
+            query_cache.get_cache().store(cache_key, body, db, raw_sql, params, since)
+        return body, payload, is_truncated
+    finally:
+        db.rollback()
+        db.close()
+
+
+def submit_query_job(raw_sql: str, params: dict, user: User, decision: "cost_guard.Decision") -> JSONResponse:
+    """Тяжёлый SELECT -> фоновое задание; клиент опрашивает /api/jobs/{id}"""
+    guard = cost_guard.get_guard()
+
+    def run(ctx: jobs.JobContext) -> bytes:
+        db = ctx.session()
+        try:
+            set_statement_timeout(db, settings.JOB_STATEMENT_TIMEOUT)
+            with query_log.record(raw_sql, params, "job", user.username) as entry:
+                payload, is_truncated = fetch_result(db.execute(text(raw_sql), params), MAX_ROWS)
+                payload["truncated"] = is_truncated
+                body = query_cache.render_json(payload)
+                entry.rows, entry.bytes = payload["row_count"], len(body)
+            if not is_truncated:
+                guard.record_actual(decision.estimate, payload["row_count"])
+            return body
+        finally:
+            db.rollback()
+            db.close()
+
+    estimate = decision.estimate.describe() if decision.estimate is not None else None
+    try:
+        job = jobs.get_queue().submit(user.id, "sql_execute", raw_sql[:200], run, meta={"estimate": estimate})
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    logger.info(f"User {user.username} query routed to job {job.id}: {decision.reason}")
+    return JSONResponse(
+        status_code=202,
+        content={
+            "job_id": job.id,
+            "status": job.status,
+            "reason": decision.reason,
+            "estimate": estimate,
+            "poll": f"/api/jobs/{job.id}",
+        },
+        headers={"X-Query-Route": cost_guard.JOB},
+    )
+
+
+def is_read_query(raw_sql: str) -> bool:
+    """Один читающий оператор (окончательно решает план в invalidation)"""
+    return sql_analysis.analyze(raw_sql).is_read
+
+
+def result_response(
+    body: bytes,
+    request: SQLExecuteRequest,
+    cache_status: Optional[str] = None,
+    payload: Optional[dict] = None,
+    version_key: Optional[str] = None,
+    if_none_match: Optional[str] = None,
+) -> Response:
+    """
+    Готовый JSON результата -> ответ. Если в запросе есть transforms,
+    они применяются к результату (в т.ч. взятому из кэша). К ответу
+    добавляется отпечаток; если клиент прислал отпечаток своей версии —
+    отвечаем "не изменилось" или дельтой по key_columns.
+    """
+    headers = {"X-Cache": cache_status} if cache_status else {}
+    if request.transforms:
+        # Декларативная постобработка (filter/aggregate/pivot/...)
+        try:
+            out = apply_transforms(payload if payload is not None else json.loads(body), request.transforms, request.inputs)
+        except TransformError as e:
+            raise HTTPException(status_code=400, detail=f"Transform error: {e}")
+        body = query_cache.render_json(out)
+
+    body, fp = result_versions.with_fingerprint(body)
+    headers["ETag"] = f'"{fp}"'
+    store = result_versions.get_store()
+
+    # If-None-Match — настоящий 304; fingerprint в теле — ответ без данных
+    if if_none_match and fp in {t.strip().removeprefix("W/").strip('"') for t in if_none_match.split(",")}:
+        store.stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    if request.fingerprint == fp:
+        store.stats["not_modified"] += 1
+        return JSONResponse({"not_modified": True, "fingerprint": fp}, headers=headers)
+
+    if version_key is not None:
+        if request.transforms:
+            version_key += query_cache.query_key(json.dumps(request.transforms, sort_keys=True, default=str), {})
+        store.add(version_key, fp, body)
+        if request.fingerprint and request.key_columns:
+            delta = result_versions.delta_payload(store, version_key, request.fingerprint, body, fp, request.key_columns)
+            if delta is not None:
+                store.stats["diffs"] += 1
+                return Response(delta, media_type="application/json", headers=headers)
+    store.stats["full"] += 1
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def check_developer_sql(raw_sql: str) -> None:
+    """
+    Ограничения роли DEVELOPER: один читающий оператор и без опасных функций
+    """
+    analysis = sql_analysis.analyze(raw_sql)
+    if analysis.error:
+        raise HTTPException(status_code=400, detail=f"SQL parse error: {analysis.error}")
+
+    # Один оператор SELECT/WITH/VALUES без изменяющих CTE, SELECT INTO и FOR UPDATE
+    if not analysis.is_read:
+        raise HTTPException(
+            status_code=403,
+            detail="Developer can only execute read-only queries (SELECT/WITH)"
+        )
+
+    # Блокируем опасные функции (по вызовам, а не по подстроке: copy_count допустим)
+    blocked = blocked_functions(analysis.function_names)
+    if blocked:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Function '{blocked[0]}' is not allowed for developer role"
+        )
+
+
+def guard_user_sql(raw_sql: str, role: str, db: Optional[Session] = None, read_only: bool = False) -> None:
+    """
+    Ограничения /api/sql/execute для SQL, который выполняется от имени
+    пользователя, в том числе сохранённого SQL виджетов и источников
+    дашборда: всем, кроме ADMIN, — проверки роли DEVELOPER и её таймаут.
+    read_only — только чтение и для ADMIN (рендер, выгрузка, кросс-фильтр)
+    """
+    if read_only and not is_read_query(raw_sql):
+        raise HTTPException(status_code=400, detail="Only SELECT/WITH queries are allowed here")
+    if role == "ADMIN":
+        return
+    check_developer_sql(raw_sql)
+    if db is not None:
+        set_statement_timeout(db, DEVELOPER_STATEMENT_TIMEOUT)
+
+
+def set_statement_timeout(db: Session, timeout: str = DEVELOPER_STATEMENT_TIMEOUT) -> None:
+    """Локальный таймаут запроса, чтобы не зависал бэкенд"""
+    try:
+        db.execute(text(f"SET LOCAL statement_timeout = '{timeout}'"))
+    except Exception as e:
+        logger.warning(f"Failed to set statement timeout: {e}")
+
+
+def raise_sql_error(e: Exception) -> NoReturn:
+    """Перевести ошибку БД в HTTPException с дружелюбным сообщением"""
+    msg = str(e)
+    ml = msg.lower()
+    
+    # Дружелюбные сообщения об ошибках
+    if "syntax error" in ml:
+        raise HTTPException(
+            status_code=400,
+            detail=f"SQL Syntax Error: {msg}"
+        )
+    
+    if "permission denied" in ml:
+        raise HTTPException(
+            status_code=403,
+            detail=f"Permission denied: {msg}"
+        )
+    
+    if "does not exist" in ml:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Table or column not found: {msg}"
+        )
+    
+    if "statement timeout" in ml or "timeout" in ml:
+        raise HTTPException(
+            status_code=408,
+            detail="Query timeout (30s) exceeded"
+        )
+    
+    if "value is required for bind parameter" in ml:
+        raise HTTPException(
+            status_code=400,
+            detail="Missing query parameter. Ensure params include p_date_from, p_date_to, p_object_id (use null if not needed)."
+        )
+    
+    # Общая ошибка
+    logger.error(f"SQL execution error: {msg}")
+    raise HTTPException(
+        status_code=400,
+        detail=f"Database error: {msg}"
+    )
+
+
 # ========================================
 # НОВЫЙ ЭНДПОИНТ: Получить список таблиц
 # ========================================
@@ -132,6 +376,7 @@ async def get_database_tables(
 @router.post("/execute", response_model=SQLResult)
 async def execute_sql(
     request: SQLExecuteRequest,
+    http_request: Request,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
@@ -160,10 +405,6 @@ async def execute_sql(
             detail="SQL query cannot be empty"
         )
     
-    # Нормализуем начало, чтобы разрешить комментарии и WITH
-    norm = normalize_sql_start(raw_sql)
-    upper_prefix = norm[:8].upper()  # достаточно для SELECT/WITH
-    
     # Параметры запроса (могут прийти из клиента)
     params = ensure_default_params(getattr(request, "params", None))
     
@@ -171,120 +412,138 @@ async def execute_sql(
     # DEVELOPER: Только read-only запросы
     # ========================================
     
-    if current_user.role.value == "DEVELOPER":
-        # Разрешаем SELECT и WITH
-        if not (upper_prefix.startswith("SELECT") or upper_prefix.startswith("WITH")):
-            raise HTTPException(
-                status_code=403,
-                detail="Developer can only execute read-only queries (SELECT/WITH)"
-            )
-        
-        # Блокируем опасные функции
-        low = raw_sql.lower()
-        for danger in DANGEROUS_FUNCS:
-            if danger in low:
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"Function '{danger}' is not allowed for developer role"
-                )
-        
-        # Локальный таймаут запроса, чтобы не зависал бэкенд
-        try:
-            db.execute(text("SET LOCAL statement_timeout = '30s'"))
-        except Exception as e:
-            logger.warning(f"Failed to set statement timeout: {e}")
+    guard_user_sql(raw_sql, current_user.role.value, db)
     
     # ========================================
     # Выполнение запроса
     # ========================================
     
-    try:
-        # Ограничим объём результата, чтобы не уронить фронт
-        MAX_ROWS = 10000
-        
-        # Логирование запроса
-        logger.info(f"User {current_user.username} executing query: {raw_sql[:100]}...")
-        
-        # Выполняем параметризованно
-        result = db.execute(text(raw_sql), params)
-        
-        if result.returns_rows:
-            rows = result.fetchmany(MAX_ROWS + 1)
-            columns = list(result.keys()) if rows else list(result.keys())
-            
-            # Преобразуем строки в словари
-            data = [dict(zip(columns, row)) for row in rows[:MAX_ROWS]]
-            
-            # Проверка на обрезку результата
-            is_truncated = len(rows) > MAX_ROWS
-            
-            if is_truncated:
-                logger.warning(f"Query result truncated to {MAX_ROWS} rows")
-            
-            return SQLResult(
-                columns=columns,
-                data=data,
-                row_count=len(data)
-            )
-        
-        else:
-            # Не-SELECT операции допустимы только для admin
-            if current_user.role.value != "ADMIN":
-                raise HTTPException(
-                    status_code=403,
-                    detail="Developer cannot modify data"
-                )
-            
-            db.commit()
-            
-            return SQLResult(
-                columns=["status"],
-                data=[{"status": "success"}],
-                row_count=getattr(result, "rowcount", 0)
-            )
-    
-    except HTTPException:
-        raise
+    # Запрос материализован (тот же текст и параметры) — читаем представление
+    materialized = matviews.rewrite(raw_sql, params)
+    if materialized is not None:
+        logger.info(f"Query served from materialized view: {materialized[:100]}")
+        raw_sql = materialized
+    else:
+        # Агрегат по измерениям сводной таблицы — считаем по сводке
+        summarized = rollups.rewrite(raw_sql)
+        if summarized is not None:
+            logger.info(f"Query served from rollup: {summarized[:100]}")
+            raw_sql = summarized
     
-    except Exception as e:
-        db.rollback()
-        msg = str(e)
-        ml = msg.lower()
-        
-        # Дружелюбные сообщения об ошибках
-        if "syntax error" in ml:
-            raise HTTPException(
-                status_code=400,
-                detail=f"SQL Syntax Error: {msg}"
-            )
-        
-        if "permission denied" in ml:
-            raise HTTPException(
-                status_code=403,
-                detail=f"Permission denied: {msg}"
-            )
-        
-        if "does not exist" in ml:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Table or column not found: {msg}"
-            )
-        
-        if "statement timeout" in ml or "timeout" in ml:
-            raise HTTPException(
-                status_code=408,
-                detail="Query timeout (30s) exceeded"
-            )
-        
-        if "value is required for bind parameter" in ml:
-            raise HTTPException(
-                status_code=400,
-                detail="Missing query parameter. Ensure params include p_date_from, p_date_to, p_object_id (use null if not needed)."
-            )
-        
-        # Общая ошибка
-        logger.error(f"SQL execution error: {msg}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Database error: {msg}"
-        )
+    # Каждое выполнение (и попадание в кэш) — в журнал запросов
+    with query_log.record(raw_sql, params, "sql_execute", current_user.username) as entry:
+        # Кэш результатов: только для чтения, инвалидируется по изменению таблиц
+        cache = query_cache.get_cache() if settings.QUERY_CACHE_ENABLED and is_read_query(raw_sql) else None
+        cache_key = query_cache.query_key(raw_sql, params) if cache is not None else None
+        if_none_match = http_request.headers.get("if-none-match")
+        if cache is not None:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                entry.cache, entry.bytes = "HIT", len(cached.body)
+                return result_response(cached.body, request, "HIT", version_key=cache_key, if_none_match=if_none_match)
+        since = invalidation.index.begin()
+
+        try:
+            # Логирование запроса
+            logger.info(f"User {current_user.username} executing query: {raw_sql[:100]}...")
+
+            # Окно дат по кускам: целые дни/месяцы из кэша, недостающие — отдельными запросами
+            if request.time_window and is_read_query(raw_sql):
+                windowed = run_time_window(db, raw_sql, params, request.time_window)
+                if windowed is not None:
+                    payload, summary = windowed
+                    body = query_cache.render_json(payload)
+                    entry.cache = "HIT" if not summary["queried"] else "PARTIAL" if summary["cached"] else "MISS"
+                    entry.rows, entry.bytes = payload["row_count"], len(body)
+                    response = result_response(
+                        body, request, entry.cache, payload, version_key=query_cache.query_key(raw_sql, params), if_none_match=if_none_match,
+                    )
+                    response.headers["X-Time-Window"] = ";".join(f"{k}={v}" for k, v in summary.items())
+                    return response
+
+            # Оценка плана: тяжёлый запрос — на реплику, в фоновое задание или отказ
+            guard = cost_guard.get_guard()
+            decision = None
+            if settings.COST_GUARD_ENABLED and is_read_query(raw_sql):
+                decision = guard.decide(current_user.role.value, guard.estimate(db, raw_sql, params))
+                if decision.action == cost_guard.REJECT:
+                    raise HTTPException(
+                        status_code=422,
+                        detail={"message": decision.reason, "estimate": decision.estimate.describe()},
+                    )
+                if decision.action == cost_guard.JOB:
+                    return submit_query_job(raw_sql, params, current_user, decision)
+            estimate = decision.estimate if decision is not None else None
+            replica = decision is not None and decision.action == cost_guard.REPLICA
+
+            # Одинаковые одновременные SELECT выполняются один раз, остальные ждут результат
+            if (settings.SINGLE_FLIGHT_ENABLED and is_read_query(raw_sql)) or replica:
+                timeout = DEVELOPER_STATEMENT_TIMEOUT if current_user.role.value == "DEVELOPER" else None
+                # Реплика может отставать — её результат в кэш не кладём
+                shared = await single_flight.get_flight("sql_execute").run(
+                    single_flight.flight_key(raw_sql, params, timeout, replica),
+                    run_shared_read, raw_sql, params, timeout, None if replica else cache_key, since, replica,
+                )
+                if shared is not None:
+                    body, payload, is_truncated = shared
+                    entry.cache = "MISS" if cache is not None else None
+                    entry.rows, entry.bytes = payload["row_count"], len(body)
+                    if is_truncated:
+                        logger.warning(f"Query result truncated to {MAX_ROWS} rows")
+                    else:
+                        guard.record_actual(estimate, payload["row_count"])
+                    response = result_response(
+                        body, request, "MISS" if cache is not None else None, payload,
+                        version_key=query_cache.query_key(raw_sql, params), if_none_match=if_none_match,
+                    )
+                    if decision is not None:
+                        response.headers["X-Query-Route"] = decision.action
+                    return response
+
+            # Выполняем параметризованно
+            result = db.execute(text(raw_sql), params)
+
+            if result.returns_rows:
+                payload, is_truncated = fetch_result(result, MAX_ROWS)
+
+                if is_truncated:
+                    logger.warning(f"Query result truncated to {MAX_ROWS} rows")
+                else:
+                    guard.record_actual(estimate, payload["row_count"])
+
+                # Значения уже JSON-совместимы — сериализуем один раз, без jsonable_encoder
+                body = query_cache.render_json(payload)
+                if cache is not None and not is_truncated:
+                    cache.store(cache_key, body, db, raw_sql, params, since)
+                entry.cache = "MISS" if cache is not None else None
+                entry.rows, entry.bytes = payload["row_count"], len(body)
+                return result_response(
+                    body, request, "MISS" if cache is not None else None, payload,
+                    version_key=query_cache.query_key(raw_sql, params), if_none_match=if_none_match,
+                )
+
+            else:
+                # Не-SELECT операции допустимы только для admin
+                if current_user.role.value != "ADMIN":
+                    raise HTTPException(
+                        status_code=403,
+                        detail="Developer cannot modify data"
+                    )
+
+                db.commit()
+                # Изменение прошло в обход триггеров инвалидации — сбрасываем кэши
+                invalidation.index.clear()
+                entry.rows = getattr(result, "rowcount", 0)
+
+                return SQLResult(
+                    columns=["status"],
+                    data=[{"status": "success"}],
+                    row_count=getattr(result, "rowcount", 0)
+                )
+
+        except HTTPException:
+            raise
+
+        except Exception as e:
+            db.rollback()
+            raise_sql_error(e)
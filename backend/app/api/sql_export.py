@@ -1,58 +1,447 @@
-# app/api/sql_export.py — обновите обработчик
-from datetime import datetime, timezone, date
-from decimal import Decimal
-from uuid import UUID
-import json
-from fastapi import APIRouter, Depends, HTTPException
+# app/api/sql_export.py — потоковая выгрузка результата SQL (xlsx / csv / parquet / arrow)
+from contextlib import nullcontext
+from typing import Any, Dict, Iterator, Optional, Sequence
+import logging
+import queue
+import tempfile
+import threading
+import time
+from fastapi import APIRouter, Depends, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from io import BytesIO
 from openpyxl import Workbook
-from typing import Any, Dict
-from app.database import get_db
+from app.database import get_db, engine
 from app.auth.dependencies import get_current_active_user
+from app.api.sql_executor import DEVELOPER_STATEMENT_TIMEOUT, guard_user_sql
+from app.services import converters as cv, query_log, sql_analysis
+from app.services.converters import ResultConverter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/sql", tags=["sql"])
 
-def normalize_cell(v: Any) -> Any:
-    if isinstance(v, datetime):
-        # приводим к naive (Excel не поддерживает tz)
-        return v.astimezone(timezone.utc).replace(tzinfo=None) if v.tzinfo else v  # naive ok
-    if isinstance(v, date):
-        return v  # даты поддерживаются
-    if isinstance(v, Decimal):
-        return float(v)
-    if isinstance(v, (dict, list)):
-        return json.dumps(v, ensure_ascii=False)
-    if isinstance(v, (UUID, bytes)):
-        return str(v)
-    return v
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# format -> (media type, расширение файла)
+EXPORT_FORMATS = {
+    "xlsx": (XLSX_MEDIA_TYPE, "xlsx"),
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", "arrow"),
+}
+
+# Сжатие колонок для parquet / arrow
+ARROW_COMPRESSION = "zstd"
+
+# Сколько строк забираем с серверного курсора за один раз
+FETCH_BATCH_SIZE = 2000
+# Размер куска, которым файл отдаётся клиенту
+STREAM_CHUNK_SIZE = 64 * 1024
+# Сколько ждать, пока клиент заберёт данные из полной очереди CSV, прежде чем считать его отключившимся
+STREAM_STALL_TIMEOUT = 120
+
+
+def iter_batches(result, size: int = FETCH_BATCH_SIZE) -> Iterator[Sequence[Any]]:
+    """Читать результат серверного курсора пачками по size строк"""
+    while True:
+        batch = result.fetchmany(size)
+        if not batch:
+            break
+        yield batch
+
+
+def execute_streaming(db: Session, sql: str, params: Dict[str, Any]):
+    """Выполнить запрос через серверный (именованный) курсор psycopg2"""
+    return db.execute(
+        text(sql),
+        params,
+        execution_options={"stream_results": True, "yield_per": FETCH_BATCH_SIZE},
+    )
+
+
+def fill_xlsx_sheet(ws, result, lock: Optional[threading.Lock] = None) -> int:
+    """
+    Дописать результат в лист write-only книги. lock нужен, когда несколько
+    потоков пишут в разные листы одной книги (общая таблица строк openpyxl).
+    Возвращает число строк.
+    """
+    guard = lock if lock is not None else nullcontext()
+    converter = ResultConverter.for_result(result, "excel")
+    with guard:
+        ws.append(converter.names)
+
+    row_count = 0
+    for batch in iter_batches(result):
+        rows = converter.rows(batch)
+        with guard:
+            for r in rows:
+                ws.append(r)
+        row_count += len(batch)
+    return row_count
+
+
+def write_xlsx(result, fileobj) -> int:
+    """
+    Записать результат в write-only книгу openpyxl: строки не держатся
+    в памяти целиком, сразу уходят в XML листа. Возвращает число строк.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="data")
+    row_count = fill_xlsx_sheet(ws, result)
+    wb.save(fileobj)
+    return row_count
+
+
+if HAS_ARROW:
+    _ARROW_TYPES = {
+        cv.BOOL: pa.bool_(),
+        cv.INT2: pa.int16(), cv.INT4: pa.int32(), cv.INT8: pa.int64(), cv.OID: pa.int64(),
+        cv.FLOAT4: pa.float32(), cv.FLOAT8: pa.float64(), cv.NUMERIC: pa.float64(),
+        cv.TEXT: pa.string(), cv.VARCHAR: pa.string(), cv.BPCHAR: pa.string(),
+        cv.CHAR: pa.string(), cv.NAME: pa.string(), cv.UUID_OID: pa.string(),
+        cv.JSON_OID: pa.string(), cv.JSONB: pa.string(), cv.TIMETZ: pa.string(),
+        cv.DATE: pa.date32(), cv.TIME: pa.time64("us"),
+        cv.TIMESTAMP: pa.timestamp("us"), cv.TIMESTAMPTZ: pa.timestamp("us", tz="UTC"),
+        cv.INTERVAL: pa.duration("us"), cv.BYTEA: pa.binary(),
+    }
+
+
+def _arrow_type(type_code: Any, numeric_spec=None):
+    """
+    Тип колонки Arrow по OID PostgreSQL (None — вывести из данных).
+    NUMERIC(p, s) -> decimal128(p, s); NUMERIC без (p, s) — float64.
+    """
+    if not HAS_ARROW:
+        return None
+    if type_code == cv.NUMERIC and numeric_spec:
+        return pa.decimal128(*numeric_spec)
+    return _ARROW_TYPES.get(type_code)
+
+
+def _arrow_batch(converter: ResultConverter, batch: Sequence[Sequence[Any]], schema=None):
+    """
+    Собрать RecordBatch из пачки строк. Типы колонок берутся по OID;
+    неизвестные выводятся из первой пачки, а если в ней одни NULL —
+    колонка становится строковой.
+    """
+    columns = converter.columns(batch)
+    arrays = []
+    for idx, values in enumerate(columns):
+        if schema is not None:
+            field_type = schema.field(idx).type
+        else:
+            field_type = _arrow_type(converter.type_codes[idx], converter.numeric_specs[idx])
+        if field_type is None:
+            arr = pa.array(values)
+            if pa.types.is_null(arr.type):
+                arr = pa.array(values, type=pa.string())
+        else:
+            if pa.types.is_string(field_type) and schema is not None:
+                values = [None if v is None or isinstance(v, str) else str(v) for v in values]
+            arr = pa.array(values, type=field_type)
+        arrays.append(arr)
+    if schema is None:
+        return pa.RecordBatch.from_arrays(arrays, names=converter.names)
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _write_arrow_batches(result, make_writer) -> int:
+    converter = ResultConverter.for_result(result, "arrow")
+    writer = None
+    schema = None
+    row_count = 0
+    try:
+        for batch in iter_batches(result):
+            record_batch = _arrow_batch(converter, batch, schema)
+            if writer is None:
+                schema = record_batch.schema
+                writer = make_writer(schema)
+            writer.write_batch(record_batch)
+            row_count += len(batch)
+        if writer is None:
+            # пустой результат — файл только со схемой
+            schema = _arrow_batch(converter, [], None).schema
+            writer = make_writer(schema)
+    finally:
+        if writer is not None:
+            writer.close()
+    return row_count
+
+
+def write_parquet(result, fileobj) -> int:
+    """Parquet: row group на каждую пачку курсора, статистика колонок и сжатие"""
+    return _write_arrow_batches(
+        result,
+        lambda schema: pq.ParquetWriter(
+            fileobj, schema, compression=ARROW_COMPRESSION, write_statistics=True
+        ),
+    )
+
+
+def write_arrow(result, fileobj) -> int:
+    """Arrow IPC (file format) со сжатием буферов"""
+    return _write_arrow_batches(
+        result,
+        lambda schema: pa.ipc.new_file(
+            fileobj, schema, options=pa.ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)
+        ),
+    )
+
+
+RESULT_WRITERS = {
+    "xlsx": write_xlsx,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
+
+
+def render_copy_sql(cursor, sql: str, params: Dict[str, Any]) -> str:
+    """
+    COPY не принимает bind-параметры: компилируем text() под psycopg2
+    и подставляем значения через mogrify (с корректным экранированием).
+    Текст запроса встаёт внутрь COPY (...), поэтому готовый текст (уже
+    со значениями) ещё раз проверяется: ровно один читающий оператор со
+    сбалансированными скобками. Иначе "SELECT 1) TO PROGRAM '...' --"
+    закрыл бы обёртку и выполнил COPY TO PROGRAM.
+    """
+    compiled = text(sql.rstrip().rstrip(";")).compile(dialect=engine.dialect)
+    inner = cursor.mogrify(compiled.string, compiled.construct_params(params)).decode()
+    analysis = sql_analysis.SQLAnalysis(inner.rstrip().rstrip(";"))
+    if not analysis.is_read:
+        raise ValueError(analysis.error or "Only a single SELECT can be exported as CSV")
+    return f"COPY (\n{analysis.sql}\n) TO STDOUT WITH (FORMAT csv, HEADER true)"
+
+
+def copy_csv(cursor, sql: str, params: Dict[str, Any], fileobj) -> None:
+    """Выгрузить результат запроса в файл через COPY ... TO STDOUT"""
+    cursor.copy_expert(render_copy_sql(cursor, sql, params), fileobj)
+
+
+class _QueueWriter:
+    """
+    Файлоподобный приёмник для copy_expert: копит данные в куски по
+    STREAM_CHUNK_SIZE и кладёт их в ограниченную очередь. Полная очередь
+    тормозит COPY (backpressure), отмена — прерывает его.
+    """
+
+    def __init__(self, q: "queue.Queue", cancelled: threading.Event):
+        self.q = q
+        self.cancelled = cancelled
+        self.buf = bytearray()
+        self.bytes_written = 0
+
+    def _put(self, item) -> None:
+        deadline = time.monotonic() + STREAM_STALL_TIMEOUT
+        while True:
+            if self.cancelled.is_set():
+                raise IOError("export cancelled by client")
+            try:
+                self.q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                if time.monotonic() > deadline:
+                    # Очередь никто не читает: ответ брошен без закрытия генератора
+                    self.cancelled.set()
+
+    def signal(self, item) -> None:
+        """Ошибка или конец выгрузки; после отмены их уже некому читать"""
+        try:
+            self._put(item)
+        except IOError:
+            pass
+
+    def write(self, data) -> int:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.buf += data
+        if len(self.buf) >= STREAM_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self.buf:
+            chunk = bytes(self.buf)
+            self.buf.clear()
+            self.bytes_written += len(chunk)
+            self._put(chunk)
+
+
+_EOF = object()
+
+
+def _copy_worker(sql: str, params: Dict[str, Any], writer: _QueueWriter, stats: Dict[str, Any],
+                 statement_timeout: Optional[str] = None) -> None:
+    conn = engine.raw_connection()
+    error: Optional[Exception] = None
+    try:
+        cursor = conn.cursor()
+        if statement_timeout:
+            cursor.execute("SET LOCAL statement_timeout = %s", (statement_timeout,))
+        copy_csv(cursor, sql, params, writer)
+        writer.flush()
+        stats["rows"] = cursor.rowcount
+        conn.rollback()
+    except Exception as e:
+        error = e
+        if writer.cancelled.is_set():
+            # COPY прерван посреди потока: отменяем запрос на сервере и не
+            # возвращаем соединение в пул — его состояние не определено
+            try:
+                conn.driver_connection.cancel()
+            except Exception:
+                pass
+            conn.invalidate()
+        else:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+    finally:
+        conn.close()
+        if error is not None:
+            writer.signal(error)
+        writer.signal(_EOF)
+
+
+def stream_csv_copy(sql: str, params: Dict[str, Any], username: str,
+                    statement_timeout: Optional[str] = None) -> Iterator[bytes]:
+    """
+    CSV через COPY (query) TO STDOUT: отдельный поток пишет в очередь,
+    ответ читает из неё — данные уходят клиенту по мере выгрузки.
+    Ошибки запроса (синтаксис, параметры) поднимаются до первого байта ответа.
+    statement_timeout — таймаут COPY на его соединении (роль DEVELOPER).
+    """
+    q: "queue.Queue" = queue.Queue(maxsize=16)
+    cancelled = threading.Event()
+    writer = _QueueWriter(q, cancelled)
+    stats: Dict[str, Any] = {}
+    started = time.perf_counter()
+    entry = query_log.start(sql, params, "export_csv", username)
+    threading.Thread(
+        target=_copy_worker, args=(sql, params, writer, stats, statement_timeout), daemon=True
+    ).start()
+
+    first = q.get()
+    if isinstance(first, Exception):
+        q.get()  # _EOF
+        cancelled.set()
+        entry.finish(first)
+        raise HTTPException(status_code=400, detail=f"Export error: {first}")
+
+    def body() -> Iterator[bytes]:
+        item = first
+        try:
+            while item is not _EOF:
+                if isinstance(item, Exception):
+                    # Заголовки и часть данных уже отправлены: обрываем ответ,
+                    # чтобы клиент не принял усечённый CSV за полный
+                    logger.error(f"CSV export aborted: {item}")
+                    entry.finish(item)
+                    raise IOError(f"CSV export aborted: {item}") from item
+                yield item
+                item = q.get()
+            entry.rows, entry.bytes = stats.get("rows"), writer.bytes_written
+            entry.finish()
+            logger.info(
+                f"User {username} exported {stats.get('rows', '?')} rows "
+                f"({writer.bytes_written} bytes csv) in {time.perf_counter() - started:.2f}s"
+            )
+        finally:
+            cancelled.set()
+            # Клиент отключился до конца выгрузки
+            entry.bytes = writer.bytes_written
+            entry.finish()
+
+    return body()
+
+
+def iter_file(fileobj, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Отдавать временный файл кусками и закрыть (удалить) его в конце"""
+    try:
+        fileobj.seek(0)
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+def check_export_format(fmt: str) -> str:
+    fmt = (fmt or "xlsx").lower()
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}"
+        )
+    if fmt in ("parquet", "arrow") and not HAS_ARROW:
+        raise HTTPException(status_code=400, detail=f"Format '{fmt}' requires pyarrow on the server")
+    return fmt
+
 
 @router.post("/export")
-def export_sql(body: Dict[str, Any], db: Session = Depends(get_db), user=Depends(get_current_active_user)):
+def export_sql(
+    body: Dict[str, Any],
+    fmt: str = Query("xlsx", alias="format"),
+    db: Session = Depends(get_db),
+    user=Depends(get_current_active_user),
+):
+    """
+    Выгрузка результата SELECT: ?format=xlsx (по умолчанию) | csv | parquet | arrow
+    """
+    fmt = check_export_format(fmt)
     sql = (body.get("sql") or "").strip()
     params = body.get("params") or {}
-    if not sql.lower().startswith("select"):
-        raise HTTPException(status_code=400, detail="Only SELECT is allowed for export")
-    if ";" in sql:
+    if sql_analysis.analyze(sql).statement_count > 1:
         raise HTTPException(status_code=400, detail="Single SELECT statement only")
+    # Проверки роли и таймаут DEVELOPER, как у /api/sql/execute
+    role = user.role.value
+    guard_user_sql(sql, role, db, read_only=True)
+
+    media_type, ext = EXPORT_FORMATS[fmt]
+    disposition = f'attachment; filename="export.{ext}"'
+    username = getattr(user, "username", "?")
 
-    rows = db.execute(text(sql), params).mappings().all()  # list of row mappings
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "data"
-    if rows:
-        headers = list(rows[0].keys())
-        ws.append(headers)
-        for r in rows:
-            ws.append([normalize_cell(r.get(h)) for h in headers])
-
-    stream = BytesIO()
-    wb.save(stream)
-    stream.seek(0)
+    if fmt == "csv":
+        return StreamingResponse(
+            stream_csv_copy(sql, params, username, None if role == "ADMIN" else DEVELOPER_STATEMENT_TIMEOUT),
+            media_type=media_type,
+            headers={"Content-Disposition": disposition},
+        )
+
+    started = time.perf_counter()
+    spool = tempfile.TemporaryFile(suffix=f".{ext}")
+    try:
+        with query_log.record(sql, params, f"export_{fmt}", username) as entry:
+            result = execute_streaming(db, sql, params)
+            try:
+                row_count = RESULT_WRITERS[fmt](result, spool)
+            finally:
+                result.close()
+            size = spool.tell()
+            entry.rows, entry.bytes = row_count, size
+    except Exception:
+        spool.close()
+        raise
+
+    logger.info(
+        f"User {username} exported {row_count} rows "
+        f"({size} bytes {fmt}) in {time.perf_counter() - started:.2f}s"
+    )
     return StreamingResponse(
-        stream,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": 'attachment; filename=\"export.xlsx\"'}
+        iter_file(spool),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": disposition,
+            "Content-Length": str(size),
+        }
     )
@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from app.database import get_db
+from app.database import get_async_db
 from app.models.user import User
 from app.schemas.user import UserCreate, UserResponse, UserUpdate
-from app.auth.jwt import get_password_hash, get_current_user
+from app.auth.jwt import get_current_user
+from app.auth import passwords, principals
 from app.auth.rbac import allow_admin
 
 router = APIRouter(prefix="/api/users", tags=["users"])
@@ -15,42 +17,47 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
 
 @router.post("/", response_model=UserResponse, dependencies=[Depends(allow_admin)])
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.username == user.username).first()
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = (await db.execute(select(User).where(User.username == user.username))).scalar_one_or_none()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    db_user = db.query(User).filter(User.email == user.email).first()
+    db_user = (await db.execute(select(User).where(User.email == user.email))).scalar_one_or_none()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
+    try:
+        hashed_password = await passwords.hash_password(user.password)
+    except passwords.HashQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    
     new_user = User(
         username=user.username,
         email=user.email,
-        hashed_password=get_password_hash(user.password),
+        hashed_password=hashed_password,
         role=user.role
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @router.get("/", response_model=List[UserResponse], dependencies=[Depends(allow_admin)])
-async def list_users(db: Session = Depends(get_db)):
-    users = db.query(User).all()
+async def list_users(db: AsyncSession = Depends(get_async_db)):
+    users = (await db.execute(select(User))).scalars().all()
     return users
 
 @router.get("/{user_id}", response_model=UserResponse, dependencies=[Depends(allow_admin)])
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 @router.put("/{user_id}", response_model=UserResponse, dependencies=[Depends(allow_admin)])
-async def update_user(user_id: int, user_update: UserUpdate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
+async def update_user(user_id: int, user_update: UserUpdate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -61,16 +68,20 @@ async def update_user(user_id: int, user_update: UserUpdate, db: Session = Depen
     if user_update.is_active is not None:
         db_user.is_active = user_update.is_active
     
-    db.commit()
-    db.refresh(db_user)
+    await principals.user_changed(db, db_user.username)
+    await db.commit()
+    principals.forget(db_user.username)
+    await db.refresh(db_user)
     return db_user
 
 @router.delete("/{user_id}", dependencies=[Depends(allow_admin)])
-async def delete_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    user = await db.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    db.delete(user)
-    db.commit()
+    await db.delete(user)
+    await principals.user_changed(db, user.username)
+    await db.commit()
+    principals.forget(user.username)
     return {"message": "User deleted successfully"}
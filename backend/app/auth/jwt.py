@@ -1,14 +1,14 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.auth import principals
+from app.auth.passwords import pwd_context
 from app.config import settings
-from app.database import get_db
+from app.database import get_async_db
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -36,15 +36,20 @@ def create_refresh_token(data: dict) -> str:
     return encoded_jwt
 
 def decode_token(token: str) -> dict:
+    # Проверенный токен — из кэша (до своего exp, не дольше AUTH_CACHE_TTL_SECONDS)
+    payload = principals.tokens.get(token)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        return payload
     except JWTError:
         return None
+    principals.tokens.put(token, payload, principals.token_ttl(payload))
+    return payload
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -52,16 +57,13 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
+    payload = decode_token(token)
+    username: str = payload.get("sub") if payload is not None else None
+    if username is None:
         raise credentials_exception
     
-    from app.models.user import User
-    user = db.query(User).filter(User.username == username).first()
+    # Без обращения к БД, если пользователь в кэше
+    user = await principals.load_user(db, username)
     
     if user is None:
         raise credentials_exception
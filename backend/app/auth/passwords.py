@@ -0,0 +1,123 @@
+# backend/app/auth/passwords.py
+# Хэширование паролей вне цикла событий.
+#
+# bcrypt намеренно медленный (сотни миллисекунд при AUTH_BCRYPT_ROUNDS=12),
+# поэтому async-обработчики (вход, создание пользователя) отдают его в
+# отдельный пул AUTH_HASH_WORKERS потоков — библиотека bcrypt отпускает
+# GIL, и пока идёт хэширование, остальные запросы обслуживаются. Очередь
+# ограничена AUTH_HASH_MAX_QUEUED: при всплеске входов лишние сразу
+# получают отказ (HashQueueFull -> 503), а не копятся до таймаута.
+#
+# Стоимость задаётся AUTH_BCRYPT_ROUNDS. Хэш с другой стоимостью при
+# успешном входе пересчитывается (verify_and_update) и сохраняется —
+# смена параметра применяется к пользователям по мере их входа.
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import threading
+import time
+
+from passlib.context import CryptContext
+
+from app.config import settings
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.AUTH_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=settings.AUTH_BCRYPT_ROUNDS,
+    bcrypt__max_rounds=settings.AUTH_BCRYPT_ROUNDS,
+)
+
+
+class HashQueueFull(OverflowError):
+    """В пуле хэширования нет места — клиенту стоит повторить позже"""
+
+
+class HashPool:
+    def __init__(self, workers: int, max_queued: int):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.stats = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0,
+                      "max_pending": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.stats["total_ms"] += elapsed
+                self.stats["max_ms"] = max(self.stats["max_ms"], elapsed)
+
+    async def run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.workers + self.max_queued:
+                self.stats["rejected"] += 1
+                raise HashQueueFull(f"Password hashing queue is full ({self.pending} pending)")
+            self.pending += 1
+            self.stats["max_pending"] = max(self.stats["max_pending"], self.pending)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, fn, *args)
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            done = self.stats["hashed"] + self.stats["verified"]
+            return {
+                "rounds": settings.AUTH_BCRYPT_ROUNDS,
+                "workers": self.workers,
+                "pending": self.pending,
+                "queued": max(self.pending - self.workers, 0),
+                "avg_ms": round(self.stats["total_ms"] / done, 1) if done else None,
+                **{k: (round(v, 1) if isinstance(v, float) else v) for k, v in self.stats.items()},
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool: Optional[HashPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> HashPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashPool(settings.AUTH_HASH_WORKERS, settings.AUTH_HASH_MAX_QUEUED)
+    return _pool
+
+
+async def hash_password(password: str) -> str:
+    pool = get_pool()
+    hashed = await pool.run(pwd_context.hash, password)
+    pool.stats["hashed"] += 1
+    return hashed
+
+
+async def verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """(пароль верен, новый хэш или None) — новый, если параметры хэша устарели"""
+    pool = get_pool()
+    ok, new_hash = await pool.run(pwd_context.verify_and_update, password, hashed)
+    pool.stats["verified"] += 1
+    if new_hash is not None:
+        pool.stats["rehashed"] += 1
+    return ok, new_hash
+
+
+def info() -> Dict[str, Any]:
+    return get_pool().info()
+
+
+def shutdown() -> None:
+    if _pool is not None:
+        _pool.shutdown()
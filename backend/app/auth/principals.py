@@ -0,0 +1,140 @@
+# backend/app/auth/principals.py
+# Кэш авторизации в процессе: проверенные JWT (token -> payload) и
+# пользователи (username -> колонки users без пароля). При попадании
+# get_current_user не обращается к БД и не проверяет подпись заново.
+#
+# Записи живут AUTH_CACHE_TTL_SECONDS (токен — не дольше своего exp).
+# Изменение пользователя (users.update_user/delete_user) сбрасывает
+# запись сразу в этом процессе и через NOTIFY AUTH_NOTIFY_CHANNEL — в
+# остальных воркерах (слушает app.services.invalidation). Пока LISTEN
+# отключён, кэш очищается при переподключении, а до того выручает TTL.
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+import threading
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.models.user import User
+from app.services import invalidation
+
+# Колонки principal: всё, кроме хэша пароля
+_COLUMNS = [c.key for c in User.__table__.columns if c.key != "hashed_password"]
+
+
+class TTLCache:
+    """
+    LRU с TTL. Поколение ключа растёт при pop, общее — при clear: запись,
+    прочитанная из БД до сброса, не кладётся в кэш после него.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._generations: Dict[Hashable, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def generation(self, key: Hashable) -> Tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def put(self, key: Hashable, value: Any, ttl: float, generation: Optional[Tuple[int, int]] = None) -> None:
+        """generation — значение generation(key) до чтения value: если с тех пор был сброс, не кладём"""
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                return
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), **self.stats}
+
+
+tokens = TTLCache(settings.AUTH_CACHE_SIZE)
+users = TTLCache(settings.AUTH_CACHE_SIZE)
+
+
+def token_ttl(payload: dict) -> float:
+    """TTL проверенного токена: не дольше AUTH_CACHE_TTL_SECONDS и его exp"""
+    exp = payload.get("exp")
+    ttl = float(settings.AUTH_CACHE_TTL_SECONDS)
+    return min(ttl, float(exp) - time.time()) if isinstance(exp, (int, float)) else ttl
+
+
+async def load_user(db: AsyncSession, username: str) -> Optional[User]:
+    """Пользователь по имени: из кэша (несвязанный с сессией объект) или из БД"""
+    values = users.get(username)
+    if values is None:
+        # forget() во время await ниже отменяет put: иначе в кэш попала бы
+        # строка, прочитанная до деактивации или смены роли
+        generation = users.generation(username)
+        result = await db.execute(select(User).where(User.username == username))
+        user = result.scalar_one_or_none()
+        if user is None:
+            return None
+        values = {key: getattr(user, key) for key in _COLUMNS}
+        users.put(username, values, settings.AUTH_CACHE_TTL_SECONDS, generation)
+    # Свой экземпляр на запрос: изменения обработчика не попадают в кэш
+    return User(**values)
+
+
+def forget(username: str) -> None:
+    users.pop(username)
+
+
+def clear() -> None:
+    tokens.clear()
+    users.clear()
+
+
+async def user_changed(db: AsyncSession, username: str) -> None:
+    """
+    NOTIFY об изменении пользователя в транзакции изменения: воркеры
+    получат его после commit. После commit вызывающий делает forget()
+    """
+    await db.execute(
+        text("SELECT pg_notify(:channel, :username)"),
+        {"channel": settings.AUTH_NOTIFY_CHANNEL, "username": username},
+    )
+
+
+def info() -> Dict[str, Any]:
+    return {"ttl_seconds": settings.AUTH_CACHE_TTL_SECONDS, "tokens": tokens.info(), "users": users.info()}
+
+
+invalidation.subscribe(settings.AUTH_NOTIFY_CHANNEL, forget, users.clear)
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     POSTGRES_HOST: str = "localhost"         # <-- исправлено!
@@ -12,10 +12,142 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 1440  # 24 часа
 
+    # numeric в JSON-ответах: False — число (float), True — строка без потери точности
+    JSON_DECIMALS_AS_STRING: bool = False
+
+    # Пул процессов для /api/code/execute
+    CODE_EXECUTOR_WORKERS: int = 2
+    CODE_EXECUTOR_CPU_SECONDS: int = 5
+    CODE_EXECUTOR_WALL_SECONDS: float = 10.0
+    CODE_EXECUTOR_MEMORY_MB: int = 512         # RLIMIT_AS на время задания, 0 — без лимита
+    CODE_EXECUTOR_BYTECODE_CACHE: int = 128    # скомпилированных скриптов на процесс
+
+    # Выгрузка дашборда целиком (POST /api/dashboards/{id}/export)
+    DASHBOARD_EXPORT_WORKERS: int = 4          # параллельных запросов виджетов
+    DASHBOARD_EXPORT_MEMORY_MB: int = 256      # общий лимит строк "в полёте"
+    DASHBOARD_EXPORT_TIMEOUT_SECONDS: int = 120
+
+    # Сводные таблицы (POST /api/sql/pivot): максимум ячеек в ответе
+    PIVOT_MAX_CELLS: int = 200_000
+
+    # Кэш данных виджетов для кросс-фильтрации (POST /api/dashboards/{id}/crossfilter)
+    DATASET_CACHE_MEMORY_MB: int = 256            # общий бюджет, дальше вытеснение LRU
+    DATASET_CACHE_TTL_SECONDS: int = 300
+    DATASET_CACHE_MAX_ROWS: int = 500_000         # больше — виджет не кэшируется
+    DATASET_CACHE_BITMAP_MAX_CARDINALITY: int = 256  # битовый индекс, если значений не больше
+
+    # Серверное автообновление дашбордов (WebSocket / SSE, /api/live)
+    REFRESH_HUB_DEFAULT_INTERVAL_SECONDS: int = 30
+    REFRESH_HUB_MIN_INTERVAL_SECONDS: int = 5
+    REFRESH_HUB_SEND_TIMEOUT_SECONDS: int = 10   # клиент не принял сообщение — отключаем
+    REFRESH_HUB_HEARTBEAT_SECONDS: int = 15
+    REFRESH_HUB_MAX_ROWS: int = 10000
+
+    # Кэш результатов /api/sql/execute с инвалидацией по изменению таблиц
+    QUERY_CACHE_ENABLED: bool = True
+    QUERY_CACHE_MEMORY_MB: int = 128
+    QUERY_CACHE_MAX_AGE_SECONDS: int = 3600     # страховочный предел, основное — инвалидация
+    CACHE_NOTIFY_CHANNEL: str = "dash_table_changes"   # LISTEN/NOTIFY от триггеров
+    CACHE_STATS_POLL_SECONDS: float = 5.0       # опрос pg_stat_user_tables, 0 — выключен
+
+    # Прошлые версии результатов для дельта-ответов /api/sql/execute
+    RESULT_VERSIONS_MEMORY_MB: int = 64
+
+    # Кэш кусков окна дат (time_window в /api/sql/execute)
+    TIME_CHUNK_CACHE_MEMORY_MB: int = 128
+    TIME_CHUNK_MAX_QUERIES: int = 62    # недостающих кусков больше — запрос целиком
+
+    # Одинаковые одновременные SELECT в /api/sql/execute выполняются один раз
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    # Управляемые материализованные представления для тяжёлых виджетов
+    MATVIEW_SCHEMA: str = "public"
+    MATVIEW_SCHEDULER_SECONDS: float = 15.0     # проверка расписания, 0 — выключен
+    MATVIEW_MIN_REFRESH_SECONDS: int = 60       # refresh_on_change не чаще
+    MATVIEW_REFRESH_TIMEOUT: str = "10min"
+
+    # Сводные таблицы (rollups) с инкрементальным обновлением
+    ROLLUP_JOB_SECONDS: float = 60.0            # delta-синхронизация, 0 — выключена
+    ROLLUP_FULL_REBUILD_SECONDS: int = 86400    # полная пересборка delta-сводок (удаления, смена измерений)
+    ROLLUP_DELTA_MAX_LAG_SECONDS: int = 300     # delta-сводка старше — запросы идут в базовую таблицу
+
+    # Журнал запросов и медленные запросы (/api/query-log)
+    QUERY_LOG_ENABLED: bool = True
+    QUERY_LOG_MAX_RECORDS: int = 10000          # последних выполнений в кольцевом буфере
+    QUERY_LOG_MAX_FINGERPRINTS: int = 2000      # различных отпечатков, дальше вытеснение LRU
+    QUERY_LOG_EXPLAIN_MS: float = 2000          # дольше — EXPLAIN (ANALYZE, BUFFERS) в фоне, 0 — выключен
+    QUERY_LOG_EXPLAIN_INTERVAL_SECONDS: int = 600   # план одного отпечатка не чаще
+    QUERY_LOG_EXPLAIN_TIMEOUT: str = "60s"
+
+    # Советник индексов по журналу запросов (/api/index-advisor)
+    INDEX_ADVISOR_MIN_ROWS: int = 10000         # таблицы меньше — Seq Scan не считается проблемой
+    INDEX_ADVISOR_MAX_SELECTIVITY: float = 0.2  # фильтр отбирает большую долю строк — индекс не поможет
+    INDEX_ADVISOR_EXPLAIN_TIMEOUT: str = "10s"
+    INDEX_ADVISOR_CREATE_TIMEOUT: str = "2h"
+
+    # Реплика только для чтения: средние по оценке SELECT из /api/sql/execute
+    REPLICA_DATABASE_URL: Optional[str] = None
+
+    # Оценка плана (EXPLAIN) перед выполнением /api/sql/execute и маршрутизация.
+    # Пороги по ролям: до inline_* — сразу; выше — реплика (если есть);
+    # выше job_* — фоновое задание; выше reject_* — отказ. Нет ключа — нет порога.
+    COST_GUARD_ENABLED: bool = True
+    COST_GUARD_CACHE_SIZE: int = 2048           # оценок по отпечаткам
+    COST_GUARD_CACHE_SECONDS: int = 300
+    COST_GUARD_LIMITS: Dict[str, Dict[str, float]] = {
+        "DEVELOPER": {
+            "inline_cost": 100_000, "inline_rows": 100_000,
+            "job_cost": 2_000_000, "job_rows": 1_000_000,
+            "reject_cost": 100_000_000, "reject_rows": 50_000_000,
+        },
+        "ADMIN": {"inline_cost": 1_000_000, "job_cost": 20_000_000},
+    }
+
+    # Повторное использование text() и подготовленных операторов для SQL виджетов.
+    # Выключить за пулером соединений в режиме транзакций (pgbouncer)
+    PREPARED_STATEMENTS_ENABLED: bool = True
+    PREPARED_STATEMENTS_CACHE_SIZE: int = 1024      # текстов запросов в LRU
+    PREPARED_STATEMENTS_PER_CONNECTION: int = 200   # подготовленных операторов на соединении
+    PREPARED_STATEMENTS_MIN_CALLS: int = 2          # готовить текст начиная с N-го выполнения
+
+    # Пул асинхронного движка (asyncpg): авторизация, пользователи, CRUD дашбордов
+    ASYNC_DB_POOL_SIZE: int = 20
+    ASYNC_DB_MAX_OVERFLOW: int = 10
+
+    # Кэш авторизации: проверенные токены и пользователи (app/auth/principals.py)
+    AUTH_CACHE_TTL_SECONDS: int = 60
+    AUTH_CACHE_SIZE: int = 10000
+    AUTH_NOTIFY_CHANNEL: str = "dash_auth_changes"  # сброс записи пользователя в других воркерах
+
+    # Хэширование паролей (app/auth/passwords.py): стоимость bcrypt и пул вне цикла событий.
+    # Хэши с другой стоимостью пересчитываются при входе
+    AUTH_BCRYPT_ROUNDS: int = 12
+    AUTH_HASH_WORKERS: int = 4
+    AUTH_HASH_MAX_QUEUED: int = 64              # больше ожидающих — 503
+
+    # Массовая загрузка (/api/import, app/services/bulk_import.py): COPY фоновым заданием
+    IMPORT_ALLOWED_TABLES: List[str] = []      # schema.table; пусто — любая таблица
+    IMPORT_MAX_FILE_MB: int = 2048
+    IMPORT_STATEMENT_TIMEOUT: str = "1h"
+    IMPORT_WORKERS: int = 1                    # свой пул: загрузки не занимают воркеры JOB_WORKERS
+    IMPORT_CATALOG_TTL_SECONDS: int = 300      # кэш колонок и ключей целевых таблиц
+    IMPORT_PARQUET_BATCH_ROWS: int = 100_000
+
+    # Фоновые задания (/api/jobs)
+    JOB_WORKERS: int = 2
+    JOB_MAX_QUEUED: int = 50
+    JOB_STATEMENT_TIMEOUT: str = "15min"
+    JOB_RESULTS_MEMORY_MB: int = 256
+    JOB_RESULT_TTL_SECONDS: int = 3600
+
     @property
     def DATABASE_URL(self) -> str:
         return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
+    @property
+    def ASYNC_DATABASE_URL(self) -> str:
+        return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -1,14 +1,27 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 
-# Поддержка асинхронного подключения (если понадобится для FastAPI)
-# from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-
 # Основные настройки
 engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Реплика только для чтения (если задана): тяжёлые SELECT уходят туда
+replica_engine = create_engine(settings.REPLICA_DATABASE_URL, pool_pre_ping=True) if settings.REPLICA_DATABASE_URL else None
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine) if replica_engine is not None else None
+
+# Асинхронный движок (asyncpg) для async-обработчиков: авторизация,
+# пользователи, CRUD дашбордов. Ожидание БД не блокирует цикл событий.
+# expire_on_commit=False: после commit атрибуты читаются без ленивой загрузки
+async_engine = create_async_engine(
+    settings.ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=settings.ASYNC_DB_POOL_SIZE,
+    max_overflow=settings.ASYNC_DB_MAX_OVERFLOW,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 Base = declarative_base()
 
 def get_db():
@@ -18,15 +31,21 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # Вариант для работы с Alembic — миграции не должны использовать init_db напрямую!
 def init_db():
     # Важно: Импортировать все модели перед созданием схемы
     import app.models.user
     import app.models.dashboard
+    import app.models.materialized_view
+    import app.models.rollup
     # Если добавишь новые — не забудь добавить импорт!
     Base.metadata.create_all(bind=engine)
 
 # Советы и расширения:
 # - Для unit-тестов можешь использовать тестовый SQLite engine
-# - Если будешь мигрировать асинхронно — используй create_async_engine
+# - Синхронные обработчики (def) — get_db, асинхронные (async def) — get_async_db
 # - Для Alembic: настройки для env.py — должен видеть Base и engine
@@ -7,12 +7,23 @@ from fastapi import FastAPI, Request, HTTPException
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.api import dashboards_files
-from app.database import init_db, SessionLocal
+from app.database import async_engine, init_db, SessionLocal
 from app.models.user import User, UserRole
+from app.auth import passwords
 from app.auth.jwt import get_password_hash
 from app.api.db_meta import router as meta_router
 from app.api import auth, users, dashboards, sql_executor, code_executor
 from app.api.query import router as query_router
+from app.api.pivot import router as pivot_router
+from app.api.live import router as live_router
+from app.api.cache import router as cache_router
+from app.api.rollups import router as rollups_router
+from app.api.query_log import router as query_log_router
+from app.api.index_advisor import router as index_advisor_router
+from app.api.jobs import router as jobs_router
+from app.api.bulk_import import router as import_router
+from app.services import code_sandbox, invalidation, jobs, matviews, rollups
+from app.services.refresh_hub import hub as refresh_hub
 
 try:
     from app.api import sql_export
@@ -90,8 +101,28 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ Startup error: {e}")
         raise
+    try:
+        code_sandbox.get_pool().start()
+        logger.info("✅ Code executor pool started")
+    except Exception as e:
+        # пул поднимется лениво при первом запросе
+        logger.warning(f"⚠️ Code executor pool not started: {e}")
+    invalidation.start()
+    logger.info("✅ Cache invalidation listener started")
+    matviews.start()
+    logger.info("✅ Materialized view scheduler started")
+    rollups.start()
+    logger.info("✅ Rollup delta job started")
     yield
     logger.info("🛑 Shutting down Escrow Dashboard API...")
+    await refresh_hub.shutdown()
+    jobs.shutdown()
+    rollups.stop()
+    matviews.stop()
+    invalidation.stop()
+    code_sandbox.get_pool().shutdown()
+    passwords.shutdown()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Escrow Dashboard API",
@@ -120,6 +151,14 @@ routers = [
     (code_executor.router, "Code Executor"),
     (meta_router, "Meta (DB Structure)"),
     (query_router, "Query"),
+    (pivot_router, "SQL Pivot"),
+    (live_router, "Live"),
+    (cache_router, "Cache"),
+    (rollups_router, "Rollups"),
+    (query_log_router, "Query Log"),
+    (index_advisor_router, "Index Advisor"),
+    (jobs_router, "Jobs"),
+    (import_router, "Import"),
 ]
 if HAS_SQL_EXPORT:
     routers.append((sql_export.router, "SQL Export"))
@@ -1,4 +1,6 @@
 from app.models.user import User, UserRole
 from app.models.dashboard import Dashboard
+from app.models.materialized_view import MaterializedView
+from app.models.rollup import Rollup
 
-__all__ = ['User', 'UserRole', 'Dashboard']
+__all__ = ['User', 'UserRole', 'Dashboard', 'MaterializedView', 'Rollup']
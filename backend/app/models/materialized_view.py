@@ -0,0 +1,30 @@
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String, Text
+from sqlalchemy.sql import func
+from app.database import Base
+
+
+class MaterializedView(Base):
+    """Управляемое материализованное представление для тяжёлого запроса виджета/источника"""
+    __tablename__ = "materialized_views"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(63), unique=True, nullable=False)      # имя представления в PostgreSQL
+    dashboard_id = Column(Integer, nullable=False, index=True)
+    widget_id = Column(String(255), nullable=True)              # виджет с props.sql
+    source_name = Column(String(255), nullable=True)            # или источник config.sources
+    source_sql = Column(Text, nullable=False)                   # исходный SQL виджета
+    params = Column(Text, nullable=False, default="{}")         # JSON: значения параметров, зашитые в представление
+    columns = Column(Text, nullable=False, default="[]")        # JSON: колонки результата исходного запроса
+    unique_key = Column(Text, nullable=False)                   # JSON: колонки уникального индекса
+    refresh_interval_seconds = Column(Integer, nullable=True)   # обновление по расписанию
+    refresh_on_change = Column(Boolean, default=True)           # обновление при изменении таблиц
+    status = Column(String(20), nullable=False, default="ready")   # ready / error
+    last_refreshed_at = Column(DateTime(timezone=True), nullable=True)
+    last_refresh_ms = Column(Float, nullable=True)
+    refresh_count = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    created_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<MaterializedView(id={self.id}, name='{self.name}', dashboard_id={self.dashboard_id})>"
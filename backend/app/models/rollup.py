@@ -0,0 +1,31 @@
+from sqlalchemy import Boolean, Column, DateTime, Float, Integer, String, Text, false
+from sqlalchemy.sql import func
+from app.database import Base
+
+
+class Rollup(Base):
+    """Определение агрегата (rollup) над базовой таблицей и его сводная таблица"""
+    __tablename__ = "rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(50), unique=True, nullable=False)
+    base_table = Column(String(255), nullable=False)            # schema.table
+    summary_table = Column(String(63), unique=True, nullable=False)
+    dimensions = Column(Text, nullable=False)                   # JSON: [{column, grain}]
+    measures = Column(Text, nullable=False)                     # JSON: [{column, agg, type}]
+    mode = Column(String(20), nullable=False, default="trigger")   # trigger / delta
+    updated_column = Column(String(255), nullable=True)         # для mode=delta
+    # mode=delta: отвечать запросам из сводки, хотя она может отставать
+    allow_stale = Column(Boolean, nullable=False, default=False, server_default=false())
+    status = Column(String(20), nullable=False, default="ready")   # ready / error
+    watermark = Column(DateTime(timezone=True), nullable=True)  # max(updated_column) на момент синхронизации
+    last_sync_at = Column(DateTime(timezone=True), nullable=True)
+    last_sync_ms = Column(Float, nullable=True)
+    last_full_at = Column(DateTime(timezone=True), nullable=True)
+    row_count = Column(Integer, nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<Rollup(id={self.id}, name='{self.name}', base_table='{self.base_table}')>"
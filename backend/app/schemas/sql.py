@@ -3,8 +3,37 @@ from typing import List, Dict, Any, Optional
 
 class SQLExecuteRequest(BaseModel):
     query: str
+    params: Optional[Dict[str, Any]] = None
+    # Постобработка результата (app.services.transforms) и результаты
+    # других виджетов для шага join
+    transforms: Optional[List[Dict[str, Any]]] = None
+    inputs: Optional[Dict[str, Any]] = None
+    # Отпечаток версии результата, которая уже есть у клиента, и ключевые
+    # колонки для дельты (inserted/updated/deleted) относительно неё
+    fingerprint: Optional[str] = None
+    key_columns: Optional[List[str]] = None
+    # Кэш по кускам окна дат (app.services.time_chunks):
+    # {chunk: day|month, mode: rows|additive, bounds, group_by, measures}
+    time_window: Optional[Dict[str, Any]] = None
 
 class SQLResult(BaseModel):
     columns: List[str]
     data: List[Dict[str, Any]]
     row_count: int
+
+class PivotMeasure(BaseModel):
+    field: str
+    # sum / avg / count / count_distinct / min / max
+    agg: str = "sum"
+    name: Optional[str] = None
+
+class PivotRequest(BaseModel):
+    query: str
+    params: Optional[Dict[str, Any]] = None
+    rows: List[str] = []
+    columns: List[str] = []
+    measures: List[PivotMeasure]
+    # Промежуточные итоги по каждому уровню измерений
+    subtotals: bool = True
+    # Общие итоги (строка/колонка "всего")
+    totals: bool = True
@@ -0,0 +1,361 @@
+# backend/app/services/bulk_import.py
+# Массовая загрузка CSV/Parquet в таблицу через COPY FROM STDIN.
+#
+# Загрузка выполняется фоновым заданием (app.services.jobs) в отдельном
+# пуле IMPORT_WORKERS — долгий COPY не занимает воркеры SQL-заданий.
+# Прогресс — в /api/jobs/{id} (фаза, прочитано байт/строк), отмена —
+# DELETE /api/jobs/{id} (pg_cancel_backend прерывает COPY, транзакция
+# откатывается целиком).
+#
+# Режимы:
+#   - append — COPY прямо в таблицу;
+#   - upsert — COPY во временную staging-таблицу (LIKE целевой), затем
+#     INSERT ... SELECT DISTINCT ON (ключ) ... ON CONFLICT (ключ) DO UPDATE.
+#     Ключ — первичный или другой уникальный индекс таблицы; при повторах
+#     ключа в файле побеждает последняя строка.
+#
+# Таблица и колонки проверяются по кэшу каталога (колонки, типы, NOT NULL
+# без DEFAULT, уникальные ключи; IMPORT_CATALOG_TTL_SECONDS) до постановки
+# задания: неизвестная колонка или пропущенная обязательная — сразу 400.
+# Parquet (нужен pyarrow) перекладывается в CSV пачками по
+# IMPORT_PARQUET_BATCH_ROWS строк, каждая пачка — свой COPY в той же
+# транзакции.
+
+from typing import IO, Any, Dict, List, Optional, Sequence, Tuple
+import csv
+import io
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import SessionLocal
+from app.services import invalidation, jobs
+
+try:
+    import pyarrow.csv as pacsv
+    import pyarrow.parquet as pq
+    HAS_ARROW = True
+except ImportError:
+    HAS_ARROW = False
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "parquet")
+APPEND, UPSERT = "append", "upsert"
+COPY_BUFFER = 1 << 20
+
+
+class BulkImportError(ValueError):
+    """Файл или параметры не подходят к целевой таблице (-> 400)"""
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+# ========================================
+# Кэш каталога
+# ========================================
+
+class TableSchema:
+    __slots__ = ("relation", "quoted", "columns", "required", "unique_keys", "primary_key")
+
+    def __init__(self, relation: str, quoted: str):
+        self.relation = relation
+        self.quoted = quoted
+        self.columns: Dict[str, str] = {}          # имя -> тип, в порядке attnum
+        self.required: List[str] = []              # NOT NULL без DEFAULT
+        self.unique_keys: List[Tuple[str, ...]] = []
+        self.primary_key: Optional[Tuple[str, ...]] = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "table": self.relation,
+            "columns": self.columns,
+            "required": self.required,
+            "primary_key": list(self.primary_key) if self.primary_key else None,
+            "unique_keys": [list(k) for k in self.unique_keys],
+        }
+
+
+def _load_schema(conn, relation: str) -> Optional[TableSchema]:
+    rows = conn.execute(
+        text(
+            "SELECT format('%I.%I', n.nspname, c.relname), lower(n.nspname || '.' || c.relname), "
+            "a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull AND NOT a.atthasdef "
+            "FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped "
+            "WHERE c.oid = to_regclass(:name) AND c.relkind IN ('r', 'p') "
+            "ORDER BY a.attnum"
+        ),
+        {"name": relation},
+    ).fetchall()
+    if not rows:
+        return None
+    schema = TableSchema(rows[0][1], rows[0][0])
+    for _, _, column, type_, required in rows:
+        schema.columns[column] = type_
+        if required:
+            schema.required.append(column)
+    keys = conn.execute(
+        text(
+            "SELECT i.indisprimary, array_agg(a.attname::text ORDER BY k.ord) FROM pg_index i "
+            "CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord) "
+            "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum "
+            "WHERE i.indrelid = to_regclass(:name) AND i.indisunique AND i.indpred IS NULL "
+            "AND i.indexprs IS NULL GROUP BY i.indexrelid, i.indisprimary"
+        ),
+        {"name": relation},
+    ).fetchall()
+    for primary, columns in keys:
+        schema.unique_keys.append(tuple(columns))
+        if primary:
+            schema.primary_key = tuple(columns)
+    return schema
+
+
+class Catalog:
+    """Описание таблиц по имени на IMPORT_CATALOG_TTL_SECONDS"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._tables: Dict[str, Tuple[float, Optional[TableSchema]]] = {}
+        self._lock = threading.Lock()
+
+    def table(self, relation: str, refresh: bool = False) -> Optional[TableSchema]:
+        key = relation.lower()
+        now = time.monotonic()
+        with self._lock:
+            cached = self._tables.get(key)
+        if cached is not None and not refresh and now - cached[0] <= self.ttl:
+            return cached[1]
+        db = SessionLocal()
+        try:
+            schema = _load_schema(db, relation)
+        finally:
+            db.rollback()
+            db.close()
+        with self._lock:
+            self._tables[key] = (now, schema)
+        return schema
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tables.clear()
+
+
+catalog = Catalog(settings.IMPORT_CATALOG_TTL_SECONDS)
+
+
+# ========================================
+# Проверка файла
+# ========================================
+
+class ImportPlan:
+    __slots__ = ("table", "fmt", "columns", "mode", "key", "delimiter", "null", "size")
+
+    def __init__(self, table: TableSchema, fmt: str, columns: List[str], mode: str,
+                 key: Optional[Tuple[str, ...]], delimiter: str, null: str, size: int):
+        self.table = table
+        self.fmt = fmt
+        self.columns = columns
+        self.mode = mode
+        self.key = key
+        self.delimiter = delimiter
+        self.null = null
+        self.size = size
+
+
+def file_columns(fileobj: IO[bytes], fmt: str, delimiter: str) -> List[str]:
+    """Имена колонок файла: заголовок CSV или схема Parquet"""
+    fileobj.seek(0)
+    if fmt == "parquet":
+        names = pq.ParquetFile(fileobj).schema_arrow.names
+    else:
+        header = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+        try:
+            names = next(csv.reader(header, delimiter=delimiter), [])
+        finally:
+            header.detach()
+    fileobj.seek(0)
+    return [n.strip() for n in names]
+
+
+def plan_import(fileobj: IO[bytes], size: int, table: str, fmt: str, mode: str,
+                key: Optional[Sequence[str]] = None, delimiter: str = ",", null: str = "") -> ImportPlan:
+    if fmt not in FORMATS:
+        raise BulkImportError(f"Unsupported format '{fmt}', expected one of {', '.join(FORMATS)}")
+    if fmt == "parquet" and not HAS_ARROW:
+        raise BulkImportError("Format 'parquet' requires pyarrow on the server")
+    if mode not in (APPEND, UPSERT):
+        raise BulkImportError(f"Unsupported mode '{mode}'")
+    if len(delimiter) != 1 or delimiter in "\r\n\"":
+        raise BulkImportError("delimiter must be a single character")
+    allowed = [t.lower() for t in settings.IMPORT_ALLOWED_TABLES]
+
+    schema = catalog.table(table)
+    if schema is None:
+        raise BulkImportError(f"Table '{table}' not found")
+    if allowed and schema.relation not in allowed:
+        raise BulkImportError(f"Import into '{schema.relation}' is not allowed")
+
+    columns = file_columns(fileobj, fmt, delimiter)
+    if not columns or any(not c for c in columns):
+        raise BulkImportError("File has no header or has empty column names")
+    if len(set(columns)) != len(columns):
+        raise BulkImportError("File has duplicate column names")
+    if any(c not in schema.columns for c in columns):
+        # Колонку могли добавить после кэширования — перечитываем один раз
+        schema = catalog.table(table, refresh=True) or schema
+    unknown = [c for c in columns if c not in schema.columns]
+    if unknown:
+        raise BulkImportError(f"Columns not found in {schema.relation}: {', '.join(unknown)}")
+    missing = [c for c in schema.required if c not in columns]
+    if missing:
+        raise BulkImportError(f"Required columns missing from file: {', '.join(missing)}")
+
+    conflict: Optional[Tuple[str, ...]] = None
+    if mode == UPSERT:
+        conflict = tuple(key) if key else schema.primary_key
+        if not conflict:
+            raise BulkImportError(f"{schema.relation} has no primary key, pass key columns for upsert")
+        if not any(set(conflict) == set(k) for k in schema.unique_keys):
+            raise BulkImportError(f"No unique index on ({', '.join(conflict)}) in {schema.relation}")
+        absent = [c for c in conflict if c not in columns]
+        if absent:
+            raise BulkImportError(f"Key columns missing from file: {', '.join(absent)}")
+    return ImportPlan(schema, fmt, columns, mode, conflict, delimiter, null, size)
+
+
+# ========================================
+# Загрузка
+# ========================================
+
+class _ProgressReader:
+    """Файл для copy_expert: считает прочитанные байты в meta задания"""
+
+    def __init__(self, fileobj: IO[bytes], job: jobs.Job, total: int):
+        self.fileobj = fileobj
+        self.job = job
+        self.total = total
+        self.done = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self.job.status == jobs.CANCELLED:
+            raise jobs.JobCancelled(self.job.id)
+        data = self.fileobj.read(size)
+        self.done += len(data)
+        self.job.meta["progress"].update(
+            bytes_read=self.done,
+            percent=round(100 * self.done / self.total, 1) if self.total else None,
+        )
+        return data
+
+    def readline(self, size: int = -1) -> bytes:
+        return self.read(size)
+
+
+def _copy_sql(target: str, columns: List[str], header: bool, delimiter: str, null: str) -> str:
+    options = ["FORMAT csv", f"HEADER {str(header).lower()}", f"DELIMITER {_literal(delimiter)}",
+               f"NULL {_literal(null)}"]
+    return f"COPY {target} ({', '.join(_ident(c) for c in columns)}) FROM STDIN WITH ({', '.join(options)})"
+
+
+def _copy(cur, job: jobs.Job, fileobj: IO[bytes], plan: ImportPlan, target: str) -> int:
+    progress = job.meta["progress"]
+    if plan.fmt == "csv":
+        fileobj.seek(0)
+        cur.copy_expert(_copy_sql(target, plan.columns, True, plan.delimiter, plan.null), _ProgressReader(fileobj, job, plan.size), COPY_BUFFER)
+        return cur.rowcount
+    rows = 0
+    parquet = pq.ParquetFile(fileobj)
+    total_rows = parquet.metadata.num_rows
+    sql = _copy_sql(target, plan.columns, False, ",", "")
+    for batch in parquet.iter_batches(batch_size=settings.IMPORT_PARQUET_BATCH_ROWS, columns=plan.columns):
+        if job.status == jobs.CANCELLED:
+            raise jobs.JobCancelled(job.id)
+        chunk = io.BytesIO()
+        # Пустая строка без кавычек в CSV — NULL, строковое "" — в кавычках
+        pacsv.write_csv(batch, chunk, pacsv.WriteOptions(include_header=False))
+        chunk.seek(0)
+        cur.copy_expert(sql, chunk, COPY_BUFFER)
+        rows += batch.num_rows
+        progress.update(rows_copied=rows, percent=round(100 * rows / total_rows, 1) if total_rows else None)
+    return rows
+
+
+def _merge_sql(plan: ImportPlan, staging: str) -> str:
+    columns = ", ".join(_ident(c) for c in plan.columns)
+    key = ", ".join(_ident(c) for c in plan.key)
+    updates = [f"{_ident(c)} = EXCLUDED.{_ident(c)}" for c in plan.columns if c not in plan.key]
+    action = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+    # Повторы ключа в файле: ON CONFLICT не обновляет строку дважды — берём последнюю
+    return (
+        f"INSERT INTO {plan.table.quoted} ({columns}) "
+        f"SELECT DISTINCT ON ({key}) {columns} FROM {staging} ORDER BY {key}, ctid DESC "
+        f"ON CONFLICT ({key}) {action}"
+    )
+
+
+def run_import(ctx: jobs.JobContext, fileobj: IO[bytes], plan: ImportPlan) -> bytes:
+    job = ctx.job
+    progress = job.meta["progress"]
+    started = time.perf_counter()
+    db = ctx.session()
+    try:
+        db.execute(text(f"SET LOCAL statement_timeout = '{settings.IMPORT_STATEMENT_TIMEOUT}'"))
+        cur = db.connection().connection.driver_connection.cursor()
+        if plan.mode == UPSERT:
+            staging = "bulk_import_staging"
+            cur.execute(f"CREATE TEMP TABLE {staging} (LIKE {plan.table.quoted} INCLUDING DEFAULTS) ON COMMIT DROP")
+            progress["phase"] = "copy"
+            copied = _copy(cur, job, fileobj, plan, staging)
+            progress.update(phase="merge", rows_copied=copied)
+            cur.execute(_merge_sql(plan, staging))
+            written = cur.rowcount
+        else:
+            progress["phase"] = "copy"
+            copied = written = _copy(cur, job, fileobj, plan, plan.table.quoted)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    progress.update(phase="done", rows_copied=copied, rows_written=written, percent=100.0)
+    # Кэши, зависящие от таблицы, сбрасываем сразу (не дожидаясь NOTIFY/опроса)
+    invalidation.index.relations_changed([plan.table.relation])
+    logger.info(f"Bulk import into {plan.table.relation}: {copied} rows copied, {written} written in {elapsed_ms} ms")
+    return json.dumps({
+        "table": plan.table.relation,
+        "mode": plan.mode,
+        "rows_copied": copied,
+        "rows_written": written,
+        "elapsed_ms": elapsed_ms,
+        "rows_per_second": round(copied / (elapsed_ms / 1000)) if elapsed_ms else None,
+    }).encode("utf-8")
+
+
+def submit(owner_id: int, fileobj: IO[bytes], plan: ImportPlan) -> jobs.Job:
+    """
+    Поставить загрузку в очередь (свой пул IMPORT_WORKERS). Временный файл
+    закрывается и удаляется по завершении задания — и при отмене до старта
+    """
+    meta = {
+        "table": plan.table.relation,
+        "mode": plan.mode,
+        "progress": {"phase": "queued", "bytes_total": plan.size, "bytes_read": 0, "rows_copied": 0, "percent": 0.0},
+    }
+    return jobs.get_queue().submit(
+        owner_id, "import", f"{plan.fmt.upper()} -> {plan.table.relation} ({plan.mode})",
+        lambda ctx: run_import(ctx, fileobj, plan), meta=meta, cleanup=fileobj.close,
+    )
@@ -0,0 +1,378 @@
+# backend/app/services/code_sandbox.py
+# Пул заранее запущенных процессов для /api/code/execute.
+#
+# Каждое задание выполняется вне event loop: медленный скрипт не блокирует
+# остальные запросы. Рабочий процесс пула — «заготовка»: модули прогреты,
+# скомпилированный код кэшируется в нём, а само задание выполняется в
+# дочернем процессе (fork), который выставляет себе лимиты CPU/памяти
+# (setrlimit, мягкий = жёсткий — поднять их обратно из пользовательского
+# кода нельзя) и завершается после задания. Входные данные передаются
+# через shared memory (JSON-байты), а не pickle словаря через pipe.
+#
+# Время выполнения ограничено дважды: рабочий процесс убивает дочерний по
+# wall-time, а пул, если рабочий процесс не ответил и после этого, убивает
+# и заменяет его (дочерний при этом получает SIGKILL через PDEATHSIG).
+
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from io import StringIO
+from multiprocessing import shared_memory
+from typing import Any, Dict, Optional, Set
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import select
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Сколько символов stdout возвращать клиенту
+MAX_OUTPUT_CHARS = 1_000_000
+
+# Модули, которые прогреваются в рабочем процессе при старте
+WARM_MODULES = ("math", "statistics", "datetime", "collections", "itertools", "functools", "re", "decimal")
+
+# Запас пула сверх wall-time: за это время рабочий процесс сам снимает зависшее задание
+WALL_GRACE_SECONDS = 2.0
+
+PR_SET_PDEATHSIG = 1
+
+
+# ========================================
+# Рабочий процесс
+# ========================================
+
+def _to_jsonable(value: Any) -> Any:
+    """Результат задания должен пережить передачу в родителя и JSON-ответ"""
+    return json.loads(json.dumps(value, ensure_ascii=False, default=str))
+
+
+def _read_shared(name: Optional[str], size: int) -> Any:
+    if not name:
+        return None
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return json.loads(bytes(shm.buf[:size]))
+    finally:
+        shm.close()
+
+
+def _error(message: str, output: str = "") -> Dict[str, Any]:
+    return {"output": output, "result": None, "error": message}
+
+
+def _apply_limits(cpu_seconds: int, memory_mb: int) -> None:
+    """Мягкий и жёсткий лимиты равны: процесс задания не может их поднять"""
+    import resource
+    if cpu_seconds > 0:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _die_with_parent(parent_pid: int) -> None:
+    """SIGKILL процессу задания, если рабочий процесс убит пулом (Linux)"""
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+    except (OSError, AttributeError):
+        pass
+    if os.getppid() != parent_pid:
+        os._exit(1)
+
+
+def _exec_job(job: Dict[str, Any], code_obj: Any, data: Any) -> Dict[str, Any]:
+    """Выполняется в дочернем процессе задания"""
+    captured = StringIO()
+    try:
+        _apply_limits(job["cpu_seconds"], job["memory_mb"])
+        local_vars = {"data": data}
+        with redirect_stdout(captured):
+            exec(code_obj, {"__builtins__": __builtins__}, local_vars)
+        return {
+            "output": captured.getvalue()[:MAX_OUTPUT_CHARS],
+            "result": _to_jsonable(local_vars.get("result", None)),
+            "error": None,
+        }
+    except MemoryError:
+        return _error(f"Memory limit exceeded ({job['memory_mb']} MB)", captured.getvalue()[:MAX_OUTPUT_CHARS])
+    except Exception as e:
+        return _error(str(e), captured.getvalue()[:MAX_OUTPUT_CHARS])
+
+
+def _collect(pid: int, fd: int, job: Dict[str, Any]) -> Dict[str, Any]:
+    """Ответ процесса задания (JSON в pipe) с учётом wall-time; процесс снимается"""
+    deadline = time.monotonic() + job["wall_seconds"]
+    chunks = []
+    timed_out = False
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if not ready:
+            continue
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(fd)
+    if timed_out:
+        os.kill(pid, signal.SIGKILL)
+    _, status, usage = os.wait4(pid, 0)
+
+    if timed_out:
+        return _error(f"Wall time limit exceeded ({job['wall_limit']}s)")
+    if chunks and os.WIFEXITED(status):
+        return json.loads(b"".join(chunks))
+    if os.WIFSIGNALED(status):
+        sig = os.WTERMSIG(status)
+        if sig in (signal.SIGKILL, signal.SIGXCPU) and usage.ru_utime + usage.ru_stime >= job["cpu_seconds"] - 0.5:
+            return _error(f"CPU time limit exceeded ({job['cpu_seconds']}s)")
+        return _error(f"Code worker crashed (signal {sig}, limit exceeded?)")
+    return _error("Code worker crashed (limit exceeded?)")
+
+
+def _run_job(job: Dict[str, Any], code_cache: "OrderedDict[str, Any]", cache_size: int, conn) -> Dict[str, Any]:
+    try:
+        code_obj = code_cache.get(job["code_hash"])
+        if code_obj is None:
+            code_obj = compile(job["code"], "<user_code>", "exec")
+            code_cache[job["code_hash"]] = code_obj
+            if len(code_cache) > cache_size:
+                code_cache.popitem(last=False)
+        else:
+            code_cache.move_to_end(job["code_hash"])
+        data = _read_shared(job.get("shm_name"), job.get("shm_size", 0))
+    except Exception as e:
+        return _error(str(e))
+
+    parent_pid = os.getpid()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Процесс задания: наружу — только JSON ответа в pipe
+        status = 0
+        try:
+            os.close(read_fd)
+            conn.close()
+            _die_with_parent(parent_pid)
+            body = json.dumps(_exec_job(job, code_obj, data), ensure_ascii=False).encode("utf-8")
+            view = memoryview(body)
+            while view:
+                view = view[os.write(write_fd, view):]
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    return _collect(pid, read_fd, job)
+
+
+def _worker_main(conn, cache_size: int) -> None:
+    import importlib
+
+    # Ctrl+C в терминале получает вся группа процессов — останавливает родитель
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in WARM_MODULES:
+        importlib.import_module(name)
+
+    code_cache: "OrderedDict[str, Any]" = OrderedDict()
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            break
+        if job is None:
+            break
+        conn.send(_run_job(job, code_cache, cache_size, conn))
+
+
+# ========================================
+# Пул (процесс приложения)
+# ========================================
+
+class _Worker:
+    def __init__(self, ctx, cache_size: int):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, cache_size), daemon=True, name="code-sandbox"
+        )
+        self.process.start()
+        child_conn.close()
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        finally:
+            self.conn.close()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class CodeSandboxPool:
+    """
+    Пул тёплых рабочих процессов. run() блокирующий — вызывать из пула
+    потоков (run_in_threadpool). Процесс, превысивший wall-time или упавший,
+    убивается и заменяется новым.
+    """
+
+    def __init__(self, size: int, cpu_seconds: int, wall_seconds: float, memory_mb: int, cache_size: int):
+        self.size = max(1, size)
+        self.cpu_seconds = cpu_seconds
+        self.wall_seconds = wall_seconds
+        self.memory_mb = memory_mb
+        self.cache_size = cache_size
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers = []
+        self._busy: Set[_Worker] = set()
+        self._lock = threading.Lock()
+        self.started = False
+        self.stats = {"jobs": 0, "timeouts": 0, "crashes": 0, "restarts": 0}
+
+    def start(self) -> None:
+        with self._lock:
+            if self.started:
+                return
+            for _ in range(self.size):
+                w = _Worker(self._ctx, self.cache_size)
+                self._workers.append(w)
+                self._idle.put(w)
+            self.started = True
+        logger.info(f"Code sandbox pool started: {self.size} workers")
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self.started = False
+            workers, self._workers = self._workers, []
+            busy, self._busy = self._busy, set()
+            self._idle = queue.Queue()
+        # Занятые процессы убиваем: их run() получит ошибку соединения и не вернёт их в пул
+        for w in workers:
+            if w in busy:
+                w.kill()
+            else:
+                w.stop()
+
+    def _acquire(self) -> Optional[_Worker]:
+        with self._lock:
+            idle = self._idle
+        try:
+            worker = idle.get(timeout=self.wall_seconds)
+        except queue.Empty:
+            return None
+        with self._lock:
+            if worker not in self._workers:
+                return None     # пул остановлен, пока ждали
+            self._busy.add(worker)
+        return worker
+
+    def _release(self, worker: Optional[_Worker]) -> None:
+        if worker is None:
+            return
+        with self._lock:
+            self._busy.discard(worker)
+            if worker in self._workers:
+                self._idle.put(worker)
+                return
+        worker.kill()
+
+    def _replace(self, worker: _Worker) -> Optional[_Worker]:
+        worker.kill()
+        with self._lock:
+            self._busy.discard(worker)
+            if worker not in self._workers:
+                return None
+        fresh = _Worker(self._ctx, self.cache_size)
+        with self._lock:
+            if worker in self._workers:
+                self._workers = [w for w in self._workers if w is not worker] + [fresh]
+                self._busy.add(fresh)
+                self.stats["restarts"] += 1
+                return fresh
+        fresh.stop()
+        return None
+
+    def run(self, code: str, data: Any = None) -> Dict[str, Any]:
+        if not self.started:
+            self.start()
+
+        shm = None
+        started = time.monotonic()
+        try:
+            job: Dict[str, Any] = {
+                "code": code,
+                "code_hash": hashlib.sha256(code.encode("utf-8")).hexdigest(),
+                "cpu_seconds": self.cpu_seconds,
+                "memory_mb": self.memory_mb,
+                "wall_limit": self.wall_seconds,
+            }
+            if data is not None:
+                payload = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+                shm = shared_memory.SharedMemory(create=True, size=max(1, len(payload)))
+                shm.buf[:len(payload)] = payload
+                job["shm_name"], job["shm_size"] = shm.name, len(payload)
+
+            worker = self._acquire()
+            if worker is None:
+                return _error("Code executor is busy, try again later")
+
+            try:
+                job["wall_seconds"] = max(0.1, self.wall_seconds - (time.monotonic() - started))
+                worker.conn.send(job)
+                if not worker.conn.poll(job["wall_seconds"] + WALL_GRACE_SECONDS):
+                    self.stats["timeouts"] += 1
+                    worker = self._replace(worker)
+                    return _error(f"Wall time limit exceeded ({self.wall_seconds}s)")
+                result = worker.conn.recv()
+                self.stats["jobs"] += 1
+                if (result.get("error") or "").startswith("Wall time limit"):
+                    self.stats["timeouts"] += 1
+                return result
+            except (EOFError, OSError):
+                worker = self._replace(worker)
+                if not self.started:
+                    return _error("Code executor is shutting down")
+                self.stats["crashes"] += 1
+                return _error("Code worker crashed (limit exceeded?)")
+            finally:
+                self._release(worker)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+
+_pool: Optional[CodeSandboxPool] = None
+
+
+def get_pool() -> CodeSandboxPool:
+    global _pool
+    if _pool is None:
+        from app.config import settings
+        _pool = CodeSandboxPool(
+            size=settings.CODE_EXECUTOR_WORKERS,
+            cpu_seconds=settings.CODE_EXECUTOR_CPU_SECONDS,
+            wall_seconds=settings.CODE_EXECUTOR_WALL_SECONDS,
+            memory_mb=settings.CODE_EXECUTOR_MEMORY_MB,
+            cache_size=settings.CODE_EXECUTOR_BYTECODE_CACHE,
+        )
+    return _pool
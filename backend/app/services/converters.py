@@ -0,0 +1,266 @@
+# backend/app/services/converters.py
+# Поколоночное преобразование результатов SQL для JSON, Excel и Arrow.
+#
+# Тип колонки определяется один раз на результат по OID из
+# cursor.description (psycopg2), после чего к каждой колонке пачки строк
+# применяется заранее выбранная функция — без isinstance на каждую ячейку.
+
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+import base64
+import json
+
+Converter = Optional[Callable[[Any], Any]]
+
+# OID типов PostgreSQL (pg_type.oid)
+BOOL, BYTEA, CHAR, NAME, INT8, INT2, INT4, TEXT, OID = 16, 17, 18, 19, 20, 21, 23, 25, 26
+JSON_OID, FLOAT4, FLOAT8, BPCHAR, VARCHAR = 114, 700, 701, 1042, 1043
+DATE, TIME, TIMESTAMP, TIMESTAMPTZ, INTERVAL, TIMETZ = 1082, 1083, 1114, 1184, 1186, 1266
+NUMERIC, UUID_OID, JSONB = 1700, 2950, 3802
+
+INT_TYPES = {INT2, INT4, INT8, OID}
+FLOAT_TYPES = {FLOAT4, FLOAT8}
+TEXT_TYPES = {TEXT, VARCHAR, BPCHAR, CHAR, NAME}
+JSON_TYPES = {JSON_OID, JSONB}
+
+PROFILES = ("json", "excel", "arrow")
+
+# Наибольшая точность decimal128 в Arrow: NUMERIC(p, s) с p больше — float64
+ARROW_MAX_DECIMAL_PRECISION = 38
+
+
+def _utc_iso(v: datetime) -> str:
+    if v.tzinfo is None:
+        return v.isoformat()
+    return v.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _excel_datetime(v: datetime) -> datetime:
+    # Excel не поддерживает tz — приводим к naive UTC
+    return v.astimezone(timezone.utc).replace(tzinfo=None) if v.tzinfo else v
+
+
+def _b64(v: Any) -> str:
+    return base64.b64encode(bytes(v)).decode("ascii")
+
+
+def _json_text(v: Any) -> str:
+    return json.dumps(v, ensure_ascii=False, default=str)
+
+
+def _iso(v: Any) -> str:
+    return v.isoformat()
+
+
+def json_value(v: Any) -> Any:
+    """Общий (медленный) путь для JSON: типы, не известные по OID, и массивы"""
+    if v is None or isinstance(v, (str, int, float, bool)):
+        return v
+    if isinstance(v, datetime):
+        return _utc_iso(v)
+    if isinstance(v, (date, dt_time)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, timedelta):
+        return v.total_seconds()
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return _b64(v)
+    if isinstance(v, UUID):
+        return str(v)
+    if isinstance(v, (list, tuple)):
+        return [json_value(x) for x in v]
+    if isinstance(v, dict):
+        return {str(k): json_value(x) for k, x in v.items()}
+    return str(v)
+
+
+def excel_value(v: Any) -> Any:
+    """Общий путь для Excel (бывший normalize_cell из sql_export)"""
+    if isinstance(v, datetime):
+        return _excel_datetime(v)
+    if v is None or isinstance(v, (str, int, float, bool, date)):
+        return v
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, (dict, list, tuple)):
+        return _json_text(v)
+    if isinstance(v, (bytes, bytearray, memoryview)):
+        return _b64(v)
+    return str(v)
+
+
+def arrow_value(v: Any) -> Any:
+    """Общий путь для Arrow: всё, что pyarrow не выведет стабильно, — в строку/float"""
+    if isinstance(v, Decimal):
+        return float(v)
+    if isinstance(v, dict):
+        return _json_text(v)
+    if isinstance(v, UUID):
+        return str(v)
+    return v
+
+
+FALLBACKS: Dict[str, Callable[[Any], Any]] = {
+    "json": json_value,
+    "excel": excel_value,
+    "arrow": arrow_value,
+}
+
+
+def _by_oid(type_code: Any, profile: str, decimal_as_string: bool) -> Any:
+    """
+    Конвертер колонки по OID. None — значение уже подходит как есть;
+    ... (Ellipsis) — OID не распознан, решаем по образцу значения.
+    """
+    if type_code in INT_TYPES or type_code in FLOAT_TYPES or type_code in TEXT_TYPES or type_code == BOOL:
+        return None
+    if type_code == NUMERIC:
+        if profile == "json" and decimal_as_string:
+            return str
+        return float
+    if type_code == TIMESTAMPTZ:
+        return {"json": _utc_iso, "excel": _excel_datetime, "arrow": None}[profile]
+    if type_code in (TIMESTAMP, DATE, TIME):
+        return _iso if profile == "json" else None
+    if type_code == TIMETZ:
+        return _iso if profile in ("json", "excel") else str
+    if type_code == INTERVAL:
+        return {"json": timedelta.total_seconds, "excel": str, "arrow": None}[profile]
+    if type_code == BYTEA:
+        return bytes if profile == "arrow" else _b64
+    if type_code in JSON_TYPES:
+        # json/jsonb уже разобраны драйвером — в JSON отдаём как есть
+        return None if profile == "json" else _json_text
+    if type_code == UUID_OID:
+        return str
+    return ...
+
+
+def _by_sample(sample: Any, profile: str) -> Converter:
+    """Подбор конвертера по первому непустому значению (нет OID, напр. sqlite)"""
+    if sample is None:
+        return FALLBACKS[profile]
+    if isinstance(sample, bool) or isinstance(sample, (int, float, str)):
+        return None
+    if isinstance(sample, datetime):
+        return {"json": _utc_iso, "excel": _excel_datetime, "arrow": None}[profile]
+    if isinstance(sample, date):
+        return _iso if profile == "json" else None
+    if isinstance(sample, Decimal):
+        return float
+    if isinstance(sample, UUID):
+        return str
+    return FALLBACKS[profile]
+
+
+def column_type_codes(result) -> List[Any]:
+    """OID колонок из cursor.description (None, если драйвер их не даёт)"""
+    cursor = getattr(result, "cursor", None)
+    description = getattr(cursor, "description", None)
+    if not description:
+        return [None] * len(result.keys())
+    return [getattr(d, "type_code", d[1]) for d in description]
+
+
+def column_numeric_specs(result) -> List[Optional[Tuple[int, int]]]:
+    """
+    (precision, scale) колонок NUMERIC(p, s) из cursor.description; None —
+    модификатор не задан (numeric без (p, s), SUM(...)) или не влезает в decimal128
+    """
+    cursor = getattr(result, "cursor", None)
+    description = getattr(cursor, "description", None)
+    if not description:
+        return [None] * len(result.keys())
+    specs: List[Optional[Tuple[int, int]]] = []
+    for d in description:
+        precision, scale = (d[4], d[5]) if len(d) > 5 else (None, None)
+        known = (isinstance(precision, int) and isinstance(scale, int)
+                 and 0 <= scale <= precision <= ARROW_MAX_DECIMAL_PRECISION and precision > 0)
+        specs.append((precision, scale) if known else None)
+    return specs
+
+
+def build_converters(
+    type_codes: Sequence[Any],
+    profile: str,
+    sample_rows: Sequence[Sequence[Any]] = (),
+    decimal_as_string: bool = False,
+    numeric_specs: Optional[Sequence[Optional[Tuple[int, int]]]] = None,
+) -> List[Converter]:
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown converter profile: {profile}")
+    funcs: List[Converter] = []
+    for idx, type_code in enumerate(type_codes):
+        if profile == "arrow" and type_code == NUMERIC and numeric_specs and numeric_specs[idx]:
+            # NUMERIC(p, s) -> decimal128(p, s): Decimal без потери точности
+            funcs.append(None)
+            continue
+        fn = _by_oid(type_code, profile, decimal_as_string) if type_code is not None else ...
+        if fn is ...:
+            sample = next((r[idx] for r in sample_rows if r[idx] is not None), None)
+            fn = _by_sample(sample, profile)
+        funcs.append(fn)
+    return funcs
+
+
+class ResultConverter:
+    """
+    Конвертер результата запроса. Функции колонок строятся один раз —
+    по OID, а для нераспознанных колонок по первой пачке строк —
+    и затем применяются к пачкам поколоночно.
+    """
+
+    def __init__(
+        self,
+        names: Sequence[str],
+        type_codes: Sequence[Any],
+        profile: str,
+        decimal_as_string: bool = False,
+        numeric_specs: Optional[Sequence[Optional[Tuple[int, int]]]] = None,
+    ):
+        self.names = list(names)
+        self.type_codes = list(type_codes)
+        self.profile = profile
+        self.decimal_as_string = decimal_as_string
+        self.numeric_specs = list(numeric_specs) if numeric_specs is not None else [None] * len(self.names)
+        self.funcs: Optional[List[Converter]] = None
+
+    @classmethod
+    def for_result(cls, result, profile: str, decimal_as_string: bool = False) -> "ResultConverter":
+        specs = column_numeric_specs(result) if profile == "arrow" else None
+        return cls(list(result.keys()), column_type_codes(result), profile, decimal_as_string, specs)
+
+    def _ensure(self, batch: Sequence[Sequence[Any]]) -> List[Converter]:
+        if self.funcs is None:
+            self.funcs = build_converters(
+                self.type_codes, self.profile, batch, self.decimal_as_string, self.numeric_specs
+            )
+        return self.funcs
+
+    def columns(self, batch: Sequence[Sequence[Any]]) -> List[List[Any]]:
+        """Пачка строк -> список преобразованных колонок"""
+        funcs = self._ensure(batch)
+        if not batch:
+            return [[] for _ in self.names]
+        cols = [list(c) for c in zip(*batch)]
+        for idx, fn in enumerate(funcs):
+            if fn is not None:
+                cols[idx] = [None if v is None else fn(v) for v in cols[idx]]
+        return cols
+
+    def rows(self, batch: Sequence[Sequence[Any]]) -> List[tuple]:
+        """Пачка строк -> преобразованные строки (для Excel)"""
+        if all(fn is None for fn in self._ensure(batch)):
+            # Row из SQLAlchemy — не tuple: write-only лист openpyxl его не принимает
+            return [tuple(r) for r in batch]
+        return list(zip(*self.columns(batch)))
+
+    def records(self, batch: Sequence[Sequence[Any]]) -> List[Dict[str, Any]]:
+        """Пачка строк -> список словарей (для JSON)"""
+        names = self.names
+        if all(fn is None for fn in self._ensure(batch)):
+            return [dict(zip(names, r)) for r in batch]
+        return [dict(zip(names, r)) for r in zip(*self.columns(batch))]
@@ -0,0 +1,181 @@
+# backend/app/services/cost_guard.py
+# Предварительная оценка запроса перед выполнением в /api/sql/execute.
+#
+# EXPLAIN (FORMAT JSON) без ANALYZE даёт оценку стоимости и числа строк
+# корневого узла; оценка кэшируется по отпечатку запроса (текст без
+# литералов, app.services.sql_analysis) на COST_GUARD_CACHE_SECONDS. По
+# порогам роли (COST_GUARD_LIMITS) запрос:
+#   - inline  — выполняется сразу, как раньше;
+#   - replica — средний: на реплике, если она настроена (REPLICA_DATABASE_URL),
+#               иначе inline;
+#   - job     — тяжёлый: в очередь фоновых заданий (app.services.jobs);
+#   - reject  — отказ с объяснением (оценка и порог).
+# После выполнения фактическое число строк сравнивается с оценкой:
+# точность оценок (q-error) копится по отпечаткам — сильно промахивающиеся
+# запросы видны в /api/jobs/guard.
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import replica_engine
+from app.services import sql_analysis
+
+logger = logging.getLogger(__name__)
+
+INLINE, REPLICA, JOB, REJECT = "inline", "replica", "job", "reject"
+ACCURACY_SAMPLES = 64
+
+
+class Estimate:
+    __slots__ = ("fingerprint", "cost", "rows", "node", "cached")
+
+    def __init__(self, fingerprint: str, cost: float, rows: float, node: str, cached: bool = False):
+        self.fingerprint = fingerprint
+        self.cost = cost
+        self.rows = rows
+        self.node = node
+        self.cached = cached
+
+    def describe(self) -> Dict[str, Any]:
+        return {"fingerprint": self.fingerprint, "cost": self.cost, "rows": self.rows, "node": self.node}
+
+
+class Decision:
+    __slots__ = ("action", "reason", "estimate")
+
+    def __init__(self, action: str, reason: str, estimate: Optional[Estimate]):
+        self.action = action
+        self.reason = reason
+        self.estimate = estimate
+
+
+def limits_for(role: str) -> Dict[str, float]:
+    """Пороги роли; отсутствующие — без ограничения"""
+    return (settings.COST_GUARD_LIMITS or {}).get(role) or {}
+
+
+class CostGuard:
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._cache: "OrderedDict[str, Estimate]" = OrderedDict()
+        self._cached_at: Dict[str, float] = {}
+        self._accuracy: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"explained": 0, "estimate_hits": 0, "explain_errors": 0,
+                      INLINE: 0, REPLICA: 0, JOB: 0, REJECT: 0}
+
+    def estimate(self, db, sql: str, params: dict) -> Optional[Estimate]:
+        """Оценка плана (из кэша по отпечатку) или None, если EXPLAIN не удался"""
+        fp = sql_analysis.analyze(sql).fingerprint
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(fp)
+            if cached is not None and now - self._cached_at[fp] <= self.ttl:
+                self._cache.move_to_end(fp)
+                self.stats["estimate_hits"] += 1
+                return Estimate(fp, cached.cost, cached.rows, cached.node, cached=True)
+        try:
+            # Savepoint: ошибка EXPLAIN (синтаксис) не ломает транзакцию — её покажет само выполнение
+            with db.begin_nested():
+                plan = db.execute(text(f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}"), params).scalar()
+        except Exception as e:
+            self.stats["explain_errors"] += 1
+            logger.debug(f"Cost guard: EXPLAIN failed: {e}")
+            return None
+        root = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+        estimate = Estimate(fp, float(root.get("Total Cost", 0)), float(root.get("Plan Rows", 0)), root.get("Node Type", ""))
+        with self._lock:
+            self.stats["explained"] += 1
+            self._cache[fp] = estimate
+            self._cached_at[fp] = now
+            while len(self._cache) > self.size:
+                old, _ = self._cache.popitem(last=False)
+                self._cached_at.pop(old, None)
+        return estimate
+
+    def decide(self, role: str, estimate: Optional[Estimate]) -> Decision:
+        if estimate is None:
+            return self._count(Decision(INLINE, "no estimate", None))
+        limits = limits_for(role)
+        cost, rows = estimate.cost, estimate.rows
+
+        def over(key: str, value: float) -> bool:
+            return limits.get(key) is not None and value > limits[key]
+
+        if over("reject_cost", cost) or over("reject_rows", rows):
+            which = "cost" if over("reject_cost", cost) else "rows"
+            limit = limits[f"reject_{which}"]
+            value = cost if which == "cost" else rows
+            return self._count(Decision(
+                REJECT,
+                f"Estimated {which} {value:,.0f} exceeds the {role} limit {limit:,.0f}. "
+                f"Narrow the query (filters on p_date_from/p_date_to/p_object_id, LIMIT) "
+                f"or use /api/sql/export for full extracts.",
+                estimate,
+            ))
+        if over("job_cost", cost) or over("job_rows", rows):
+            return self._count(Decision(JOB, f"Estimated cost {cost:,.0f}, rows {rows:,.0f}: running as a background job", estimate))
+        if over("inline_cost", cost) or over("inline_rows", rows):
+            if replica_engine is not None:
+                return self._count(Decision(REPLICA, f"Estimated cost {cost:,.0f}: routed to replica", estimate))
+        return self._count(Decision(INLINE, "within inline limits", estimate))
+
+    def _count(self, decision: Decision) -> Decision:
+        self.stats[decision.action] += 1
+        return decision
+
+    def record_actual(self, estimate: Optional[Estimate], rows: Optional[int]) -> None:
+        """Фактическое число строк выполнения -> q-error оценки max(est/act, act/est)"""
+        if estimate is None or rows is None:
+            return
+        est, act = max(estimate.rows, 1.0), max(float(rows), 1.0)
+        q_error = max(est / act, act / est)
+        with self._lock:
+            samples = self._accuracy.setdefault(estimate.fingerprint, [])
+            self._accuracy.move_to_end(estimate.fingerprint)
+            samples.append(q_error)
+            del samples[:-ACCURACY_SAMPLES]
+            while len(self._accuracy) > self.size:
+                self._accuracy.popitem(last=False)
+
+    def accuracy(self, limit: int = 20) -> Dict[str, Any]:
+        """Медиана q-error по всем и худшие отпечатки (1.0 — оценка точна)"""
+        with self._lock:
+            per_fp = {fp: sorted(s) for fp, s in self._accuracy.items() if s}
+        medians = {fp: s[len(s) // 2] for fp, s in per_fp.items()}
+        everything = sorted(q for s in per_fp.values() for q in s)
+        worst = sorted(medians.items(), key=lambda i: -i[1])[:limit]
+        return {
+            "samples": len(everything),
+            "median_q_error": round(everything[len(everything) // 2], 2) if everything else None,
+            "within_10x": round(sum(q <= 10 for q in everything) / len(everything), 3) if everything else None,
+            "worst": [
+                {"fingerprint": fp, "median_q_error": round(q, 2), "samples": len(per_fp[fp])}
+                for fp, q in worst
+            ],
+        }
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"estimates": len(self._cache), **self.stats}
+
+
+_guard: Optional[CostGuard] = None
+_guard_lock = threading.Lock()
+
+
+def get_guard() -> CostGuard:
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = CostGuard(settings.COST_GUARD_CACHE_SIZE, settings.COST_GUARD_CACHE_SECONDS)
+    return _guard
@@ -0,0 +1,286 @@
+# backend/app/services/dashboard_export.py
+# Выгрузка всех виджетов дашборда одним файлом: xlsx (лист на виджет)
+# или zip (файл на виджет) для csv / parquet / arrow.
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from typing import Any, Dict, List, Optional
+import logging
+import re
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+from fastapi import HTTPException
+from sqlalchemy import text
+from openpyxl import Workbook
+
+from app.api import sql_export
+from app.api.sql_executor import DEVELOPER_TIMEOUT_SECONDS, guard_user_sql
+from app.config import settings
+from app.database import engine
+from app.services.widgets import widget_key, widget_query
+
+logger = logging.getLogger(__name__)
+
+# Оценка размера строки до первой выборки (байт)
+INITIAL_ROW_ESTIMATE = 512
+
+
+class ExportLimitError(Exception):
+    """Превышен общий лимит памяти или времени выгрузки"""
+
+
+class MemoryBudget:
+    """
+    Общий на выгрузку бюджет памяти под выбранные, но ещё не записанные
+    строки. Поток резервирует место перед очередной пачкой и ждёт, если
+    бюджет исчерпан другими виджетами.
+    """
+
+    def __init__(self, cap_bytes: int, deadline: float, cancelled: threading.Event):
+        self.cap = cap_bytes
+        self.used = 0
+        self.deadline = deadline
+        self.cancelled = cancelled
+        self.cond = threading.Condition()
+
+    def reserve(self, n: int) -> None:
+        if n > self.cap:
+            raise ExportLimitError(
+                f"Batch needs ~{n // (1024 * 1024)} MB, over the export memory cap"
+            )
+        with self.cond:
+            while self.used + n > self.cap:
+                if self.cancelled.is_set():
+                    raise ExportLimitError("Export cancelled")
+                if time.monotonic() >= self.deadline:
+                    raise ExportLimitError("Export timeout exceeded")
+                self.cond.wait(0.2)
+            self.used += n
+
+    def release(self, n: int) -> None:
+        if n:
+            with self.cond:
+                self.used -= n
+                self.cond.notify_all()
+
+
+class BudgetedResult:
+    """
+    Обёртка над результатом серверного курсора: каждая fetchmany
+    резервирует память в бюджете и освобождает резерв предыдущей пачки
+    (к этому моменту она уже записана в файл).
+    """
+
+    def __init__(self, result, budget: MemoryBudget):
+        self.result = result
+        self.budget = budget
+        self.row_estimate = INITIAL_ROW_ESTIMATE
+        self.held = 0
+
+    @property
+    def cursor(self):
+        return self.result.cursor
+
+    def keys(self):
+        return self.result.keys()
+
+    def fetchmany(self, size: int):
+        self.budget.release(self.held)
+        self.held = 0
+        if self.budget.cancelled.is_set():
+            raise ExportLimitError("Export cancelled")
+        if time.monotonic() >= self.budget.deadline:
+            raise ExportLimitError("Export timeout exceeded")
+
+        need = self.row_estimate * size
+        self.budget.reserve(need)
+        self.held = need
+        batch = self.result.fetchmany(size)
+        if batch:
+            sample = batch[0]
+            self.row_estimate = max(64, sum(sys.getsizeof(v) for v in sample) + 56 + 8 * len(sample))
+        return batch
+
+    def close(self):
+        self.budget.release(self.held)
+        self.held = 0
+        self.result.close()
+
+
+def _safe_name(name: str, taken: set, limit: int) -> str:
+    base = re.sub(r"[\[\]:*?/\\]", "_", name).strip() or "widget"
+    base = base[:limit]
+    candidate, n = base, 2
+    while candidate.lower() in taken:
+        suffix = f"_{n}"
+        candidate = base[: limit - len(suffix)] + suffix
+        n += 1
+    taken.add(candidate.lower())
+    return candidate
+
+
+def _set_timeout(conn, deadline: float, limit_seconds: Optional[float] = None) -> None:
+    remaining = deadline - time.monotonic()
+    if limit_seconds is not None:
+        remaining = min(remaining, limit_seconds)
+    conn.execute(text(f"SET LOCAL statement_timeout = {max(1000, int(remaining * 1000))}"))
+
+
+class DashboardExport:
+    """
+    Одна выгрузка дашборда. Запросы виджетов выполняются параллельно,
+    каждый на своём соединении из пула (engine.connect()), с серверным
+    курсором. Ошибка запроса отдельного виджета не срывает выгрузку —
+    она попадает в файл; лимит памяти и таймаут срывают выгрузку целиком.
+    SQL виджетов проходит те же проверки роли, что и /api/sql/execute.
+    """
+
+    def __init__(
+        self,
+        widgets: List[Dict[str, Any]],
+        fmt: str,
+        role: str,
+        extra_params: Optional[Dict[str, Any]] = None,
+        sources: Optional[Dict[str, Dict[str, Any]]] = None,
+    ):
+        self.widgets = widgets
+        self.fmt = fmt
+        self.role = role
+        self.extra_params = extra_params or {}
+        self.sources = sources or {}
+        self.cancelled = threading.Event()
+        self.deadline = time.monotonic() + settings.DASHBOARD_EXPORT_TIMEOUT_SECONDS
+        self.budget = MemoryBudget(
+            settings.DASHBOARD_EXPORT_MEMORY_MB * 1024 * 1024, self.deadline, self.cancelled
+        )
+        self.row_counts: Dict[str, int] = {}
+        self.errors: Dict[str, str] = {}
+
+    def _run_widget(self, wid: str, widget: Dict[str, Any], write) -> None:
+        sql, params = widget_query(widget, self.sources, self.extra_params)
+        try:
+            guard_user_sql(sql, self.role, read_only=True)
+        except HTTPException as e:
+            self.errors[wid] = str(e.detail)
+            return
+        limit = None if self.role == "ADMIN" else DEVELOPER_TIMEOUT_SECONDS
+        with engine.connect() as conn:
+            try:
+                _set_timeout(conn, self.deadline, limit)
+                self.row_counts[wid] = write(conn, sql, params)
+            except ExportLimitError:
+                self.cancelled.set()
+                raise
+            except Exception as e:
+                if time.monotonic() >= self.deadline:
+                    self.cancelled.set()
+                    raise ExportLimitError("Export timeout exceeded")
+                logger.warning(f"Dashboard export: widget {wid} failed: {e}")
+                self.errors[wid] = str(e)
+            finally:
+                conn.rollback()
+
+    def _streamed(self, write_result):
+        """Выполнить запрос серверным курсором и передать результат писателю"""
+        def run(conn, sql: str, params: Dict[str, Any]) -> int:
+            result = conn.execute(
+                text(sql),
+                params,
+                execution_options={"stream_results": True, "yield_per": sql_export.FETCH_BATCH_SIZE},
+            )
+            budgeted = BudgetedResult(result, self.budget)
+            try:
+                return write_result(budgeted)
+            finally:
+                budgeted.close()
+        return run
+
+    def _run_all(self, tasks) -> None:
+        workers = max(1, min(settings.DASHBOARD_EXPORT_WORKERS, len(tasks)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dash-export") as pool:
+            futures = [pool.submit(fn, *args) for fn, *args in tasks]
+            done, pending = wait(
+                futures,
+                timeout=max(0.0, self.deadline - time.monotonic()),
+                return_when=FIRST_EXCEPTION,
+            )
+            if pending:
+                self.cancelled.set()
+            for f in done:
+                exc = f.exception()
+                if exc is not None:
+                    self.cancelled.set()
+                    raise exc
+            if pending:
+                raise ExportLimitError("Export timeout exceeded")
+
+    def write_workbook(self, fileobj) -> None:
+        wb = Workbook(write_only=True)
+        lock = threading.Lock()
+        taken: set = set()
+        tasks = []
+        for i, w in enumerate(self.widgets):
+            wid = widget_key(w, i)
+            ws = wb.create_sheet(title=_safe_name(str(w.get("name") or wid), taken, 31))
+            tasks.append((
+                self._run_widget, wid, w,
+                self._streamed(lambda res, ws=ws: sql_export.fill_xlsx_sheet(ws, res, lock)),
+            ))
+        self._run_all(tasks)
+
+        if self.errors:
+            ws = wb.create_sheet(title=_safe_name("errors", taken, 31))
+            ws.append(["widget_id", "error"])
+            for wid, err in self.errors.items():
+                ws.append([wid, err])
+        wb.save(fileobj)
+
+    def write_zip(self, fileobj) -> None:
+        taken: set = set()
+        parts = []
+        tasks = []
+        for i, w in enumerate(self.widgets):
+            wid = widget_key(w, i)
+            name = _safe_name(str(w.get("name") or wid), taken, 100)
+            part = tempfile.TemporaryFile(suffix=f".{self.fmt}")
+            parts.append((name, wid, part))
+            tasks.append((self._run_widget, wid, w, self._file_writer(part)))
+        try:
+            self._run_all(tasks)
+            with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for name, wid, part in parts:
+                    if wid in self.errors:
+                        zf.writestr(f"{name}.error.txt", self.errors[wid])
+                        continue
+                    part.seek(0)
+                    with zf.open(f"{name}.{self.fmt}", "w", force_zip64=True) as dst:
+                        while True:
+                            chunk = part.read(sql_export.STREAM_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            dst.write(chunk)
+        finally:
+            for _, _, part in parts:
+                part.close()
+
+    def _file_writer(self, part):
+        if self.fmt == "csv":
+            # COPY пишет прямо в файл, минуя python-объекты строк. Текст COPY
+            # собирает только sql_export.copy_csv: он же отклоняет запрос,
+            # который вышел бы за скобки обёртки COPY (...)
+            def write_csv(conn, sql: str, params: Dict[str, Any]) -> int:
+                cursor = conn.connection.cursor()
+                sql_export.copy_csv(cursor, sql, params, part)
+                return cursor.rowcount
+            return write_csv
+        writer = sql_export.RESULT_WRITERS[self.fmt]
+        return self._streamed(lambda res: writer(res, part))
+
+    def write(self, fileobj) -> None:
+        if self.fmt == "xlsx":
+            self.write_workbook(fileobj)
+        else:
+            self.write_zip(fileobj)
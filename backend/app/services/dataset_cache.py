@@ -0,0 +1,315 @@
+# backend/app/services/dataset_cache.py
+# Кэш результатов виджетов дашборда для кросс-фильтрации.
+#
+# Результат запроса виджета хранится поколоночно (Frame из transforms),
+# для колонок с небольшим числом различных значений (status,
+# construction_object_id, ...) строятся битовые индексы: значение ->
+# упакованная битовая маска строк. Комбинация фильтров считается
+# побитовыми AND/OR над масками, без повторного запроса в PostgreSQL.
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+
+import numpy as np
+
+from app.services import invalidation, prepared
+from app.services.converters import ResultConverter
+from app.services.transforms import COMPARE_OPS, FILTER_OPS, Frame, TransformError, comparable, factorize, to_python
+
+logger = logging.getLogger(__name__)
+
+CACHE_NAME = "dashboard_datasets"
+
+# Операторы, которые отвечаются битовыми индексами
+BITMAP_OPS = {"=", "==", "in", "!=", "<>", "not_in", "is_null", "not_null"}
+
+
+class DatasetTooLarge(Exception):
+    """Результат виджета больше DATASET_CACHE_MAX_ROWS"""
+
+
+def dataset_key(dashboard_id: int, widget_id: str, sql: str, params: Dict[str, Any]) -> Tuple:
+    digest = hashlib.sha1(
+        (sql + "\x00" + json.dumps(params, sort_keys=True, default=str)).encode("utf-8")
+    ).hexdigest()
+    return (dashboard_id, widget_id, digest)
+
+
+def _array_bytes(arr: np.ndarray) -> int:
+    size = arr.nbytes
+    if arr.dtype == object and len(arr):
+        sample = arr[:100]
+        size += len(arr) * sum(sys.getsizeof(v) for v in sample) // len(sample)
+    return size
+
+
+def normalize_filters(raw: Any) -> List[Dict[str, Any]]:
+    """
+    Фильтры дашборда -> список условий {column, op, value, source}.
+    Принимаются словарь {колонка: значение | [значения]} и список условий.
+    source — id виджета, кликом по которому задан фильтр: сам этот
+    виджет им не фильтруется.
+    """
+    if not raw:
+        return []
+    if isinstance(raw, dict):
+        raw = [{"column": k, "value": v} for k, v in raw.items()]
+    if not isinstance(raw, list):
+        raise TransformError("filters must be an object or a list of conditions")
+    conditions = []
+    for cond in raw:
+        if not isinstance(cond, dict):
+            raise TransformError(f"Invalid filter condition: {cond!r}")
+        column = cond.get("column") or cond.get("field")
+        if not column:
+            raise TransformError("Filter condition requires 'column'")
+        value = cond.get("value")
+        op = str(cond.get("op") or ("in" if isinstance(value, list) else "=")).lower()
+        if op not in FILTER_OPS:
+            raise TransformError(f"Unsupported filter operator '{op}'")
+        # Пустой выбор в кросс-фильтре означает «без фильтра»
+        if op in ("in", "=") and value in ([], ""):
+            continue
+        conditions.append({"column": column, "op": op, "value": value, "source": cond.get("source")})
+    return conditions
+
+
+class Dataset:
+    """
+    Результат одного виджета: колонки + битовые индексы. Маски хранятся
+    упакованными (np.packbits, 1 бит на строку).
+    """
+
+    def __init__(self, frame: Frame, max_cardinality: int):
+        self.frame = frame
+        self.rows = len(frame)
+        self.index: Dict[str, Dict[Hashable, np.ndarray]] = {}
+        for name, arr in frame.columns.items():
+            self._build_index(name, arr, max_cardinality)
+        self.nbytes = sum(_array_bytes(a) for a in frame.columns.values()) + sum(
+            m.nbytes for bitmaps in self.index.values() for m in bitmaps.values()
+        )
+
+    def _build_index(self, name: str, arr: np.ndarray, max_cardinality: int) -> None:
+        if not self.rows:
+            return
+        try:
+            codes, uniques = factorize(arr)
+        except TypeError:
+            return
+        if len(uniques) > max_cardinality:
+            return
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        bitmaps: Dict[Hashable, np.ndarray] = {}
+        for code, value in enumerate(to_python(uniques)):
+            bits = np.zeros(self.rows, dtype=bool)
+            bits[order[bounds[code]:bounds[code + 1]]] = True
+            try:
+                bitmaps[value] = np.packbits(bits)
+            except TypeError:
+                # Нехешируемые значения (json-массивы) — колонку не индексируем
+                return
+        self.index[name] = bitmaps
+
+    # ---------- маски ----------
+
+    def _empty(self) -> np.ndarray:
+        return np.zeros((self.rows + 7) // 8, dtype=np.uint8)
+
+    def _full(self) -> np.ndarray:
+        return np.packbits(np.ones(self.rows, dtype=bool))
+
+    def _lookup(self, bitmaps: Dict[Hashable, np.ndarray], value: Any) -> Optional[np.ndarray]:
+        found = bitmaps.get(value)
+        if found is None and isinstance(value, str):
+            # Значения из URL/селектов приходят строками
+            for cast in (int, float):
+                try:
+                    found = bitmaps.get(cast(value))
+                except (ValueError, TypeError):
+                    continue
+                if found is not None:
+                    break
+        return found
+
+    def _any_of(self, bitmaps: Dict[Hashable, np.ndarray], values: Sequence[Any]) -> np.ndarray:
+        result = self._empty()
+        for v in values:
+            found = self._lookup(bitmaps, v)
+            if found is not None:
+                np.bitwise_or(result, found, out=result)
+        return result
+
+    def _invert(self, packed: np.ndarray) -> np.ndarray:
+        return np.bitwise_and(np.invert(packed), self._full())
+
+    def condition_mask(self, cond: Dict[str, Any]) -> np.ndarray:
+        column, op, value = cond["column"], cond["op"], cond["value"]
+        bitmaps = self.index.get(column)
+        if bitmaps is not None and op in BITMAP_OPS:
+            if op in ("is_null", "not_null"):
+                mask = self._any_of(bitmaps, [None])
+                return mask if op == "is_null" else self._invert(mask)
+            values = value if isinstance(value, list) else [value]
+            mask = self._any_of(bitmaps, values)
+            return mask if op in ("=", "==", "in") else self._invert(mask)
+
+        # Колонка без индекса или диапазонный оператор — векторное сравнение
+        arr = self.frame.col(column)
+        if op in COMPARE_OPS:
+            arr = comparable(arr)
+        if arr.dtype.kind in "iuf" and isinstance(value, str) and op != "contains":
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        with np.errstate(invalid="ignore"):
+            return np.packbits(np.asarray(FILTER_OPS[op](arr, value), dtype=bool))
+
+    def select(self, conditions: Sequence[Dict[str, Any]]) -> Frame:
+        """Строки, удовлетворяющие всем условиям (AND), как новый Frame"""
+        applicable = [c for c in conditions if c["column"] in self.frame.columns]
+        if not applicable:
+            return self.frame
+        mask = None
+        for cond in applicable:
+            m = self.condition_mask(cond)
+            mask = m if mask is None else np.bitwise_and(mask, m)
+        bits = np.unpackbits(mask, count=self.rows).astype(bool)
+        return self.frame.take(np.flatnonzero(bits))
+
+
+class DatasetCache:
+    """
+    LRU-кэш наборов данных с общим бюджетом памяти и TTL.
+    Ключ — (dashboard_id, widget_id, хэш SQL и параметров).
+    """
+
+    def __init__(self, memory_bytes: int, ttl_seconds: float, max_cardinality: int):
+        self.memory_bytes = memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_cardinality = max_cardinality
+        self._entries: "OrderedDict[Tuple, Tuple[Dataset, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.used = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "rejected": 0}
+        invalidation.index.register_cache(CACHE_NAME, self.invalidate_key)
+
+    def get(self, key: Tuple) -> Optional[Dataset]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            dataset, loaded_at = entry
+            if time.monotonic() - loaded_at > self.ttl_seconds:
+                self._drop(key)
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return dataset
+
+    def build(self, frame: Frame) -> Dataset:
+        return Dataset(frame, self.max_cardinality)
+
+    def put(self, key: Tuple, dataset: Dataset) -> bool:
+        """Положить набор в кэш; False — он больше всего бюджета"""
+        if dataset.nbytes > self.memory_bytes:
+            self.stats["rejected"] += 1
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while self._entries and self.used + dataset.nbytes > self.memory_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.stats["evictions"] += 1
+            self._entries[key] = (dataset, time.monotonic())
+            self.used += dataset.nbytes
+        return True
+
+    def _drop(self, key: Tuple) -> None:
+        dataset, _ = self._entries.pop(key)
+        self.used -= dataset.nbytes
+        invalidation.index.forget(CACHE_NAME, key)
+
+    def invalidate_key(self, key: Tuple) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+    def invalidate(self, dashboard_id: Optional[int] = None) -> int:
+        with self._lock:
+            keys = [k for k in self._entries if dashboard_id is None or k[0] == dashboard_id]
+            for k in keys:
+                self._drop(k)
+        return len(keys)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "used_bytes": self.used,
+                "memory_bytes": self.memory_bytes,
+                **self.stats,
+            }
+
+
+_cache: Optional[DatasetCache] = None
+
+
+def get_cache() -> DatasetCache:
+    global _cache
+    if _cache is None:
+        from app.config import settings
+        _cache = DatasetCache(
+            memory_bytes=settings.DATASET_CACHE_MEMORY_MB * 1024 * 1024,
+            ttl_seconds=settings.DATASET_CACHE_TTL_SECONDS,
+            max_cardinality=settings.DATASET_CACHE_BITMAP_MAX_CARDINALITY,
+        )
+    return _cache
+
+
+def load_dataset(
+    db, cache: DatasetCache, key: Tuple, sql: str, params: Dict[str, Any], max_rows: int,
+    statement_timeout: Optional[str] = None,
+) -> Tuple[Dataset, bool]:
+    """
+    Набор данных виджета из кэша или из БД. Возвращает (dataset, из_кэша).
+    statement_timeout ставится только при промахе — попадание не ходит в БД.
+    """
+    dataset = cache.get(key)
+    if dataset is not None:
+        return dataset, True
+    if statement_timeout is not None:
+        from app.api.sql_executor import set_statement_timeout
+        set_statement_timeout(db, statement_timeout)
+    since = invalidation.index.begin()
+    result = prepared.execute(db, sql, params)
+    # Числа оставляем числами — по ним дальше агрегируют transforms
+    converter = ResultConverter.for_result(result, "json")
+    rows = result.fetchmany(max_rows + 1)
+    if len(rows) > max_rows:
+        result.close()
+        raise DatasetTooLarge(f"Widget result exceeds {max_rows} rows, cross-filtering is not available")
+    started = time.perf_counter()
+    dataset = cache.build(Frame.from_rows(converter.names, converter.rows(rows)))
+    if cache.put(key, dataset):
+        # Таблицы неизвестны (volatile-функции и т.п.) — запись живёт до TTL;
+        # таблицы изменились, пока шёл запрос, — сразу убираем
+        relations = invalidation.extractor.relations(db, sql, params)
+        if relations is not None and not invalidation.index.track(CACHE_NAME, key, relations, since):
+            cache.invalidate_key(key)
+    logger.info(
+        f"Dataset cached: {key[0]}/{key[1]}, {dataset.rows} rows, {len(dataset.index)} indexed columns, "
+        f"{dataset.nbytes // 1024} KiB, built in {(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return dataset, False
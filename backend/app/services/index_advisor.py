@@ -0,0 +1,331 @@
+# backend/app/services/index_advisor.py
+# Советник индексов по журналу запросов (app/services/query_log.py).
+#
+# Для самых дорогих отпечатков журнала берётся последний образец
+# (sql, params) и выполняется EXPLAIN (FORMAT JSON) — без ANALYZE, запрос
+# не выполняется. В плане ищутся:
+#   - Seq Scan по большой таблице с Filter: колонки равенства, затем
+#     одна колонка диапазона;
+#   - Sort над Seq Scan: колонки фильтра равенства + ключи сортировки.
+# Кандидат, который уже покрыт существующим индексом (совпадают ведущие
+# колонки), отбрасывается. Выигрыш — оценка стоимости, которой не будет
+# с индексом (стоимость скана за вычетом доли отбираемых строк, стоимость
+# сортировки), умноженная на число выполнений отпечатка; одинаковые
+# кандидаты из разных запросов складываются.
+#
+# Предложения хранятся в памяти до следующего анализа; одобренные
+# создаются CREATE INDEX CONCURRENTLY в фоновом потоке.
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import engine
+from app.services import prepared, query_log
+
+logger = logging.getLogger(__name__)
+
+EQ_OPS = {"=", "= ANY"}
+RANGE_OPS = {"<", ">", "<=", ">="}
+# (колонка)::тип оператор — как PostgreSQL печатает Filter; f(колонка) не берём
+FILTER_RE = re.compile(
+    r"(?<![\w.])(?<!\w\()\(?([a-z_][a-z0-9_]*)\)?(?:::[a-z ]+(?:\[\])?)?\s*(= ANY|<=|>=|<>|=|<|>)",
+    re.IGNORECASE,
+)
+SORT_KEY_RE = re.compile(
+    r"^(?:[a-z_][a-z0-9_]*\.)?([a-z_][a-z0-9_]*)(\s+DESC)?(?:\s+NULLS\s+(?:FIRST|LAST))?$",
+    re.IGNORECASE,
+)
+
+
+def _walk(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    yield node
+    for child in node.get("Plans") or []:
+        yield from _walk(child)
+
+
+def _scan_below(node: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Seq Scan под узлом через цепочку узлов с одним потомком (Gather, Materialize...)"""
+    while True:
+        children = node.get("Plans") or []
+        if len(children) != 1:
+            return None
+        node = children[0]
+        if node.get("Node Type") == "Seq Scan":
+            return node
+
+
+def filter_columns(condition: str, columns: set) -> Tuple[List[str], List[str]]:
+    """Колонки условия: (равенства, диапазоны). Условия под OR не индексируются одним индексом."""
+    if re.search(r"\bOR\b", condition or "", re.IGNORECASE):
+        return [], []
+    eq, ranged = [], []
+    for column, op in FILTER_RE.findall(condition or ""):
+        column = column.lower()
+        if column not in columns:
+            continue
+        op = op.upper()
+        if op in EQ_OPS and column not in eq:
+            eq.append(column)
+        elif op in RANGE_OPS and column not in ranged:
+            ranged.append(column)
+    return eq, [c for c in ranged if c not in eq]
+
+
+class Candidate:
+    """Предлагаемый индекс и запросы, которые он ускорит"""
+
+    def __init__(self, table: str, columns: List[Tuple[str, bool]], reason: str):
+        self.table = table
+        self.columns = columns          # (колонка, DESC)
+        self.reason = reason
+        self.benefit = 0.0
+        self.fingerprints: Dict[str, float] = {}
+        self.status = "proposed"        # proposed / applying / applied / error
+        self.error: Optional[str] = None
+        self.index_name: Optional[str] = None
+        self.applied_ms: Optional[float] = None
+
+    @property
+    def id(self) -> str:
+        raw = json.dumps([self.table, self.columns])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+    def definition(self) -> str:
+        return ", ".join(f'"{c}"' + (" DESC" if desc else "") for c, desc in self.columns)
+
+    def name(self) -> str:
+        base = f"dash_idx_{self.table.split('.')[-1]}_" + "_".join(c for c, _ in self.columns)
+        return base if len(base) <= 63 else f"{base[:50]}_{self.id}"
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "table": self.table,
+            "columns": [c + (" DESC" if desc else "") for c, desc in self.columns],
+            "reason": self.reason,
+            "estimated_benefit": round(self.benefit, 1),
+            "fingerprints": {fp: round(b, 1) for fp, b in sorted(self.fingerprints.items(), key=lambda i: -i[1])},
+            "ddl": f"CREATE INDEX CONCURRENTLY {self.name()} ON {self.table} ({self.definition()})",
+            "status": self.status,
+            "error": self.error,
+            "applied_ms": self.applied_ms,
+        }
+
+
+class TableInfo:
+    def __init__(self, conn, relation: str):
+        row = conn.execute(
+            text(
+                "SELECT format('%I.%I', n.nspname, c.relname), c.reltuples::bigint FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "WHERE c.oid = to_regclass(:name) AND c.relkind IN ('r', 'p', 'm')"
+            ),
+            {"name": relation},
+        ).first()
+        self.exists = row is not None
+        self.name, self.rows = (row[0], max(row[1], 0)) if row else (relation, 0)
+        self.columns = set()
+        self.indexes: List[List[str]] = []
+        if not self.exists:
+            return
+        self.columns = {
+            r[0] for r in conn.execute(
+                text("SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(:name) AND attnum > 0 AND NOT attisdropped"),
+                {"name": relation},
+            )
+        }
+        self.indexes = [
+            list(r[0]) for r in conn.execute(
+                text(
+                    "SELECT array_agg(a.attname ORDER BY k.ord) FROM pg_index i "
+                    "CROSS JOIN LATERAL unnest(i.indkey) WITH ORDINALITY k(attnum, ord) "
+                    "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum "
+                    "WHERE i.indrelid = to_regclass(:name) AND i.indisvalid AND i.indpred IS NULL "
+                    "GROUP BY i.indexrelid"
+                ),
+                {"name": relation},
+            )
+        ]
+
+    def covered(self, columns: List[Tuple[str, bool]], eq_count: int) -> bool:
+        """Есть индекс с теми же ведущими колонками (равенства — в любом порядке)"""
+        wanted = [c for c, _ in columns]
+        for index in self.indexes:
+            lead = index[:len(wanted)]
+            if len(lead) < len(wanted):
+                continue
+            if set(lead[:eq_count]) == set(wanted[:eq_count]) and lead[eq_count:] == wanted[eq_count:]:
+                return True
+        return False
+
+
+def plan_candidates(plan: Dict[str, Any], tables: Dict[str, TableInfo], conn) -> List[Tuple[Candidate, float]]:
+    """Кандидаты из одного плана и выигрыш для одного выполнения"""
+    found = []
+
+    def info(relation: str) -> TableInfo:
+        if relation not in tables:
+            tables[relation] = TableInfo(conn, relation)
+        return tables[relation]
+
+    for node in _walk(plan):
+        kind = node.get("Node Type")
+        if kind == "Seq Scan" and node.get("Filter"):
+            table = info(node["Relation Name"])
+            if not table.exists or table.rows < settings.INDEX_ADVISOR_MIN_ROWS:
+                continue
+            eq, ranged = filter_columns(node["Filter"], table.columns)
+            columns = [(c, False) for c in eq] + [(c, False) for c in ranged[:1]]
+            if not columns or table.covered(columns, len(eq)):
+                continue
+            selectivity = min(1.0, node.get("Plan Rows", 0) / max(table.rows, 1))
+            if selectivity > settings.INDEX_ADVISOR_MAX_SELECTIVITY:
+                continue
+            benefit = node.get("Total Cost", 0) * (1 - selectivity)
+            found.append((Candidate(table.name, columns, f"Seq Scan with Filter: {node['Filter']}"), benefit))
+        elif kind in ("Sort", "Incremental Sort") and node.get("Sort Key"):
+            scan = _scan_below(node)
+            if scan is None:
+                continue
+            table = info(scan["Relation Name"])
+            if not table.exists or table.rows < settings.INDEX_ADVISOR_MIN_ROWS:
+                continue
+            keys = []
+            for key in node["Sort Key"]:
+                m = SORT_KEY_RE.match(key.strip())
+                if m is None or m.group(1).lower() not in table.columns:
+                    keys = []
+                    break
+                keys.append((m.group(1).lower(), bool(m.group(2))))
+            if not keys:
+                continue
+            eq, _ = filter_columns(scan.get("Filter") or "", table.columns)
+            columns = [(c, False) for c in eq if c not in {k for k, _ in keys}] + keys
+            if table.covered(columns, len(columns) - len(keys)):
+                continue
+            child = (node.get("Plans") or [{}])[0]
+            benefit = max(node.get("Total Cost", 0) - child.get("Total Cost", 0), 0) + scan.get("Total Cost", 0) * 0.5
+            found.append((Candidate(table.name, columns, f"Sort on {', '.join(node['Sort Key'])} over Seq Scan"), benefit))
+    return found
+
+
+class IndexAdvisor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.candidates: Dict[str, Candidate] = {}
+        self.analyzed_at: Optional[float] = None
+        self.last_run: Dict[str, Any] = {}
+
+    def analyze(self, limit: int) -> List[Dict[str, Any]]:
+        """EXPLAIN образцов limit самых дорогих отпечатков -> предложения по убыванию выигрыша"""
+        samples = query_log.get_log().samples(limit)
+        found: Dict[str, Candidate] = {}
+        tables: Dict[str, TableInfo] = {}
+        explained, failed = 0, 0
+        with engine.connect() as conn:
+            for summary, sql, params in samples:
+                executions = max(summary["calls"] - summary["cache_hits"], 1)
+                try:
+                    conn.execute(text("SET TRANSACTION READ ONLY"))
+                    conn.execute(text(f"SET LOCAL statement_timeout = '{settings.INDEX_ADVISOR_EXPLAIN_TIMEOUT}'"))
+                    raw = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql.strip().rstrip(';')}"), params).scalar()
+                    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+                    candidates = plan_candidates(plan, tables, conn)
+                except Exception as e:
+                    failed += 1
+                    logger.info(f"Index advisor: EXPLAIN of {summary['fingerprint']} failed: {e}")
+                    continue
+                finally:
+                    conn.rollback()
+                explained += 1
+                for candidate, benefit in candidates:
+                    existing = found.setdefault(candidate.id, candidate)
+                    weighted = benefit * executions
+                    existing.benefit += weighted
+                    existing.fingerprints[summary["fingerprint"]] = existing.fingerprints.get(summary["fingerprint"], 0) + weighted
+        with self._lock:
+            # Уже применённые и применяемые остаются видны
+            for cid, old in self.candidates.items():
+                if old.status != "proposed":
+                    found[cid] = old
+            self.candidates = found
+            self.analyzed_at = time.time()
+            self.last_run = {"fingerprints": len(samples), "explained": explained, "failed": failed}
+        return self.proposals()
+
+    def proposals(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = sorted(self.candidates.values(), key=lambda c: c.benefit, reverse=True)
+        return [c.describe() for c in items]
+
+    def get(self, candidate_id: str) -> Optional[Candidate]:
+        with self._lock:
+            return self.candidates.get(candidate_id)
+
+    def apply(self, candidate_id: str) -> Candidate:
+        """Создать индекс в фоне; статус — в предложениях"""
+        with self._lock:
+            candidate = self.candidates.get(candidate_id)
+            if candidate is None:
+                raise KeyError(candidate_id)
+            if candidate.status in ("applying", "applied"):
+                return candidate
+            candidate.status, candidate.error = "applying", None
+        threading.Thread(
+            target=self._create, args=(candidate,), name=f"index-advisor-{candidate.id}", daemon=True
+        ).start()
+        return candidate
+
+    def _create(self, candidate: Candidate) -> None:
+        name = candidate.name()
+        started = time.perf_counter()
+        # CONCURRENTLY не работает внутри транзакции
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            try:
+                conn.exec_driver_sql(f"SET statement_timeout = '{settings.INDEX_ADVISOR_CREATE_TIMEOUT}'")
+                conn.exec_driver_sql(
+                    f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON {candidate.table} ({candidate.definition()})',
+                    execution_options={"no_parameters": True},
+                )
+            except Exception as e:
+                candidate.status, candidate.error = "error", str(e)
+                logger.warning(f"Index advisor: CREATE INDEX {name} failed: {e}")
+                # Прерванный CONCURRENTLY оставляет INVALID индекс
+                try:
+                    conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+                except Exception:
+                    pass
+                return
+            finally:
+                # Соединение возвращается в пул — таймаут сессии не оставляем
+                conn.exec_driver_sql("RESET statement_timeout")
+        candidate.status, candidate.index_name = "applied", name
+        prepared.invalidate()
+        candidate.applied_ms = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Index advisor: created {name} on {candidate.table} in {candidate.applied_ms} ms")
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"proposals": len(self.candidates), "analyzed_at": self.analyzed_at, **self.last_run}
+
+
+_advisor: Optional[IndexAdvisor] = None
+_advisor_lock = threading.Lock()
+
+
+def get_advisor() -> IndexAdvisor:
+    global _advisor
+    if _advisor is None:
+        with _advisor_lock:
+            if _advisor is None:
+                _advisor = IndexAdvisor()
+    return _advisor
+
@@ -0,0 +1,423 @@
+# backend/app/services/invalidation.py
+# Инвалидация кэшей по изменению таблиц.
+#
+# Для каждого закэшированного запроса запоминается набор таблиц, которые
+# он читает (EXPLAIN (VERBOSE, FORMAT JSON) — представления раскрываются
+# до базовых таблиц). Об изменениях узнаём двумя путями:
+#   - NOTIFY из statement-level триггеров (install_triggers), слушает
+#     отдельное соединение с LISTEN;
+#   - опрос счётчиков n_tup_ins/upd/del в pg_stat_user_tables — для
+#     таблиц без триггеров (и как страховка, если LISTEN отвалился).
+# Из кэшей удаляются только записи, зависящие от изменённых таблиц.
+
+from collections import OrderedDict
+from typing import Callable, Dict, FrozenSet, Hashable, Iterable, List, Optional, Set, Tuple
+import hashlib
+import json
+import logging
+import re
+import select
+import threading
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import engine
+from app.services import sql_analysis
+
+logger = logging.getLogger(__name__)
+
+TRIGGER_NAME = "dash_notify_change"
+FUNCTION_NAME = "dash_notify_change"
+
+# Функции в FROM, которые не читают таблиц (остальные Function Scan — не кэшируем)
+SAFE_TABLE_FUNCTIONS = {
+    "generate_series", "unnest", "json_array_elements", "jsonb_array_elements",
+    "json_array_elements_text", "jsonb_array_elements_text", "json_each", "jsonb_each",
+    "json_each_text", "jsonb_each_text", "json_to_recordset", "jsonb_to_recordset",
+    "regexp_matches", "regexp_split_to_table", "string_to_table",
+}
+
+EXPLAIN_CACHE_SIZE = 1024
+
+
+def _plan_relations(node: dict, out: Set[str]) -> bool:
+    """Собрать schema.table из узлов плана; False — план нельзя кэшировать"""
+    ok = True
+    if node.get("Relation Name"):
+        schema = node.get("Schema") or "public"
+        out.add(f"{schema}.{node['Relation Name']}".lower())
+    if node.get("Node Type") in ("ModifyTable", "LockRows"):
+        # WITH ... DELETE/UPDATE, SELECT ... FOR UPDATE
+        ok = False
+    if node.get("Node Type") == "Function Scan":
+        name = str(node.get("Function Name") or "").lower()
+        if name not in SAFE_TABLE_FUNCTIONS:
+            ok = False
+    for child in node.get("Plans") or []:
+        ok = _plan_relations(child, out) and ok
+    return ok
+
+
+class RelationExtractor:
+    """Набор таблиц запроса через EXPLAIN; кэшируется по тексту SQL"""
+
+    def __init__(self, size: int = EXPLAIN_CACHE_SIZE):
+        self.size = size
+        self._cache: "OrderedDict[str, Optional[FrozenSet[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def relations(self, conn, sql: str, params: dict) -> Optional[FrozenSet[str]]:
+        """frozenset таблиц или None, если запрос нельзя кэшировать"""
+        # Результат зависит не только от данных — такие запросы не кэшируются
+        if sql_analysis.analyze(sql).volatile:
+            return None
+        digest = hashlib.sha1(sql.encode("utf-8")).hexdigest()
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return self._cache[digest]
+        try:
+            # Savepoint: неудачный EXPLAIN не должен ломать транзакцию вызывающего
+            with conn.begin_nested():
+                plan = conn.execute(text(f"EXPLAIN (VERBOSE, FORMAT JSON) {sql}"), params).scalar()
+        except Exception as e:
+            logger.debug(f"EXPLAIN failed, query will not be cached: {e}")
+            return None
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        found: Set[str] = set()
+        ok = all(_plan_relations(p.get("Plan") or {}, found) for p in plan or [])
+        result = frozenset(found) if ok else None
+        with self._lock:
+            self._cache[digest] = result
+            if len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+        return result
+
+
+class DependencyIndex:
+    """
+    Таблица -> записи кэшей, которые от неё зависят. Кэши регистрируют
+    функцию удаления записи; при изменении таблицы она вызывается для
+    всех зависимых ключей.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._evictors: Dict[str, Callable[[Hashable], None]] = {}
+        self._by_relation: Dict[str, Set[Tuple[str, Hashable]]] = {}
+        self._entries: Dict[Tuple[str, Hashable], FrozenSet[str]] = {}
+        # Номер последнего изменения таблицы — чтобы не положить в кэш
+        # результат, который устарел, пока запрос выполнялся
+        self._seq = 0
+        self._changed_at: Dict[str, int] = {}
+        self._cleared_at = -1
+        self.stats = {"changes": 0, "evicted": 0, "skipped_stale": 0}
+
+    def register_cache(self, name: str, evict: Callable[[Hashable], None]) -> None:
+        self._evictors[name] = evict
+
+    def begin(self) -> int:
+        """Отметка перед выполнением запроса, передаётся в track(since=...)"""
+        with self._lock:
+            return self._seq
+
+    def track(self, cache: str, key: Hashable, relations: Iterable[str], since: int) -> bool:
+        """Запомнить зависимости записи. False — таблицы менялись после since, не кэшировать."""
+        relations = frozenset(relations)
+        with self._lock:
+            if self._cleared_at > since or any(self._changed_at.get(r, -1) > since for r in relations):
+                self.stats["skipped_stale"] += 1
+                return False
+            self._forget_locked((cache, key))
+            self._entries[(cache, key)] = relations
+            for r in relations:
+                self._by_relation.setdefault(r, set()).add((cache, key))
+        return True
+
+    def forget(self, cache: str, key: Hashable) -> None:
+        with self._lock:
+            self._forget_locked((cache, key))
+
+    def _forget_locked(self, entry: Tuple[str, Hashable]) -> None:
+        relations = self._entries.pop(entry, None)
+        for r in relations or ():
+            dependents = self._by_relation.get(r)
+            if dependents is not None:
+                dependents.discard(entry)
+                if not dependents:
+                    del self._by_relation[r]
+
+    def tracked_relations(self) -> List[str]:
+        with self._lock:
+            return list(self._by_relation)
+
+    def relations_changed(self, relations: Iterable[str]) -> int:
+        relations = [r.lower() for r in relations]
+        victims: Set[Tuple[str, Hashable]] = set()
+        with self._lock:
+            self._seq += 1
+            for r in relations:
+                self._changed_at[r] = self._seq
+                victims |= self._by_relation.get(r, set())
+            for entry in victims:
+                self._forget_locked(entry)
+            self.stats["changes"] += 1
+            self.stats["evicted"] += len(victims)
+        # Удаление из кэшей — вне блокировки (кэш зовёт forget при вытеснении)
+        for cache, key in victims:
+            evict = self._evictors.get(cache)
+            if evict is not None:
+                evict(key)
+        if victims:
+            logger.info(f"Cache invalidation: {sorted(relations)} changed, {len(victims)} entries evicted")
+        return len(victims)
+
+    def clear(self) -> None:
+        """Всё сбросить (после DDL/DML в обход триггеров через /api/sql/execute)"""
+        with self._lock:
+            victims = list(self._entries)
+            self._seq += 1
+            self._cleared_at = self._seq
+            self._entries.clear()
+            self._by_relation.clear()
+        for cache, key in victims:
+            evict = self._evictors.get(cache)
+            if evict is not None:
+                evict(key)
+
+
+# ========================================
+# Источники изменений
+# ========================================
+
+def _channel(channel: Optional[str] = None) -> str:
+    channel = channel or settings.CACHE_NOTIFY_CHANNEL
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", channel):
+        raise ValueError(f"Invalid NOTIFY channel: {channel!r}")
+    return channel
+
+
+# Другие каналы на том же LISTEN-соединении: канал -> (on_notify(payload), on_reset())
+_subscribers: Dict[str, Tuple[Callable[[str], None], Callable[[], None]]] = {}
+
+
+def subscribe(channel: str, on_notify: Callable[[str], None], on_reset: Callable[[], None]) -> None:
+    """
+    Получать NOTIFY канала; on_reset вызывается после разрыва LISTEN
+    (уведомления могли быть пропущены)
+    """
+    _subscribers[_channel(channel)] = (on_notify, on_reset)
+
+
+def _quote_relation(conn, relation: str) -> str:
+    """schema.table -> безопасно заквотированное имя существующей таблицы"""
+    quoted = conn.execute(
+        text(
+            "SELECT format('%I.%I', n.nspname, c.relname) FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.oid = to_regclass(:name) AND c.relkind IN ('r', 'p')"
+        ),
+        {"name": relation},
+    ).scalar()
+    if quoted is None:
+        raise ValueError(f"Table not found: {relation}")
+    return quoted
+
+
+def install_triggers(conn, relations: Iterable[str]) -> List[str]:
+    """Statement-level триггеры INSERT/UPDATE/DELETE/TRUNCATE -> pg_notify"""
+    channel = _channel()
+    conn.execute(text(
+        f"CREATE OR REPLACE FUNCTION {FUNCTION_NAME}() RETURNS trigger LANGUAGE plpgsql AS $fn$\n"
+        f"BEGIN\n"
+        f"  PERFORM pg_notify('{channel}', lower(TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME));\n"
+        f"  RETURN NULL;\n"
+        f"END\n$fn$"
+    ))
+    installed = []
+    for relation in relations:
+        quoted = _quote_relation(conn, relation)
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON {quoted}"))
+        conn.execute(text(
+            f"CREATE TRIGGER {TRIGGER_NAME} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {quoted} "
+            f"FOR EACH STATEMENT EXECUTE FUNCTION {FUNCTION_NAME}()"
+        ))
+        installed.append(relation)
+    return installed
+
+
+def drop_triggers(conn, relations: Iterable[str]) -> List[str]:
+    dropped = []
+    for relation in relations:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {TRIGGER_NAME} ON {_quote_relation(conn, relation)}"))
+        dropped.append(relation)
+    return dropped
+
+
+def list_triggers(conn) -> List[str]:
+    rows = conn.execute(
+        text(
+            "SELECT lower(n.nspname || '.' || c.relname) FROM pg_trigger t "
+            "JOIN pg_class c ON c.oid = t.tgrelid JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE t.tgname = :name ORDER BY 1"
+        ),
+        {"name": TRIGGER_NAME},
+    )
+    return [r[0] for r in rows]
+
+
+class NotifyListener(threading.Thread):
+    """LISTEN на отдельном (не из пула) соединении"""
+
+    def __init__(self, index: DependencyIndex, stop: threading.Event):
+        super().__init__(name="cache-notify", daemon=True)
+        self.index = index
+        self.stop_event = stop
+        self.connected = False
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                self.connected = False
+                logger.warning(f"Cache NOTIFY listener error: {e}; reconnecting")
+                # Пока были отключены, могли пропустить изменения
+                self.index.clear()
+                for _, on_reset in _subscribers.values():
+                    on_reset()
+                self.stop_event.wait(5)
+
+    def _listen(self) -> None:
+        raw = engine.raw_connection()
+        raw.detach()
+        conn = raw.driver_connection
+        try:
+            conn.autocommit = True
+            channel = _channel()
+            with conn.cursor() as cur:
+                for name in (channel, *_subscribers):
+                    cur.execute(f"LISTEN {name}")
+            self.connected = True
+            while not self.stop_event.is_set():
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+                conn.poll()
+                changed = set()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    if notify.channel == channel:
+                        changed.add(notify.payload)
+                    elif notify.channel in _subscribers:
+                        _subscribers[notify.channel][0](notify.payload)
+                if changed:
+                    self.index.relations_changed(changed)
+        finally:
+            self.connected = False
+            conn.close()
+
+
+class StatsPoller(threading.Thread):
+    """
+    Опрос n_tup_ins/upd/del отслеживаемых таблиц в pg_stat_user_tables.
+    Базовые значения снимаются по всем таблицам при старте, до того как
+    что-либо закэшировано; таблица без базового значения (создана позже
+    или снимок не удался) при первом опросе считается изменённой.
+    Счётчики переживают перезапуск опроса (start() передаёт их новому).
+    """
+
+    def __init__(self, index: DependencyIndex, stop: threading.Event, interval: float,
+                 counters: Optional[Dict[str, int]] = None):
+        super().__init__(name="cache-stats-poller", daemon=True)
+        self.index = index
+        self.stop_event = stop
+        self.interval = interval
+        self.counters: Dict[str, int] = counters if counters is not None else {}
+
+    def _counters(self, names: Optional[List[str]] = None) -> List[Tuple[str, int]]:
+        sql = ("SELECT lower(schemaname || '.' || relname), n_tup_ins + n_tup_upd + n_tup_del "
+               "FROM pg_stat_user_tables")
+        with engine.connect() as conn:
+            if names is None:
+                return conn.execute(text(sql)).fetchall()
+            return conn.execute(
+                text(sql + " WHERE lower(schemaname || '.' || relname) = ANY(:names)"), {"names": names}
+            ).fetchall()
+
+    def baseline(self) -> None:
+        """Снимок счётчиков всех таблиц (уже известные не перезаписываются)"""
+        try:
+            for name, counter in self._counters():
+                self.counters.setdefault(name, counter)
+        except Exception as e:
+            logger.warning(f"Cache stats poller: baseline failed, tables will be invalidated on first poll: {e}")
+
+    def poll_once(self) -> List[str]:
+        relations = self.index.tracked_relations()
+        if not relations:
+            return []
+        changed = []
+        for name, counter in self._counters(relations):
+            previous = self.counters.get(name)
+            self.counters[name] = counter
+            if counter != previous:
+                changed.append(name)
+        return changed
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                changed = self.poll_once()
+                if changed:
+                    self.index.relations_changed(changed)
+            except Exception as e:
+                logger.warning(f"Cache stats poller error: {e}")
+
+
+# ========================================
+# Модуль целиком
+# ========================================
+
+index = DependencyIndex()
+extractor = RelationExtractor()
+
+_stop = threading.Event()
+_listener: Optional[NotifyListener] = None
+_poller: Optional[StatsPoller] = None
+
+
+def start() -> None:
+    global _listener, _poller
+    _stop.clear()
+    if _listener is None or not _listener.is_alive():
+        _listener = NotifyListener(index, _stop)
+        _listener.start()
+    if settings.CACHE_STATS_POLL_SECONDS > 0 and (_poller is None or not _poller.is_alive()):
+        _poller = StatsPoller(index, _stop, settings.CACHE_STATS_POLL_SECONDS,
+                              _poller.counters if _poller is not None else None)
+        # До первого запроса: записи, которые появятся в кэше, сравниваются с этим снимком
+        _poller.baseline()
+        _poller.start()
+
+
+def stop() -> None:
+    _stop.set()
+
+
+def info() -> dict:
+    return {
+        "listening": bool(_listener and _listener.connected),
+        "polling": bool(_poller and _poller.is_alive()),
+        "tracked_relations": len(index.tracked_relations()),
+        **index.stats,
+    }
+
+
+def track_query(cache: str, key: Hashable, conn, sql: str, params: dict, since: int) -> bool:
+    """Запомнить зависимости результата; False — кэшировать нельзя"""
+    relations = extractor.relations(conn, sql, params)
+    if relations is None:
+        return False
+    return index.track(cache, key, relations, since)
@@ -0,0 +1,241 @@
+# backend/app/services/jobs.py
+# Очередь фоновых запросов: тяжёлые SELECT из /api/sql/execute не держат
+# HTTP-соединение, а выполняются пулом JOB_WORKERS; клиент опрашивает
+# /api/jobs/{id} и забирает готовый результат.
+#
+# Задания живут в памяти процесса: результат хранится JOB_RESULT_TTL_SECONDS
+# после завершения (и не дольше, чем позволяет JOB_RESULTS_MEMORY_MB —
+# дальше вытесняются самые старые). Отмена запущенного задания —
+# pg_cancel_backend по pid соединения, на котором оно выполняется.
+#
+# Долгие виды заданий (массовая загрузка) выполняются своим пулом потоков
+# с отдельным числом воркеров и не занимают воркеры SQL-заданий; статус и
+# отмена — через ту же очередь.
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import threading
+import time
+import uuid
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, ERROR, CANCELLED = "queued", "running", "done", "error", "cancelled"
+
+
+class JobCancelled(Exception):
+    """Задание отменено до или во время выполнения"""
+
+
+class Job:
+    def __init__(self, owner_id: int, kind: str, description: str, meta: Optional[Dict[str, Any]] = None):
+        self.id = uuid.uuid4().hex
+        self.owner_id = owner_id
+        self.kind = kind
+        self.description = description
+        self.meta = meta or {}
+        self.status = QUEUED
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.finished_mono: Optional[float] = None
+        self.result: Optional[bytes] = None
+        self.error: Optional[str] = None
+        self.backend_pid: Optional[int] = None
+        self.future: Optional[Future] = None
+        self.cleanup: Optional[Callable[[], None]] = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "description": self.description,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_ms": round(((self.finished_at or datetime.now(timezone.utc)) - (self.started_at or self.created_at)).total_seconds() * 1000, 1),
+            "result_bytes": len(self.result) if self.result is not None else None,
+            "error": self.error,
+            **self.meta,
+        }
+
+
+class JobContext:
+    """Передаётся функции задания: сессия БД с запомненным pid для отмены"""
+
+    def __init__(self, job: Job):
+        self.job = job
+
+    def session(self, factory: Callable = SessionLocal):
+        db = factory()
+        try:
+            self.job.backend_pid = db.execute(text("SELECT pg_backend_pid()")).scalar()
+        except Exception:
+            self.job.backend_pid = None
+        if self.job.status == CANCELLED:
+            db.close()
+            raise JobCancelled(self.job.id)
+        return db
+
+
+class JobQueue:
+    def __init__(self, workers: int, max_queued: int, memory_bytes: int, ttl: float,
+                 pools: Optional[Dict[str, int]] = None):
+        self.max_queued = max_queued
+        self.memory_bytes = memory_bytes
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sql-job")
+        # kind -> свой пул: такие задания не ждут и не занимают воркеры остальных
+        self._pools = {
+            kind: ThreadPoolExecutor(max_workers=max(1, n), thread_name_prefix=f"{kind}-job")
+            for kind, n in (pools or {}).items()
+        }
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "done": 0, "errors": 0, "cancelled": 0, "rejected": 0, "expired": 0}
+
+    def submit(self, owner_id: int, kind: str, description: str, fn: Callable[[JobContext], bytes],
+               meta: Optional[Dict[str, Any]] = None, cleanup: Optional[Callable[[], None]] = None) -> Job:
+        """
+        fn(ctx) -> готовое тело ответа (JSON). OverflowError, если очередь полна.
+        cleanup вызывается один раз по завершении задания, в том числе если
+        оно отменено или остановлено до запуска (освобождение файлов и т.п.).
+        """
+        self._expire()
+        with self._lock:
+            queued = sum(1 for j in self._jobs.values() if j.status == QUEUED)
+            if queued >= self.max_queued:
+                self.stats["rejected"] += 1
+                raise OverflowError(f"Job queue is full ({queued} queued)")
+            job = Job(owner_id, kind, description, meta)
+            job.cleanup = cleanup
+            self._jobs[job.id] = job
+            self.stats["submitted"] += 1
+        job.future = self._pools.get(kind, self._executor).submit(self._run, job, fn)
+        if cleanup is not None:
+            job.future.add_done_callback(lambda _: self._cleanup(job))
+        return job
+
+    @staticmethod
+    def _cleanup(job: Job) -> None:
+        cleanup, job.cleanup = job.cleanup, None
+        if cleanup is not None:
+            try:
+                cleanup()
+            except Exception as e:
+                logger.warning(f"Job {job.id} cleanup failed: {e}")
+
+    def _run(self, job: Job, fn: Callable[[JobContext], bytes]) -> None:
+        if job.status == CANCELLED:
+            return
+        job.status, job.started_at = RUNNING, datetime.now(timezone.utc)
+        try:
+            job.result = fn(JobContext(job))
+            job.status = DONE
+            self.stats["done"] += 1
+        except Exception as e:
+            if job.status == CANCELLED or isinstance(e, JobCancelled):
+                job.status = CANCELLED
+            else:
+                job.status, job.error = ERROR, str(e)
+                self.stats["errors"] += 1
+                logger.warning(f"Job {job.id} ({job.kind}) failed: {e}")
+        finally:
+            job.backend_pid = None
+            job.finished_at = datetime.now(timezone.utc)
+            job.finished_mono = time.monotonic()
+        self._expire()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._expire()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, owner_id: Optional[int] = None) -> List[Job]:
+        self._expire()
+        with self._lock:
+            jobs = [j for j in self._jobs.values() if owner_id is None or j.owner_id == owner_id]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job: Job) -> bool:
+        if job.status not in (QUEUED, RUNNING):
+            return False
+        pid = job.backend_pid
+        job.status = CANCELLED
+        self.stats["cancelled"] += 1
+        if job.future is not None:
+            job.future.cancel()
+        if pid is not None:
+            db = SessionLocal()
+            try:
+                db.execute(text("SELECT pg_cancel_backend(:pid)"), {"pid": pid})
+            except Exception as e:
+                logger.warning(f"Job {job.id}: pg_cancel_backend({pid}) failed: {e}")
+            finally:
+                db.close()
+        if job.finished_at is None and job.future is not None and job.future.cancelled():
+            job.finished_at, job.finished_mono = datetime.now(timezone.utc), time.monotonic()
+        return True
+
+    def remove(self, job: Job) -> None:
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def _expire(self) -> None:
+        """Завершённые задания старше TTL; при нехватке памяти — самые старые результаты"""
+        now = time.monotonic()
+        with self._lock:
+            finished = sorted(
+                (j for j in self._jobs.values() if j.finished_mono is not None),
+                key=lambda j: j.finished_mono,
+            )
+            used = sum(len(j.result) for j in finished if j.result is not None)
+            for job in finished:
+                if now - job.finished_mono > self.ttl or used > self.memory_bytes:
+                    used -= len(job.result) if job.result is not None else 0
+                    del self._jobs[job.id]
+                    self.stats["expired"] += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            by_status: Dict[str, int] = {}
+            for job in self._jobs.values():
+                by_status[job.status] = by_status.get(job.status, 0) + 1
+            memory = sum(len(j.result) for j in self._jobs.values() if j.result is not None)
+        return {"jobs": by_status, "memory_mb": round(memory / 2**20, 2), **self.stats}
+
+    def shutdown(self) -> None:
+        for executor in (self._executor, *self._pools.values()):
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_queue() -> JobQueue:
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue(
+                    settings.JOB_WORKERS,
+                    settings.JOB_MAX_QUEUED,
+                    settings.JOB_RESULTS_MEMORY_MB * 2**20,
+                    settings.JOB_RESULT_TTL_SECONDS,
+                    pools={"import": settings.IMPORT_WORKERS},
+                )
+    return _queue
+
+
+def shutdown() -> None:
+    if _queue is not None:
+        _queue.shutdown()
@@ -0,0 +1,421 @@
+# backend/app/services/matviews.py
+# Управляемые материализованные представления для тяжёлых запросов
+# виджетов (многотабличные агрегаты по эскроу-таблицам).
+#
+# SQL виджета (или источника config.sources) с его текущими значениями
+# параметров превращается в MATERIALIZED VIEW с уникальным индексом.
+# Запрос с тем же текстом и теми же параметрами дальше прозрачно читает
+# представление (rewrite) — и из /api/sql/execute, и при рендере
+# дашборда. Порядок строк исходного запроса сохраняется колонкой
+# __mv_row.
+#
+# Обновление — REFRESH MATERIALIZED VIEW CONCURRENTLY (чтение не
+# блокируется) по расписанию и/или при изменении таблиц, которые читает
+# запрос (через app.services.invalidation). Между процессами обновление
+# одного представления разграничено advisory-блокировкой.
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+import json
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.models.materialized_view import MaterializedView
+from app.services import invalidation, prepared
+from app.services.single_flight import flight_key
+
+logger = logging.getLogger(__name__)
+
+CACHE_NAME = "materialized_views"
+VIEW_PREFIX = "dash_mv_"
+ROW_COLUMN = "__mv_row"
+
+
+class MatviewError(ValueError):
+    """Запрос нельзя материализовать"""
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def qualified(name: str) -> str:
+    return f"{_ident(settings.MATVIEW_SCHEMA)}.{_ident(name)}"
+
+
+def relation_name(name: str) -> str:
+    """schema.view в том виде, в каком его видит app.services.invalidation"""
+    return f"{settings.MATVIEW_SCHEMA}.{name}".lower()
+
+
+def view_name(dashboard_id: int, target: str) -> str:
+    slug = re.sub(r"[^a-z0-9_]+", "_", target.lower()).strip("_") or "widget"
+    return f"{VIEW_PREFIX}{dashboard_id}_{slug}"[:63]
+
+
+def view_key(sql: str, params: Dict[str, Any]) -> str:
+    """Ключ сопоставления запроса с представлением: нормализованный SQL + параметры"""
+    return flight_key(sql.strip().rstrip(";"), params)
+
+
+def bind_literals(sql: str, params: Dict[str, Any]) -> str:
+    """SQL с подставленными литералами вместо bind-параметров (в VIEW их не передать)"""
+    dialect = postgresql.dialect(paramstyle="named")
+    clause = text(sql.strip().rstrip(";"))
+    names = list(clause.compile(dialect=dialect).params)
+    try:
+        bound = clause.bindparams(**{n: params.get(n) for n in names})
+        return str(bound.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    except Exception as e:
+        raise MatviewError(f"Cannot inline query parameters: {e}")
+
+
+def _raw(conn, sql: str):
+    # Литералы уже подставлены: ни :name, ни % больше не разбираются
+    return conn.exec_driver_sql(sql, execution_options={"no_parameters": True})
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def age_seconds(mv: MaterializedView) -> Optional[float]:
+    if mv.last_refreshed_at is None:
+        return None
+    refreshed = mv.last_refreshed_at
+    if refreshed.tzinfo is None:
+        refreshed = refreshed.replace(tzinfo=timezone.utc)
+    return (_utcnow() - refreshed).total_seconds()
+
+
+class ViewRegistry:
+    """
+    Представления в памяти процесса: ключ запроса -> SQL чтения из
+    представления, и «грязные» представления (таблицы запроса менялись
+    после последнего обновления).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_query: Dict[str, str] = {}
+        self._tracked: set = set()
+        self.dirty: set = set()
+        self.stats = {"rewrites": 0, "refreshes": 0, "refresh_errors": 0, "skipped_locked": 0}
+        invalidation.index.register_cache(CACHE_NAME, self._changed)
+
+    def _changed(self, name: Hashable) -> None:
+        with self._lock:
+            self._tracked.discard(name)
+            self.dirty.add(name)
+
+    def load(self, views: Sequence[MaterializedView]) -> None:
+        by_query = {}
+        for mv in views:
+            columns = ", ".join(_ident(c) for c in json.loads(mv.columns or "[]"))
+            by_query[view_key(mv.source_sql, json.loads(mv.params or "{}"))] = (
+                f"SELECT {columns} FROM {qualified(mv.name)} ORDER BY {ROW_COLUMN}"
+            )
+        with self._lock:
+            self._by_query = by_query
+
+    def rewrite(self, sql: str, params: Dict[str, Any]) -> Optional[str]:
+        if not self._by_query:
+            return None
+        rewritten = self._by_query.get(view_key(sql, params))
+        if rewritten is not None:
+            self.stats["rewrites"] += 1
+        return rewritten
+
+    def track(self, conn, mv: MaterializedView, since: int) -> None:
+        """Связать представление с таблицами запроса: их изменение пометит его грязным"""
+        relations = invalidation.extractor.relations(conn, mv.source_sql, json.loads(mv.params or "{}"))
+        if relations is None:
+            return
+        with self._lock:
+            self._tracked.add(mv.name)
+        if not invalidation.index.track(CACHE_NAME, mv.name, relations, since):
+            self._changed(mv.name)
+
+    def is_tracked(self, name: str) -> bool:
+        with self._lock:
+            return name in self._tracked
+
+    def take_dirty(self, name: str) -> None:
+        with self._lock:
+            self.dirty.discard(name)
+
+    def forget(self, name: str) -> None:
+        invalidation.index.forget(CACHE_NAME, name)
+        with self._lock:
+            self._tracked.discard(name)
+            self.dirty.discard(name)
+
+
+registry = ViewRegistry()
+
+
+def rewrite(sql: str, params: Dict[str, Any]) -> Optional[str]:
+    """SQL чтения из представления, если запрос материализован с такими параметрами"""
+    return registry.rewrite(sql, params)
+
+
+def load_views() -> List[MaterializedView]:
+    db = SessionLocal()
+    try:
+        return db.query(MaterializedView).order_by(MaterializedView.id).all()
+    finally:
+        db.close()
+
+
+def reload() -> None:
+    registry.load(load_views())
+
+
+# ========================================
+# Создание, удаление, обновление
+# ========================================
+
+def create_view(
+    db,
+    dashboard_id: int,
+    sql: str,
+    params: Dict[str, Any],
+    widget_id: Optional[str] = None,
+    source_name: Optional[str] = None,
+    unique_key: Optional[List[str]] = None,
+    refresh_interval_seconds: Optional[int] = None,
+    refresh_on_change: bool = True,
+    created_by: Optional[int] = None,
+) -> MaterializedView:
+    """
+    CREATE MATERIALIZED VIEW + уникальный индекс + запись в
+    materialized_views. Коммит — за вызывающим.
+    """
+    name = view_name(dashboard_id, widget_id or f"source_{source_name}")
+    if db.query(MaterializedView).filter(MaterializedView.name == name).first() is not None:
+        raise MatviewError(f"Already materialized as {name}")
+    literal = bind_literals(sql, params)
+    target = qualified(name)
+
+    conn = db.connection()
+    started = time.perf_counter()
+    conn.execute(text(f"SET LOCAL statement_timeout = '{settings.MATVIEW_REFRESH_TIMEOUT}'"))
+    _raw(
+        conn,
+        f"CREATE MATERIALIZED VIEW {target} AS "
+        f"SELECT row_number() OVER () AS {ROW_COLUMN}, src.* FROM ({literal}) AS src WITH DATA"
+    )
+    columns = [c for c in _raw(conn, f"SELECT * FROM {target} LIMIT 0").keys() if c != ROW_COLUMN]
+    key = list(unique_key or [ROW_COLUMN])
+    missing = [c for c in key if c != ROW_COLUMN and c not in columns]
+    if missing:
+        raise MatviewError(f"unique_key columns not in result: {missing}")
+    try:
+        # CONCURRENTLY требует уникальный индекс по колонкам (без WHERE и выражений)
+        _raw(
+            conn,
+            f"CREATE UNIQUE INDEX {_ident(name[:59] + '_key')} ON {target} ({', '.join(_ident(c) for c in key)})"
+        )
+    except Exception as e:
+        raise MatviewError(f"unique_key {key} is not unique in the result: {e}")
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    mv = MaterializedView(
+        name=name,
+        dashboard_id=dashboard_id,
+        widget_id=widget_id,
+        source_name=source_name,
+        source_sql=sql.strip().rstrip(";"),
+        params=json.dumps(params, sort_keys=True, default=str),
+        columns=json.dumps(columns),
+        unique_key=json.dumps(key),
+        refresh_interval_seconds=refresh_interval_seconds,
+        refresh_on_change=refresh_on_change,
+        status="ready",
+        last_refreshed_at=_utcnow(),
+        last_refresh_ms=round(elapsed_ms, 1),
+        refresh_count=0,
+        created_by=created_by,
+    )
+    db.add(mv)
+    db.flush()
+    prepared.invalidate()
+    logger.info(f"Materialized view {name} created for dashboard {dashboard_id} in {elapsed_ms:.0f} ms")
+    return mv
+
+
+def activate(mv: MaterializedView) -> None:
+    """После коммита создания: начать подменять запросы и следить за таблицами"""
+    reload()
+    if mv.refresh_on_change:
+        try:
+            with engine.connect() as conn:
+                registry.track(conn, mv, invalidation.index.begin())
+                conn.rollback()
+        except Exception as e:
+            logger.warning(f"Materialized view {mv.name}: dependency tracking failed: {e}")
+
+
+def drop_view(db, mv: MaterializedView) -> None:
+    """DROP MATERIALIZED VIEW + удаление записи. Коммит — за вызывающим."""
+    _raw(db.connection(), f"DROP MATERIALIZED VIEW IF EXISTS {qualified(mv.name)}")
+    db.delete(mv)
+    prepared.invalidate()
+
+
+def deactivate(name: str) -> None:
+    """После коммита удаления: запросы снова идут в исходные таблицы"""
+    registry.forget(name)
+    reload()
+    invalidation.index.relations_changed([relation_name(name)])
+
+
+def refresh_view(view_id: int) -> Dict[str, Any]:
+    """
+    REFRESH MATERIALIZED VIEW CONCURRENTLY на отдельном соединении.
+    Если то же представление обновляет другой процесс — пропуск.
+    """
+    db = SessionLocal()
+    try:
+        mv = db.query(MaterializedView).filter(MaterializedView.id == view_id).first()
+        if mv is None:
+            raise MatviewError(f"Materialized view {view_id} not found")
+        with engine.connect() as conn:
+            locked = conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": mv.name}).scalar()
+            conn.commit()
+            if not locked:
+                registry.stats["skipped_locked"] += 1
+                return {"name": mv.name, "skipped": True}
+            try:
+                since = invalidation.index.begin()
+                registry.take_dirty(mv.name)
+                started = time.perf_counter()
+                try:
+                    conn.execute(text(f"SET LOCAL statement_timeout = '{settings.MATVIEW_REFRESH_TIMEOUT}'"))
+                    _raw(conn, f"REFRESH MATERIALIZED VIEW CONCURRENTLY {qualified(mv.name)}")
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    registry.stats["refresh_errors"] += 1
+                    mv.status, mv.last_error = "error", str(e)
+                    db.commit()
+                    logger.warning(f"Materialized view {mv.name} refresh failed: {e}")
+                    return {"name": mv.name, "refreshed": False, "error": str(e)}
+                elapsed_ms = (time.perf_counter() - started) * 1000
+
+                registry.stats["refreshes"] += 1
+                mv.status, mv.last_error = "ready", None
+                mv.last_refreshed_at = _utcnow()
+                mv.last_refresh_ms = round(elapsed_ms, 1)
+                mv.refresh_count = (mv.refresh_count or 0) + 1
+                db.commit()
+                # Кэши результатов, читавших представление, устарели
+                invalidation.index.relations_changed([relation_name(mv.name)])
+                if mv.refresh_on_change:
+                    registry.track(conn, mv, since)
+                    conn.rollback()
+                logger.info(f"Materialized view {mv.name} refreshed in {elapsed_ms:.0f} ms")
+                return {"name": mv.name, "refreshed": True, "elapsed_ms": mv.last_refresh_ms}
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": mv.name})
+                conn.commit()
+    finally:
+        db.close()
+
+
+def is_due(mv: MaterializedView) -> bool:
+    age = age_seconds(mv)
+    if age is None:
+        return True
+    if mv.refresh_interval_seconds and age >= mv.refresh_interval_seconds:
+        return True
+    return bool(mv.refresh_on_change and mv.name in registry.dirty and age >= settings.MATVIEW_MIN_REFRESH_SECONDS)
+
+
+def describe(mv: MaterializedView) -> Dict[str, Any]:
+    return {
+        "id": mv.id,
+        "name": mv.name,
+        "dashboard_id": mv.dashboard_id,
+        "widget_id": mv.widget_id,
+        "source": mv.source_name,
+        "params": json.loads(mv.params or "{}"),
+        "unique_key": json.loads(mv.unique_key or "[]"),
+        "refresh_interval_seconds": mv.refresh_interval_seconds,
+        "refresh_on_change": mv.refresh_on_change,
+        "status": mv.status,
+        "last_refreshed_at": mv.last_refreshed_at,
+        "last_refresh_ms": mv.last_refresh_ms,
+        "refresh_count": mv.refresh_count,
+        "last_error": mv.last_error,
+        "stale_seconds": age_seconds(mv),
+        "changed_since_refresh": mv.name in registry.dirty,
+    }
+
+
+# ========================================
+# Расписание
+# ========================================
+
+class RefreshScheduler(threading.Thread):
+    """Раз в MATVIEW_SCHEDULER_SECONDS: перечитать представления, обновить подошедшие"""
+
+    def __init__(self, stop: threading.Event, interval: float):
+        super().__init__(name="matview-scheduler", daemon=True)
+        self.stop_event = stop
+        self.interval = interval
+
+    def tick(self) -> None:
+        views = load_views()
+        registry.load(views)
+        for mv in views:
+            if self.stop_event.is_set():
+                return
+            if mv.refresh_on_change and not registry.is_tracked(mv.name) and mv.name not in registry.dirty:
+                with engine.connect() as conn:
+                    registry.track(conn, mv, invalidation.index.begin())
+                    conn.rollback()
+            if is_due(mv):
+                refresh_view(mv.id)
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning(f"Materialized view scheduler error: {e}")
+
+
+_stop = threading.Event()
+_scheduler: Optional[RefreshScheduler] = None
+
+
+def start() -> None:
+    global _scheduler
+    _stop.clear()
+    try:
+        reload()
+    except Exception as e:
+        logger.warning(f"Materialized views not loaded: {e}")
+    if settings.MATVIEW_SCHEDULER_SECONDS > 0 and (_scheduler is None or not _scheduler.is_alive()):
+        _scheduler = RefreshScheduler(_stop, settings.MATVIEW_SCHEDULER_SECONDS)
+        _scheduler.start()
+
+
+def stop() -> None:
+    _stop.set()
+
+
+def info() -> Dict[str, Any]:
+    return {
+        "scheduler": bool(_scheduler and _scheduler.is_alive()),
+        "dirty": len(registry.dirty),
+        **registry.stats,
+    }
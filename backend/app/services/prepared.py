@@ -0,0 +1,219 @@
+# backend/app/services/prepared.py
+# Повторное использование разбора и плана для SQL виджетов.
+#
+# Текст опубликованного виджета не меняется, меняются только значения
+# (p_date_from, p_date_to, p_object_id). Поэтому:
+#   - объекты text() хранятся в LRU по тексту (PREPARED_STATEMENTS_CACHE_SIZE):
+#     не разбираются заново и попадают в кэш компиляции SQLAlchemy;
+#   - начиная с PREPARED_STATEMENTS_MIN_CALLS-го выполнения текст
+#     готовится на соединении (PREPARE dash_<хэш> AS ... с $1..$n) и дальше
+#     выполняется EXECUTE — PostgreSQL не разбирает и (после пяти
+#     выполнений, если выгодно) не планирует его заново.
+#
+# Подготовленные операторы живут в соединении, поэтому список имён
+# хранится в info соединения пула: уходит вместе с закрытым или
+# инвалидированным соединением, на каждом не больше
+# PREPARED_STATEMENTS_PER_CONNECTION (лишние — DEALLOCATE). После DDL
+# приложения (матпредставления, сводки, индексы) invalidate() повышает
+# поколение — соединения со старым поколением делают DEALLOCATE ALL.
+#
+# Время планирования текста замеряется один раз (EXPLAIN (SUMMARY)):
+# экономия в info() — оценка «повторные выполнения × время планирования».
+# За пулером в режиме транзакций (pgbouncer) — PREPARED_STATEMENTS_ENABLED=False.
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import logging
+import re
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_PYFORMAT_RE = re.compile(r"%\((\w+)\)s|%%")
+# Ошибки, после которых подготовленный оператор на соединении больше не годится
+_STALE_CODES = {"26000", "0A000"}   # invalid_sql_statement_name, cached plan must not change result type
+
+
+class Statement:
+    """Текст запроса: готовый text(), имя и текст PREPARE, счётчики"""
+
+    __slots__ = ("sql", "clause", "name", "prepare_sql", "execute_clause", "preparable",
+                 "calls", "executes", "reuses", "planning_ms")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.clause = text(sql)
+        self.name = "dash_" + hashlib.sha1(sql.encode("utf-8")).hexdigest()[:20]
+        self.prepare_sql: Optional[str] = None
+        self.execute_clause = None
+        self.preparable = True
+        self.calls = 0
+        self.executes = 0
+        self.reuses = 0             # EXECUTE уже подготовленного на соединении оператора
+        self.planning_ms: Optional[float] = None
+
+    def compile_for(self, dialect) -> None:
+        """:name -> $n по скомпилированному тексту (pyformat драйвера)"""
+        order: List[str] = []
+
+        def placeholder(m: "re.Match") -> str:
+            if m.group(1) is None:
+                return "%"
+            if m.group(1) not in order:
+                order.append(m.group(1))
+            return f"${order.index(m.group(1)) + 1}"
+
+        compiled = self.clause.compile(dialect=dialect).string
+        body = _PYFORMAT_RE.sub(placeholder, compiled).strip().rstrip(";")
+        self.prepare_sql = f"PREPARE {self.name} AS {body}"
+        args = f"({', '.join(':' + p for p in order)})" if order else ""
+        self.execute_clause = text(f"EXECUTE {self.name}{args}")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "sql": self.sql[:200],
+            "calls": self.calls,
+            "executes": self.executes,
+            "reuses": self.reuses,
+            "preparable": self.preparable,
+            "planning_ms": self.planning_ms,
+        }
+
+
+class StatementCache:
+    def __init__(self, size: int):
+        self.size = size
+        self.generation = 0
+        self._statements: "OrderedDict[str, Statement]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "prepared": 0, "prepare_errors": 0, "executes": 0,
+                      "deallocated": 0, "stale": 0, "invalidations": 0}
+
+    def statement(self, sql: str) -> Statement:
+        with self._lock:
+            st = self._statements.get(sql)
+            if st is None:
+                self.stats["misses"] += 1
+                st = self._statements[sql] = Statement(sql)
+                while len(self._statements) > self.size:
+                    self._statements.popitem(last=False)
+            else:
+                self.stats["hits"] += 1
+                self._statements.move_to_end(sql)
+            st.calls += 1
+            return st
+
+    def invalidate(self) -> None:
+        """После DDL: соединения сбросят подготовленные операторы при следующем использовании"""
+        with self._lock:
+            self.generation += 1
+            self.stats["invalidations"] += 1
+
+    def _connection_state(self, conn) -> "OrderedDict[str, None]":
+        info = conn.connection.info
+        state = info.get("prepared")
+        if state is not None and state["generation"] != self.generation:
+            if state["names"]:
+                conn.exec_driver_sql("DEALLOCATE ALL")
+                self.stats["deallocated"] += len(state["names"])
+            state = None
+        if state is None:
+            state = info["prepared"] = {"generation": self.generation, "names": OrderedDict()}
+        return state["names"]
+
+    def _prepare(self, db, conn, st: Statement, params: Dict[str, Any], names: "OrderedDict[str, None]") -> bool:
+        if st.prepare_sql is None:
+            st.compile_for(conn.dialect)
+        try:
+            # Savepoint: текст, который PostgreSQL не подготовит (тип параметра
+            # не выводится), не ломает транзакцию — он просто выполняется как есть
+            with db.begin_nested():
+                if st.planning_ms is None:
+                    plan = conn.execute(text(f"EXPLAIN (SUMMARY, FORMAT JSON) {st.sql.strip().rstrip(';')}"), params).scalar()
+                    st.planning_ms = float((json.loads(plan) if isinstance(plan, str) else plan)[0].get("Planning Time", 0))
+                conn.exec_driver_sql(st.prepare_sql, execution_options={"no_parameters": True})
+        except DBAPIError as e:
+            st.preparable = False
+            self.stats["prepare_errors"] += 1
+            logger.info(f"Prepared statements: {st.name} is executed unprepared: {e.orig}")
+            return False
+        names[st.name] = None
+        self.stats["prepared"] += 1
+        while len(names) > settings.PREPARED_STATEMENTS_PER_CONNECTION:
+            old, _ = names.popitem(last=False)
+            conn.exec_driver_sql(f"DEALLOCATE {old}")
+            self.stats["deallocated"] += 1
+        return True
+
+    def execute(self, db, sql: str, params: Dict[str, Any]):
+        """Выполнить SQL виджета (Session или Connection): EXECUTE, если оператор подготовлен"""
+        st = self.statement(sql)
+        conn = db.connection() if isinstance(db, Session) else db
+        if (not settings.PREPARED_STATEMENTS_ENABLED or conn.dialect.name != "postgresql"
+                or not st.preparable or st.calls < settings.PREPARED_STATEMENTS_MIN_CALLS):
+            return db.execute(st.clause, params)
+
+        names = self._connection_state(conn)
+        reused = st.name in names
+        if reused:
+            names.move_to_end(st.name)
+        elif not self._prepare(db, conn, st, params, names):
+            return db.execute(st.clause, params)
+        try:
+            result = db.execute(st.execute_clause, params)
+        except DBAPIError as e:
+            if getattr(e.orig, "pgcode", None) in _STALE_CODES:
+                # Оператор пропал или устарел после чужого DDL — соединение подготовит заново
+                conn.connection.info["prepared"]["generation"] = -1
+                self.stats["stale"] += 1
+            raise
+        with self._lock:
+            st.executes += 1
+            st.reuses += reused
+            self.stats["executes"] += 1
+        return result
+
+    def info(self, limit: int = 20) -> Dict[str, Any]:
+        with self._lock:
+            statements = list(self._statements.values())
+            stats = dict(self.stats)
+        saved = sum(st.reuses * (st.planning_ms or 0) for st in statements)
+        top = sorted(statements, key=lambda st: -st.executes)[:limit]
+        return {
+            "enabled": settings.PREPARED_STATEMENTS_ENABLED,
+            "statements": len(statements),
+            "generation": self.generation,
+            "planning_ms_saved_estimate": round(saved, 1),
+            "top": [st.describe() for st in top],
+            **stats,
+        }
+
+
+_cache: Optional[StatementCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> StatementCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = StatementCache(settings.PREPARED_STATEMENTS_CACHE_SIZE)
+    return _cache
+
+
+def execute(db, sql: str, params: Dict[str, Any]):
+    return get_cache().execute(db, sql, params)
+
+
+def invalidate() -> None:
+    get_cache().invalidate()
@@ -0,0 +1,127 @@
+# backend/app/services/query_cache.py
+# Кэш результатов /api/sql/execute.
+#
+# Хранится уже сериализованный JSON-ответ: попадание в кэш отдаётся без
+# выполнения запроса и без повторной сериализации. Запись живёт, пока не
+# изменится одна из таблиц, которые читает запрос (app.services.invalidation);
+# QUERY_CACHE_MAX_AGE_SECONDS — только страховочный верхний предел.
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+import hashlib
+import json
+import threading
+import time
+
+from app.services import invalidation
+
+CACHE_NAME = "sql_execute"
+
+
+def render_json(payload: Dict[str, Any]) -> bytes:
+    """Тот же формат, что у JSONResponse"""
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def query_key(sql: str, params: Dict[str, Any]) -> str:
+    raw = sql + "\x00" + json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class CachedResult:
+    __slots__ = ("body", "stored_at", "hits")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.stored_at = time.monotonic()
+        self.hits = 0
+
+    def payload(self) -> Dict[str, Any]:
+        return json.loads(self.body)
+
+
+class QueryResultCache:
+    """LRU по размеру сериализованного ответа"""
+
+    def __init__(self, name: str, memory_bytes: int, max_age: float):
+        self.name = name
+        self.memory_bytes = memory_bytes
+        self.max_age = max_age
+        self._entries: "OrderedDict[Hashable, CachedResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.used = 0
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+        invalidation.index.register_cache(name, self._invalidated)
+
+    def get(self, key: Hashable) -> Optional[CachedResult]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.stored_at > self.max_age:
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            entry.hits += 1
+            self.stats["hits"] += 1
+            return entry
+
+    def put(self, key: Hashable, body: bytes) -> None:
+        if len(body) > self.memory_bytes // 4:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while self._entries and self.used + len(body) > self.memory_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+            self._entries[key] = CachedResult(body)
+            self.used += len(body)
+            self.stats["stores"] += 1
+
+    def store(self, key: Hashable, body: bytes, conn, sql: str, params: Dict[str, Any], since: int) -> bool:
+        """
+        Положить результат, если известны его таблицы и они не менялись
+        с момента since (invalidation.index.begin() перед выполнением).
+        """
+        if not invalidation.track_query(self.name, key, conn, sql, params, since):
+            return False
+        self.put(key, body)
+        return True
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.used -= len(entry.body)
+            invalidation.index.forget(self.name, key)
+
+    def _invalidated(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+                self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "used_bytes": self.used, "memory_bytes": self.memory_bytes, **self.stats}
+
+
+_cache: Optional[QueryResultCache] = None
+
+
+def get_cache() -> QueryResultCache:
+    global _cache
+    if _cache is None:
+        from app.config import settings
+        _cache = QueryResultCache(
+            CACHE_NAME,
+            memory_bytes=settings.QUERY_CACHE_MEMORY_MB * 1024 * 1024,
+            max_age=settings.QUERY_CACHE_MAX_AGE_SECONDS,
+        )
+    return _cache
@@ -0,0 +1,332 @@
+# backend/app/services/query_log.py
+# Журнал выполнения запросов: /api/sql/execute, /api/query, выгрузка и
+# рендер дашборда.
+#
+# Каждое выполнение — запись (отпечаток, пользователь, дашборд/виджет,
+# длительность, строки, байты, попадание в кэш, класс ошибки). Записи
+# хранятся в кольцевом буфере, по отпечатку копится сводка: число
+# вызовов, суммарное время, p95 по последним выполнениям. Отпечаток —
+# текст запроса без комментариев и литералов (app.services.sql_analysis):
+# запросы, отличающиеся только значениями, попадают в одну группу.
+#
+# Медленные (дольше QUERY_LOG_EXPLAIN_MS) читающие запросы повторяются
+# в фоне под EXPLAIN (ANALYZE, BUFFERS) в read-only транзакции; план
+# сохраняется у отпечатка.
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import SessionLocal
+from app.services import sql_analysis
+
+logger = logging.getLogger(__name__)
+
+MAX_TEXT = 4000             # символов нормализованного текста в сводке
+DURATION_SAMPLES = 256      # последних длительностей на отпечаток (для p95)
+
+
+def error_class(exc: Optional[BaseException]) -> Optional[str]:
+    """Класс ошибки драйвера (UndefinedTable, QueryCanceled...), а не обёртки"""
+    if exc is None:
+        return None
+    # raise_sql_error переводит ошибку БД в HTTPException — берём исходную
+    if type(exc).__name__ == "HTTPException" and exc.__context__ is not None:
+        exc = exc.__context__
+    return type(getattr(exc, "orig", None) or exc).__name__
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+class QueryEntry:
+    """Одно выполнение; поля заполняются по ходу, запись — в finish()"""
+
+    def __init__(self, log: "QueryLog", sql: str, params: Optional[Dict[str, Any]], source: str,
+                 user: Optional[str], dashboard_id: Optional[int], widget_id: Optional[str]):
+        self.log = log
+        self.sql = sql
+        self.params = params
+        self.source = source
+        self.user = user
+        self.dashboard_id = dashboard_id
+        self.widget_id = widget_id
+        self.rows: Optional[int] = None
+        self.bytes: Optional[int] = None
+        self.cache: Optional[str] = None     # HIT / MISS / PARTIAL
+        self.error: Optional[str] = None
+        self.started = time.perf_counter()
+        self.finished = False
+
+    def finish(self, exc: Optional[BaseException] = None) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        if exc is not None:
+            self.error = error_class(exc)
+        self.log.add(self, round((time.perf_counter() - self.started) * 1000, 2))
+
+
+class FingerprintStats:
+    __slots__ = ("fingerprint", "text", "sources", "calls", "errors", "cache_hits", "total_ms",
+                 "max_ms", "rows", "bytes", "durations", "last_at", "last_user", "dashboards",
+                 "plan", "plan_at", "plan_ms", "plan_error", "explaining", "sample")
+
+    def __init__(self, fp: str, text: str):
+        self.fingerprint = fp
+        self.text = text
+        self.sources: Dict[str, int] = {}
+        self.calls = self.errors = self.cache_hits = 0
+        self.total_ms = self.max_ms = 0.0
+        self.rows = self.bytes = 0
+        self.durations: Deque[float] = deque(maxlen=DURATION_SAMPLES)
+        self.last_at: Optional[datetime] = None
+        self.last_user: Optional[str] = None
+        self.dashboards: Dict[str, int] = {}
+        self.plan: Optional[Any] = None
+        self.plan_at: Optional[float] = None
+        self.plan_ms: Optional[float] = None
+        self.plan_error: Optional[str] = None
+        self.explaining = False
+        # Последнее успешное выполнение читающего запроса (sql, params) — для советника индексов
+        self.sample: Optional[Tuple[str, Dict[str, Any]]] = None
+
+    def summary(self, with_plan: bool = False) -> Dict[str, Any]:
+        durations = list(self.durations)
+        executed = self.calls - self.cache_hits
+        out = {
+            "fingerprint": self.fingerprint,
+            "query": self.text,
+            "sources": dict(self.sources),
+            "calls": self.calls,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "total_ms": round(self.total_ms, 1),
+            "mean_ms": round(self.total_ms / self.calls, 2) if self.calls else None,
+            "p50_ms": _percentile(durations, 0.5),
+            "p95_ms": _percentile(durations, 0.95),
+            "max_ms": self.max_ms,
+            "rows_per_call": round(self.rows / executed, 1) if executed > 0 else None,
+            "bytes": self.bytes,
+            "last_at": self.last_at,
+            "last_user": self.last_user,
+            "dashboards": dict(self.dashboards),
+            "has_plan": self.plan is not None,
+        }
+        if with_plan:
+            out.update({
+                "plan": self.plan,
+                "plan_ms": self.plan_ms,
+                "plan_error": self.plan_error,
+                "plan_age_seconds": round(time.monotonic() - self.plan_at, 1) if self.plan_at else None,
+            })
+        return out
+
+
+class QueryLog:
+    """Кольцевой буфер записей + сводка по отпечаткам (LRU по числу отпечатков)"""
+
+    def __init__(self, max_records: int, max_fingerprints: int):
+        self.records: Deque[Dict[str, Any]] = deque(maxlen=max_records)
+        self.max_fingerprints = max_fingerprints
+        self._by_fp: "OrderedDict[str, FingerprintStats]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._explainer: Optional[ThreadPoolExecutor] = None
+        self.stats = {"recorded": 0, "explained": 0, "explain_errors": 0, "explain_skipped": 0}
+
+    def entry(self, sql: str, params: Optional[Dict[str, Any]] = None, source: str = "sql_execute",
+              user: Optional[str] = None, dashboard_id: Optional[int] = None,
+              widget_id: Optional[str] = None) -> QueryEntry:
+        return QueryEntry(self, sql, params, source, user, dashboard_id, widget_id)
+
+    def add(self, entry: QueryEntry, duration_ms: float) -> None:
+        if not settings.QUERY_LOG_ENABLED:
+            return
+        analysis = sql_analysis.analyze(entry.sql)
+        text_, fp = analysis.normalized, analysis.fingerprint
+        hit = entry.cache == "HIT"
+        record = {
+            "at": datetime.now(timezone.utc),
+            "fingerprint": fp,
+            "source": entry.source,
+            "user": entry.user,
+            "dashboard_id": entry.dashboard_id,
+            "widget_id": entry.widget_id,
+            "duration_ms": duration_ms,
+            "rows": entry.rows,
+            "bytes": entry.bytes,
+            "cache": entry.cache,
+            "error": entry.error,
+        }
+        with self._lock:
+            self.records.append(record)
+            self.stats["recorded"] += 1
+            stats = self._by_fp.get(fp)
+            if stats is None:
+                stats = self._by_fp[fp] = FingerprintStats(fp, text_[:MAX_TEXT])
+                while len(self._by_fp) > self.max_fingerprints:
+                    self._by_fp.popitem(last=False)
+            else:
+                self._by_fp.move_to_end(fp)
+            stats.calls += 1
+            stats.sources[entry.source] = stats.sources.get(entry.source, 0) + 1
+            stats.total_ms += duration_ms
+            stats.max_ms = max(stats.max_ms, duration_ms)
+            stats.durations.append(duration_ms)
+            stats.last_at, stats.last_user = record["at"], entry.user
+            stats.errors += entry.error is not None
+            stats.cache_hits += hit
+            if not hit:
+                stats.rows += entry.rows or 0
+            stats.bytes += entry.bytes or 0
+            if entry.dashboard_id is not None:
+                key = str(entry.dashboard_id)
+                stats.dashboards[key] = stats.dashboards.get(key, 0) + 1
+            if entry.error is None and analysis.is_read:
+                stats.sample = (entry.sql, dict(entry.params or {}))
+            explain = (
+                settings.QUERY_LOG_EXPLAIN_MS > 0
+                and duration_ms >= settings.QUERY_LOG_EXPLAIN_MS
+                and entry.error is None and not hit
+                and analysis.is_read
+                and not stats.explaining
+                and (stats.plan_at is None
+                     or time.monotonic() - stats.plan_at > settings.QUERY_LOG_EXPLAIN_INTERVAL_SECONDS)
+            )
+            if explain:
+                stats.explaining = True
+        if explain:
+            self._schedule_explain(stats, entry.sql, dict(entry.params or {}))
+
+    # ----- EXPLAIN медленных запросов -----
+
+    def _schedule_explain(self, stats: FingerprintStats, sql: str, params: Dict[str, Any]) -> None:
+        if self._explainer is None:
+            with self._lock:
+                if self._explainer is None:
+                    self._explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-explain")
+        # Очередь не копим: пока идёт EXPLAIN, остальные медленные запросы пропускаются
+        if self._explainer._work_queue.qsize() > 0:
+            stats.explaining = False
+            self.stats["explain_skipped"] += 1
+            return
+        self._explainer.submit(self._explain, stats, sql, params)
+
+    def _explain(self, stats: FingerprintStats, sql: str, params: Dict[str, Any]) -> None:
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            # ANALYZE выполняет запрос: только чтение и с таймаутом
+            db.execute(text("SET TRANSACTION READ ONLY"))
+            db.execute(text(f"SET LOCAL statement_timeout = '{settings.QUERY_LOG_EXPLAIN_TIMEOUT}'"))
+            plan = db.execute(
+                text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql.strip().rstrip(';')}"), params
+            ).scalar()
+            stats.plan = json.loads(plan) if isinstance(plan, str) else plan
+            stats.plan_error = None
+            self.stats["explained"] += 1
+        except Exception as e:
+            stats.plan_error = str(e)
+            self.stats["explain_errors"] += 1
+            logger.warning(f"EXPLAIN of slow query {stats.fingerprint} failed: {e}")
+        finally:
+            db.rollback()
+            db.close()
+            stats.plan_at = time.monotonic()
+            stats.plan_ms = round((time.perf_counter() - started) * 1000, 1)
+            stats.explaining = False
+
+    # ----- Отчёты -----
+
+    def top(self, by: str = "total_ms", limit: int = 20, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [s.summary() for s in self._by_fp.values() if source is None or source in s.sources]
+        items.sort(key=lambda s: s.get(by) or 0, reverse=True)
+        return items[:limit]
+
+    def samples(self, limit: int) -> List[Tuple[Dict[str, Any], str, Dict[str, Any]]]:
+        """(сводка, sql, params) читающих отпечатков с образцом, дорогие первыми"""
+        with self._lock:
+            items = [(s.summary(), *s.sample) for s in self._by_fp.values() if s.sample is not None]
+        items.sort(key=lambda item: item[0]["total_ms"], reverse=True)
+        return items[:limit]
+
+    def get(self, fp: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            stats = self._by_fp.get(fp)
+            return stats.summary(with_plan=True) if stats is not None else None
+
+    def recent(self, limit: int = 100, fingerprint: Optional[str] = None,
+               min_ms: float = 0, errors_only: bool = False) -> List[Dict[str, Any]]:
+        with self._lock:
+            records = list(self.records)
+        out = []
+        for record in reversed(records):
+            if fingerprint and record["fingerprint"] != fingerprint:
+                continue
+            if record["duration_ms"] < min_ms or (errors_only and record["error"] is None):
+                continue
+            out.append(record)
+            if len(out) >= limit:
+                break
+        return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self.records.clear()
+            self._by_fp.clear()
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"records": len(self.records), "fingerprints": len(self._by_fp), **self.stats}
+
+
+_log: Optional[QueryLog] = None
+_log_lock = threading.Lock()
+
+
+def get_log() -> QueryLog:
+    global _log
+    if _log is None:
+        with _log_lock:
+            if _log is None:
+                _log = QueryLog(settings.QUERY_LOG_MAX_RECORDS, settings.QUERY_LOG_MAX_FINGERPRINTS)
+    return _log
+
+
+def start(sql: str, params: Optional[Dict[str, Any]] = None, source: str = "sql_execute",
+          user: Optional[str] = None, dashboard_id: Optional[int] = None,
+          widget_id: Optional[str] = None) -> QueryEntry:
+    """Начать запись вручную (потоковые ответы): завершить entry.finish()"""
+    return get_log().entry(sql, params, source, user, dashboard_id, widget_id)
+
+
+@contextmanager
+def record(sql: str, params: Optional[Dict[str, Any]] = None, source: str = "sql_execute",
+           user: Optional[str] = None, dashboard_id: Optional[int] = None,
+           widget_id: Optional[str] = None) -> Iterator[QueryEntry]:
+    """
+    with query_log.record(sql, params, "query", user) as entry:
+        ...; entry.rows = n
+    Исключение записывается как класс ошибки и пробрасывается дальше.
+    """
+    entry = start(sql, params, source, user, dashboard_id, widget_id)
+    try:
+        yield entry
+    except BaseException as e:
+        entry.finish(e)
+        raise
+    entry.finish()
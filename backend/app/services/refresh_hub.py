@@ -0,0 +1,305 @@
+# backend/app/services/refresh_hub.py
+# Серверное автообновление дашбордов.
+#
+# Вместо того чтобы каждый открытый браузер по setInterval перезапускал
+# все запросы виджетов, клиенты подписываются на дашборд (WebSocket или
+# SSE). На дашборд (и набор параметров) заводится один канал: он раз в
+# интервал выполняет каждый различный запрос виджетов один раз, считает
+# хэш результата и рассылает подписчикам только изменившиеся виджеты.
+#
+# Медленные клиенты не копят очередь: у подписки хранится последнее
+# непрочитанное сообщение на виджет (новое замещает старое), а отправка,
+# зависшая дольше REFRESH_HUB_SEND_TIMEOUT_SECONDS, закрывает соединение.
+
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.database import SessionLocal
+from app.services import prepared, single_flight
+from app.services.widgets import dashboard_sources, data_widgets, plan_queries, widget_key
+
+logger = logging.getLogger(__name__)
+
+
+def _digest(*parts: Any) -> str:
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class Subscription:
+    """
+    Подписка одного клиента. pending — последнее сообщение на виджет:
+    если клиент не успевает читать, промежуточные обновления схлопываются.
+    """
+
+    def __init__(self, channel: "DashboardChannel", interval: float):
+        self.channel = channel
+        self.interval = interval
+        self.pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.event = asyncio.Event()
+        self.coalesced = 0
+        self.closed = False
+
+    def offer(self, key: str, message: Dict[str, Any]) -> None:
+        if key in self.pending:
+            self.coalesced += 1
+            del self.pending[key]
+        self.pending[key] = message
+        self.event.set()
+
+    async def next_batch(self, timeout: float) -> List[Dict[str, Any]]:
+        """Все накопившиеся сообщения; пустой список — таймаут (пора слать ping)"""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        self.event.clear()
+        batch = list(self.pending.values())
+        self.pending.clear()
+        return batch
+
+    def close(self, reason: Optional[str] = None) -> None:
+        if reason:
+            self.offer("__closed__", {"type": "closed", "reason": reason})
+        self.closed = True
+        self.event.set()
+
+
+class DashboardChannel:
+    """Один фоновый цикл обновления на (дашборд, параметры)"""
+
+    def __init__(self, hub: "RefreshHub", key: Tuple, dashboard_id: int, params: Dict[str, Any]):
+        self.hub = hub
+        self.key = key
+        self.dashboard_id = dashboard_id
+        self.params = params
+        self.subscribers: List[Subscription] = []
+        self.snapshot: Dict[str, Dict[str, Any]] = {}   # widget_id -> последнее сообщение
+        self.hashes: Dict[str, str] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+        self.ticks = 0
+
+    @property
+    def interval(self) -> float:
+        wanted = min((s.interval for s in self.subscribers), default=settings.REFRESH_HUB_DEFAULT_INTERVAL_SECONDS)
+        return max(settings.REFRESH_HUB_MIN_INTERVAL_SECONDS, wanted)
+
+    def publish(self, widget_id: str, message: Dict[str, Any]) -> None:
+        self.snapshot[widget_id] = message
+        for sub in list(self.subscribers):
+            sub.offer(widget_id, message)
+
+    def close_all(self, reason: str) -> None:
+        for sub in list(self.subscribers):
+            sub.close(reason)
+
+    async def run(self) -> None:
+        try:
+            while self.subscribers:
+                started = time.monotonic()
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.warning(f"Refresh hub: dashboard {self.dashboard_id} refresh failed: {e}")
+                self.ticks += 1
+                delay = max(0.0, self.interval - (time.monotonic() - started))
+                self.wakeup.clear()
+                try:
+                    # Новый подписчик с меньшим интервалом будит цикл раньше
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.hub.channel_done(self)
+
+    async def refresh(self) -> None:
+        loaded = await run_in_threadpool(load_widgets, self.dashboard_id)
+        if loaded is None:
+            self.close_all("Dashboard not found")
+            return
+        widgets, sources = loaded
+
+        # Общие источники и одинаковые запросы (SQL + параметры) выполняются один раз на тик
+        queries, by_widget = plan_queries(widgets, sources, self.params)
+
+        results = await asyncio.gather(
+            *(self.hub.execute(qkey, sql, params, self.interval) for qkey, (sql, params) in queries.items()),
+            return_exceptions=True,
+        )
+        by_query = dict(zip(queries, results))
+
+        for i, w in enumerate(widgets):
+            wid = widget_key(w, i)
+            result = by_query[by_widget[wid]]
+            if isinstance(result, Exception):
+                message = {"type": "error", "widget_id": wid, "error": str(result)}
+                digest = _digest("error", str(result))
+            else:
+                transforms = (w.get("props") or {}).get("transforms")
+                if transforms:
+                    message, digest = await run_in_threadpool(_transformed, wid, result, transforms)
+                else:
+                    payload, digest = result
+                    message = {"type": "update", "widget_id": wid, "hash": digest, "result": payload}
+            if self.hashes.get(wid) != digest:
+                self.hashes[wid] = digest
+                self.publish(wid, message)
+
+        # Виджет удалён из дашборда
+        for wid in set(self.snapshot) - set(by_widget):
+            self.snapshot.pop(wid, None)
+            self.hashes.pop(wid, None)
+            for sub in list(self.subscribers):
+                sub.offer(wid, {"type": "removed", "widget_id": wid})
+
+
+def _transformed(widget_id: str, result: Tuple[Dict[str, Any], str], transforms: Any) -> Tuple[Dict[str, Any], str]:
+    from app.services.transforms import TransformError, apply_transforms
+    payload, _ = result
+    try:
+        out = apply_transforms(payload, transforms)
+    except TransformError as e:
+        return {"type": "error", "widget_id": widget_id, "error": f"Transform error: {e}"}, _digest("error", str(e))
+    digest = _digest(out)
+    return {"type": "update", "widget_id": widget_id, "hash": digest, "result": out}, digest
+
+
+def load_widgets(dashboard_id: int) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]]:
+    """Актуальные table/chart виджеты и источники дашборда (None — дашборд удалён)"""
+    from app.models.dashboard import Dashboard
+    db = SessionLocal()
+    try:
+        dashboard = db.query(Dashboard).filter(Dashboard.id == dashboard_id).first()
+        if dashboard is None:
+            return None
+        config = json.loads(dashboard.config) if isinstance(dashboard.config, str) else (dashboard.config or {})
+        return data_widgets(config), dashboard_sources(config)
+    finally:
+        db.close()
+
+
+def run_query(sql: str, params: Dict[str, Any]) -> Tuple[Dict[str, Any], str]:
+    """Выполнить запрос виджета на своей сессии; результат и его хэш"""
+    from app.api.sql_executor import guard_user_sql, set_statement_timeout
+    from app.services.converters import ResultConverter
+    # Канал общий для подписчиков (у опубликованного дашборда — не только
+    # владельца), поэтому SQL проверяется как у роли DEVELOPER
+    guard_user_sql(sql, "DEVELOPER", read_only=True)
+    max_rows = settings.REFRESH_HUB_MAX_ROWS
+    db = SessionLocal()
+    try:
+        set_statement_timeout(db)
+        result = prepared.execute(db, sql, params)
+        converter = ResultConverter.for_result(result, "json", settings.JSON_DECIMALS_AS_STRING)
+        rows = result.fetchmany(max_rows + 1)
+        data = converter.records(rows[:max_rows])
+        payload = {
+            "columns": converter.names,
+            "data": data,
+            "row_count": len(data),
+            "truncated": len(rows) > max_rows,
+        }
+        return payload, _digest(payload)
+    finally:
+        db.rollback()
+        db.close()
+
+
+class RefreshHub:
+    """
+    Реестр каналов. Запросы дедуплицируются и между каналами: одинаковый
+    запрос, уже выполняемый или выполненный не раньше интервала назад,
+    повторно в БД не уходит.
+    """
+
+    def __init__(self):
+        self.channels: Dict[Tuple, DashboardChannel] = {}
+        self._recent: Dict[str, Tuple[float, Any]] = {}
+        self.stats = {"queries": 0, "shared": 0, "subscribers": 0}
+
+    async def execute(self, qkey: str, sql: str, params: Dict[str, Any], max_age: float):
+        now = time.monotonic()
+        recent = self._recent.get(qkey)
+        if recent is not None and now - recent[0] < max_age * 0.9:
+            self.stats["shared"] += 1
+            return recent[1]
+        # Одновременные одинаковые запросы разных каналов — один вызов
+        flight = single_flight.get_flight("refresh_hub")
+        leader = not flight.running(qkey)
+        try:
+            result = await flight.run(qkey, run_query, sql, params)
+        finally:
+            self._prune(now)
+        if leader:
+            self.stats["queries"] += 1
+            self._recent[qkey] = (time.monotonic(), result)
+        else:
+            self.stats["shared"] += 1
+        return result
+
+    def _prune(self, now: float) -> None:
+        horizon = settings.REFRESH_HUB_MIN_INTERVAL_SECONDS * 20
+        for k in [k for k, (ts, _) in self._recent.items() if now - ts > horizon]:
+            self._recent.pop(k, None)
+
+    def subscribe(self, dashboard_id: int, params: Optional[Dict[str, Any]], interval: float) -> Subscription:
+        params = params or {}
+        key = (dashboard_id, _digest(params))
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = DashboardChannel(self, key, dashboard_id, params)
+            self.channels[key] = channel
+        sub = Subscription(channel, interval)
+        shorter = interval < channel.interval
+        channel.subscribers.append(sub)
+        self.stats["subscribers"] += 1
+        # Новому клиенту сразу отдаём последние известные данные
+        for wid, message in channel.snapshot.items():
+            sub.offer(wid, dict(message, type="snapshot") if message.get("type") == "update" else message)
+        if channel.task is None or channel.task.done():
+            channel.task = asyncio.create_task(channel.run())
+        elif shorter:
+            channel.wakeup.set()
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        channel = sub.channel
+        if sub in channel.subscribers:
+            channel.subscribers.remove(sub)
+            self.stats["subscribers"] -= 1
+        sub.closed = True
+        if not channel.subscribers:
+            channel.wakeup.set()
+
+    def channel_done(self, channel: DashboardChannel) -> None:
+        if self.channels.get(channel.key) is channel and not channel.subscribers:
+            self.channels.pop(channel.key, None)
+
+    async def shutdown(self) -> None:
+        tasks = []
+        for channel in list(self.channels.values()):
+            channel.close_all("Server shutting down")
+            if channel.task is not None:
+                channel.task.cancel()
+                tasks.append(channel.task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.channels.clear()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "channels": len(self.channels),
+            **self.stats,
+            "coalesced": sum(s.coalesced for c in self.channels.values() for s in c.subscribers),
+        }
+
+
+hub = RefreshHub()
@@ -0,0 +1,146 @@
+# backend/app/services/result_versions.py
+# Отпечатки результатов и дельта-обновление для автообновляемых виджетов.
+#
+# Клиент присылает отпечаток (fingerprint) версии, которая у него уже
+# есть. Если результат не изменился — ответ без данных (или HTTP 304 по
+# If-None-Match). Если изменился и прошлая версия ещё хранится здесь, а
+# клиент указал ключевые колонки, — отдаются только вставленные,
+# изменённые и удалённые строки.
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import threading
+
+# Дельта больше этой доли строк нового результата — выгоднее отдать всё
+MAX_DIFF_RATIO = 0.5
+
+
+def fingerprint(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def with_fingerprint(body: bytes) -> Tuple[bytes, str]:
+    """Дописать "fingerprint" в сериализованный JSON-объект результата"""
+    fp = fingerprint(body)
+    return body[:-1] + b',"fingerprint":"' + fp.encode("ascii") + b'"}', fp
+
+
+def keyed_diff(old: Dict[str, Any], new: Dict[str, Any], key_columns: Sequence[str]) -> Optional[Dict[str, Any]]:
+    """
+    Разница двух результатов по ключевым колонкам. None — дельту построить
+    нельзя (поменялись колонки, ключ не уникален) или она не выгодна.
+    """
+    columns = new.get("columns") or []
+    if old.get("columns") != columns or not key_columns or any(k not in columns for k in key_columns):
+        return None
+
+    def index(rows: List[Dict[str, Any]]) -> Optional[Dict[Hashable, Dict[str, Any]]]:
+        out: Dict[Hashable, Dict[str, Any]] = {}
+        for row in rows:
+            key = tuple(row.get(k) for k in key_columns)
+            try:
+                if key in out:
+                    return None
+            except TypeError:
+                return None
+            out[key] = row
+        return out
+
+    old_rows = index(old.get("data") or [])
+    new_rows = index(new.get("data") or [])
+    if old_rows is None or new_rows is None:
+        return None
+
+    inserted, updated = [], []
+    for key, row in new_rows.items():
+        previous = old_rows.get(key)
+        if previous is None:
+            inserted.append(row)
+        elif previous != row:
+            updated.append(row)
+    deleted = [list(key) for key in old_rows.keys() - new_rows.keys()]
+
+    changed = len(inserted) + len(updated) + len(deleted)
+    if changed > max(1, len(new_rows)) * MAX_DIFF_RATIO:
+        return None
+    return {"inserted": inserted, "updated": updated, "deleted": deleted}
+
+
+class VersionStore:
+    """
+    Последние версии результата по ключу запроса (SQL + параметры +
+    transforms), LRU по общему объёму. Живёт отдельно от кэша
+    результатов: после инвалидации старая версия нужна как база дельты.
+    """
+
+    def __init__(self, memory_bytes: int, versions_per_key: int = 3):
+        self.memory_bytes = memory_bytes
+        self.versions_per_key = versions_per_key
+        self._keys: "OrderedDict[Hashable, OrderedDict[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.used = 0
+        self.stats = {"not_modified": 0, "diffs": 0, "full": 0}
+
+    def add(self, key: Hashable, fp: str, body: bytes) -> None:
+        if len(body) > self.memory_bytes // 4:
+            return
+        with self._lock:
+            versions = self._keys.get(key)
+            if versions is None:
+                versions = self._keys[key] = OrderedDict()
+            self._keys.move_to_end(key)
+            if fp in versions:
+                versions.move_to_end(fp)
+                return
+            versions[fp] = body
+            self.used += len(body)
+            while len(versions) > self.versions_per_key:
+                _, old = versions.popitem(last=False)
+                self.used -= len(old)
+            while self.used > self.memory_bytes and self._keys:
+                oldest_key = next(iter(self._keys))
+                for old in self._keys.pop(oldest_key).values():
+                    self.used -= len(old)
+
+    def get(self, key: Hashable, fp: str) -> Optional[bytes]:
+        with self._lock:
+            versions = self._keys.get(key)
+            return versions.get(fp) if versions is not None else None
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"keys": len(self._keys), "used_bytes": self.used, **self.stats}
+
+
+def delta_payload(store: VersionStore, key: Hashable, base_fp: str, body: bytes, fp: str,
+                  key_columns: Sequence[str]) -> Optional[bytes]:
+    """Тело ответа-дельты относительно версии base_fp или None (отдать полностью)"""
+    base = store.get(key, base_fp)
+    if base is None:
+        return None
+    new = json.loads(body)
+    diff = keyed_diff(json.loads(base), new, key_columns)
+    if diff is None:
+        return None
+    payload = {
+        "columns": new.get("columns"),
+        "row_count": new.get("row_count"),
+        "key_columns": list(key_columns),
+        "base_fingerprint": base_fp,
+        "fingerprint": fp,
+        "diff": diff,
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+_store: Optional[VersionStore] = None
+
+
+def get_store() -> VersionStore:
+    global _store
+    if _store is None:
+        from app.config import settings
+        _store = VersionStore(settings.RESULT_VERSIONS_MEMORY_MB * 1024 * 1024)
+    return _store
@@ -0,0 +1,779 @@
+# backend/app/services/rollups.py
+# Сводные таблицы (rollups) для типовых агрегатов по базовым таблицам
+# (deposited_amount по construction_object_id, status, месяцу в
+# escrow_accounts).
+#
+# Определение: базовая таблица, измерения (колонка и, для дат, зерно
+# date_trunc) и меры (sum/count). Сводная таблица хранит по строке на
+# комбинацию измерений: суммы, счётчики и __count — число строк группы.
+#
+# Поддержка в актуальном состоянии:
+#   - mode="trigger": statement-level триггеры с transition tables
+#     применяют дельту (новые строки с плюсом, старые с минусом) в той же
+#     транзакции, что и изменение базовой таблицы;
+#   - mode="delta": фоновая задача пересчитывает группы строк, у которых
+#     updated_column больше прошлой отметки, и раз в
+#     ROLLUP_FULL_REBUILD_SECONDS пересобирает сводку целиком (удаления,
+#     переход строки между группами и строки, закоммиченные позже с
+#     updated_column не больше отметки, так не видны).
+#
+# Подмена запросов: простой агрегатный запрос к базовой таблице
+#   SELECT измерения, SUM(x), COUNT(*) FROM t [WHERE ...] GROUP BY ...
+#     [ORDER BY ...] [LIMIT n]
+# переписывается на сводку, если его измерения в ней есть (зерно может
+# быть крупнее), а WHERE ссылается только на измерения без зерна.
+# Всё, что не распознано, выполняется как есть. Delta-сводка до полной
+# пересборки может отвечать устаревшими данными, поэтому запросы на неё
+# переписываются только с явным allow_stale у сводки.
+
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import json
+import logging
+import re
+import threading
+import time
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.models.rollup import Rollup
+from app.services import prepared
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "dash_rollup_"
+COUNT_COLUMN = "__count"
+MODES = ("trigger", "delta")
+AGGS = ("sum", "count")
+# Зерно запроса -> зёрна сводки, из которых оно получается повторным date_trunc
+GRAIN_SOURCES = {
+    "day": {"day"},
+    "week": {"day", "week"},
+    "month": {"day", "month"},
+    "quarter": {"day", "month", "quarter"},
+    "year": {"day", "month", "quarter", "year"},
+}
+
+_NAME = r"[a-z_][a-z0-9_]*"
+NAME_RE = re.compile(rf"^{_NAME}$", re.IGNORECASE)
+
+
+class RollupError(ValueError):
+    """Некорректное определение или ошибка построения сводки"""
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# ========================================
+# Определение
+# ========================================
+
+class RollupSpec:
+    """Разобранное определение: измерения и меры с именами колонок сводки"""
+
+    def __init__(self, base_table: str, dimensions: Sequence[Dict[str, Any]], measures: Sequence[Dict[str, Any]]):
+        self.base_table = base_table.lower()
+        self.dimensions: List[Tuple[str, Optional[str]]] = []
+        for d in dimensions:
+            column = str(d.get("column") or "").lower()
+            grain = (str(d["grain"]).lower() if d.get("grain") else None)
+            if not NAME_RE.match(column):
+                raise RollupError(f"Invalid dimension column: {column!r}")
+            if grain is not None and grain not in GRAIN_SOURCES:
+                raise RollupError(f"grain must be one of {', '.join(GRAIN_SOURCES)}")
+            self.dimensions.append((column, grain))
+        if not self.dimensions:
+            raise RollupError("At least one dimension is required")
+        if len(set(self.dim_columns)) != len(self.dimensions):
+            raise RollupError("Duplicate dimensions")
+
+        self.measures: List[Tuple[str, str]] = []
+        self.types: Dict[str, str] = {}
+        for m in measures:
+            column = str(m.get("column") or "").lower()
+            agg = str(m.get("agg") or "sum").lower()
+            if agg not in AGGS:
+                raise RollupError(f"Measure aggregate must be one of {', '.join(AGGS)} (avg = sum / count)")
+            if not NAME_RE.match(column):
+                raise RollupError(f"Invalid measure column: {column!r}")
+            if (column, agg) not in self.measures:
+                self.measures.append((column, agg))
+                if m.get("type"):
+                    self.types[self.measure_column(column, agg)] = str(m["type"])
+
+    @staticmethod
+    def dim_column(column: str, grain: Optional[str]) -> str:
+        return column if grain is None else f"{column}_{grain}"
+
+    @staticmethod
+    def measure_column(column: str, agg: str) -> str:
+        return f"{agg}_{column}"
+
+    @property
+    def dim_columns(self) -> List[str]:
+        return [self.dim_column(c, g) for c, g in self.dimensions]
+
+    @property
+    def measure_columns(self) -> List[str]:
+        return [self.measure_column(c, a) for c, a in self.measures]
+
+    @property
+    def source_columns(self) -> List[str]:
+        return sorted({c for c, _ in self.dimensions} | {c for c, _ in self.measures})
+
+    def dim_exprs(self) -> List[str]:
+        return [
+            _ident(c) if g is None else f"date_trunc('{g}', {_ident(c)})"
+            for c, g in self.dimensions
+        ]
+
+    def aggregate_select(self, source: str, sign: str = "") -> str:
+        """SELECT измерений и мер по source (таблица или transition table)"""
+        items = [f"{e} AS {_ident(n)}" for e, n in zip(self.dim_exprs(), self.dim_columns)]
+        for column, agg in self.measures:
+            expr = f"COALESCE(SUM({_ident(column)}), 0)" if agg == "sum" else f"COUNT({_ident(column)})"
+            items.append(f"{sign}{expr} AS {_ident(self.measure_column(column, agg))}")
+        items.append(f"{sign}COUNT(*) AS {COUNT_COLUMN}")
+        groups = ", ".join(str(i + 1) for i in range(len(self.dimensions)))
+        return f"SELECT {', '.join(items)} FROM {source} GROUP BY {groups}"
+
+    def to_json(self) -> Tuple[str, str]:
+        dims = [{"column": c, "grain": g} for c, g in self.dimensions]
+        measures = [
+            {"column": c, "agg": a, "type": self.types.get(self.measure_column(c, a))}
+            for c, a in self.measures
+        ]
+        return json.dumps(dims), json.dumps(measures)
+
+    @classmethod
+    def from_model(cls, rollup: Rollup) -> "RollupSpec":
+        return cls(rollup.base_table, json.loads(rollup.dimensions), json.loads(rollup.measures))
+
+
+def _table_columns(conn, relation: str) -> Dict[str, str]:
+    rows = conn.execute(
+        text(
+            "SELECT lower(attname), format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = to_regclass(:name) AND attnum > 0 AND NOT attisdropped"
+        ),
+        {"name": relation},
+    ).fetchall()
+    return dict(rows)
+
+
+def _quoted_table(conn, relation: str) -> str:
+    quoted = conn.execute(
+        text(
+            "SELECT format('%I.%I', n.nspname, c.relname) FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.oid = to_regclass(:name) AND c.relkind IN ('r', 'p')"
+        ),
+        {"name": relation},
+    ).scalar()
+    if quoted is None:
+        raise RollupError(f"Table not found: {relation}")
+    return quoted
+
+
+def summary_name(name: str) -> str:
+    return f"{SUMMARY_PREFIX}{name}"[:63]
+
+
+def _summary(rollup: Rollup) -> str:
+    return f"{_ident(settings.MATVIEW_SCHEMA)}.{_ident(rollup.summary_table)}"
+
+
+def _function(rollup: Rollup) -> str:
+    return f"{_ident(settings.MATVIEW_SCHEMA)}.{_ident(rollup.summary_table[:54] + '_maintain')}"
+
+
+def _trigger_names(rollup: Rollup) -> Dict[str, str]:
+    base = f"dash_rollup_{rollup.id}"
+    return {"INSERT": f"{base}_ins", "UPDATE": f"{base}_upd", "DELETE": f"{base}_del", "TRUNCATE": f"{base}_trunc"}
+
+
+# ========================================
+# Поддержка сводки
+# ========================================
+
+def _apply_delta_sql(spec: RollupSpec, summary: str, delta_select: str) -> str:
+    """Прибавить дельту (строки с ± мерами) к сводке, удалить опустевшие группы"""
+    dims = spec.dim_columns
+    values = spec.measure_columns + [COUNT_COLUMN]
+    same = " AND ".join(f"s.{_ident(d)} IS NOT DISTINCT FROM d.{_ident(d)}" for d in dims)
+    same_upd = " AND ".join(f"u.{_ident(d)} IS NOT DISTINCT FROM d.{_ident(d)}" for d in dims)
+    sets = ", ".join(f"{_ident(v)} = s.{_ident(v)} + d.{_ident(v)}" for v in values)
+    columns = ", ".join(_ident(c) for c in dims + values)
+    return (
+        f"WITH d AS ({delta_select}), "
+        f"upd AS (UPDATE {summary} s SET {sets} FROM d WHERE {same} "
+        f"RETURNING {', '.join('s.' + _ident(c) for c in dims)}) "
+        f"INSERT INTO {summary} ({columns}) SELECT {columns} FROM d "
+        f"WHERE NOT EXISTS (SELECT 1 FROM upd u WHERE {same_upd}); "
+        f"DELETE FROM {summary} WHERE {COUNT_COLUMN} = 0;"
+    )
+
+
+def _trigger_function_sql(rollup: Rollup, spec: RollupSpec) -> str:
+    summary = _summary(rollup)
+    dims = spec.dim_columns
+    values = spec.measure_columns + [COUNT_COLUMN]
+    regroup = (
+        f"SELECT {', '.join(_ident(d) for d in dims)}, "
+        f"{', '.join(f'SUM({_ident(v)}) AS {_ident(v)}' for v in values)} "
+        f"FROM ({spec.aggregate_select('new_rows')} UNION ALL {spec.aggregate_select('old_rows', '-')}) x "
+        f"GROUP BY {', '.join(str(i + 1) for i in range(len(dims)))}"
+    )
+    return (
+        f"CREATE OR REPLACE FUNCTION {_function(rollup)}() RETURNS trigger LANGUAGE plpgsql AS $fn$\n"
+        f"BEGIN\n"
+        # Конкурирующие писатели по очереди: иначе обе вставят одну новую группу
+        f"  PERFORM pg_advisory_xact_lock(hashtext({_literal(rollup.summary_table)}));\n"
+        f"  IF TG_OP = 'INSERT' THEN\n    {_apply_delta_sql(spec, summary, spec.aggregate_select('new_rows'))}\n"
+        f"  ELSIF TG_OP = 'DELETE' THEN\n    {_apply_delta_sql(spec, summary, spec.aggregate_select('old_rows', '-'))}\n"
+        f"  ELSIF TG_OP = 'UPDATE' THEN\n    {_apply_delta_sql(spec, summary, regroup)}\n"
+        f"  ELSIF TG_OP = 'TRUNCATE' THEN\n    DELETE FROM {summary};\n"
+        f"  END IF;\n"
+        f"  RETURN NULL;\n"
+        f"END\n$fn$"
+    )
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _raw(conn, sql: str):
+    # Текст собран из заквотированных имён: без разбора :name и %
+    return conn.exec_driver_sql(sql, execution_options={"no_parameters": True})
+
+
+def install_triggers(conn, rollup: Rollup, spec: RollupSpec) -> None:
+    base = _quoted_table(conn, spec.base_table)
+    _raw(conn, _trigger_function_sql(rollup, spec))
+    names = _trigger_names(rollup)
+    # Transition tables допускаются только у триггера на одно событие
+    _raw(conn, f"CREATE TRIGGER {_ident(names['INSERT'])} AFTER INSERT ON {base} "
+               f"REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {_function(rollup)}()")
+    _raw(conn, f"CREATE TRIGGER {_ident(names['UPDATE'])} AFTER UPDATE ON {base} "
+               f"REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {_function(rollup)}()")
+    _raw(conn, f"CREATE TRIGGER {_ident(names['DELETE'])} AFTER DELETE ON {base} "
+               f"REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION {_function(rollup)}()")
+    _raw(conn, f"CREATE TRIGGER {_ident(names['TRUNCATE'])} AFTER TRUNCATE ON {base} "
+               f"FOR EACH STATEMENT EXECUTE FUNCTION {_function(rollup)}()")
+
+
+def drop_objects(conn, rollup: Rollup) -> None:
+    """Триггеры, функция и сводная таблица"""
+    base = conn.execute(text("SELECT to_regclass(:name)::text"), {"name": rollup.base_table}).scalar()
+    if base is not None:
+        for trigger in _trigger_names(rollup).values():
+            _raw(conn, f"DROP TRIGGER IF EXISTS {_ident(trigger)} ON {_quoted_table(conn, rollup.base_table)}")
+    _raw(conn, f"DROP FUNCTION IF EXISTS {_function(rollup)}()")
+    _raw(conn, f"DROP TABLE IF EXISTS {_summary(rollup)}")
+
+
+def rebuild(conn, rollup: Rollup, spec: RollupSpec) -> int:
+    """Пересобрать сводку целиком (DELETE + INSERT: читатели видят старую версию до коммита)"""
+    base = _quoted_table(conn, spec.base_table)
+    summary = _summary(rollup)
+    if rollup.mode == "trigger":
+        # Дельты из триггеров не должны перемешаться с пересборкой
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": rollup.summary_table})
+    _raw(conn, f"DELETE FROM {summary}")
+    result = _raw(conn, f"INSERT INTO {summary} {spec.aggregate_select(base)}")
+    return result.rowcount
+
+
+def delta_sync(conn, rollup: Rollup, spec: RollupSpec) -> Tuple[int, Optional[datetime]]:
+    """
+    Пересчитать группы строк с updated_column > watermark. Возвращает
+    (число пересчитанных групп, новая отметка).
+    """
+    base = _quoted_table(conn, spec.base_table)
+    summary = _summary(rollup)
+    column = _ident(rollup.updated_column)
+    until = _raw(conn, f"SELECT max({column}) FROM {base}").scalar()
+    if until is None or (rollup.watermark is not None and until <= rollup.watermark):
+        return 0, rollup.watermark
+    since = rollup.watermark
+    window = f"{column} <= :until" + (f" AND {column} > :since" if since is not None else "")
+    changed_keys = f"SELECT DISTINCT {', '.join(f'{e} AS {_ident(n)}' for e, n in zip(spec.dim_exprs(), spec.dim_columns))} FROM {base} WHERE {window}"
+    in_changed = " AND ".join(
+        f"{e} IS NOT DISTINCT FROM c.{_ident(n)}" for e, n in zip(spec.dim_exprs(), spec.dim_columns)
+    )
+    same = " AND ".join(f"s.{_ident(n)} IS NOT DISTINCT FROM c.{_ident(n)}" for n in spec.dim_columns)
+    params = {"until": until, "since": since}
+    keys = conn.execute(text(f"CREATE TEMP TABLE rollup_changed_keys ON COMMIT DROP AS {changed_keys}"), params)
+    conn.execute(text(f"DELETE FROM {summary} s USING rollup_changed_keys c WHERE {same}"))
+    source = f"(SELECT * FROM {base} WHERE EXISTS (SELECT 1 FROM rollup_changed_keys c WHERE {in_changed})) src"
+    conn.execute(text(f"INSERT INTO {summary} {spec.aggregate_select(source)}"))
+    return keys.rowcount, until
+
+
+def create_rollup(
+    db,
+    name: str,
+    base_table: str,
+    dimensions: Sequence[Dict[str, Any]],
+    measures: Sequence[Dict[str, Any]],
+    mode: str = "trigger",
+    updated_column: Optional[str] = None,
+    created_by: Optional[int] = None,
+    allow_stale: bool = False,
+) -> Rollup:
+    """Сводная таблица + начальное заполнение + триггеры. Коммит — за вызывающим."""
+    if not NAME_RE.match(name or ""):
+        raise RollupError("name must be a lowercase identifier")
+    if mode not in MODES:
+        raise RollupError(f"mode must be one of {', '.join(MODES)}")
+    spec = RollupSpec(base_table, dimensions, measures)
+    conn = db.connection()
+    base = _quoted_table(conn, spec.base_table)
+    columns = _table_columns(conn, spec.base_table)
+    missing = [c for c in spec.source_columns + ([updated_column.lower()] if updated_column else []) if c not in columns]
+    if missing:
+        raise RollupError(f"Columns not found in {spec.base_table}: {missing}")
+    if mode == "delta" and not updated_column:
+        raise RollupError("mode=delta requires updated_column")
+
+    rollup = Rollup(
+        name=name,
+        base_table=spec.base_table,
+        summary_table=summary_name(name),
+        mode=mode,
+        updated_column=updated_column.lower() if updated_column else None,
+        allow_stale=bool(allow_stale),
+        created_by=created_by,
+    )
+    started = time.perf_counter()
+    summary = _summary(rollup)
+    conn.execute(text(f"SET LOCAL statement_timeout = '{settings.MATVIEW_REFRESH_TIMEOUT}'"))
+    if mode == "delta":
+        rollup.watermark = _raw(conn, f"SELECT max({_ident(rollup.updated_column)}) FROM {base}").scalar()
+    _raw(conn, f"CREATE TABLE {summary} AS {spec.aggregate_select(base)}")
+    _raw(conn, f"CREATE INDEX {_ident(rollup.summary_table[:57] + '_dims')} ON {summary} "
+               f"({', '.join(_ident(c) for c in spec.dim_columns)})")
+
+    # Типы мер в сводке: при подмене запроса SUM по ним приводится обратно
+    summary_columns = _table_columns(conn, f"{settings.MATVIEW_SCHEMA}.{rollup.summary_table}")
+    spec.types = {m: summary_columns[m] for m in spec.measure_columns}
+    rollup.dimensions, rollup.measures = spec.to_json()
+    db.add(rollup)
+    db.flush()
+    if mode == "trigger":
+        install_triggers(conn, rollup, spec)
+
+    rollup.row_count = _raw(conn, f"SELECT count(*) FROM {summary}").scalar()
+    rollup.last_sync_at = rollup.last_full_at = _utcnow()
+    rollup.last_sync_ms = round((time.perf_counter() - started) * 1000, 1)
+    rollup.status = "ready"
+    prepared.invalidate()
+    logger.info(f"Rollup {name} created over {spec.base_table}: {rollup.row_count} groups in {rollup.last_sync_ms} ms")
+    return rollup
+
+
+def drop_rollup(db, rollup: Rollup) -> None:
+    drop_objects(db.connection(), rollup)
+    db.delete(rollup)
+    prepared.invalidate()
+
+
+def sync(rollup_id: int, full: bool = False) -> Dict[str, Any]:
+    """Синхронизация delta-сводки (или полная пересборка любой) на отдельном соединении"""
+    db = SessionLocal()
+    try:
+        rollup = db.query(Rollup).filter(Rollup.id == rollup_id).first()
+        if rollup is None:
+            raise RollupError(f"Rollup {rollup_id} not found")
+        spec = RollupSpec.from_model(rollup)
+        started = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"SET LOCAL statement_timeout = '{settings.MATVIEW_REFRESH_TIMEOUT}'"))
+                if full or rollup.mode == "trigger" or rollup.watermark is None:
+                    if rollup.mode == "delta":
+                        rollup.watermark = _raw(
+                            conn, f"SELECT max({_ident(rollup.updated_column)}) FROM {_quoted_table(conn, spec.base_table)}"
+                        ).scalar()
+                    groups = rebuild(conn, rollup, spec)
+                    rollup.last_full_at = _utcnow()
+                    kind = "full"
+                else:
+                    groups, rollup.watermark = delta_sync(conn, rollup, spec)
+                    kind = "delta"
+                rollup.row_count = _raw(conn, f"SELECT count(*) FROM {_summary(rollup)}").scalar()
+        except Exception as e:
+            rollup.status, rollup.last_error = "error", str(e)
+            db.commit()
+            registry.stats["sync_errors"] += 1
+            logger.warning(f"Rollup {rollup.name} sync failed: {e}")
+            return {"name": rollup.name, "synced": False, "error": str(e)}
+        rollup.status, rollup.last_error = "ready", None
+        rollup.last_sync_at = _utcnow()
+        rollup.last_sync_ms = round((time.perf_counter() - started) * 1000, 1)
+        db.commit()
+        registry.stats["syncs"] += 1
+        reload()
+        return {"name": rollup.name, "synced": True, "kind": kind, "groups": groups, "elapsed_ms": rollup.last_sync_ms}
+    finally:
+        db.close()
+
+
+# ========================================
+# Подмена агрегатных запросов
+# ========================================
+
+QUERY_RE = re.compile(
+    rf"^select\s+(?P<select>.+?)\s+from\s+(?P<table>{_NAME}(?:\.{_NAME})?)"
+    r"(?:\s+where\s+(?P<where>.+?))?\s+group\s+by\s+(?P<group>.+?)"
+    r"(?:\s+order\s+by\s+(?P<order>.+?))?"
+    r"(?:\s+limit\s+(?P<limit>\d+|:[a-z_][a-z0-9_]*))?$",
+    re.IGNORECASE | re.DOTALL,
+)
+ALIAS_RE = re.compile(rf"^(?P<expr>.+?)(?:\s+as\s+(?P<alias>{_NAME}))?$", re.IGNORECASE | re.DOTALL)
+TRUNC_RE = re.compile(rf"^date_trunc\(\s*'(?P<grain>[a-z]+)'\s*,\s*(?P<column>{_NAME})\s*\)$", re.IGNORECASE)
+AGG_RE = re.compile(rf"^(?P<agg>sum|count)\(\s*(?P<column>\*|{_NAME})\s*\)$", re.IGNORECASE)
+TOKEN_RE = re.compile(
+    r"'(?:[^']|'')*'|::\s*[a-z_][a-z0-9_]*|:[a-z_][a-z0-9_]*|\d+(?:\.\d+)?|[a-z_][a-z0-9_]*|\S",
+    re.IGNORECASE,
+)
+WHERE_KEYWORDS = {
+    "and", "or", "not", "in", "is", "null", "true", "false", "between", "like", "ilike",
+    "cast", "as", "any", "distinct", "from",
+}
+ORDER_KEYWORDS = {"asc", "desc", "nulls", "first", "last"}
+PG_DEFAULT_NAMES = {"sum": "sum", "count": "count"}
+
+
+def _split_top(s: str) -> List[str]:
+    """Разбить по запятым верхнего уровня (вне скобок и строк)"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(s):
+        if ch == "'":
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and ch == ",":
+            parts.append(s[start:i].strip())
+            start = i + 1
+    parts.append(s[start:].strip())
+    return parts
+
+
+def _parse_term(expr: str) -> Optional[Tuple]:
+    """("dim", колонка, зерно) | ("measure", agg, колонка) | None"""
+    expr = expr.strip()
+    if NAME_RE.match(expr):
+        return ("dim", expr.lower(), None)
+    m = TRUNC_RE.match(expr)
+    if m:
+        grain = m.group("grain").lower()
+        return ("dim", m.group("column").lower(), grain) if grain in GRAIN_SOURCES else None
+    m = AGG_RE.match(expr)
+    if m:
+        agg, column = m.group("agg").lower(), m.group("column").lower()
+        if column == "*" and agg != "count":
+            return None
+        return ("measure", agg, column)
+    return None
+
+
+class AggregateQuery:
+    """Распознанный простой агрегатный запрос"""
+
+    def __init__(self, table: str, items: List[Tuple[Tuple, str]], groups: List[Tuple],
+                 where: Optional[str], order: Optional[str], limit: Optional[str]):
+        self.table = table
+        self.items = items          # (терм, имя выходной колонки)
+        self.groups = groups        # термы измерений GROUP BY
+        self.where = where
+        self.order = order
+        self.limit = limit
+
+
+@lru_cache(maxsize=512)
+def parse_aggregate_query(sql: str) -> Optional[AggregateQuery]:
+    sql = sql.strip().rstrip(";").strip()
+    # Комментарии, идентификаторы в кавычках, $-строки, несколько запросов — не разбираем
+    if any(t in sql for t in ("--", "/*", '"', "$", ";")):
+        return None
+    m = QUERY_RE.match(sql)
+    if m is None:
+        return None
+    if re.search(r"\b(join|union|intersect|except|having|over|select|distinct|offset)\b",
+                 " ".join(m.group(g) or "" for g in ("select", "where", "group", "order")), re.IGNORECASE):
+        return None
+
+    items = []
+    for raw in _split_top(m.group("select")):
+        am = ALIAS_RE.match(raw)
+        term = _parse_term(am.group("expr")) if am else None
+        if term is None:
+            return None
+        if am.group("alias"):
+            name = am.group("alias").lower()
+        elif term[0] == "dim":
+            name = term[1] if term[2] is None else "date_trunc"
+        else:
+            name = PG_DEFAULT_NAMES[term[1]]
+        items.append((term, name))
+
+    groups = []
+    for raw in _split_top(m.group("group")):
+        if raw.isdigit():
+            idx = int(raw) - 1
+            if not 0 <= idx < len(items):
+                return None
+            term = items[idx][0]
+        else:
+            term = next((t for t, n in items if n == raw.lower() and t[0] == "dim"), None) or _parse_term(raw)
+        if term is None or term[0] != "dim":
+            return None
+        if term not in groups:
+            groups.append(term)
+    if any(t[0] == "dim" and t not in groups for t, _ in items):
+        return None
+    return AggregateQuery(m.group("table").lower(), items, groups, m.group("where"), m.group("order"), m.group("limit"))
+
+
+def _only_names(clause: str, allowed: set, keywords: set) -> bool:
+    """В выражении только разрешённые колонки, параметры, литералы и ключевые слова"""
+    tokens = TOKEN_RE.findall(clause)
+    for i, tok in enumerate(tokens):
+        low = tok.lower()
+        if tok.startswith("'") or tok.startswith(":") or tok[0].isdigit():
+            continue
+        if NAME_RE.match(tok):
+            following = tokens[i + 1] if i + 1 < len(tokens) else ""
+            previous = tokens[i - 1].lower() if i else ""
+            if previous == "as" or low in keywords:
+                continue
+            if following == "(" or low not in allowed:
+                return False
+        elif tok not in ("(", ")", ",", "=", "<", ">", "!", "+", "-", "*", "/", "%"):
+            return False
+    return True
+
+
+def match_rollup(query: AggregateQuery, rollup: Rollup, spec: RollupSpec) -> Optional[str]:
+    """SQL по сводке, отвечающий на запрос, или None"""
+    base = spec.base_table
+    if query.table != base and f"public.{query.table}" != base:
+        return None
+    by_column: Dict[str, List[Optional[str]]] = {}
+    for column, grain in spec.dimensions:
+        by_column.setdefault(column, []).append(grain)
+
+    def dim_expr(column: str, grain: Optional[str]) -> Optional[str]:
+        grains = by_column.get(column, [])
+        if grain is None:
+            return _ident(column) if None in grains else None
+        if grain in grains:
+            return _ident(spec.dim_column(column, grain))
+        if None in grains:
+            return f"date_trunc('{grain}', {_ident(column)})"
+        source = next((g for g in grains if g in GRAIN_SOURCES[grain]), None)
+        if source is None:
+            return None
+        return f"date_trunc('{grain}', {_ident(spec.dim_column(column, source))})"
+
+    measures = set(spec.measures)
+    select = []
+    for term, name in query.items:
+        if term[0] == "dim":
+            expr = dim_expr(term[1], term[2])
+        elif term[2] == "*":
+            expr = f"SUM({COUNT_COLUMN})::bigint"
+        elif (term[2], term[1]) in measures:
+            column = spec.measure_column(term[2], term[1])
+            cast = spec.types.get(column) or "numeric"
+            expr = f"SUM({_ident(column)})::{'bigint' if term[1] == 'count' else cast}"
+        else:
+            expr = None
+        if expr is None:
+            return None
+        select.append(f"{expr} AS {_ident(name)}")
+    groups = [dim_expr(c, g) for _, c, g in query.groups]
+    if any(g is None for g in groups):
+        return None
+
+    plain_dims = {c for c, g in spec.dimensions if g is None}
+    if query.where and not _only_names(query.where, plain_dims, WHERE_KEYWORDS):
+        return None
+    outputs = {name for _, name in query.items}
+    if query.order and not _only_names(query.order, outputs | plain_dims, ORDER_KEYWORDS):
+        return None
+
+    sql = f"SELECT {', '.join(select)} FROM {_summary(rollup)}"
+    if query.where:
+        sql += f" WHERE {query.where}"
+    sql += f" GROUP BY {', '.join(groups)}"
+    if query.order:
+        sql += f" ORDER BY {query.order}"
+    if query.limit:
+        sql += f" LIMIT {query.limit}"
+    return sql
+
+
+class RollupRegistry:
+    """Действующие сводки процесса (перечитываются из БД фоновой задачей)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rollups: List[Tuple[Rollup, RollupSpec]] = []
+        self.stats = {"rewrites": 0, "syncs": 0, "sync_errors": 0}
+
+    def load(self, rollups: Sequence[Rollup]) -> None:
+        loaded = []
+        for rollup in rollups:
+            try:
+                loaded.append((rollup, RollupSpec.from_model(rollup)))
+            except RollupError as e:
+                logger.warning(f"Rollup {rollup.name} skipped: {e}")
+        # Меньшая сводка — быстрее ответ
+        loaded.sort(key=lambda r: r[0].row_count or 0)
+        with self._lock:
+            self._rollups = loaded
+
+    def usable(self) -> List[Tuple[Rollup, RollupSpec]]:
+        with self._lock:
+            rollups = list(self._rollups)
+        now = _utcnow()
+        out = []
+        for rollup, spec in rollups:
+            if rollup.status != "ready":
+                continue
+            if rollup.mode == "delta":
+                # Delta не видит удалений и переходов между группами — только по согласию
+                if not rollup.allow_stale:
+                    continue
+                synced = rollup.last_sync_at
+                if synced is None:
+                    continue
+                if synced.tzinfo is None:
+                    synced = synced.replace(tzinfo=timezone.utc)
+                if (now - synced).total_seconds() > settings.ROLLUP_DELTA_MAX_LAG_SECONDS:
+                    continue
+            out.append((rollup, spec))
+        return out
+
+    def rewrite(self, sql: str) -> Optional[str]:
+        if not self._rollups:
+            return None
+        query = parse_aggregate_query(sql)
+        if query is None:
+            return None
+        for rollup, spec in self.usable():
+            rewritten = match_rollup(query, rollup, spec)
+            if rewritten is not None:
+                self.stats["rewrites"] += 1
+                return rewritten
+        return None
+
+
+registry = RollupRegistry()
+
+
+def rewrite(sql: str) -> Optional[str]:
+    """SQL по сводной таблице, если агрегатный запрос на неё ложится"""
+    return registry.rewrite(sql)
+
+
+def load_rollups() -> List[Rollup]:
+    db = SessionLocal()
+    try:
+        return db.query(Rollup).order_by(Rollup.id).all()
+    finally:
+        db.close()
+
+
+def reload() -> None:
+    registry.load(load_rollups())
+
+
+def describe(rollup: Rollup) -> Dict[str, Any]:
+    return {
+        "id": rollup.id,
+        "name": rollup.name,
+        "base_table": rollup.base_table,
+        "summary_table": f"{settings.MATVIEW_SCHEMA}.{rollup.summary_table}",
+        "dimensions": json.loads(rollup.dimensions),
+        "measures": json.loads(rollup.measures),
+        "mode": rollup.mode,
+        "updated_column": rollup.updated_column,
+        "allow_stale": bool(rollup.allow_stale),
+        "status": rollup.status,
+        "row_count": rollup.row_count,
+        "watermark": rollup.watermark,
+        "last_sync_at": rollup.last_sync_at,
+        "last_sync_ms": rollup.last_sync_ms,
+        "last_full_at": rollup.last_full_at,
+        "last_error": rollup.last_error,
+    }
+
+
+# ========================================
+# Фоновая задача delta-синхронизации
+# ========================================
+
+class DeltaJob(threading.Thread):
+    def __init__(self, stop: threading.Event, interval: float):
+        super().__init__(name="rollup-delta-job", daemon=True)
+        self.stop_event = stop
+        self.interval = interval
+
+    def tick(self) -> None:
+        rollups = load_rollups()
+        registry.load(rollups)
+        now = _utcnow()
+        for rollup in rollups:
+            if self.stop_event.is_set() or rollup.mode != "delta":
+                continue
+            full_at = rollup.last_full_at
+            if full_at is not None and full_at.tzinfo is None:
+                full_at = full_at.replace(tzinfo=timezone.utc)
+            full = full_at is None or (now - full_at).total_seconds() > settings.ROLLUP_FULL_REBUILD_SECONDS
+            sync(rollup.id, full=full)
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning(f"Rollup delta job error: {e}")
+
+
+_stop = threading.Event()
+_job: Optional[DeltaJob] = None
+
+
+def start() -> None:
+    global _job
+    _stop.clear()
+    try:
+        reload()
+    except Exception as e:
+        logger.warning(f"Rollups not loaded: {e}")
+    if settings.ROLLUP_JOB_SECONDS > 0 and (_job is None or not _job.is_alive()):
+        _job = DeltaJob(_stop, settings.ROLLUP_JOB_SECONDS)
+        _job.start()
+
+
+def stop() -> None:
+    _stop.set()
+
+
+def info() -> Dict[str, Any]:
+    return {"delta_job": bool(_job and _job.is_alive()), **registry.stats}
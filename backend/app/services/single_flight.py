@@ -0,0 +1,110 @@
+# backend/app/services/single_flight.py
+# Объединение одинаковых одновременных запросов (single-flight).
+#
+# Пока запрос с данным ключом (нормализованный SQL + параметры) выполняется,
+# повторные такие же запросы не идут в БД, а ждут результат первого
+# («ведущего»). Работа выполняется в пуле потоков на собственной сессии
+# отдельной задачей: если ведущий запрос отменён (клиент закрыл
+# соединение), остальные всё равно получают результат. Исключение
+# выполнения получают все ожидающие.
+
+from typing import Any, Callable, Dict
+import asyncio
+import hashlib
+import json
+import logging
+
+from starlette.concurrency import run_in_threadpool
+
+from app.services import sql_analysis
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Текст запроса для ключа: токены без комментариев и лишних пробелов
+    (app.services.sql_analysis), литералы и "идентификаторы" как есть.
+    Текст, который не разбирается, берётся без изменений.
+    """
+    analysis = sql_analysis.analyze(sql)
+    return sql.strip() if analysis.error else analysis.canonical.rstrip(";").rstrip()
+
+
+def flight_key(sql: str, params: Dict[str, Any], *extra: Any) -> str:
+    raw = json.dumps([normalize_sql(sql), params, *extra], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Реестр выполняемых запросов: ключ -> задача, общая для всех ожидающих"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.stats = {"leaders": 0, "coalesced": 0, "errors": 0, "cancelled_waiters": 0, "orphaned": 0}
+
+    def running(self, key: str) -> bool:
+        return key in self._inflight
+
+    async def run(self, key: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        Выполнить fn(*args) в пуле потоков или присоединиться к уже
+        выполняемому вызову с тем же ключом.
+        """
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is not asyncio.get_running_loop():
+            # Задача другого цикла событий (несколько циклов в процессе) — не общая
+            return await run_in_threadpool(fn, *args)
+        if task is None:
+            task = asyncio.ensure_future(run_in_threadpool(fn, *args))
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            self.stats["leaders"] += 1
+            task.add_done_callback(lambda t, key=key: self._done(key, t))
+        else:
+            self.stats["coalesced"] += 1
+        self._waiters[key] += 1
+        try:
+            # shield: отмена одного ожидающего не отменяет общую задачу
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                self.stats["cancelled_waiters"] += 1
+            raise
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            waiters = self._waiters.pop(key, 0)
+            del self._inflight[key]
+        else:
+            waiters = 0
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            # exception() заодно помечает исключение полученным (без "never retrieved")
+            self.stats["errors"] += 1
+        elif not waiters:
+            # Все ожидающие ушли раньше — результат никому не понадобился
+            self.stats["orphaned"] += 1
+
+    def info(self) -> Dict[str, Any]:
+        return {"inflight": len(self._inflight), "waiting": sum(self._waiters.values()), **self.stats}
+
+
+_flights: Dict[str, SingleFlight] = {}
+
+
+def get_flight(name: str) -> SingleFlight:
+    flight = _flights.get(name)
+    if flight is None:
+        flight = _flights[name] = SingleFlight(name)
+    return flight
+
+
+def info() -> Dict[str, Dict[str, Any]]:
+    return {name: flight.info() for name, flight in _flights.items()}
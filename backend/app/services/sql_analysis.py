@@ -0,0 +1,423 @@
+# backend/app/services/sql_analysis.py
+# Разбор текста SQL на токены и анализ запроса — один раз на текст
+# (кэш по строке), результат используют кэширование, single-flight,
+# журнал запросов, оценка стоимости и проверки прав.
+#
+# Токенизатор знает комментарии (-- и вложенные /* */), строки ('...',
+# E'...', $tag$...$tag$), идентификаторы в кавычках, bind-параметры
+# :name, оператор ::. Поэтому колонка copy_count или updated_at не
+# принимается за COPY/UPDATE, а точка с запятой в строке — за второй
+# оператор.
+#
+# Анализ (SQLAnalysis): число операторов, вид (для WITH — вид основного
+# оператора), изменяет ли запрос данные (в т.ч. WITH x AS (DELETE ...),
+# SELECT ... INTO, FOR UPDATE), таблицы, функции, есть ли LIMIT на
+# верхнем уровне, нормализованный текст без литералов и его отпечаток.
+# Незакрытые строки/комментарии и несбалансированные скобки — ошибка
+# разбора (error): такой запрос не считается читающим.
+# Это разбор токенов, а не грамматика: окончательное слово — за сервером.
+
+from functools import lru_cache
+from typing import FrozenSet, List, Optional, Tuple
+import hashlib
+import re
+
+WORD, QIDENT, STRING, NUMBER, PARAM, OP, PUNCT = "word", "qident", "string", "number", "param", "op", "punct"
+
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<space>\s+)
+    | (?P<line_comment>--[^\n]*)
+    | (?P<estring>[eE]'(?:[^'\\]|\\.|'')*')
+    | (?P<string>(?:[bBxXnN]|[uU]&)?'(?:[^']|'')*')
+    | (?P<qident>(?:[uU]&)?"(?:[^"]|"")*")
+    | (?P<dollar>\$(?:[A-Za-z_][A-Za-z0-9_]*)?\$)
+    | (?P<positional>\$\d+)
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<cast>::)
+    | (?P<param>:[A-Za-z_][A-Za-z0-9_]*)
+    | (?P<word>[A-Za-z_\u0080-￿][A-Za-z0-9_$\u0080-￿]*)
+    | (?P<punct>[(),;.\[\]])
+    | (?P<op>[-+*/<>=~!@#%^&|`?:]+)
+    """,
+    re.VERBOSE,
+)
+
+READ_KINDS = {"select", "values", "table"}
+# Операторы в скобках, которые делают WITH изменяющим данные
+MODIFYING_KINDS = {"insert", "update", "delete", "merge"}
+STATEMENT_KINDS = READ_KINDS | MODIFYING_KINDS
+# Слова, после которых "(" — не вызов функции
+NOT_FUNCTIONS = {
+    "in", "exists", "any", "all", "some", "values", "as", "on", "using", "over", "filter", "within",
+    "and", "or", "not", "select", "from", "where", "join", "lateral", "into", "table", "with", "when",
+    "then", "else", "case", "is", "between", "like", "ilike", "similar", "set", "returning", "by",
+    "group", "partition", "rows", "range", "groups", "distinct", "union", "intersect", "except",
+    "only", "array", "row", "cast", "materialized", "recursive", "conflict", "do", "window",
+    "grouping", "cube", "rollup", "sets", "limit", "offset", "having", "order",
+}
+# В этих функциях FROM — часть синтаксиса аргументов, а не список таблиц
+FROM_IN_ARGS = {"extract", "substring", "trim", "overlay", "position", "normalize"}
+FROM_END = {
+    "where", "group", "order", "limit", "offset", "having", "window", "union", "intersect", "except",
+    "join", "inner", "left", "right", "full", "cross", "natural", "on", "using", "returning", "for",
+    "fetch", "into", "set", "values", "select",
+}
+# Результат зависит не только от данных (не кэшировать)
+VOLATILE_WORDS = {
+    "now", "random", "clock_timestamp", "statement_timestamp", "transaction_timestamp", "timeofday",
+    "nextval", "currval", "setval", "current_date", "current_time", "current_timestamp", "localtime",
+    "localtimestamp", "txid_current", "pg_current_xact_id", "gen_random_uuid",
+}
+_UUID_GENERATE_RE = re.compile(r"^uuid_generate_v\d")
+_IDENT_RE = re.compile(r"^[a-z_][a-z0-9_$]*$")
+
+
+class Token:
+    __slots__ = ("kind", "value", "depth")
+
+    def __init__(self, kind: str, value: str, depth: int):
+        self.kind = kind
+        self.value = value
+        self.depth = depth
+
+    @property
+    def low(self) -> str:
+        return self.value.lower() if self.kind == WORD else self.value
+
+    def __repr__(self) -> str:
+        return f"Token({self.kind}, {self.value!r})"
+
+
+class SQLSyntaxError(ValueError):
+    """Незакрытая строка, комментарий или идентификатор"""
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Токены без пробелов и комментариев; depth — вложенность круглых скобок"""
+    tokens: List[Token] = []
+    depth, pos, n = 0, 0, len(sql)
+    while pos < n:
+        if sql.startswith("/*", pos):
+            # Вложенные блочные комментарии, как в PostgreSQL
+            level, i = 1, pos + 2
+            while level and i < n:
+                if sql.startswith("/*", i):
+                    level, i = level + 1, i + 2
+                elif sql.startswith("*/", i):
+                    level, i = level - 1, i + 2
+                else:
+                    i += 1
+            if level:
+                raise SQLSyntaxError("unterminated /* comment")
+            pos = i
+            continue
+        m = _TOKEN_RE.match(sql, pos)
+        if m is None:
+            ch = sql[pos]
+            if ch in "'\"":
+                raise SQLSyntaxError(f"unterminated {'string' if ch == chr(39) else 'quoted identifier'}")
+            tokens.append(Token(OP, ch, depth))
+            pos += 1
+            continue
+        kind = m.lastgroup
+        value = m.group()
+        pos = m.end()
+        if kind in ("space", "line_comment"):
+            continue
+        if kind == "dollar":
+            end = sql.find(value, pos)
+            if end < 0:
+                raise SQLSyntaxError("unterminated dollar-quoted string")
+            value = sql[m.start():end + len(value)]
+            pos = end + len(m.group())
+            kind = STRING
+        elif kind == "estring":
+            kind = STRING
+        elif kind in ("positional", "param"):
+            kind = PARAM
+        elif kind == "cast":
+            kind = OP
+        if value == ")":
+            depth = max(depth - 1, 0)
+        tokens.append(Token(kind, value, depth))
+        if value == "(":
+            depth += 1
+    return tokens
+
+
+def _paren_error(tokens: List[Token]) -> Optional[str]:
+    """
+    Лишняя ")" или незакрытая "(". Текст запроса подставляется в обёртки
+    (COPY (...) TO STDOUT, FROM (...) AS __src): лишняя скобка закрыла бы
+    обёртку и дописала к ней свой текст.
+    """
+    balance = 0
+    for t in tokens:
+        if t.kind != PUNCT:
+            continue
+        if t.value == "(":
+            balance += 1
+        elif t.value == ")":
+            balance -= 1
+            if balance < 0:
+                return "unbalanced parentheses: unexpected ')'"
+    return "unbalanced parentheses: missing ')'" if balance else None
+
+
+def _join(values: List[str]) -> str:
+    """Склеить токены в читаемый текст: без пробелов вокруг . :: и внутри скобок"""
+    out: List[str] = []
+    prev = ""
+    for v in values:
+        call = v == "(" and _IDENT_RE.match(prev) is not None and prev not in NOT_FUNCTIONS
+        if out and not call and v not in (")", ",", ".", "]", "::", "[", ";") and prev not in ("(", ".", "::", "["):
+            out.append(" ")
+        out.append(v)
+        prev = v
+    return "".join(out)
+
+
+def _collapse_lists(values: List[str]) -> List[str]:
+    """( ?, ?, ? ) -> (...) и ARRAY[?, ?] -> [...]"""
+    out: List[str] = []
+    i = 0
+    while i < len(values):
+        v = values[i]
+        if v in ("(", "[") and i + 2 < len(values) and values[i + 1] == "?":
+            close = ")" if v == "(" else "]"
+            j = i + 2
+            while j + 1 < len(values) and values[j] == "," and values[j + 1] == "?":
+                j += 2
+            if j < len(values) and values[j] == close and j > i + 2:
+                out += [v, "...", close]
+                i = j + 1
+                continue
+        out.append(v)
+        i += 1
+    return out
+
+
+_UNICODE_ESCAPE_RE = re.compile(r"\\(\\|[0-9A-Fa-f]{4}|\+[0-9A-Fa-f]{6})")
+
+
+def _unquote(value: str) -> str:
+    """Текст идентификатора в кавычках: "a""b" -> a"b, U&"\\0070g" -> pg"""
+    if value[0] != '"':
+        body = value[3:-1].replace('""', '"')
+        return _UNICODE_ESCAPE_RE.sub(lambda m: "\\" if m.group(1) == "\\" else chr(int(m.group(1).lstrip("+"), 16)), body)
+    return value[1:-1].replace('""', '"')
+
+
+def _qualified_name(tokens: List[Token], i: int) -> Tuple[Optional[str], int]:
+    """Имя вида a.b.c с позиции i: (имя в нижнем регистре для неквотированных, следующий индекс)"""
+    parts = []
+    while i < len(tokens) and tokens[i].kind in (WORD, QIDENT):
+        t = tokens[i]
+        parts.append(_unquote(t.value) if t.kind == QIDENT else t.value.lower())
+        if i + 2 < len(tokens) and tokens[i + 1].value == "." and tokens[i + 2].kind in (WORD, QIDENT):
+            i += 2
+            continue
+        i += 1
+        break
+    return (".".join(parts) if parts else None), i
+
+
+def _cte_names(tokens: List[Token]) -> set:
+    """Имена CTE (WITH name [(cols)] AS [NOT] [MATERIALIZED] (...), ...)"""
+    names = set()
+    for i, t in enumerate(tokens):
+        if t.low != "with" or t.kind != WORD:
+            continue
+        j = i + 1
+        if j < len(tokens) and tokens[j].low == "recursive":
+            j += 1
+        while j < len(tokens) and tokens[j].kind in (WORD, QIDENT):
+            name, j = _qualified_name(tokens, j)
+            depth = tokens[j - 1].depth
+            # Пропускаем список колонок, AS, MATERIALIZED и тело до закрывающей скобки
+            while j < len(tokens) and not (tokens[j].value == "(" and tokens[j - 1].low in ("as", "materialized")):
+                j += 1
+            j += 1
+            while j < len(tokens) and not (tokens[j].value == ")" and tokens[j].depth == depth):
+                j += 1
+            j += 1
+            names.add(name)
+            if j < len(tokens) and tokens[j].value == ",":
+                j += 1
+                continue
+            break
+    return names
+
+
+class SQLAnalysis:
+    """Результат разбора одного текста SQL (неизменяемый, общий через кэш)"""
+
+    __slots__ = ("sql", "error", "statement_count", "kind", "kinds", "modifies", "locking",
+                 "relations", "functions", "words", "has_limit", "normalized", "canonical", "fingerprint")
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.error: Optional[str] = None
+        try:
+            tokens = tokenize(sql)
+        except SQLSyntaxError as e:
+            self.error = str(e)
+            tokens = []
+        if self.error is None:
+            self.error = _paren_error(tokens)
+
+        statements: List[List[Token]] = [[]]
+        for t in tokens:
+            if t.value == ";" and t.kind == PUNCT:
+                statements.append([])
+            else:
+                statements[-1].append(t)
+        statements = [s for s in statements if s]
+        self.statement_count = len(statements)
+        self.kinds: Tuple[str, ...] = tuple(self._statement_kind(s) for s in statements)
+        self.kind = self.kinds[0] if self.kinds else ""
+
+        modifies = locking = False
+        for s in statements:
+            for i, t in enumerate(s):
+                if t.kind != WORD:
+                    continue
+                low = t.low
+                prev = s[i - 1].low if i else ""
+                if low in MODIFYING_KINDS and prev == "(":
+                    modifies = True     # WITH x AS (DELETE ... RETURNING ...)
+                elif low == "into" and t.depth == 0 and self._statement_kind(s) == "select":
+                    modifies = True     # SELECT ... INTO новая_таблица
+                elif low == "for" and i + 1 < len(s) and s[i + 1].low in ("update", "share", "no", "key"):
+                    locking = True
+        self.modifies = modifies or any(k not in READ_KINDS for k in self.kinds)
+        self.locking = locking
+
+        ctes = _cte_names(tokens)
+        relations, functions = set(), set()
+        words = set()
+        for s in statements:
+            self._references(s, ctes, relations, functions)
+            words.update(t.low for t in s if t.kind == WORD)
+        self.relations: FrozenSet[str] = frozenset(relations)
+        self.functions: FrozenSet[str] = frozenset(functions)
+        self.words: FrozenSet[str] = frozenset(words)
+
+        last = statements[-1] if statements else []
+        self.has_limit = any(
+            t.kind == WORD and t.depth == 0 and (t.low == "limit" or (t.low == "fetch" and i + 1 < len(last) and last[i + 1].low in ("first", "next")))
+            for i, t in enumerate(last)
+        )
+
+        masked = [("?" if t.kind in (STRING, NUMBER) else t.low) for t in tokens]
+        self.normalized = _join(_collapse_lists(masked)).rstrip(";").strip()
+        self.canonical = " ".join(t.low if t.kind == WORD else t.value for t in tokens)
+        self.fingerprint = hashlib.sha1(self.normalized.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _statement_kind(tokens: List[Token]) -> str:
+        i = 0
+        while i < len(tokens) and tokens[i].value == "(":
+            i += 1
+        if i >= len(tokens) or tokens[i].kind != WORD:
+            return ""
+        first = tokens[i].low
+        if first != "with":
+            return first
+        # Вид WITH — по первому оператору верхнего уровня после списка CTE
+        base = tokens[i].depth
+        for t in tokens[i + 1:]:
+            if t.kind == WORD and t.depth == base and t.low in STATEMENT_KINDS:
+                return t.low
+        return "with"
+
+    @staticmethod
+    def _references(tokens: List[Token], ctes: set, relations: set, functions: set) -> None:
+        owners: List[str] = []       # функция, которой принадлежит каждая открытая скобка
+        from_depths: List[int] = []  # открытые списки FROM (таблицы через запятую)
+
+        def table_ref(k: int, target: bool = False) -> int:
+            while k < len(tokens) and tokens[k].low in ("only", "lateral"):
+                k += 1
+            if k >= len(tokens) or tokens[k].kind not in (WORD, QIDENT):
+                return k
+            name, j = _qualified_name(tokens, k)
+            # У цели INSERT INTO t (...) в скобках — колонки, а не аргументы
+            if not target and j < len(tokens) and tokens[j].value == "(":
+                functions.add(name)      # FROM generate_series(...)
+            elif name not in ctes:
+                relations.add(name)
+            return j
+
+        i = 0
+        while i < len(tokens):
+            t = tokens[i]
+            prev = tokens[i - 1].low if i else ""
+            if t.value == "(":
+                owners.append(prev if i and tokens[i - 1].kind == WORD else "")
+            elif t.value == ")":
+                if owners:
+                    owners.pop()
+                while from_depths and from_depths[-1] > t.depth:
+                    from_depths.pop()
+            elif t.value == "," and from_depths and from_depths[-1] == t.depth:
+                i = table_ref(i + 1)
+                continue
+            elif t.kind == WORD:
+                low = t.low
+                if low == "from" and prev != "distinct" and not (owners and owners[-1] in FROM_IN_ARGS):
+                    while from_depths and from_depths[-1] >= t.depth:
+                        from_depths.pop()
+                    from_depths.append(t.depth)
+                    i = table_ref(i + 1)
+                    continue
+                if low == "join":
+                    if not from_depths or from_depths[-1] != t.depth:
+                        from_depths.append(t.depth)
+                    i = table_ref(i + 1)
+                    continue
+                if from_depths and from_depths[-1] == t.depth and low in FROM_END:
+                    from_depths.pop()
+                # Цель изменяющего оператора: INSERT INTO t, UPDATE t, TABLE t, TRUNCATE t
+                if ((low == "into" and prev in ("insert", "merge"))
+                        or (low in ("update", "table") and prev in ("", "(", "truncate"))
+                        or low == "truncate"):
+                    i = table_ref(i + 1, target=True)
+                    continue
+                if i + 1 < len(tokens) and low not in NOT_FUNCTIONS:
+                    name, j = _qualified_name(tokens, i)
+                    if j < len(tokens) and tokens[j].value == "(" and prev != ".":
+                        functions.add(name)
+                        i = j
+                        continue
+            elif t.kind == QIDENT and prev != ".":
+                # Вызов по имени в кавычках: "pg_sleep"(1), "pg_catalog"."pg_sleep"(1)
+                name, j = _qualified_name(tokens, i)
+                if j < len(tokens) and tokens[j].value == "(":
+                    functions.add(name)
+                    i = j
+                    continue
+            i += 1
+
+    @property
+    def is_read(self) -> bool:
+        """Один читающий оператор без изменения данных и блокировок строк"""
+        return (self.error is None and self.statement_count == 1 and self.kind in READ_KINDS
+                and not self.modifies and not self.locking)
+
+    @property
+    def function_names(self) -> FrozenSet[str]:
+        """Имена функций без схемы в нижнем регистре (pg_catalog."PG_SLEEP" -> pg_sleep)"""
+        return frozenset(f.rsplit(".", 1)[-1].lower() for f in self.functions)
+
+    @property
+    def volatile(self) -> bool:
+        """Результат зависит от времени/последовательностей, а не только от данных"""
+        names = self.words | self.function_names
+        return bool(names & VOLATILE_WORDS) or any(_UUID_GENERATE_RE.match(n) for n in names)
+
+
+@lru_cache(maxsize=4096)
+def analyze(sql: str) -> SQLAnalysis:
+    return SQLAnalysis(sql)
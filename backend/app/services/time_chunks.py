@@ -0,0 +1,290 @@
+# backend/app/services/time_chunks.py
+# Кэш запросов с диапазоном дат (p_date_from / p_date_to) по выровненным
+# кускам времени.
+#
+# Окно [p_date_from, p_date_to] режется на куски по дню или месяцу.
+# Целые куски берутся из кэша или запрашиваются отдельно (тот же SQL с
+# границами куска) и кэшируются; неполные края окна запрашиваются как
+# есть. Результаты кусков склеиваются:
+#   - mode="rows": строки кусков подряд (каждая строка попадает ровно
+#     в один кусок, если SQL фильтрует по p_date_from/p_date_to);
+#   - mode="additive": строки с одинаковыми group_by объединяются,
+#     меры складываются (sum/count) или берутся min/max.
+# Усреднения (avg) так склеить нельзя — для них нужен sum и count.
+#
+# Записи кэша связаны с таблицами запроса через app.services.invalidation.
+
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+import json
+import logging
+import threading
+
+from app.services import invalidation
+from app.services.query_cache import query_key
+
+logger = logging.getLogger(__name__)
+
+CACHE_NAME = "time_chunks"
+
+CHUNK_UNITS = ("day", "month")
+MODES = ("rows", "additive")
+MERGEABLE_AGGS = ("sum", "count", "min", "max")
+
+
+class TimeWindowError(ValueError):
+    """Некорректное описание time_window"""
+
+
+def parse_date(value: Any) -> Optional[date]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        raise TimeWindowError(f"Invalid date: {value!r}")
+
+
+def chunk_start(d: date, unit: str) -> date:
+    return d.replace(day=1) if unit == "month" else d
+
+
+def next_chunk(start: date, unit: str) -> date:
+    if unit == "day":
+        return start + timedelta(days=1)
+    return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def split_window(first: date, last: date, unit: str) -> List[Tuple[date, date, bool]]:
+    """
+    Закрытый интервал дней [first, last] -> куски (начало, последний день,
+    целый ли кусок). Целые куски выровнены по unit и кэшируются.
+    """
+    pieces = []
+    start = first
+    while start <= last:
+        aligned = chunk_start(start, unit)
+        end = next_chunk(aligned, unit) - timedelta(days=1)
+        whole = aligned == start and end <= last
+        pieces.append((start, min(end, last), whole))
+        start = min(end, last) + timedelta(days=1)
+    return pieces
+
+
+class TimeWindowSpec:
+    """
+    Описание окна из запроса:
+    {"chunk": "day"|"month", "mode": "rows"|"additive",
+     "bounds": "inclusive"|"exclusive", "group_by": [...],
+     "measures": {"amount": "sum", "cnt": "count"}}
+    bounds — как SQL сравнивает с p_date_to: <= (inclusive) или < (exclusive).
+    """
+
+    def __init__(self, raw: Dict[str, Any]):
+        if not isinstance(raw, dict):
+            raise TimeWindowError("time_window must be an object")
+        self.unit = str(raw.get("chunk", "day")).lower()
+        self.mode = str(raw.get("mode", "rows")).lower()
+        self.bounds = str(raw.get("bounds", "inclusive")).lower()
+        self.group_by = list(raw.get("group_by") or [])
+        self.measures = {str(k): str(v).lower() for k, v in (raw.get("measures") or {}).items()}
+        if self.unit not in CHUNK_UNITS:
+            raise TimeWindowError(f"chunk must be one of {', '.join(CHUNK_UNITS)}")
+        if self.mode not in MODES:
+            raise TimeWindowError(f"mode must be one of {', '.join(MODES)}")
+        if self.bounds not in ("inclusive", "exclusive"):
+            raise TimeWindowError("bounds must be 'inclusive' or 'exclusive'")
+        if self.mode == "additive":
+            if not self.measures:
+                raise TimeWindowError("additive mode requires measures")
+            bad = [f"{k}:{v}" for k, v in self.measures.items() if v not in MERGEABLE_AGGS]
+            if bad:
+                raise TimeWindowError(
+                    f"Measures {bad} cannot be merged across chunks (allowed: {', '.join(MERGEABLE_AGGS)}; "
+                    f"compute avg from sum and count)"
+                )
+
+    def digest(self) -> str:
+        return query_key(json.dumps([self.unit, self.mode, self.bounds], sort_keys=True), {})
+
+    def window(self, params: Dict[str, Any]) -> Optional[Tuple[date, date]]:
+        """Закрытый интервал дней окна или None (нет обеих границ)"""
+        first, bound = parse_date(params.get("p_date_from")), parse_date(params.get("p_date_to"))
+        if first is None or bound is None:
+            return None
+        last = bound - timedelta(days=1) if self.bounds == "exclusive" else bound
+        if last < first:
+            return None
+        return first, last
+
+    def piece_params(self, params: Dict[str, Any], first: date, last: date) -> Dict[str, Any]:
+        out = dict(params)
+        out["p_date_from"] = first.isoformat()
+        out["p_date_to"] = (last + timedelta(days=1) if self.bounds == "exclusive" else last).isoformat()
+        return out
+
+
+def merge_additive(parts: Sequence[Dict[str, Any]], spec: TimeWindowSpec) -> Dict[str, Any]:
+    columns = next((p["columns"] for p in parts if p.get("columns")), [])
+    missing = [c for c in spec.group_by + list(spec.measures) if c not in columns]
+    if columns and missing:
+        raise TimeWindowError(f"Columns not in result: {missing}")
+    merged: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+    for part in parts:
+        for row in part["data"]:
+            key = tuple(row.get(c) for c in spec.group_by)
+            acc = merged.get(key)
+            if acc is None:
+                merged[key] = dict(row)
+                continue
+            for col, agg in spec.measures.items():
+                a, b = acc.get(col), row.get(col)
+                if a is None or b is None:
+                    acc[col] = b if a is None else a
+                elif agg in ("sum", "count"):
+                    acc[col] = a + b
+                elif agg == "min":
+                    acc[col] = min(a, b)
+                else:
+                    acc[col] = max(a, b)
+    data = list(merged.values())
+    return {"columns": columns, "data": data, "row_count": len(data)}
+
+
+def merge_rows(parts: Sequence[Dict[str, Any]], max_rows: int) -> Tuple[Dict[str, Any], bool]:
+    columns = next((p["columns"] for p in parts if p.get("columns")), [])
+    data: List[Dict[str, Any]] = []
+    for part in parts:
+        data.extend(part["data"])
+    truncated = len(data) > max_rows
+    data = data[:max_rows]
+    return {"columns": columns, "data": data, "row_count": len(data)}, truncated
+
+
+class ChunkCache:
+    """LRU кусков: ключ (запрос без дат, режим, начало куска) -> {columns, data}"""
+
+    def __init__(self, memory_bytes: int):
+        self.memory_bytes = memory_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.used = 0
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        invalidation.index.register_cache(CACHE_NAME, self.invalidate_key)
+
+    def get(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key: Hashable, part: Dict[str, Any], size: int) -> bool:
+        if size > self.memory_bytes // 4:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            while self._entries and self.used + size > self.memory_bytes:
+                self._drop(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+            self._entries[key] = (part, size)
+            self.used += size
+        return True
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.used -= entry[1]
+            invalidation.index.forget(CACHE_NAME, key)
+
+    def invalidate_key(self, key: Hashable) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+                self.stats["invalidations"] += 1
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": len(self._entries), "used_bytes": self.used, "memory_bytes": self.memory_bytes, **self.stats}
+
+
+def run_windowed(
+    cache: ChunkCache,
+    conn,
+    sql: str,
+    params: Dict[str, Any],
+    spec: TimeWindowSpec,
+    run: Callable[[Dict[str, Any]], Dict[str, Any]],
+    max_rows: int,
+    max_queries: int,
+) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    Выполнить запрос по кускам окна. run(params) -> {columns, data} —
+    выполнение SQL с заданными границами. Возвращает (результат, сводку)
+    или None, если окно не задано или недостающих кусков слишком много
+    (тогда вызывающий выполняет запрос целиком).
+    """
+    window = spec.window(params)
+    if window is None:
+        return None
+    pieces = split_window(window[0], window[1], spec.unit)
+
+    # Ключ запроса без дат: SQL, остальные параметры, режим
+    rest = {k: v for k, v in params.items() if k not in ("p_date_from", "p_date_to")}
+    base = query_key(sql, rest) + spec.digest()
+
+    parts: List[Optional[Dict[str, Any]]] = []
+    todo: List[int] = []
+    for i, (first, _, whole) in enumerate(pieces):
+        part = cache.get((base, spec.unit, first)) if whole else None
+        parts.append(part)
+        if part is None:
+            todo.append(i)
+    if len(todo) > max_queries:
+        return None
+
+    since = invalidation.index.begin()
+    relations = invalidation.extractor.relations(conn, sql, params) if todo else None
+    for i in todo:
+        first, last, whole = pieces[i]
+        part = run(spec.piece_params(params, first, last))
+        parts[i] = part
+        if whole and relations is not None and not part.get("truncated"):
+            key = (base, spec.unit, first)
+            size = len(json.dumps(part["data"], default=str))
+            if cache.put(key, part, size) and not invalidation.index.track(CACHE_NAME, key, relations, since):
+                cache.invalidate_key(key)
+
+    if spec.mode == "additive":
+        result, truncated = merge_additive(parts, spec), any(p.get("truncated") for p in parts)
+    else:
+        result, truncated = merge_rows(parts, max_rows)
+        truncated = truncated or any(p.get("truncated") for p in parts)
+    summary = {
+        "chunk": spec.unit,
+        "chunks": len(pieces),
+        "cached": len(pieces) - len(todo),
+        "queried": len(todo),
+        "truncated": truncated,
+    }
+    return result, summary
+
+
+_cache: Optional[ChunkCache] = None
+
+
+def get_cache() -> ChunkCache:
+    global _cache
+    if _cache is None:
+        from app.config import settings
+        _cache = ChunkCache(settings.TIME_CHUNK_CACHE_MEMORY_MB * 1024 * 1024)
+    return _cache
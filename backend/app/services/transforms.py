@@ -0,0 +1,797 @@
+# backend/app/services/transforms.py
+# Декларативная постобработка результатов виджетов (props.transforms).
+#
+# Результат запроса превращается в набор колонок NumPy, к которому по
+# очереди применяются шаги спецификации:
+#
+#   {"op": "filter",    "where": [{"column": "status", "op": "=", "value": "Открыт"}], "mode": "and"}
+#   {"op": "filter",    "expr": "deposited_amount > 1000000 and status != 'Закрыт'"}
+#   {"op": "derive",    "column": "amount_k", "expr": "round(deposited_amount / 1000, 1)"}
+#   {"op": "aggregate", "group_by": ["construction_object_id"],
+#                       "measures": [{"column": "deposited_amount", "agg": "sum", "as": "total"}]}
+#   {"op": "pivot",     "index": ["construction_object_id"], "columns": "status",
+#                       "values": "deposited_amount", "agg": "sum"}
+#   {"op": "rolling",   "column": "total", "window": 3, "agg": "mean", "order_by": "month", "as": "total_ma3"}
+#   {"op": "top_n",     "n": 10, "by": "total", "desc": true}
+#   {"op": "sort",      "by": [{"column": "month", "desc": false}]}
+#   {"op": "join",      "with": "<widget id>", "on": ["construction_object_id"], "how": "left"}
+#   {"op": "select",    "columns": ["construction_object_id", "total"]}
+#   {"op": "rename",    "columns": {"total": "Сумма"}}
+#
+# Все шаги работают над целыми колонками (маски, bincount, argsort), без
+# построчных циклов на Python там, где это позволяет тип данных.
+
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import ast
+
+import numpy as np
+
+# Верхняя граница шагов в одной спецификации
+MAX_STEPS = 50
+
+
+class TransformError(ValueError):
+    """Некорректная спецификация или неприменимый к данным шаг"""
+
+
+# ========================================
+# Колоночный фрейм
+# ========================================
+
+def to_array(values: Sequence[Any]) -> np.ndarray:
+    """
+    Список значений -> массив NumPy. Целые без NULL -> int64, целые с NULL
+    -> object (int и None: id не должны превращаться в 123.0), дробные с
+    NULL -> float64 (NULL = NaN), bool -> bool, остальное -> object.
+    """
+    kinds = set(map(type, values))
+    has_null = type(None) in kinds
+    kinds.discard(type(None))
+    if kinds and kinds <= {bool}:
+        if not has_null:
+            return np.array(values, dtype=bool)
+        return np.array(values, dtype=object)
+    if kinds == {int} and not has_null:
+        return np.array(values, dtype=np.int64)
+    if kinds and kinds <= {int, float} and kinds != {int}:
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = list(values)
+    return arr
+
+
+def is_nullable_int(arr: np.ndarray) -> bool:
+    """object-колонка из целых и NULL (см. to_array)"""
+    return arr.dtype == object and len(arr) > 0 and all(
+        v is None or (isinstance(v, int) and not isinstance(v, bool)) for v in arr
+    )
+
+
+def comparable(arr: Any) -> Any:
+    """
+    Операнд арифметики и сравнений: целые с NULL -> float64 с NaN, чтобы
+    NULL давал NaN/False, а не TypeError. Остальное — как есть.
+    """
+    if isinstance(arr, np.ndarray) and is_nullable_int(arr):
+        return np.array([np.nan if v is None else v for v in arr], dtype=np.float64)
+    return arr
+
+
+def null_mask(arr: np.ndarray) -> np.ndarray:
+    if arr.dtype.kind == "f":
+        return np.isnan(arr)
+    if arr.dtype == object:
+        return np.fromiter((v is None or (isinstance(v, float) and v != v) for v in arr), bool, len(arr))
+    return np.zeros(len(arr), dtype=bool)
+
+
+def to_python(arr: np.ndarray) -> List[Any]:
+    """Массив -> list с NaN, заменёнными на None (JSON не принимает NaN)"""
+    if arr.dtype.kind == "f":
+        nan = np.isnan(arr)
+        if nan.any():
+            out = arr.astype(object)
+            out[nan] = None
+            return out.tolist()
+    return arr.tolist()
+
+
+class Frame:
+    """Упорядоченный набор колонок одинаковой длины"""
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+
+    @property
+    def names(self) -> List[str]:
+        return list(self.columns)
+
+    def __len__(self) -> int:
+        for arr in self.columns.values():
+            return len(arr)
+        return 0
+
+    def col(self, name: str) -> np.ndarray:
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise TransformError(f"Unknown column '{name}'")
+
+    def take(self, idx: np.ndarray) -> "Frame":
+        return Frame({k: v[idx] for k, v in self.columns.items()})
+
+    @classmethod
+    def from_records(cls, columns: Sequence[str], records: Sequence[Dict[str, Any]]) -> "Frame":
+        return cls({c: to_array([r.get(c) for r in records]) for c in columns})
+
+    @classmethod
+    def from_rows(cls, columns: Sequence[str], rows: Sequence[Sequence[Any]]) -> "Frame":
+        cols = list(zip(*rows)) if rows else [() for _ in columns]
+        return cls({c: to_array(list(v)) for c, v in zip(columns, cols)})
+
+    @classmethod
+    def from_result(cls, result: Dict[str, Any]) -> "Frame":
+        """{columns, data} в формате SQLResult; data — словари или списки"""
+        columns = list(result.get("columns") or [])
+        data = result.get("data") or []
+        if data and not isinstance(data[0], dict):
+            return cls.from_rows(columns, data)
+        if not columns and data:
+            columns = list(data[0].keys())
+        return cls.from_records(columns, data)
+
+    def to_result(self) -> Dict[str, Any]:
+        names = self.names
+        cols = [to_python(self.columns[n]) for n in names]
+        data = [dict(zip(names, row)) for row in zip(*cols)]
+        return {"columns": names, "data": data, "row_count": len(data)}
+
+
+# ========================================
+# Вспомогательные векторные операции
+# ========================================
+
+def factorize(arr: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Коды (int64) и уникальные значения. NULL — отдельная группа."""
+    if arr.dtype.kind in "iub":
+        uniques, codes = np.unique(arr, return_inverse=True)
+        return codes.astype(np.int64), uniques
+    if arr.dtype.kind == "f":
+        nan = np.isnan(arr)
+        if not nan.any():
+            uniques, codes = np.unique(arr, return_inverse=True)
+            return codes.astype(np.int64), uniques
+        uniques, codes = np.unique(arr[~nan], return_inverse=True)
+        out = np.full(len(arr), len(uniques), dtype=np.int64)
+        out[~nan] = codes
+        return out, np.append(uniques.astype(object), None)
+    mapping: Dict[Any, int] = {}
+    codes = np.fromiter((mapping.setdefault(v, len(mapping)) for v in arr), np.int64, len(arr))
+    uniques = np.empty(len(mapping), dtype=object)
+    uniques[:] = list(mapping)
+    return codes, uniques
+
+
+def group_ids(frame: Frame, keys: Sequence[str]) -> Tuple[np.ndarray, int, List[np.ndarray]]:
+    """
+    Номер группы для каждой строки по набору колонок. Возвращает коды,
+    число групп и значения ключей для каждой группы.
+    """
+    n = len(frame)
+    if not keys:
+        return np.zeros(n, dtype=np.int64), (1 if n else 0), []
+    combined = np.zeros(n, dtype=np.int64)
+    for key in keys:
+        codes, uniques = factorize(frame.col(key))
+        combined = combined * max(1, len(uniques)) + codes
+        if len(keys) > 1:
+            # сжимаем коды после каждой колонки, чтобы произведение не переполнило int64
+            uniq, combined = np.unique(combined, return_inverse=True)
+            combined = combined.astype(np.int64)
+    uniq, first_idx, inverse = np.unique(combined, return_index=True, return_inverse=True)
+    key_values = [frame.col(k)[first_idx] for k in keys]
+    return inverse.astype(np.int64), len(uniq), key_values
+
+
+def sort_key(arr: np.ndarray, desc: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """Числовой ключ сортировки и признак NULL (NULL всегда в конце)"""
+    nulls = null_mask(arr)
+    if arr.dtype.kind in "iufb":
+        key = arr.astype(np.float64)
+        key = np.where(nulls, 0.0, key)
+    else:
+        present = sorted({v for v, is_null in zip(arr, nulls) if not is_null}, key=_orderable)
+        rank = {v: i for i, v in enumerate(present)}
+        key = np.fromiter((0 if is_null else rank[v] for v, is_null in zip(arr, nulls)), np.float64, len(arr))
+    return (-key if desc else key), nulls
+
+
+def _orderable(v: Any):
+    # смешанные типы в object-колонке сравниваем сначала по типу
+    return (isinstance(v, str), v if not isinstance(v, (dict, list)) else str(v))
+
+
+def order_index(frame: Frame, by: Sequence[Tuple[str, bool]]) -> np.ndarray:
+    keys = []
+    for name, desc in reversed(list(by)):
+        key, nulls = sort_key(frame.col(name), desc)
+        keys.extend([key, nulls])
+    if not keys:
+        return np.arange(len(frame))
+    return np.lexsort(keys)
+
+
+def cumcount(sorted_groups: np.ndarray) -> np.ndarray:
+    """Номер строки внутри группы для массива кодов, отсортированного по группе"""
+    n = len(sorted_groups)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    start_idx = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+    return np.arange(n) - start_idx
+
+
+def _numeric(arr: np.ndarray, name: str) -> np.ndarray:
+    if arr.dtype.kind in "iufb":
+        return arr.astype(np.float64)
+    try:
+        return np.array([np.nan if v is None else float(v) for v in arr], dtype=np.float64)
+    except (TypeError, ValueError):
+        raise TransformError(f"Column '{name}' is not numeric")
+
+
+# ========================================
+# Агрегаты
+# ========================================
+
+AGGREGATIONS = ("sum", "avg", "mean", "count", "count_distinct", "min", "max")
+
+
+def aggregate_column(values: np.ndarray, name: str, agg: str, gid: np.ndarray, ngroups: int) -> np.ndarray:
+    agg = agg.lower()
+    if agg not in AGGREGATIONS:
+        raise TransformError(f"Unsupported aggregation '{agg}'")
+    valid = ~null_mask(values)
+    if agg == "count":
+        return np.bincount(gid[valid], minlength=ngroups).astype(np.int64)
+    if agg == "count_distinct":
+        codes, uniques = factorize(values[valid])
+        pairs = np.unique(gid[valid] * max(1, len(uniques)) + codes)
+        return np.bincount(pairs // max(1, len(uniques)), minlength=ngroups).astype(np.int64)
+    if agg in ("min", "max") and values.dtype == object:
+        best: Dict[int, Any] = {}
+        pick = min if agg == "min" else max
+        for g, v in zip(gid[valid], values[valid]):
+            best[g] = v if g not in best else pick(best[g], v)
+        out = np.empty(ngroups, dtype=object)
+        out[:] = [best.get(g) for g in range(ngroups)]
+        return out
+
+    nums = _numeric(values, name)
+    valid = ~np.isnan(nums)
+    counts = np.bincount(gid[valid], minlength=ngroups)
+    if agg == "sum":
+        # как SUM в SQL: группа из одних NULL даёт NULL, а не 0
+        sums = np.bincount(gid[valid], weights=nums[valid], minlength=ngroups)
+        return np.where(counts > 0, sums, np.nan)
+    if agg in ("avg", "mean"):
+        sums = np.bincount(gid[valid], weights=nums[valid], minlength=ngroups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    out = np.full(ngroups, np.inf if agg == "min" else -np.inf)
+    (np.minimum if agg == "min" else np.maximum).at(out, gid[valid], nums[valid])
+    out[counts == 0] = np.nan
+    return out
+
+
+# ========================================
+# Выражения (derive / filter expr)
+# ========================================
+
+def _date_part(part: str) -> Callable[[np.ndarray], np.ndarray]:
+    slices = {"year": (0, 4), "month": (5, 7), "day": (8, 10)}
+
+    def fn(arr: np.ndarray) -> np.ndarray:
+        a, b = slices[part]
+        out = []
+        for v in arr:
+            if v is None:
+                out.append(np.nan)
+            elif hasattr(v, part):
+                out.append(getattr(v, part))
+            else:
+                out.append(int(str(v)[a:b]))
+        return np.array(out, dtype=np.float64)
+    return fn
+
+
+def _date_trunc(unit: str, arr: np.ndarray) -> np.ndarray:
+    cut = {"year": 4, "month": 7, "day": 10}.get(str(unit).lower())
+    if cut is None:
+        raise TransformError("date_trunc unit must be 'year', 'month' or 'day'")
+    pad = {4: "-01-01", 7: "-01", 10: ""}[cut]
+    out = np.empty(len(arr), dtype=object)
+    out[:] = [None if v is None else (v.isoformat() if hasattr(v, "isoformat") else str(v))[:cut] + pad for v in arr]
+    return out
+
+
+def _as_array(v: Any, n: int) -> np.ndarray:
+    if isinstance(v, np.ndarray):
+        return v
+    if isinstance(v, (list, tuple)):
+        return to_array(list(v))
+    return np.full(n, v, dtype=object if isinstance(v, str) or v is None else None)
+
+
+def _isin(arr: np.ndarray, values: Sequence[Any]) -> np.ndarray:
+    if arr.dtype == object:
+        allowed = set(values)
+        return np.fromiter((v in allowed for v in arr), bool, len(arr))
+    return np.isin(arr, list(values))
+
+
+def _str_map(fn: Callable[[str], Any]) -> Callable[[np.ndarray], np.ndarray]:
+    def apply(arr: np.ndarray) -> np.ndarray:
+        out = np.empty(len(arr), dtype=object)
+        out[:] = [None if v is None else fn(str(v)) for v in arr]
+        return out
+    return apply
+
+
+def _math(fn: Callable[..., Any]) -> Callable[..., Any]:
+    return lambda x, *args: fn(comparable(x), *args)
+
+
+FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "abs": _math(np.abs),
+    "round": _math(lambda x, n=0: np.round(x, int(n))),
+    "floor": _math(np.floor),
+    "ceil": _math(np.ceil),
+    "sqrt": _math(np.sqrt),
+    "log": _math(np.log),
+    "exp": _math(np.exp),
+    "where": np.where,
+    "isnull": null_mask,
+    "notnull": lambda x: ~null_mask(x),
+    "coalesce": lambda a, b: np.where(null_mask(a), b, a),
+    "num": lambda x: _numeric(x, "num()"),
+    "lower": _str_map(str.lower),
+    "upper": _str_map(str.upper),
+    "year": _date_part("year"),
+    "month": _date_part("month"),
+    "day": _date_part("day"),
+    "date_trunc": _date_trunc,
+}
+
+_BIN_OPS = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply,
+    ast.Div: np.true_divide, ast.FloorDiv: np.floor_divide, ast.Mod: np.mod, ast.Pow: np.power,
+}
+_CMP_OPS = {
+    ast.Eq: lambda a, b: a == b, ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b, ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b, ast.GtE: lambda a, b: a >= b,
+}
+
+
+@lru_cache(maxsize=512)
+def compile_expr(expr: str) -> Callable[[Frame], Any]:
+    """
+    Разобрать выражение один раз (кэш по тексту) в дерево замыканий над
+    колонками. Разрешены: арифметика, сравнения, and/or/not, in [...],
+    имена колонок, литералы и функции из FUNCTIONS.
+    """
+    try:
+        tree = ast.parse(expr, mode="eval").body
+    except SyntaxError as e:
+        raise TransformError(f"Invalid expression '{expr}': {e.msg}")
+    return _compile_node(tree)
+
+
+def _compile_node(node: ast.AST) -> Callable[[Frame], Any]:
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda f: value
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in ("true", "True"):
+            return lambda f: True
+        if name in ("false", "False"):
+            return lambda f: False
+        if name in ("null", "None"):
+            return lambda f: None
+        return lambda f: f.col(name)
+    if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == "col":
+        # col['имя с пробелами']
+        key = node.slice.value if isinstance(node.slice, ast.Constant) else None
+        if not isinstance(key, str):
+            raise TransformError("col[...] expects a string column name")
+        return lambda f: f.col(key)
+    if isinstance(node, (ast.List, ast.Tuple)):
+        items = [_compile_node(e) for e in node.elts]
+        return lambda f: [i(f) for i in items]
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        op, left, right = _BIN_OPS[type(node.op)], _compile_node(node.left), _compile_node(node.right)
+
+        def binop(f):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return op(comparable(left(f)), comparable(right(f)))
+        return binop
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand)
+        if isinstance(node.op, ast.USub):
+            return lambda f: np.negative(comparable(operand(f)))
+        if isinstance(node.op, ast.Not):
+            return lambda f: np.logical_not(operand(f))
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile_node(v) for v in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+
+        def boolop(f):
+            result = parts[0](f)
+            for p in parts[1:]:
+                result = combine(result, p(f))
+            return result
+        return boolop
+    if isinstance(node, ast.Compare):
+        left = _compile_node(node.left)
+        steps = []
+        for op, comp in zip(node.ops, node.comparators):
+            if isinstance(op, ast.In):
+                fn = _isin
+            elif isinstance(op, ast.NotIn):
+                fn = lambda a, b: ~_isin(a, b)
+            elif type(op) in _CMP_OPS:
+                fn = _CMP_OPS[type(op)]
+            else:
+                raise TransformError(f"Unsupported comparison {type(op).__name__}")
+            steps.append((fn, _compile_node(comp)))
+
+        def compare(f):
+            a = comparable(left(f))
+            result = None
+            for fn, right in steps:
+                b = comparable(right(f))
+                r = fn(a, b)
+                result = r if result is None else np.logical_and(result, r)
+                a = b
+            return result
+        return compare
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS:
+        fn = FUNCTIONS[node.func.id]
+        args = [_compile_node(a) for a in node.args]
+        return lambda f: fn(*[a(f) for a in args])
+    raise TransformError(f"Unsupported expression element: {ast.dump(node)[:60]}")
+
+
+def evaluate(expr: str, frame: Frame) -> np.ndarray:
+    value = compile_expr(expr)(frame)
+    arr = _as_array(value, len(frame))
+    if arr.dtype == object and len(arr) and all(isinstance(v, (bool, np.bool_)) for v in arr):
+        arr = arr.astype(bool)
+    return arr
+
+
+# ========================================
+# Шаги пайплайна
+# ========================================
+
+# Операторы сравнения: для них целые с NULL сравниваются как float64
+COMPARE_OPS = ("=", "==", "!=", "<>", ">", ">=", "<", "<=")
+
+FILTER_OPS = {
+    "=": lambda a, v: a == v, "==": lambda a, v: a == v, "!=": lambda a, v: a != v,
+    "<>": lambda a, v: a != v, ">": lambda a, v: a > v, ">=": lambda a, v: a >= v,
+    "<": lambda a, v: a < v, "<=": lambda a, v: a <= v,
+    "in": lambda a, v: _isin(a, v if isinstance(v, list) else [v]),
+    "not_in": lambda a, v: ~_isin(a, v if isinstance(v, list) else [v]),
+    "is_null": lambda a, v: null_mask(a),
+    "not_null": lambda a, v: ~null_mask(a),
+    "contains": lambda a, v: np.fromiter((x is not None and str(v).lower() in str(x).lower() for x in a), bool, len(a)),
+}
+
+
+def _mask(frame: Frame, step: Dict[str, Any]) -> np.ndarray:
+    masks = []
+    for cond in step.get("where") or []:
+        op = str(cond.get("op", "=")).lower()
+        if op not in FILTER_OPS:
+            raise TransformError(f"Unsupported filter operator '{op}'")
+        arr = frame.col(cond.get("column"))
+        if op in COMPARE_OPS:
+            arr = comparable(arr)
+        value = cond.get("value")
+        if arr.dtype.kind in "iuf" and isinstance(value, str) and op not in ("contains",):
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        with np.errstate(invalid="ignore"):
+            masks.append(np.asarray(FILTER_OPS[op](arr, value), dtype=bool))
+    if step.get("expr"):
+        masks.append(np.asarray(evaluate(step["expr"], frame), dtype=bool))
+    if not masks:
+        return np.ones(len(frame), dtype=bool)
+    combine = np.logical_or if str(step.get("mode", "and")).lower() == "or" else np.logical_and
+    result = masks[0]
+    for m in masks[1:]:
+        result = combine(result, m)
+    return result
+
+
+def step_filter(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    return frame.take(np.flatnonzero(_mask(frame, step)))
+
+
+def step_derive(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    name = step.get("column") or step.get("as")
+    if not name or not step.get("expr"):
+        raise TransformError("derive requires 'column' and 'expr'")
+    columns = dict(frame.columns)
+    columns[name] = evaluate(step["expr"], frame)
+    return Frame(columns)
+
+
+def _measures(step: Dict[str, Any]) -> List[Dict[str, Any]]:
+    measures = step.get("measures") or []
+    if not measures:
+        raise TransformError("aggregate requires at least one measure")
+    return measures
+
+
+def step_aggregate(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    keys = list(step.get("group_by") or [])
+    gid, ngroups, key_values = group_ids(frame, keys)
+    columns: Dict[str, np.ndarray] = dict(zip(keys, key_values))
+    for m in _measures(step):
+        col, agg = m.get("column"), str(m.get("agg", "sum")).lower()
+        values = frame.col(col) if col not in (None, "*") else np.zeros(len(frame))
+        alias = m.get("as") or (f"{agg}_{col}" if col not in (None, "*") else agg)
+        columns[alias] = aggregate_column(values, str(col), agg, gid, ngroups)
+    return Frame(columns)
+
+
+def step_pivot(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    index = list(step.get("index") or [])
+    pivot_col, values_col = step.get("columns"), step.get("values")
+    if not pivot_col or not values_col:
+        raise TransformError("pivot requires 'columns' and 'values'")
+    agg = str(step.get("agg", "sum")).lower()
+
+    row_gid, nrows, row_keys = group_ids(frame, index)
+    col_codes, col_values = factorize(frame.col(pivot_col))
+    ncols = len(col_values)
+    cell_gid = row_gid * max(1, ncols) + col_codes
+    cells = aggregate_column(frame.col(values_col), values_col, agg, cell_gid, nrows * max(1, ncols))
+
+    columns: Dict[str, np.ndarray] = dict(zip(index, row_keys))
+    present = np.bincount(cell_gid, minlength=nrows * max(1, ncols)) > 0
+    grid = cells.reshape(nrows, max(1, ncols)) if nrows else cells.reshape(0, max(1, ncols))
+    mask = present.reshape(grid.shape)
+    for j, value in enumerate(col_values):
+        column = grid[:, j]
+        if not mask[:, j].all():
+            # пустая ячейка — NULL; целые (count) остаются целыми
+            if column.dtype.kind == "f":
+                column = np.where(mask[:, j], column, np.nan)
+            else:
+                column = column.astype(object)
+                column[~mask[:, j]] = None
+        columns["null" if value is None else str(value)] = column
+    return Frame(columns)
+
+
+def step_rolling(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    col = step.get("column")
+    window = int(step.get("window") or 0)
+    agg = str(step.get("agg", "mean")).lower()
+    if not col or window < 1:
+        raise TransformError("rolling requires 'column' and 'window' >= 1")
+    if agg not in ("mean", "avg", "sum", "min", "max"):
+        raise TransformError(f"Unsupported rolling aggregation '{agg}'")
+    partition = list(step.get("partition_by") or [])
+    order_by = step.get("order_by")
+
+    by = [(p, False) for p in partition] + ([(order_by, False)] if order_by else [])
+    order = order_index(frame, by) if by else np.arange(len(frame))
+    values = _numeric(frame.col(col), col)[order]
+    gid = group_ids(frame, partition)[0][order] if partition else np.zeros(len(order), dtype=np.int64)
+    pos = cumcount(gid)
+    n = len(values)
+
+    if agg in ("mean", "avg", "sum"):
+        filled = np.where(np.isnan(values), 0.0, values)
+        cs = np.r_[0.0, np.cumsum(filled)]
+        cnt = np.r_[0, np.cumsum(~np.isnan(values))]
+        idx = np.arange(n)
+        lo = idx - np.minimum(pos, window - 1)
+        sums = cs[idx + 1] - cs[lo]
+        counts = cnt[idx + 1] - cnt[lo]
+        if agg == "sum":
+            out = sums
+        else:
+            with np.errstate(invalid="ignore", divide="ignore"):
+                out = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    else:
+        padded = np.r_[np.full(window - 1, np.nan), values]
+        windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+        # значения из предыдущей партиции не должны попасть в окно
+        offsets = np.arange(window - 1, -1, -1)
+        outside = offsets[None, :] > pos[:, None]
+        windows = np.where(outside, np.nan, windows)
+        with np.errstate(invalid="ignore"), _quiet_nan():
+            out = np.nanmin(windows, axis=1) if agg == "min" else np.nanmax(windows, axis=1)
+
+    result = np.empty(n, dtype=np.float64)
+    result[order] = out
+    columns = dict(frame.columns)
+    columns[step.get("as") or f"{col}_{agg}_{window}"] = result
+    return Frame(columns)
+
+
+class _quiet_nan:
+    """nanmin/nanmax по окну из одних NaN выдают RuntimeWarning — он ожидаем"""
+
+    def __enter__(self):
+        import warnings
+        self._ctx = warnings.catch_warnings()
+        self._ctx.__enter__()
+        warnings.simplefilter("ignore", RuntimeWarning)
+
+    def __exit__(self, *exc):
+        return self._ctx.__exit__(*exc)
+
+
+def _sort_spec(step: Dict[str, Any]) -> List[Tuple[str, bool]]:
+    by = step.get("by")
+    if isinstance(by, str):
+        return [(by, bool(step.get("desc", False)))]
+    spec = []
+    for item in by or []:
+        if isinstance(item, str):
+            spec.append((item, False))
+        else:
+            spec.append((item.get("column"), bool(item.get("desc", False))))
+    if not spec:
+        raise TransformError("sort/top_n requires 'by'")
+    return spec
+
+
+def step_sort(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    return frame.take(order_index(frame, _sort_spec(step)))
+
+
+def step_top_n(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    n = int(step.get("n") or 10)
+    if "desc" not in step and isinstance(step.get("by"), str):
+        step = {**step, "desc": True}
+    partition = list(step.get("partition_by") or [])
+    order = order_index(frame, [(p, False) for p in partition] + _sort_spec(step))
+    if not partition:
+        return frame.take(order[:n])
+    gid = group_ids(frame, partition)[0][order]
+    return frame.take(order[cumcount(gid) < n])
+
+
+def step_join(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    other_name = step.get("with")
+    if other_name not in inputs:
+        raise TransformError(f"join: unknown input '{other_name}'")
+    right: Frame = inputs[other_name]
+    on = step.get("on")
+    on = [on] if isinstance(on, str) else list(on or [])
+    if not on:
+        raise TransformError("join requires 'on'")
+    how = str(step.get("how", "inner")).lower()
+    if how not in ("inner", "left"):
+        raise TransformError("join 'how' must be 'inner' or 'left'")
+    suffix = step.get("suffix") or "_right"
+
+    nl, nr = len(frame), len(right)
+    combined = Frame({k: np.concatenate([frame.col(k).astype(object), right.col(k).astype(object)]) for k in on})
+    codes = group_ids(combined, on)[0]
+    # NULL в ключе не равен ничему, в том числе другому NULL (как в SQL)
+    null_key = np.zeros(nl + nr, dtype=bool)
+    for k in on:
+        null_key |= null_mask(combined.col(k))
+    codes[null_key] = -1
+    lcodes, rcodes = codes[:nl], codes[nl:].copy()
+    rcodes[null_key[nl:]] = -2
+
+    r_order = np.argsort(rcodes, kind="stable")
+    r_sorted = rcodes[r_order]
+    starts = np.searchsorted(r_sorted, lcodes, side="left")
+    ends = np.searchsorted(r_sorted, lcodes, side="right")
+    matches = ends - starts
+    emit = np.maximum(matches, 1) if how == "left" else matches
+
+    left_idx = np.repeat(np.arange(nl), emit)
+    offsets = cumcount(left_idx)
+    has_match = np.repeat(matches > 0, emit)
+    right_pos = np.repeat(starts, emit) + offsets
+    right_idx = np.where(has_match, r_order[np.minimum(right_pos, max(nr - 1, 0))] if nr else 0, -1)
+
+    columns = {k: v[left_idx] for k, v in frame.columns.items()}
+    for name, arr in right.columns.items():
+        if name in on:
+            continue
+        out_name = name if name not in columns else f"{name}{suffix}"
+        if nr:
+            taken = arr[np.maximum(right_idx, 0)]
+        else:
+            taken = np.empty(len(right_idx), dtype=arr.dtype)
+        if not has_match.all():
+            if taken.dtype.kind == "f":
+                taken = np.where(has_match, taken, np.nan)
+            else:
+                taken = taken.astype(object)
+                taken[~has_match] = None
+        columns[out_name] = taken
+    return Frame(columns)
+
+
+def step_select(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    names = step.get("columns") or []
+    return Frame({n: frame.col(n) for n in names})
+
+
+def step_rename(frame: Frame, step: Dict[str, Any], inputs) -> Frame:
+    mapping = step.get("columns") or {}
+    return Frame({mapping.get(k, k): v for k, v in frame.columns.items()})
+
+
+STEPS: Dict[str, Callable[[Frame, Dict[str, Any], Dict[str, Frame]], Frame]] = {
+    "filter": step_filter,
+    "derive": step_derive,
+    "aggregate": step_aggregate,
+    "group": step_aggregate,
+    "pivot": step_pivot,
+    "rolling": step_rolling,
+    "top_n": step_top_n,
+    "sort": step_sort,
+    "join": step_join,
+    "select": step_select,
+    "rename": step_rename,
+}
+
+
+def validate_spec(spec: Any) -> List[Dict[str, Any]]:
+    if spec is None:
+        return []
+    if not isinstance(spec, list):
+        raise TransformError("transforms must be a list of steps")
+    if len(spec) > MAX_STEPS:
+        raise TransformError(f"Too many transform steps (max {MAX_STEPS})")
+    for i, step in enumerate(spec):
+        if not isinstance(step, dict) or step.get("op") not in STEPS:
+            raise TransformError(f"Step {i}: unknown op {step.get('op') if isinstance(step, dict) else step!r}")
+    return spec
+
+
+def run_pipeline(frame: Frame, spec: Any, inputs: Optional[Dict[str, Frame]] = None) -> Frame:
+    inputs = inputs or {}
+    for i, step in enumerate(validate_spec(spec)):
+        try:
+            frame = STEPS[step["op"]](frame, step, inputs)
+        except TransformError as e:
+            raise TransformError(f"Step {i} ({step['op']}): {e}")
+        except (TypeError, ValueError, KeyError, IndexError, OverflowError) as e:
+            raise TransformError(f"Step {i} ({step['op']}): {e}")
+    return frame
+
+
+def apply_transforms(
+    result: Dict[str, Any],
+    spec: Any,
+    inputs: Optional[Dict[str, Dict[str, Any]]] = None,
+) -> Dict[str, Any]:
+    """
+    Применить props.transforms к результату {columns, data}. inputs —
+    результаты других виджетов для шага join (id виджета -> результат).
+    """
+    if not spec:
+        return result
+    frames = {name: Frame.from_result(r) for name, r in (inputs or {}).items()}
+    return run_pipeline(Frame.from_result(result), spec, frames).to_result()
+
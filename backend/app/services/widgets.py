@@ -0,0 +1,127 @@
+# backend/app/services/widgets.py
+# Разбор виджетов из config дашборда (без тяжёлых зависимостей:
+# используется выгрузкой, кросс-фильтрацией и автообновлением).
+#
+# Виджет берёт данные либо из собственного props.sql, либо из общего
+# источника дашборда (props.source -> config.sources): источник
+# выполняется один раз, а виджеты накладывают на него свои
+# props.transforms (select/filter/aggregate/...).
+
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import json
+
+from app.api.sql_executor import ensure_default_params
+from app.services import matviews, rollups
+
+# Типы виджетов, у которых есть табличные данные
+DATA_WIDGET_TYPES = {"table", "chart"}
+
+
+def _params_dict(raw: Any) -> Dict[str, Any]:
+    # Фронтенд хранит параметры списком {name, value}, старые дашборды — словарём
+    if isinstance(raw, list):
+        raw = {p.get("name"): p.get("value") for p in raw if isinstance(p, dict) and p.get("name")}
+    return raw if isinstance(raw, dict) else {}
+
+
+def widget_params(props: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Параметры виджета: фронтенд хранит их списком {name, value},
+    старые дашборды — словарём.
+    """
+    return ensure_default_params(_params_dict(props.get("params") or {}))
+
+
+def dashboard_sources(config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    Общие источники данных config.sources: словарь {имя: {sql, params}}
+    или список {id|name, sql, params}. Источники без SQL пропускаются.
+    """
+    raw = config.get("sources") or {}
+    if isinstance(raw, list):
+        raw = {s.get("id") or s.get("name"): s for s in raw if isinstance(s, dict)}
+    if not isinstance(raw, dict):
+        return {}
+    sources = {}
+    for name, source in raw.items():
+        if not name or not isinstance(source, dict):
+            continue
+        sql = (source.get("sql") or "").strip().rstrip(";")
+        if sql:
+            sources[str(name)] = {"sql": sql, "params": _params_dict(source.get("params") or {})}
+    return sources
+
+
+def widget_key(widget: Dict[str, Any], index: int) -> str:
+    """Ключ виджета в ответах и выгрузке: id, а у виджета без id — его номер"""
+    return str(widget.get("id") or f"#{index}")
+
+
+def widget_source(widget: Dict[str, Any]) -> Optional[str]:
+    source = (widget.get("props") or {}).get("source")
+    return str(source) if source else None
+
+
+def widget_query(
+    widget: Dict[str, Any],
+    sources: Dict[str, Dict[str, Any]],
+    extra_params: Optional[Dict[str, Any]] = None,
+    materialized: bool = True,
+) -> Tuple[str, Dict[str, Any]]:
+    """
+    SQL и параметры, которыми получаются данные виджета. У виджета на
+    источнике собственные props.params не участвуют — иначе запрос
+    перестал бы быть общим для виджетов источника. Если запрос с такими
+    параметрами материализован — SQL чтения из представления; агрегат,
+    который ложится на сводную таблицу, — SQL по сводке.
+    """
+    name = widget_source(widget)
+    if name is not None:
+        source = sources[name]
+        sql, params = source["sql"], ensure_default_params(source["params"])
+    else:
+        props = widget.get("props") or {}
+        sql, params = props["sql"].strip().rstrip(";"), widget_params(props)
+    params.update(extra_params or {})
+    if materialized:
+        sql = matviews.rewrite(sql, params) or rollups.rewrite(sql) or sql
+    return sql, params
+
+
+def _has_data(widget: Dict[str, Any], sources: Dict[str, Dict[str, Any]]) -> bool:
+    name = widget_source(widget)
+    if name is not None:
+        return name in sources
+    return bool(((widget.get("props") or {}).get("sql") or "").strip())
+
+
+def data_widgets(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """table/chart виджеты с непустым SQL или известным источником"""
+    widgets = config.get("widgets") or []
+    sources = dashboard_sources(config)
+    return [
+        w for w in widgets
+        if isinstance(w, dict) and w.get("type") in DATA_WIDGET_TYPES and _has_data(w, sources)
+    ]
+
+
+def plan_queries(
+    widgets: List[Dict[str, Any]],
+    sources: Dict[str, Dict[str, Any]],
+    extra_params: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Tuple[str, Dict[str, Any]]], Dict[str, str]]:
+    """
+    Различные запросы виджетов: (ключ -> (sql, params), id виджета -> ключ).
+    Виджеты одного источника (и с одинаковыми SQL и параметрами) делят
+    один запрос.
+    """
+    queries: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    by_widget: Dict[str, str] = {}
+    for i, w in enumerate(widgets):
+        sql, params = widget_query(w, sources, extra_params)
+        raw = json.dumps([sql, params], sort_keys=True, default=str, ensure_ascii=False)
+        qkey = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        queries[qkey] = (sql, params)
+        by_widget[widget_key(w, i)] = qkey
+    return queries, by_widget
@@ -0,0 +1,89 @@
+# backend/benchmarks/bench_converters.py
+# Микробенчмарк слоя конвертеров (app/services/converters.py) на результате
+# в 100k ячеек: поколоночные функции по OID против прежнего пути —
+# isinstance-цепочки на каждую ячейку (normalize_cell / jsonable_encoder).
+#
+# Запуск из backend/: python -m benchmarks.bench_converters [--rows 10000]
+
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from uuid import uuid4
+import argparse
+import time
+
+from fastapi.encoders import jsonable_encoder
+
+from app.services import converters as cv
+
+COLUMNS = [
+    ("id", cv.INT8, lambda i: i),
+    ("amount", cv.NUMERIC, lambda i: Decimal(i) / 100),
+    ("rate", cv.FLOAT8, lambda i: i / 7),
+    ("name", cv.TEXT, lambda i: f"object {i}"),
+    ("created_at", cv.TIMESTAMPTZ, lambda i: datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=i)),
+    ("report_date", cv.DATE, lambda i: date(2024, 1, 1) + timedelta(days=i % 365)),
+    ("flag", cv.BOOL, lambda i: i % 2 == 0),
+    ("uid", cv.UUID_OID, lambda i: uuid4()),
+    ("payload", cv.JSONB, lambda i: {"k": i}),
+    ("note", cv.TEXT, lambda i: None if i % 3 else "x"),
+]
+
+
+def make_rows(n: int):
+    return [tuple(make(i) for _, _, make in COLUMNS) for i in range(n)]
+
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--batch", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    names = [c[0] for c in COLUMNS]
+    codes = [c[1] for c in COLUMNS]
+    batches = [rows[i:i + args.batch] for i in range(0, len(rows), args.batch)]
+
+    def per_cell_json():
+        return [dict(zip(names, (cv.json_value(v) for v in r))) for r in rows]
+
+    def encoder_json():
+        return jsonable_encoder([dict(zip(names, r)) for r in rows])
+
+    def per_cell_excel():
+        return [tuple(cv.excel_value(v) for v in r) for r in rows]
+
+    def columnar(profile: str, method: str):
+        def run():
+            conv = cv.ResultConverter(names, codes, profile)
+            out = []
+            for b in batches:
+                out.extend(getattr(conv, method)(b))
+            return out
+        return run
+
+    cases = [
+        ("json: jsonable_encoder", encoder_json),
+        ("json: per-cell isinstance", per_cell_json),
+        ("json: ResultConverter.records", columnar("json", "records")),
+        ("excel: per-cell isinstance", per_cell_excel),
+        ("excel: ResultConverter.rows", columnar("excel", "rows")),
+        ("arrow: ResultConverter.columns", columnar("arrow", "columns")),
+    ]
+    print(f"{args.rows} rows x {len(COLUMNS)} columns = {args.rows * len(COLUMNS)} cells, best of {args.repeat}")
+    for label, fn in cases:
+        print(f"  {label:34} {timed(fn, args.repeat):9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# backend/benchmarks/load_async_crud.py
+# Нагрузочный тест CRUD на AsyncSession (auth / users / dashboards): N
+# одновременных клиентов в течение заданного времени бьют в запущенный
+# сервер, на каждом уровне конкурентности — req/s, p50/p99 и ошибки.
+# Сравнивать с тем же прогоном на коммите до перевода CRUD на asyncpg.
+#
+# Нужен поднятый API с PostgreSQL:
+#   uvicorn app.main:app --workers 1
+# Запуск из backend/:
+#   python -m benchmarks.load_async_crud [--url http://localhost:8000] [--concurrency 1 8 32 64]
+
+from typing import List, Optional
+import argparse
+import asyncio
+import time
+
+import httpx
+
+# Эндпоинты, которые обслуживаются через AsyncSession
+ENDPOINTS = ("/api/users/me", "/api/dashboards/")
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    resp = await client.post("/api/auth/login", data={"username": username, "password": password})
+    resp.raise_for_status()
+    return resp.json()["access_token"]
+
+
+async def worker(client: httpx.AsyncClient, paths: List[str], deadline: float,
+                 latencies: List[float], errors: List[int]) -> None:
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            resp = await client.get(path)
+            ok = resp.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - started)
+        else:
+            errors.append(1)
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+
+async def run_level(url: str, token: str, paths: List[str], concurrency: int, duration: float) -> None:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+    async with httpx.AsyncClient(base_url=url, headers=headers, limits=limits, timeout=30) as client:
+        latencies: List[float] = []
+        errors: List[int] = []
+        deadline = time.perf_counter() + duration
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            worker(client, paths[i % len(paths):] + paths[:i % len(paths)], deadline, latencies, errors)
+            for i in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+    print(f"  c={concurrency:<4} {len(latencies) / elapsed:9.1f} req/s"
+          f"   p50 {percentile(latencies, 0.50):7.1f} ms   p99 {percentile(latencies, 0.99):7.1f} ms"
+          f"   errors {len(errors)}")
+
+
+async def main_async(url: str, username: str, password: str, levels: List[int],
+                     duration: float, dashboard_id: Optional[int]) -> None:
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        token = await login(client, username, password)
+    paths = list(ENDPOINTS)
+    if dashboard_id is not None:
+        paths.append(f"/api/dashboards/{dashboard_id}")
+    print(f"{url}: {', '.join(paths)}, {duration:.0f}s per level")
+    for concurrency in levels:
+        await run_level(url, token, paths, concurrency, duration)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--dashboard-id", type=int, default=None)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.url, args.username, args.password, args.concurrency,
+                           args.duration, args.dashboard_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# backend/tests/test_auth_login.py
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from passlib.hash import bcrypt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.api.auth import login
+from app.models.user import User, UserRole
+
+# Хэш с меньшей стоимостью, чем AUTH_BCRYPT_ROUNDS: вход его пересчитывает
+LEGACY_HASH = bcrypt.using(rounds=4).hash("secret")
+
+
+async def _login(db_path, is_active: bool, password: str = "secret"):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda c: User.__table__.create(c))
+        await conn.execute(User.__table__.insert().values(
+            id=1, username="dev", email="dev@example.com", hashed_password=LEGACY_HASH,
+            role=UserRole.DEVELOPER, is_active=is_active,
+        ))
+    token = error = None
+    # как AsyncSessionLocal в app.database
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        try:
+            token = await login(username="dev", password=password, db=session)
+        except HTTPException as e:
+            error = e
+    async with AsyncSession(engine) as session:
+        stored = (await session.execute(select(User.hashed_password))).scalar_one()
+    await engine.dispose()
+    return token, error, stored
+
+
+@pytest.mark.parametrize("is_active, password, status", [(False, "secret", 400), (True, "wrong", 401)])
+def test_failed_login_does_not_rehash(tmp_path, is_active, password, status):
+    token, error, stored = asyncio.run(_login(tmp_path / "auth.db", is_active, password))
+    assert token is None and error.status_code == status
+    assert stored == LEGACY_HASH
+
+
+def test_successful_login_rehashes_legacy_hash(tmp_path):
+    token, error, stored = asyncio.run(_login(tmp_path / "auth.db", True))
+    assert error is None and token["access_token"]
+    assert stored != LEGACY_HASH
+    assert bcrypt.verify("secret", stored)
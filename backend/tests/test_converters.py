@@ -0,0 +1,77 @@
+# backend/tests/test_converters.py
+from decimal import Decimal
+from io import BytesIO
+
+import pytest
+from openpyxl import load_workbook
+from sqlalchemy import create_engine, text
+
+from app.api.sql_export import write_xlsx
+from app.services import converters as cv
+from app.services.converters import ResultConverter
+
+
+def _export(sql: str):
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        buf = BytesIO()
+        count = write_xlsx(conn.execute(text(sql)), buf)
+    buf.seek(0)
+    return count, list(load_workbook(buf).active.iter_rows(values_only=True))
+
+
+def test_xlsx_export_passthrough_columns():
+    """Колонки без преобразования (int/str) — строки Row должны стать tuple"""
+    count, rows = _export("SELECT 1 AS id, 'a' AS name UNION ALL SELECT 2, 'b'")
+    assert count == 2
+    assert rows == [("id", "name"), (1, "a"), (2, "b")]
+
+
+def test_rows_passthrough_returns_tuples():
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        result = conn.execute(text("SELECT 1 AS id, 'a' AS name"))
+        converter = ResultConverter.for_result(result, "excel")
+        rows = converter.rows(result.fetchall())
+    assert rows == [(1, "a")]
+    assert all(type(r) is tuple for r in rows)
+
+
+class _Cursor:
+    def __init__(self, description):
+        self.description = description
+
+
+class _NumericResult:
+    """Результат psycopg2 с NUMERIC-колонками: description в формате (name, type_code, ..., precision, scale)"""
+
+    def __init__(self, rows):
+        self.cursor = _Cursor([
+            ("amount", cv.NUMERIC, None, None, 14, 2, None),
+            ("total", cv.NUMERIC, None, None, None, None, None),
+        ])
+        self._rows = list(rows)
+
+    def keys(self):
+        return [d[0] for d in self.cursor.description]
+
+    def fetchmany(self, size):
+        batch, self._rows = self._rows[:size], self._rows[size:]
+        return batch
+
+
+def test_parquet_keeps_numeric_precision():
+    pa = pytest.importorskip("pyarrow")
+    pq = pytest.importorskip("pyarrow.parquet")
+    from app.api.sql_export import write_parquet
+
+    rows = [(Decimal("123456789012.34"), Decimal("0.1")), (None, Decimal("2"))]
+    buf = BytesIO()
+    assert write_parquet(_NumericResult(rows), buf) == 2
+    buf.seek(0)
+    table = pq.read_table(buf)
+    assert table.schema.field("amount").type == pa.decimal128(14, 2)
+    assert table.column("amount").to_pylist() == [Decimal("123456789012.34"), None]
+    # numeric без (p, s) — float64
+    assert table.schema.field("total").type == pa.float64()
+    assert table.column("total").to_pylist() == [0.1, 2.0]
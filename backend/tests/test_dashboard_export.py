@@ -0,0 +1,74 @@
+# backend/tests/test_dashboard_export.py
+from io import BytesIO
+import zipfile
+
+import pytest
+from openpyxl import load_workbook
+
+from app.services.dashboard_export import DashboardExport
+
+BREAKOUT = "SELECT 1) TO PROGRAM 'touch /tmp/pwn' --"
+
+
+def _widget(sql, **extra):
+    return {"id": "w1", "type": "table", "props": {"sql": sql}, **extra}
+
+
+class RecordingCursor:
+    rowcount = 0
+
+    def __init__(self):
+        self.copies = []
+
+    def mogrify(self, sql, params):
+        return sql.encode()
+
+    def copy_expert(self, sql, fileobj):
+        self.copies.append(sql)
+
+
+class FakeConn:
+    def __init__(self, cursor):
+        self.connection = self
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+@pytest.mark.parametrize("role", ["ADMIN", "DEVELOPER"])
+def test_breakout_widget_sql_is_reported_not_run(role):
+    export = DashboardExport([_widget(BREAKOUT)], "csv", role)
+    export._run_widget("w1", export.widgets[0], write=None)
+    assert "w1" in export.errors
+
+
+def test_csv_writer_never_copies_breakout_sql(tmp_path):
+    cursor = RecordingCursor()
+    export = DashboardExport([_widget(BREAKOUT)], "csv", "ADMIN")
+    with open(tmp_path / "part.csv", "wb") as part:
+        write = export._file_writer(part)
+        with pytest.raises(ValueError):
+            write(FakeConn(cursor), BREAKOUT, {})
+        assert write(FakeConn(cursor), "SELECT 1", {}) == 0
+    assert cursor.copies == ["COPY (\nSELECT 1\n) TO STDOUT WITH (FORMAT csv, HEADER true)"]
+
+
+
+def _numeric_named_widgets():
+    return [_widget(BREAKOUT, name=2024), _widget(BREAKOUT, id="w2", name=False)]
+
+
+def test_workbook_with_non_string_widget_names():
+    export = DashboardExport(_numeric_named_widgets(), "xlsx", "ADMIN")
+    buf = BytesIO()
+    export.write(buf)
+    buf.seek(0)
+    assert load_workbook(buf).sheetnames == ["2024", "w2", "errors"]
+
+
+def test_zip_with_non_string_widget_names():
+    export = DashboardExport(_numeric_named_widgets(), "csv", "ADMIN")
+    buf = BytesIO()
+    export.write(buf)
+    assert sorted(zipfile.ZipFile(buf).namelist()) == ["2024.error.txt", "w2.error.txt"]
@@ -0,0 +1,75 @@
+# backend/tests/test_pivot.py
+import pytest
+from fastapi import HTTPException
+
+from app.api.pivot import build_matrix, compile_pivot
+from app.schemas.sql import PivotMeasure, PivotRequest
+
+
+def _request(query="SELECT * FROM escrow", rows=("region",), columns=("status",), **kwargs):
+    kwargs.setdefault("measures", [PivotMeasure(field="amount", agg="sum")])
+    return PivotRequest(query=query, rows=list(rows), columns=list(columns), **kwargs)
+
+
+def test_compile_grouping_sets_with_subtotals_and_totals():
+    sql, dims = compile_pivot(_request("SELECT * FROM escrow;"))
+    assert dims == ["region", "status"]
+    assert sql == (
+        'SELECT "region", "status", GROUPING("region", "status") AS __grouping, SUM("amount") AS __m0\n'
+        "FROM (\nSELECT * FROM escrow\n) AS __src\n"
+        'GROUP BY GROUPING SETS (("region", "status"), ("region"), ("status"), ())'
+    )
+
+
+def test_compile_without_subtotals_and_totals():
+    sql, _ = compile_pivot(_request(rows=("a", "b"), columns=(), subtotals=False, totals=False))
+    assert sql.endswith('GROUP BY GROUPING SETS (("a", "b"))')
+
+
+def test_compile_without_dimensions_and_count_star():
+    sql, dims = compile_pivot(_request(rows=(), columns=(), measures=[PivotMeasure(field="*", agg="count")]))
+    assert dims == []
+    assert sql == "SELECT 0 AS __grouping, COUNT(*) AS __m0\nFROM (\nSELECT * FROM escrow\n) AS __src"
+
+
+def test_compile_quotes_column_names():
+    sql, _ = compile_pivot(_request(rows=('we"ird',), columns=()))
+    assert '"we""ird"' in sql
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM escrow) AS __src CROSS JOIN pg_shadow --",
+    "SELECT * FROM escrow) AS x, (SELECT 1",
+    "SELECT (1",
+    "DELETE FROM escrow",
+    "SELECT 1; SELECT 2",
+])
+def test_compile_rejects_queries_that_escape_the_wrapper(query):
+    with pytest.raises(HTTPException) as exc:
+        compile_pivot(_request(query))
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"rows": ("a", "a")},
+    {"rows": tuple("abcdefgh"), "columns": ("i",)},
+    {"measures": []},
+    {"measures": [PivotMeasure(field="amount", agg="median")]},
+    {"measures": [PivotMeasure(field="amount", agg="sum"), PivotMeasure(field="amount", agg="sum")]},
+])
+def test_compile_rejects_invalid_specs(kwargs):
+    with pytest.raises(HTTPException) as exc:
+        compile_pivot(_request(**kwargs))
+    assert exc.value.status_code == 400
+
+
+def test_build_matrix_places_totals_after_details():
+    body = _request(columns=())
+    groups = [
+        {"region": "b", "__grouping": 0, "__m0": 2},
+        {"region": "a", "__grouping": 0, "__m0": 1},
+        {"region": None, "__grouping": 1, "__m0": 3},
+    ]
+    matrix = build_matrix(body, groups, max_cells=100)
+    assert [r["key"] for r in matrix["rows"]] == [["a"], ["b"], []]
+    assert matrix["cells"]["sum_amount"] == [[1], [2], [3]]
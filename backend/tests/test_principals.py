@@ -0,0 +1,69 @@
+# backend/tests/test_principals.py
+import asyncio
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.auth import principals
+from app.models.user import User, UserRole
+
+
+class RacingSession:
+    """Сессия, у которой между SELECT и возвратом результата пользователя деактивируют"""
+
+    def __init__(self, session: AsyncSession, on_select):
+        self.session = session
+        self.on_select = on_select
+
+    async def execute(self, *args, **kwargs):
+        result = await self.session.execute(*args, **kwargs)
+        await self.on_select()
+        return result
+
+
+async def _deactivation_during_load():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(lambda c: User.__table__.create(c))
+        await conn.execute(User.__table__.insert().values(
+            id=1, username="dev", email="dev@example.com", hashed_password="x",
+            role=UserRole.DEVELOPER, is_active=True,
+        ))
+
+    async def deactivate():
+        # users.update_user: UPDATE, commit, forget()
+        async with engine.begin() as conn:
+            await conn.execute(update(User.__table__).where(User.__table__.c.username == "dev").values(is_active=False))
+        principals.forget("dev")
+
+    async with AsyncSession(engine) as session:
+        first = await principals.load_user(RacingSession(session, deactivate), "dev")
+    async with AsyncSession(engine) as session:
+        second = await principals.load_user(session, "dev")
+    await engine.dispose()
+    return first, second
+
+
+def test_forget_during_load_is_not_lost():
+    principals.clear()
+    first, second = asyncio.run(_deactivation_during_load())
+    # Запрос, начавшийся до деактивации, видит старую строку, но в кэш она не попадает
+    assert first.is_active
+    assert not second.is_active
+    assert principals.users.get("dev")["is_active"] is False
+
+
+def test_put_is_skipped_after_pop_and_clear():
+    cache = principals.TTLCache(10)
+    generation = cache.generation("a")
+    cache.pop("a")
+    cache.put("a", 1, 60, generation)
+    assert cache.get("a") is None
+
+    generation = cache.generation("a")
+    cache.clear()
+    cache.put("a", 2, 60, generation)
+    assert cache.get("a") is None
+
+    cache.put("a", 3, 60, cache.generation("a"))
+    assert cache.get("a") == 3
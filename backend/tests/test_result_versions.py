@@ -0,0 +1,104 @@
+# backend/tests/test_result_versions.py
+import json
+
+import pytest
+
+from app.services.result_versions import VersionStore, delta_payload, keyed_diff, with_fingerprint
+
+COLUMNS = ["id", "amount"]
+
+
+def _result(*rows, columns=COLUMNS):
+    return {"columns": columns, "data": [dict(zip(columns, r)) for r in rows]}
+
+
+def test_diff_inserted_updated_deleted():
+    old = _result(*[(i, i) for i in range(10)])
+    new = _result(*[(i, 50 if i == 5 else i) for i in range(1, 9)], (10, 10))
+    diff = keyed_diff(old, new, ["id"])
+    assert diff["inserted"] == [{"id": 10, "amount": 10}]
+    assert diff["updated"] == [{"id": 5, "amount": 50}]
+    assert sorted(diff["deleted"]) == [[0], [9]]
+
+
+def test_diff_unchanged_is_empty():
+    old = _result((1, 1), (2, 2))
+    assert keyed_diff(old, json.loads(json.dumps(old)), ["id"]) == {"inserted": [], "updated": [], "deleted": []}
+
+
+def test_diff_composite_key():
+    columns = ["region", "month", "amount"]
+    old = _result(("a", 1, 10), ("a", 2, 20), ("b", 1, 30), columns=columns)
+    new = _result(("a", 1, 10), ("a", 2, 25), ("b", 1, 30), columns=columns)
+    assert keyed_diff(old, new, ["region", "month"])["updated"] == [{"region": "a", "month": 2, "amount": 25}]
+
+
+@pytest.mark.parametrize("old, new, keys", [
+    # ключ не уникален
+    (_result((1, 1), (1, 2)), _result((1, 1), (1, 3)), ["id"]),
+    (_result((1, 1)), _result((1, 1), (1, 2)), ["id"]),
+    # нехешируемый ключ (json-массив)
+    (_result(([1], 1)), _result(([1], 2)), ["id"]),
+    # поменялись колонки
+    (_result((1, 1)), _result((1,), columns=["id"]), ["id"]),
+    # ключевой колонки нет в результате / ключ не задан
+    (_result((1, 1)), _result((1, 2)), ["missing"]),
+    (_result((1, 1)), _result((1, 2)), []),
+])
+def test_diff_not_possible(old, new, keys):
+    assert keyed_diff(old, new, keys) is None
+
+
+def test_diff_too_large_falls_back_to_full():
+    old = _result(*[(i, i) for i in range(10)])
+    new = _result(*[(i, i + 1) for i in range(10)])
+    assert keyed_diff(old, new, ["id"]) is None
+    # все строки удалены — дельта не выгодна
+    assert keyed_diff(_result((1, 1)), _result(), ["id"]) is None
+
+
+def test_fingerprint_is_appended_to_body():
+    body, fp = with_fingerprint(b'{"columns":[],"data":[]}')
+    assert json.loads(body) == {"columns": [], "data": [], "fingerprint": fp}
+    assert with_fingerprint(b'{"columns":[],"data":[]}')[1] == fp
+
+
+def test_store_keeps_last_versions_per_key():
+    store = VersionStore(memory_bytes=10_000, versions_per_key=2)
+    for fp in ("a", "b", "c"):
+        store.add("q", fp, fp.encode() * 10)
+    assert store.get("q", "a") is None
+    assert store.get("q", "b") == b"b" * 10 and store.get("q", "c") == b"c" * 10
+    assert store.used == 20
+    # повторное добавление той же версии не увеличивает объём
+    store.add("q", "c", b"c" * 10)
+    assert store.used == 20
+
+
+def test_store_evicts_least_recent_key_by_memory():
+    store = VersionStore(memory_bytes=400)
+    store.add("q1", "a", b"x" * 100)
+    store.add("q2", "a", b"y" * 100)
+    store.add("q1", "b", b"x" * 100)     # q1 становится свежее q2
+    store.add("q3", "a", b"z" * 100)
+    store.add("q4", "a", b"w" * 100)
+    assert store.get("q2", "a") is None
+    assert store.get("q1", "b") is not None
+    assert store.used <= 400
+
+
+def test_store_skips_bodies_over_quarter_of_memory():
+    store = VersionStore(memory_bytes=400)
+    store.add("q", "a", b"x" * 101)
+    assert store.get("q", "a") is None and store.used == 0
+
+
+def test_delta_payload_against_stored_version():
+    store = VersionStore(memory_bytes=100_000)
+    old = json.dumps({**_result(*[(i, i) for i in range(10)]), "row_count": 10}).encode()
+    store.add("q", "old", old)
+    new = json.dumps({**_result(*[(i, i) for i in range(9)], (9, 90)), "row_count": 10}).encode()
+    payload = json.loads(delta_payload(store, "q", "old", new, "new", ["id"]))
+    assert payload["base_fingerprint"] == "old" and payload["fingerprint"] == "new"
+    assert payload["diff"] == {"inserted": [], "updated": [{"id": 9, "amount": 90}], "deleted": []}
+    assert delta_payload(store, "q", "unknown", new, "new", ["id"]) is None
@@ -0,0 +1,34 @@
+# backend/tests/test_rollups.py
+from datetime import datetime, timezone
+
+import pytest
+
+from app.models.rollup import Rollup
+from app.services.rollups import RollupRegistry, RollupSpec
+
+QUERY = "SELECT status, SUM(deposited_amount) FROM escrow_accounts GROUP BY status"
+
+
+def _rollup(mode: str, allow_stale: bool = False) -> Rollup:
+    spec = RollupSpec("escrow_accounts", [{"column": "status"}], [{"column": "deposited_amount", "agg": "sum"}])
+    dimensions, measures = spec.to_json()
+    return Rollup(
+        id=1, name="by_status", base_table="escrow_accounts", summary_table="dash_rollup_by_status",
+        dimensions=dimensions, measures=measures, mode=mode, allow_stale=allow_stale,
+        updated_column="updated_at" if mode == "delta" else None, status="ready",
+        row_count=3, last_sync_at=datetime.now(timezone.utc),
+    )
+
+
+@pytest.mark.parametrize("mode, allow_stale, rewritten", [
+    ("trigger", False, True),
+    ("delta", False, False),
+    ("delta", True, True),
+])
+def test_delta_rollups_answer_queries_only_with_opt_in(mode, allow_stale, rewritten):
+    registry = RollupRegistry()
+    registry.load([_rollup(mode, allow_stale)])
+    sql = registry.rewrite(QUERY)
+    assert (sql is not None) == rewritten
+    if rewritten:
+        assert "dash_rollup_by_status" in sql
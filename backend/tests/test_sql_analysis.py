@@ -0,0 +1,75 @@
+# backend/tests/test_sql_analysis.py
+import pytest
+from fastapi import HTTPException
+
+from app.api.sql_executor import check_developer_sql
+from app.services.sql_analysis import analyze
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT "pg_sleep"(10)',
+    'SELECT "pg_terminate_backend"(pid) FROM pg_stat_activity',
+    'SELECT "pg_catalog"."pg_sleep"(10)',
+    'SELECT pg_catalog."pg_sleep"(10)',
+    'SELECT "pg_catalog".pg_sleep(10)',
+    'SELECT U&"\\0070g_sleep"(10)',
+    'SELECT * FROM "pg_sleep"(10)',
+])
+def test_quoted_function_calls_are_detected(sql):
+    assert analyze(sql).function_names & {"pg_sleep", "pg_terminate_backend"}
+
+
+@pytest.mark.parametrize("sql", [
+    'SELECT "pg_sleep"(10)',
+    'SELECT "pg_catalog"."pg_sleep"(10)',
+    'SELECT "pg_terminate_backend"(pid) FROM pg_stat_activity',
+])
+def test_developer_sql_blocks_quoted_dangerous_functions(sql):
+    with pytest.raises(HTTPException) as exc:
+        check_developer_sql(sql)
+    assert exc.value.status_code == 403
+
+
+def test_quoted_columns_are_not_functions():
+    analysis = analyze('SELECT "pg_sleep", "copy" FROM t WHERE "copy" IN (1, 2)')
+    assert not analysis.function_names
+    check_developer_sql('SELECT "copy_count" FROM t')
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT 1) TO PROGRAM 'touch /tmp/pwn' --",
+    "SELECT * FROM t) AS __src CROSS JOIN (SELECT 1",
+    "SELECT (1",
+])
+def test_unbalanced_parentheses_are_not_read_queries(sql):
+    analysis = analyze(sql)
+    assert analysis.error and "unbalanced parentheses" in analysis.error
+    assert not analysis.is_read
+
+
+def test_parentheses_in_strings_and_comments_are_ignored():
+    analysis = analyze("SELECT ')' AS a, \")\" FROM t -- )\n WHERE x IN (1, 2) /* ( */")
+    assert analysis.error is None
+    assert analysis.is_read
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT pg_sleep_for('5 minutes')",
+    "SELECT pg_sleep_until(now() + interval '1 hour')",
+    "SELECT dblink_send_query('conn', 'DELETE FROM t')",
+    "SELECT dblink_connect_u('host=evil')",
+    "SELECT lo_get(16400)",
+    "SELECT lo_put(16400, 0, 'x')",
+    "SELECT pg_read_file('/etc/passwd')",
+    "SELECT pg_ls_waldir()",
+    "SELECT pg_stat_file('postgresql.conf')",
+    'SELECT "pg_catalog"."PG_SLEEP_FOR"(\'1s\')',
+])
+def test_developer_sql_blocks_dangerous_function_families(sql):
+    with pytest.raises(HTTPException) as exc:
+        check_developer_sql(sql)
+    assert exc.value.status_code == 403
+
+
+def test_developer_sql_allows_similar_column_names():
+    check_developer_sql("SELECT lower(name), lot_id, pg_size_pretty(size) FROM t")
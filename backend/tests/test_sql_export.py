@@ -0,0 +1,45 @@
+# backend/tests/test_sql_export.py
+import pytest
+from fastapi import HTTPException
+from psycopg2.extensions import adapt
+
+from app.api.sql_executor import guard_user_sql
+from app.api.sql_export import render_copy_sql
+
+BREAKOUTS = [
+    "SELECT 1) TO PROGRAM 'touch /tmp/pwn' --",
+    "SELECT 1) TO '/tmp/pwn.csv' --",
+    "SELECT 1) TO PROGRAM 'touch /tmp/pwn'; SELECT (1",
+    "SELECT 1 /* ) TO PROGRAM 'x' -- ",
+]
+
+
+class MogrifyCursor:
+    """Курсор только с mogrify: подстановка значений как в psycopg2, без соединения"""
+
+    def mogrify(self, sql, params):
+        return (sql % {k: adapt(v).getquoted().decode() for k, v in (params or {}).items()}).encode()
+
+
+@pytest.mark.parametrize("sql", BREAKOUTS)
+def test_copy_wrapper_rejects_breakout(sql):
+    with pytest.raises(ValueError):
+        render_copy_sql(MogrifyCursor(), sql, {})
+
+
+@pytest.mark.parametrize("sql", BREAKOUTS[:3])
+@pytest.mark.parametrize("role", ["ADMIN", "DEVELOPER", "VIEWER"])
+def test_export_guard_rejects_breakout(sql, role):
+    with pytest.raises(HTTPException) as exc:
+        guard_user_sql(sql, role, read_only=True)
+    assert exc.value.status_code == 400
+
+
+def test_copy_wrapper_keeps_parameters_inside_strings():
+    copy = render_copy_sql(
+        MogrifyCursor(), "SELECT * FROM t WHERE name = :name;", {"name": "x') TO PROGRAM 'id"},
+    )
+    assert copy == (
+        "COPY (\nSELECT * FROM t WHERE name = 'x'') TO PROGRAM ''id'\n) "
+        "TO STDOUT WITH (FORMAT csv, HEADER true)"
+    )
@@ -0,0 +1,138 @@
+# backend/tests/test_time_chunks.py
+from datetime import date, datetime
+
+import pytest
+
+from app.services.time_chunks import (
+    TimeWindowError, TimeWindowSpec, merge_additive, merge_rows, parse_date, split_window,
+)
+
+
+def test_split_days_are_whole():
+    assert split_window(date(2024, 1, 30), date(2024, 2, 1), "day") == [
+        (date(2024, 1, 30), date(2024, 1, 30), True),
+        (date(2024, 1, 31), date(2024, 1, 31), True),
+        (date(2024, 2, 1), date(2024, 2, 1), True),
+    ]
+
+
+def test_split_months_with_partial_edges():
+    assert split_window(date(2024, 1, 15), date(2024, 3, 10), "month") == [
+        (date(2024, 1, 15), date(2024, 1, 31), False),
+        (date(2024, 2, 1), date(2024, 2, 29), True),
+        (date(2024, 3, 1), date(2024, 3, 10), False),
+    ]
+
+
+def test_split_month_year_rollover():
+    assert split_window(date(2023, 12, 1), date(2024, 1, 31), "month") == [
+        (date(2023, 12, 1), date(2023, 12, 31), True),
+        (date(2024, 1, 1), date(2024, 1, 31), True),
+    ]
+
+
+def test_split_inside_one_month():
+    assert split_window(date(2024, 2, 5), date(2024, 2, 6), "month") == [
+        (date(2024, 2, 5), date(2024, 2, 6), False),
+    ]
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2024-02-29", date(2024, 2, 29)),
+    ("2024-02-29T10:00:00", date(2024, 2, 29)),
+    (datetime(2024, 2, 29, 10), date(2024, 2, 29)),
+    (date(2024, 2, 29), date(2024, 2, 29)),
+    ("", None),
+    (None, None),
+])
+def test_parse_date(value, expected):
+    assert parse_date(value) == expected
+
+
+def test_parse_date_invalid():
+    with pytest.raises(TimeWindowError):
+        parse_date("29.02.2024")
+
+
+def test_inclusive_window_and_piece_params():
+    spec = TimeWindowSpec({"chunk": "month"})
+    params = {"p_date_from": "2024-01-01", "p_date_to": "2024-01-31", "x": 1}
+    assert spec.window(params) == (date(2024, 1, 1), date(2024, 1, 31))
+    assert spec.piece_params(params, date(2024, 1, 1), date(2024, 1, 31)) == params
+
+
+def test_exclusive_window_and_piece_params():
+    spec = TimeWindowSpec({"chunk": "month", "bounds": "exclusive"})
+    params = {"p_date_from": "2024-01-01", "p_date_to": "2024-02-01"}
+    assert spec.window(params) == (date(2024, 1, 1), date(2024, 1, 31))
+    # граница куска — первый день следующего месяца, как в исходном запросе
+    assert spec.piece_params(params, date(2023, 12, 1), date(2023, 12, 31)) == {
+        "p_date_from": "2023-12-01", "p_date_to": "2024-01-01",
+    }
+
+
+@pytest.mark.parametrize("params", [
+    {"p_date_from": "2024-01-01"},
+    {"p_date_from": "2024-01-02", "p_date_to": "2024-01-01"},
+])
+def test_window_missing_or_empty(params):
+    assert TimeWindowSpec({}).window(params) is None
+
+
+def test_exclusive_window_of_zero_days_is_empty():
+    spec = TimeWindowSpec({"bounds": "exclusive"})
+    assert spec.window({"p_date_from": "2024-01-01", "p_date_to": "2024-01-01"}) is None
+
+
+@pytest.mark.parametrize("raw", [
+    {"chunk": "week"},
+    {"mode": "cumulative"},
+    {"bounds": "open"},
+    {"mode": "additive"},
+    {"mode": "additive", "measures": {"amount": "avg"}},
+    [],
+])
+def test_spec_validation(raw):
+    with pytest.raises(TimeWindowError):
+        TimeWindowSpec(raw)
+
+
+def test_merge_additive_combines_groups():
+    spec = TimeWindowSpec({
+        "mode": "additive", "group_by": ["status"],
+        "measures": {"total": "sum", "cnt": "count", "lo": "min", "hi": "max"},
+    })
+    columns = ["status", "total", "cnt", "lo", "hi"]
+    parts = [
+        {"columns": columns, "data": [
+            {"status": "open", "total": 10, "cnt": 1, "lo": 10, "hi": 10},
+            {"status": None, "total": 1, "cnt": 1, "lo": 1, "hi": 1},
+        ]},
+        {"columns": [], "data": []},
+        {"columns": columns, "data": [
+            {"status": "open", "total": 5, "cnt": 2, "lo": 2, "hi": 3},
+            {"status": None, "total": None, "cnt": 0, "lo": None, "hi": None},
+        ]},
+    ]
+    assert merge_additive(parts, spec) == {
+        "columns": columns,
+        "data": [
+            {"status": "open", "total": 15, "cnt": 3, "lo": 2, "hi": 10},
+            {"status": None, "total": 1, "cnt": 1, "lo": 1, "hi": 1},
+        ],
+        "row_count": 2,
+    }
+
+
+def test_merge_additive_rejects_missing_columns():
+    spec = TimeWindowSpec({"mode": "additive", "group_by": ["status"], "measures": {"total": "sum"}})
+    with pytest.raises(TimeWindowError):
+        merge_additive([{"columns": ["status"], "data": []}], spec)
+
+
+def test_merge_rows_truncates():
+    parts = [{"columns": ["a"], "data": [{"a": 1}, {"a": 2}]}, {"columns": ["a"], "data": [{"a": 3}]}]
+    result, truncated = merge_rows(parts, max_rows=2)
+    assert result == {"columns": ["a"], "data": [{"a": 1}, {"a": 2}], "row_count": 2}
+    assert truncated
+    assert merge_rows(parts, max_rows=3)[1] is False
@@ -0,0 +1,65 @@
+# backend/tests/test_transforms.py
+from app.services.transforms import apply_transforms
+
+
+def _result(columns, rows):
+    return {"columns": columns, "data": [list(r) for r in rows]}
+
+
+def test_nullable_int_column_stays_int():
+    """id с NULL не должны превращаться в 123.0"""
+    out = apply_transforms(_result(["id"], [(123,), (None,)]), [{"op": "select", "columns": ["id"]}])
+    assert out["data"] == [{"id": 123}, {"id": None}]
+    assert type(out["data"][0]["id"]) is int
+
+
+def test_nullable_int_column_in_expressions():
+    data = _result(["id"], [(1,), (None,), (3,)])
+    out = apply_transforms(data, [
+        {"op": "filter", "where": [{"column": "id", "op": ">", "value": "1"}]},
+    ])
+    assert out["data"] == [{"id": 3}]
+    out = apply_transforms(data, [{"op": "derive", "column": "twice", "expr": "id * 2"}])
+    assert [r["twice"] for r in out["data"]] == [2.0, None, 6.0]
+
+
+def test_pivot_all_null_cell_is_null():
+    data = _result(
+        ["obj", "status", "amount"],
+        [(1, "open", None), (1, "closed", 5.0), (2, "open", 7.0)],
+    )
+    out = apply_transforms(data, [
+        {"op": "pivot", "index": ["obj"], "columns": "status", "values": "amount", "agg": "sum"},
+    ])
+    assert out["data"] == [
+        {"obj": 1, "open": None, "closed": 5.0},
+        {"obj": 2, "open": 7.0, "closed": None},
+    ]
+
+
+def test_pivot_count_missing_cell_is_null():
+    data = _result(["obj", "status"], [(1, "open"), (1, "open"), (2, "closed")])
+    out = apply_transforms(data, [
+        {"op": "pivot", "index": ["obj"], "columns": "status", "values": "status", "agg": "count"},
+    ])
+    assert out["data"] == [
+        {"obj": 1, "open": 2, "closed": None},
+        {"obj": 2, "open": None, "closed": 1},
+    ]
+
+
+def test_aggregate_sum_of_nulls_is_null():
+    data = _result(["g", "v"], [("a", None), ("a", None), ("b", 2.0)])
+    out = apply_transforms(data, [
+        {"op": "aggregate", "group_by": ["g"], "measures": [{"column": "v", "agg": "sum", "as": "total"}]},
+    ])
+    assert out["data"] == [{"g": "a", "total": None}, {"g": "b", "total": 2.0}]
+
+
+def test_join_does_not_match_null_keys():
+    left = _result(["k", "x"], [(1, "a"), (None, "b")])
+    right = _result(["k", "y"], [(1, 10), (None, 20)])
+    out = apply_transforms(left, [{"op": "join", "with": "r", "on": "k", "how": "left"}], {"r": right})
+    assert out["data"] == [{"k": 1, "x": "a", "y": 10}, {"k": None, "x": "b", "y": None}]
+    out = apply_transforms(left, [{"op": "join", "with": "r", "on": "k"}], {"r": right})
+    assert out["data"] == [{"k": 1, "x": "a", "y": 10}]